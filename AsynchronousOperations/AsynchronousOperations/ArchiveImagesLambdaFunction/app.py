@@ -0,0 +1,304 @@
+import os
+import io
+import boto3
+import botocore
+import hashlib
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
+
+# NumPy and Pillow are in requirements.txt. Without them, the images are not archived.
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+# Artifact storage: images stored by their SHA-256 under BLOB_PREFIX may be shared by several applications.
+BLOB_PREFIX = 'blobs/'
+
+# Archive transcoding (see archive_application_images()). After verification, the original PNG images are
+# replaced by lossless WebP images, which are verified pixel by pixel before the originals are deleted.
+ARCHIVE_IMAGE_FORMAT_ORIGINAL = 'original'
+ARCHIVE_IMAGE_FORMAT_WEBP = 'webp'
+ARCHIVE_SOURCE_EXTENSION = '.png'
+ARCHIVE_WEBP_EXTENSION = '.webp'
+ARCHIVE_WEBP_METHOD = 2 # 0 (fast) to 6 (small). Above 2, the images are barely smaller and much slower to encode
+ARCHIVE_LOSSLESS_MODES = ('RGB', 'RGBA', 'L', 'LA', 'P')
+# Pillow decodes a 16-bit PNG to 8-bit samples, so only PNG images with 8-bit samples are transcoded
+ARCHIVE_PNG_BIT_DEPTH = 8
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+def get_dynamo_db_table_name():
+    """
+    This function gets table name of the DynamoDB.
+    In the YAML template, we define an Environment in Lambda Function that gets
+    the CustomerDDBTable as TABLE. We can get the value of TABLE by using os.environ['TABLE']
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    Table name. Otherwise, None
+    
+    """    
+    ret = None
+    try:
+        table_name = os.environ['TABLE']
+    except Exception as error:
+        print(f'Exception error: {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: do nothing for now')
+        ret = table_name
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: do nothing for now')
+        return ret
+
+def get_archive_image_format():
+    """
+    This function gets the format of the archived images from the environment variable ARCHIVE_IMAGE_FORMAT.
+    If it is not set, or not a known format, 'original' is used (the images are not transcoded).
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    ARCHIVE_IMAGE_FORMAT_ORIGINAL or ARCHIVE_IMAGE_FORMAT_WEBP
+    
+    """    
+    image_format = os.environ.get('ARCHIVE_IMAGE_FORMAT', ARCHIVE_IMAGE_FORMAT_ORIGINAL)
+    if image_format not in (ARCHIVE_IMAGE_FORMAT_ORIGINAL, ARCHIVE_IMAGE_FORMAT_WEBP):
+        print(f'Unknown ARCHIVE_IMAGE_FORMAT {image_format}, using {ARCHIVE_IMAGE_FORMAT_ORIGINAL}')
+        image_format = ARCHIVE_IMAGE_FORMAT_ORIGINAL
+
+    return image_format
+
+def get_png_bit_depth(image_bytes):
+    """
+    This function reads the bit depth of a PNG image from its IHDR chunk, which is the first chunk,
+    without decoding the image (UnzipLambdaFunction checked the header, see inspect_image_header()).
+
+    Parameters:
+
+    image_bytes: The PNG image
+
+    Returns:
+
+    The bit depth of the samples, e.g. 8 or 16. Otherwise, None
+    
+    """
+    if image_bytes[:len(PNG_SIGNATURE)] != PNG_SIGNATURE or image_bytes[12:16] != b'IHDR' or len(image_bytes) < 25:
+        return None
+    return image_bytes[24]
+
+def transcode_image_to_webp(image_bytes):
+    """
+    This function transcodes an image to lossless WebP, then decodes the WebP image again and
+    compares both images pixel by pixel (round-trip check). The color values of transparent pixels
+    are kept (exact), so the round trip is exact.
+    Pillow decodes a PNG image with 16-bit samples to 8-bit samples, so the round-trip check cannot see
+    what is lost. Only a PNG image with ARCHIVE_PNG_BIT_DEPTH is transcoded (see get_png_bit_depth()).
+
+    Parameters:
+
+    image_bytes: The original image (e.g. PNG)
+
+    Returns:
+
+    The WebP image if the round trip is exact. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if numpy is None or Image is None:
+            raise ValueError('NumPy and Pillow are not available')
+
+        if image_bytes[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+            bit_depth = get_png_bit_depth(image_bytes)
+            if bit_depth != ARCHIVE_PNG_BIT_DEPTH:
+                raise ValueError(f'PNG with {bit_depth}-bit samples cannot be stored losslessly as WebP')
+
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if image.mode not in ARCHIVE_LOSSLESS_MODES:
+                raise ValueError(f'Image mode {image.mode} cannot be stored losslessly as WebP')
+            image.load()
+            # WebP stores RGB or RGBA. Expanding a grayscale or palette image to RGB(A) is lossless.
+            original = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+            icc_profile = image.info.get('icc_profile')
+
+        webp_file = io.BytesIO()
+        original.save(webp_file, 'WEBP', lossless=True, quality=100, method=ARCHIVE_WEBP_METHOD, exact=True, icc_profile=icc_profile)
+        webp_bytes = webp_file.getvalue()
+
+        # An opaque RGBA image is decoded as RGB, so both images are compared in the same mode
+        with Image.open(io.BytesIO(webp_bytes)) as decoded:
+            decoded = decoded.convert(original.mode)
+        if not numpy.array_equal(numpy.asarray(decoded), numpy.asarray(original)):
+            raise ValueError('The WebP image is not identical to the original image')
+
+    except Exception as error:
+        print(f'Exception error: transcode_image_to_webp : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: transcode_image_to_webp : {len(image_bytes)} bytes -> {len(webp_bytes)} bytes')
+        ret = webp_bytes
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: transcode_image_to_webp :')
+
+    return ret
+
+def archive_application_images(s3, bucket_name, image_keys, archive_info):
+    """
+    This function replaces the original images of an application in S3 by lossless WebP images
+    (see transcode_image_to_webp()). The WebP image is stored next to the original image
+    (e.g. unzipped/8d247914_license.webp), then the original image is deleted.
+    Content-addressed images (under BLOB_PREFIX) may be shared by several applications, so they are not archived.
+    An image that would not be smaller, or that fails the round-trip check, is kept as it is.
+
+    Parameters:
+
+    s3: S3 client
+    bucket_name: S3 bucket name
+    image_keys: The keys of the original images
+    archive_info: returned dictionary that contains 'images' (original key: WebP key), and 'bytes_saved'
+
+    Returns:
+
+    True if operations are successful. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        for image_key in image_keys:
+            if image_key.startswith(BLOB_PREFIX) or not image_key.lower().endswith(ARCHIVE_SOURCE_EXTENSION):
+                print(f'Skipping {image_key}: it is not archived')
+                continue
+
+            try:
+                response = s3.get_object(Bucket=bucket_name, Key=image_key)
+            except botocore.exceptions.ClientError as error:
+                # A parked application that is resumed may already have archived this image
+                if error.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    raise
+                print(f'Skipping {image_key}: it does not exist')
+                continue
+            image_bytes = response['Body'].read()
+
+            webp_bytes = transcode_image_to_webp(image_bytes)
+            if webp_bytes is None or len(webp_bytes) >= len(image_bytes):
+                print(f'Keeping {image_key}: the WebP image is not usable or not smaller')
+                continue
+
+            webp_key = image_key[:-len(ARCHIVE_SOURCE_EXTENSION)] + ARCHIVE_WEBP_EXTENSION
+            s3.put_object(
+                Body=webp_bytes,
+                Bucket=bucket_name,
+                Key=webp_key,
+                ContentType='image/webp',
+                Metadata={'original-key': image_key,
+                          'original-bytes': str(len(image_bytes)),
+                          'original-sha256': hashlib.sha256(image_bytes).hexdigest()})
+            s3.delete_object(Bucket=bucket_name, Key=image_key)
+
+            archive_info['images'][image_key] = webp_key
+            archive_info['bytes_saved'] += len(image_bytes) - len(webp_bytes)
+            print(f'Archived {image_key} as {webp_key}: {len(image_bytes)} bytes -> {len(webp_bytes)} bytes')
+
+    except Exception as error:
+        print(f'Exception error: archive_application_images : {error}')
+        archive_info['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: archive_application_images : {archive_info}')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: archive_application_images :')
+
+    return ret
+
+def lambda_handler(event, context):
+    """
+    This function is the AWS Lambda function call for ArchiveImagesLambdaFunction.
+    It runs after the application is verified, and archives the original images (see archive_application_images()).
+    The WebP keys (ARCHIVED_IMAGES attribute) and the bytes saved (ARCHIVE_BYTES_SAVED attribute) are added to DynamoDB table.
+
+    Parameters:
+
+    event: State machine input, which contains the bucket name and the output of UnzipLambdaFunction (archive_keys)
+    context: not used in this application
+
+    Returns:
+
+    A dictionary: {"app_uuid":appuuid, "status":"archived", "archived_images":[...], "bytes_saved":...}.
+    If the images are not archived (ARCHIVE_IMAGE_FORMAT is not webp): {"app_uuid":appuuid, "status":"skipped"}. Otherwise, None.
+
+    """    
+    
+    print(f'Entering lambda handler for ArchiveImagesLambdaFunction')
+    
+    ret = None
+
+    try:
+        bucket = event['detail']['bucket']['name']
+        application = event['application']
+        appuuid = application['app_uuid']
+        archive_keys = application.get('archive_keys', [])
+
+        print(f'bucket: {bucket}')
+        print(f'app_uuid: {appuuid}')
+        print(f'archive_keys: {archive_keys}')
+
+        if get_archive_image_format() != ARCHIVE_IMAGE_FORMAT_WEBP or not archive_keys:
+            ret = {"app_uuid":appuuid, "status":"skipped"}
+            return ret
+
+        archive_info = {'images': {}, 'bytes_saved': 0}
+        archived = archive_application_images(get_client('s3'), bucket, archive_keys, archive_info)
+
+        if archive_info['images']:
+            ddb_table = get_resource('dynamodb').Table(get_dynamo_db_table_name())
+            ddb_table.update_item(
+                Key={"APP_UUID": appuuid},
+                UpdateExpression='ADD ARCHIVED_IMAGES :images, ARCHIVE_BYTES_SAVED :saved',
+                ExpressionAttributeValues={':images': set(archive_info['images'].values()),
+                                           ':saved': archive_info['bytes_saved']})
+            print(f'Archive of {appuuid} saved {archive_info["bytes_saved"]} bytes')
+
+        # After an error, the original images that were not archived are kept
+        if archived == False:
+            raise archive_info['error']
+
+        response = {"app_uuid":appuuid,
+                    "status":"archived",
+                    "archived_images":sorted(archive_info['images'].values()),
+                    "bytes_saved":archive_info['bytes_saved']}
+
+    except Exception as error:
+        print(f'Exception error: {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: do nothing for now')
+        
+        ret = response
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
+
+        return ret
@@ -1,6 +1,16 @@
 import os
+import threading
+import json
+import time
+import random
+import botocore
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+import hashlib
 import csv
+from concurrent.futures import ThreadPoolExecutor
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
+from api_limiter import PermitUnavailableError, acquire_api_permit, release_api_permit
 
 CUSTOMER_INFORMATION = [
     'DOCUMENT_NUMBER',
@@ -11,14 +21,93 @@ CUSTOMER_INFORMATION = [
     'STATE_IN_ADDRESS',
     'CITY_IN_ADDRESS',
     'ZIP_CODE_IN_ADDRESS']
+CUSTOMER_INFORMATION_INDEX = {name: index for index, name in enumerate(CUSTOMER_INFORMATION)}
+# Comparison of the customer's details with the fields extracted by Textract (see get_details_matching()):
+# exact, or normalized (case and repeated spaces are ignored, see normalize_customer_value()).
+DETAILS_MATCHING_EXACT = 'exact'
+DETAILS_MATCHING_NORMALIZED = 'normalized'
+# Compiled extraction spec of the analyze_id() responses (see extract_customer_fields()): the slot of each
+# Textract field type in CUSTOMER_INFORMATION. The other field types (e.g. EXPIRATION_DATE) are ignored.
+TEXTRACT_FIELD_SLOTS = {field_type: CUSTOMER_INFORMATION_INDEX[field_type] for field_type in CUSTOMER_INFORMATION}
 
 SNS_IDMATCH_MESSAGE = 'No matches between Customer ID and Submitted Customer Info'
 SNS_IDMATCH_SUBJECT = 'Customer ID Info Match Fails'
+ANALYZE_ID_API = 'AnalyzeID'
+DEFAULT_ANALYZE_ID_PERMITS = 2
+# Textract analyzes at most TEXTRACT_MAX_DOCUMENT_PAGES ID documents per analyze_id() call (see analyze_document_ids()).
+TEXTRACT_MAX_DOCUMENT_PAGES = 2
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
-textract = boto3.client('textract')
+# Parking queue for applications whose check was throttled (see park_application()).
+DEFAULT_PARKING_MAX_ATTEMPTS = 5
+PARKING_BASE_DELAY_SECONDS = 30
+PARKING_MAX_DELAY_SECONDS = 900 # SQS allows a delay of at most 15 minutes
+
+# Adaptive (AIMD) concurrency limits of the calls that an invocation makes concurrently, e.g. one per
+# ID document (see call_with_adaptive_limit()).
+AIMD_INITIAL_LIMIT = 4
+AIMD_MIN_LIMIT = 1
+AIMD_MAX_LIMIT = 64
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_LATENCY_TARGET_SECONDS = {
+    'textract.analyze_id': 5.0}
+THROTTLING_ERROR_CODES = (
+    'ThrottlingException',
+    'Throttling',
+    'ProvisionedThroughputExceededException',
+    'ProvisionedThroughputExceeded',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+    'SlowDown')
+
+# S3 key layout of the unzipped objects (see get_artifact_key()). With 'sharded', the keys of each
+# application are spread across hashed sub-prefixes, e.g. unzipped/3f/8d247914_selfie.png
+KEY_LAYOUT_FLAT = 'flat'
+KEY_LAYOUT_SHARDED = 'sharded'
+KEY_SHARD_HEX_DIGITS = 2
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb'),
+    'sns': ('client', 'sns'),
+    'textract': ('client', 'textract'),
+    'sqs': ('client', 'sqs')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Item shape of the DynamoDB table (see serialize_ddb_item()). The writes use the low-level DynamoDB
+# client, and the known attributes are converted to the DynamoDB format by precompiled serializers,
+# instead of the type inspection of the boto3 resource layer. Other attributes use TypeSerializer.
+DDB_STRING_ATTRIBUTES = (
+    'APP_UUID',
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS',
+    'ARCHIVE_SHA256',
+    'SELFIE_DHASH',
+    'DUPLICATE_OF')
+DDB_BOOLEAN_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH', 'LICENSE_VALIDATION')
+DDB_STRING_LIST_ATTRIBUTES = ('DUPLICATE_LICENSE_OF', 'SIMILAR_SELFIE_OF')
+# EXTRACTED_DETAILS: the CUSTOMER_INFORMATION fields extracted by Textract, which are kept to re-verify
+# the applications when the comparison rules change (see Tools/reverify_details.py)
+DDB_STRING_MAP_ATTRIBUTES = ('EXTRACTED_DETAILS',)
+DDB_ITEM_SERIALIZERS = {
+    **{name: (str, lambda value: {'S': value}) for name in DDB_STRING_ATTRIBUTES},
+    **{name: (bool, lambda value: {'BOOL': value}) for name in DDB_BOOLEAN_ATTRIBUTES},
+    **{name: (list, lambda value: {'L': [{'S': element} for element in value]}) for name in DDB_STRING_LIST_ATTRIBUTES},
+    **{name: (dict, lambda value: {'M': {key: {'S': element} for key, element in value.items()}}) for name in DDB_STRING_MAP_ATTRIBUTES}}
+
+ddb_type_serializer = TypeSerializer()
+
+aimd_condition = threading.Condition()
+aimd_limits = {}
    
 def get_dynamo_db_table_name():
     """
@@ -49,6 +138,118 @@ def get_dynamo_db_table_name():
         print(f'finally block: do nothing for now')
         return ret
     
+def serialize_ddb_attribute(name, value):
+    """
+    This function converts the value of an attribute of the DynamoDB table to the low-level DynamoDB format,
+    e.g. 'NICK' to {'S': 'NICK'}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    name: Name of the attribute, e.g. 'FIRST_NAME'
+    value: Value of the attribute
+
+    Returns:
+
+    The value in the low-level DynamoDB format
+    
+    """
+    serializer = DDB_ITEM_SERIALIZERS.get(name)
+    if serializer is not None and type(value) is serializer[0]:
+        return serializer[1](value)
+    return ddb_type_serializer.serialize(value)
+
+def serialize_ddb_item(item):
+    """
+    This function converts an item of the DynamoDB table to the low-level DynamoDB format,
+    e.g. {'APP_UUID': '8d247914'} to {'APP_UUID': {'S': '8d247914'}}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    item: A dictionary of attribute names and values
+
+    Returns:
+
+    The item in the low-level DynamoDB format
+    
+    """
+    return {name: serialize_ddb_attribute(name, value) for name, value in item.items()}
+
+def get_ddb_table_name(ddb_table):
+    """
+    This function returns the name of a DynamoDB table.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+
+    Returns:
+
+    The table name
+    
+    """
+    return ddb_table if isinstance(ddb_table, str) else ddb_table.name
+
+def put_ddb_item(ddb_table, item, serialized = False):
+    """
+    This function writes an item to the DynamoDB table with the low-level DynamoDB client.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    item: A dictionary of attribute names and values, with APP_UUID
+    serialized: True if the item is already in the low-level DynamoDB format, e.g. CustomerDetails.to_ddb_item()
+
+    Returns:
+
+    The put_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').put_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Item = item if serialized else serialize_ddb_item(item))
+
+def set_ddb_attribute(ddb_table, appuuid, attribute_name, value):
+    """
+    This function sets one attribute of an item of the DynamoDB table with the low-level DynamoDB client.
+    update_item() creates the attribute if it does not exist.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the attribute, e.g. 'LICENSE_SELFIE_MATCH'
+    value: Value of the attribute
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return set_ddb_attributes(ddb_table, appuuid, {attribute_name: value})
+
+def set_ddb_attributes(ddb_table, appuuid, attributes):
+    """
+    This function sets several attributes of an item of the DynamoDB table with one update_item() call.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attributes: A dictionary of attribute names and values
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    names = list(attributes)
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = 'SET ' + ', '.join(f'{name}=:value{index}' for index, name in enumerate(names)),
+        ExpressionAttributeValues = {f':value{index}': serialize_ddb_attribute(name, attributes[name])
+                                     for index, name in enumerate(names)})
+
 def parse_csv_ddb(csv_filename):
     """
     This function parses .csv file and returns its contents as a dictionary.
@@ -79,16 +280,313 @@ def parse_csv_ddb(csv_filename):
 
         return details_reader
     
+def get_details_matching():
+    """
+    This function gets how the customer's details are compared with the fields extracted from the ID documents,
+    from the environment variable DETAILS_MATCHING. If it is not set, the details must be equal.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    DETAILS_MATCHING_EXACT or DETAILS_MATCHING_NORMALIZED
+    
+    """
+    matching = os.environ.get('DETAILS_MATCHING', DETAILS_MATCHING_EXACT)
+    if matching not in (DETAILS_MATCHING_EXACT, DETAILS_MATCHING_NORMALIZED):
+        print(f'Unknown DETAILS_MATCHING {matching}, using {DETAILS_MATCHING_EXACT}')
+        matching = DETAILS_MATCHING_EXACT
+    return matching
+
+def normalize_customer_value(value):
+    """
+    This function returns the normalized form of a customer's detail, which is used to compare it:
+    upper case, without leading, trailing or repeated spaces.
+
+    Parameters:
+
+    value: A customer's detail, e.g. ' 123  Main Street'. None is a missing detail.
+
+    Returns:
+
+    The normalized detail, e.g. '123 MAIN STREET'. An empty string for a missing detail.
+    
+    """
+    if value is None:
+        return ''
+    return ' '.join(value.split()).upper()
+
+class CustomerDetails:
+    """
+    This class holds the customer's details of an application (the .csv file). They are validated once,
+    when the .csv file is parsed (see parse_customer_details()). The CUSTOMER_INFORMATION fields are kept
+    in their fixed order, with their normalized form (see normalize_customer_value()), which is compared
+    with the information extracted from the ID documents when DETAILS_MATCHING is normalized
+    (see is_matching_customer_info()). The other columns of the .csv file are kept in extra: they are stored
+    with the details, but not compared.
+    Like the dictionary of the .csv file, a detail can be read with get(), e.g. customer.get('DOCUMENT_NUMBER', '0').
+    
+    """
+    __slots__ = ('values', 'normalized', 'extra')
+
+    def __init__(self, values, extra = None):
+        """
+        Parameters:
+
+        values: The CUSTOMER_INFORMATION values, in their order. A missing value is None.
+        extra: Optional dictionary of the other columns of the .csv file
+        
+        """
+        self.values = tuple(values)
+        self.normalized = tuple(normalize_customer_value(value) for value in self.values)
+        self.extra = dict(extra or {})
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        This function creates the customer's details from a dictionary, e.g. the details_dic of a checkpoint.
+        The CUSTOMER_INFORMATION fields that are not in the dictionary are missing, and the other keys are extra.
+
+        Parameters:
+
+        payload: A dictionary of the customer's details
+
+        Returns:
+
+        A CustomerDetails
+        
+        """
+        return cls((payload.get(name) for name in CUSTOMER_INFORMATION),
+                   {name: value for name, value in payload.items() if name not in CUSTOMER_INFORMATION_INDEX})
+
+    def get(self, name, default = None):
+        """
+        This function returns a customer's detail, like dict.get().
+
+        Parameters:
+
+        name: Name of the detail, e.g. 'DOCUMENT_NUMBER'
+        default: Returned value if the detail is missing
+
+        Returns:
+
+        The customer's detail. Otherwise, default
+        
+        """
+        index = CUSTOMER_INFORMATION_INDEX.get(name)
+        if index is None or self.values[index] is None:
+            return default
+        return self.values[index]
+
+    def matches(self, extracted_info, normalized = False):
+        """
+        This function compares the customer's CUSTOMER_INFORMATION details with the information extracted from
+        the ID documents. The extra details are not compared.
+
+        Parameters:
+
+        extracted_info: A CustomerDetails (see extract_customer_details()), or a dictionary of the extracted
+                        CUSTOMER_INFORMATION fields (see get_customer_extracted_info())
+        normalized: True to compare the normalized forms (see normalize_customer_value()). Otherwise, the details must be equal
+
+        Returns:
+
+        True if all the fields match. Otherwise, False
+        
+        """
+        if isinstance(extracted_info, CustomerDetails):
+            if normalized:
+                return self.normalized == extracted_info.normalized
+            return self.values == extracted_info.values
+        if normalized:
+            return self.normalized == tuple(normalize_customer_value(extracted_info.get(name)) for name in CUSTOMER_INFORMATION)
+        return self.values == tuple(extracted_info.get(name) for name in CUSTOMER_INFORMATION)
+
+    def to_payload(self):
+        """
+        This function returns the customer's details as a dictionary, e.g. for a checkpoint or a state machine payload.
+
+        Parameters:
+
+        None
+
+        Returns:
+
+        A dictionary of the CUSTOMER_INFORMATION fields that are not missing, then the extra details
+        
+        """
+        payload = {name: value for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None}
+        payload.update((name, value) for name, value in self.extra.items() if name not in payload)
+        return payload
+
+    def to_ddb_item(self, appuuid, extra_attributes = None):
+        """
+        This function returns the DynamoDB item of the application, in the low-level DynamoDB format.
+        The customer's details, including the extra details, are strings, so they are converted without serialize_ddb_item().
+
+        Parameters:
+
+        appuuid: Customer's ID, which is the partition key of the item
+        extra_attributes: Optional dictionary of attributes that are stored with the customer's details
+
+        Returns:
+
+        The item in the low-level DynamoDB format (see put_ddb_item())
+        
+        """
+        item = {name: {'S': value} for name, value in self.extra.items()}
+        item.update((name, {'S': value}) for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None)
+        if extra_attributes:
+            item.update(serialize_ddb_item(extra_attributes))
+        item['APP_UUID'] = {'S': appuuid}
+        return item
+
+    def __repr__(self):
+        return f'CustomerDetails({self.to_payload()})'
+
+def parse_customer_details(csv_filename):
+    """
+    This function parses the .csv file of an application, and validates it:
+    it must have all the CUSTOMER_INFORMATION columns. The other columns are kept as extra details (see CustomerDetails).
+
+    Parameters:
+
+    csv_filename: The .csv filename to parse.
+
+    Returns:
+
+    A CustomerDetails. Otherwise, None.
+    
+    """
+    ret = None
+    try:
+        details_dic = parse_csv_ddb(csv_filename)
+        if not details_dic:
+            raise ValueError('Could not parse csv file')
+
+        missing = [name for name in CUSTOMER_INFORMATION if details_dic.get(name) is None]
+        if missing:
+            raise ValueError(f'Missing {", ".join(missing)} in the .csv file')
+
+        # A row with more values than columns has them in a list under None, which is not a detail
+        extra = {name: value for name, value in details_dic.items()
+                 if isinstance(name, str) and isinstance(value, str) and name not in CUSTOMER_INFORMATION_INDEX}
+        ret = CustomerDetails((details_dic[name] for name in CUSTOMER_INFORMATION), extra)
+
+    except Exception as error:
+        print(f'Exception error: parse_customer_details : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: parse_customer_details :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: parse_customer_details :')
+
+    return ret
+    
+def is_throttling_error(error):
+    """
+    This function checks if an exception raised by a boto3 call is a throttling error.
+
+    Parameters:
+
+    error: The exception raised by the boto3 call
+
+    Returns:
+
+    True if the error is a throttling error. Otherwise, False
+    
+    """    
+    if isinstance(error, PermitUnavailableError):
+        return True
+
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+    # s3.upload_file() wraps the ClientError in S3UploadFailedError, so look at its message.
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+def call_with_adaptive_limit(operation, api_call, **kwargs):
+    """
+    This function calls a downstream AWS API while keeping the number of in-flight calls
+    for that operation within an adaptive limit (additive-increase/multiplicative-decrease).
+    Every call that succeeds within its latency target raises the limit by 1/limit
+    (i.e. by about one per round of calls). A throttling error or a slow call halves the limit.
+    Other errors keep the limit.
+    Callers that wait for a free slot block until another call completes.
+    It is only used for the concurrent calls of an invocation (see analyze_document_ids()):
+    the limit is per container, so the containers together are limited by the API permits (see acquire_api_permit()).
+
+    Parameters:
+
+    operation: Name of the operation, e.g. 'rekognition.compare_faces'. See AIMD_LATENCY_TARGET_SECONDS.
+    api_call: The boto3 method to call, e.g. rekognition.compare_faces
+    kwargs: Arguments passed to api_call
+
+    Returns:
+
+    The response of api_call. Exceptions raised by api_call are raised again to the caller.
+    
+    """    
+    with aimd_condition:
+        state = aimd_limits.setdefault(operation, {'limit': float(AIMD_INITIAL_LIMIT), 'in_flight': 0})
+        while state['in_flight'] >= int(state['limit']):
+            aimd_condition.wait()
+        state['in_flight'] += 1
+
+    succeeded = False
+    throttled = False
+    start = time.monotonic()
+    try:
+        response = api_call(**kwargs)
+        succeeded = True
+        return response
+    except Exception as error:
+        throttled = is_throttling_error(error)
+        raise
+    finally:
+        latency = time.monotonic() - start
+        with aimd_condition:
+            state['in_flight'] -= 1
+            # Other errors (e.g. ValidationException, AccessDenied) are not a congestion signal: the limit is kept
+            if throttled or (succeeded and latency > AIMD_LATENCY_TARGET_SECONDS.get(operation, float('inf'))):
+                state['limit'] = max(AIMD_MIN_LIMIT, state['limit'] * AIMD_DECREASE_FACTOR)
+                print(f'call_with_adaptive_limit : {operation} : throttled={throttled} latency={latency:.3f}s, limit decreased to {int(state["limit"])}')
+            elif succeeded:
+                state['limit'] = min(AIMD_MAX_LIMIT, state['limit'] + 1 / state['limit'])
+            aimd_condition.notify_all()
+
+def get_adaptive_limits():
+    """
+    This function returns the current adaptive concurrency limit of each downstream operation.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary of operation name to its current limit.
+    
+    """    
+    with aimd_condition:
+        return {operation: int(state['limit']) for operation, state in aimd_limits.items()}
+
 def analyze_document_id(
         bucket_name,
-        document_id):
+        document_id,
+        valerror = None):
     """
     This function analyzes a document using AWS Textract service and returns extracted fields from the document.
 
     Parameters:
 
     bucket_name: Name of s3 bucket where the document filename is stored.
-    document_id: Name of the document filename in S3 bucket.
+    document_id: Name of the document filename in S3 bucket, or a list of at most
+                 TEXTRACT_MAX_DOCUMENT_PAGES filenames (e.g. the front and the back of a license).
+    valerror: returned exception error (optional)
 
     Returns:
     
@@ -96,19 +594,31 @@ def analyze_document_id(
 
     """    
     ret = None
+    lease = {'permit_key': None}
     try:
-        response = textract.analyze_id(
+        # Wait for an AnalyzeID permit, so all containers together stay within the account's TPS.
+        permits = int(os.environ.get('ANALYZE_ID_PERMITS', DEFAULT_ANALYZE_ID_PERMITS))
+        if acquire_api_permit(ANALYZE_ID_API, permits, lease) == False:
+            raise PermitUnavailableError('Could not acquire an AnalyzeID permit')
+
+        document_ids = document_id if isinstance(document_id, list) else [document_id]
+        response = call_with_adaptive_limit(
+            'textract.analyze_id',
+            get_client('textract').analyze_id,
             DocumentPages=[
                 {
                     'S3Object': {
                         'Bucket': bucket_name,
-                        'Name': document_id
+                        'Name': name
                     }
                 }
+                for name in document_ids
             ]
         )
     except Exception as error:
         print(f'Exception error: {error}')
+        if valerror is not None:
+            valerror['error'] = error
     else:
         # If no errors are detected, continue to execute the following:
         print(f'else block: do nothing for now')
@@ -116,12 +626,142 @@ def analyze_document_id(
     finally:
         # Execute the following code whether or not an exception has been raised:
         print(f'finally block: do nothing for now')
+        release_api_permit(lease)
         return ret
 
+def analyze_document_ids(
+        bucket_name,
+        document_ids,
+        valerror = None):
+    """
+    This function analyzes several ID documents using AWS Textract service (see analyze_document_id()).
+    Textract analyzes at most TEXTRACT_MAX_DOCUMENT_PAGES pages per call, so the documents are analyzed
+    in groups, and the groups are analyzed concurrently.
+
+    Parameters:
+
+    bucket_name: Name of s3 bucket where the documents are stored.
+    document_ids: List of the document image filenames in S3 bucket.
+    valerror: returned exception error (optional)
+
+    Returns:
+    
+    response: A dictionary like the analyze_id() response, with the IdentityDocuments of all the documents
+              (in the order of document_ids). Otherwise, None
+
+    """    
+    ret = None
+    try:
+        groups = [document_ids[index:index + TEXTRACT_MAX_DOCUMENT_PAGES]
+                  for index in range(0, len(document_ids), TEXTRACT_MAX_DOCUMENT_PAGES)]
+        errors = [{'error':''} for group in groups]
+        if len(groups) == 1:
+            responses = [analyze_document_id(bucket_name, groups[0], errors[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                futures = [executor.submit(analyze_document_id, bucket_name, group, error)
+                           for group, error in zip(groups, errors)]
+                responses = [future.result() for future in futures]
+
+        failures = [error['error'] or ValueError('Could not analyze customer\'s ID')
+                    for response, error in zip(responses, errors) if response is None]
+        if failures:
+            raise next((failure for failure in failures if not is_throttling_error(failure)), failures[0])
+
+        response = responses[0]
+        if len(responses) > 1:
+            # Merge the groups, and number the documents again
+            response = {'DocumentMetadata': {'Pages': 0},
+                        'IdentityDocuments': [],
+                        'ResponseMetadata': responses[0]['ResponseMetadata']}
+            for group_response in responses:
+                response['DocumentMetadata']['Pages'] += group_response.get('DocumentMetadata', {}).get('Pages', 0)
+                for document_dict in group_response['IdentityDocuments']:
+                    response['IdentityDocuments'].append({**document_dict, 'DocumentIndex': len(response['IdentityDocuments']) + 1})
+
+    except Exception as error:
+        print(f'Exception error: analyze_document_ids : {error}')
+        if valerror is not None:
+            valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: analyze_document_ids :')
+        ret = response
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: analyze_document_ids :')
+
+    return ret
+
+def extract_customer_fields(response):
+    """
+    This function extracts the CUSTOMER_INFORMATION fields of the documents analyzed by analyze_id(),
+    with the compiled extraction spec (see TEXTRACT_FIELD_SLOTS): each field type is looked up once in
+    a dictionary, instead of being searched in CUSTOMER_INFORMATION. With several documents (e.g. a license
+    and a passport), a field that is empty in a document is taken from the next document.
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+
+    Returns:
+
+    A tuple of two lists in the CUSTOMER_INFORMATION order: the values and their confidence (0 to 100).
+    A field that was not found is None. Exceptions are raised to the caller.
+    
+    """
+    values = [None] * len(CUSTOMER_INFORMATION)
+    confidences = [None] * len(CUSTOMER_INFORMATION)
+    for document_dict in response['IdentityDocuments']:
+        for field in document_dict['IdentityDocumentFields']:
+            slot = TEXTRACT_FIELD_SLOTS.get(field['Type']['Text'])
+            if slot is not None and not values[slot]:
+                value_detection = field['ValueDetection']
+                values[slot] = value_detection['Text']
+                confidences[slot] = value_detection.get('Confidence')
+    return values, confidences
+
+def extract_customer_details(response, extraction):
+    """
+    This function returns the customer's details extracted by analyze_id() as a CustomerDetails,
+    which can be compared with the customer's submitted details (see is_matching_customer_info()).
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+    extraction: Returned dictionary. 'confidence' is the confidence of each extracted field, e.g. {'FIRST_NAME': 99.2}
+
+    Returns:
+
+    A CustomerDetails. Otherwise, None
+    
+    """
+    ret = None
+    try:
+        # IdentityDocuments: An array (in the dictionary) of documents that were analyzed by analyze_id()
+        if len(response['IdentityDocuments']) == 0:
+            raise ValueError('No document was processed by analyze_id()')
+
+        values, confidences = extract_customer_fields(response)
+        extraction['confidence'] = {name: confidence for name, confidence in zip(CUSTOMER_INFORMATION, confidences)
+                                    if confidence is not None}
+        ret = CustomerDetails(values)
+
+    except Exception as error:
+        print(f'Exception error: extract_customer_details : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: extract_customer_details :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: extract_customer_details :')
+
+    return ret
+
 def get_customer_extracted_info(response):
     """
     This function returns the extracted information from the analyze_id() AWS Texract function
-    as a dictionary.
+    as a dictionary. See extract_customer_fields().
 
     Parameters:
 
@@ -140,13 +780,8 @@ def get_customer_extracted_info(response):
             # The array is empty. Hence, no document was processed by analyze_id()
             return None 
         
-        # There is at least one document being analyzed.
-        document_dict = response['IdentityDocuments'][0]
-        document_fields = document_dict['IdentityDocumentFields'] # This is a list of dictionaries
-
-        for field in document_fields:
-            if field['Type']['Text'] in CUSTOMER_INFORMATION:
-                extracted_info[field['Type']['Text']] = field['ValueDetection']['Text']
+        values, confidences = extract_customer_fields(response)
+        extracted_info = {name: value for name, value in zip(CUSTOMER_INFORMATION, values) if value is not None}
 
     except Exception as error:
         print(f'Exception error: {error}')
@@ -161,15 +796,18 @@ def get_customer_extracted_info(response):
 
 def is_matching_customer_info(
         extracted_info,
-        customer_info):
+        customer_info,
+        matching = None):
     """
     This function compares the extracted customer information from the document that was analyzed by
     the analyze_id() with the corresponding customer information submitted by the customer.
+    By default, each field must be equal. With DETAILS_MATCHING_NORMALIZED, case and repeated spaces are ignored.
 
     Parameters:
 
     extracted_info: Extracted customer information from the document that was analyzed.
-    customer_info: Customer information submitted by the customer
+    customer_info: Customer information submitted by the customer (a CustomerDetails or a dictionary)
+    matching: DETAILS_MATCHING_EXACT or DETAILS_MATCHING_NORMALIZED. If it is None, see get_details_matching()
 
     Returns:
     
@@ -180,8 +818,11 @@ def is_matching_customer_info(
     ret = False
     
     try:
-        if extracted_info == customer_info:
-            ret = True
+        if isinstance(customer_info, dict):
+            customer_info = CustomerDetails.from_payload(customer_info)
+        if matching is None:
+            matching = get_details_matching()
+        ret = customer_info.matches(extracted_info, matching == DETAILS_MATCHING_NORMALIZED)
     except Exception as error:
         print(f'Exception error: {error}')
     else:
@@ -241,7 +882,7 @@ def send_sns_email(message, subject):
         if topic_name is None:
             raise ValueError('Could not get SNS Topic!')
                 
-        response_sns = sns.publish(
+        response_sns = get_client('sns').publish(
             TopicArn = topic_name,
             Message = message,
             Subject = subject)
@@ -262,7 +903,7 @@ def send_sns_email(message, subject):
         print(f'finally block: send_sns_email :')
         return ret
 
-def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic):
+def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic, valerror = None, document_keys = None):
     """
     This function compares customer's submitted info (in details_dic) with
     customer's driver license (in license_key) using AWS Textract,
@@ -275,7 +916,9 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
     license_key: Customer's driver license image
     appuuid: Customer's ID, which is also the partition key for DynamoDB table
     ddb_table: DynamoDB table name
-    details_dic: Customer's submitted info (from .csv file)
+    details_dic: Customer's submitted info (from .csv file), a CustomerDetails or a dictionary
+    valerror: returned exception error (optional)
+    document_keys: The ID documents, with license_key first (optional). Their fields are merged.
 
     Returns:
 
@@ -287,27 +930,30 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
 
     try:
         # Analyze customer's submitted document ID.
-        response_textract = analyze_document_id(bucket, license_key)
+        textract_error = {'error':''}
+        response_textract = analyze_document_ids(bucket, document_keys or [license_key], textract_error)
         if response_textract is None:
-            raise ValueError('Could not analyze customer\'s ID')
+            # Keep the error from analyze_document_id() (e.g. a throttling error) for the caller.
+            raise textract_error['error'] or ValueError('Could not analyze customer\'s ID')
         print(f'Analysis of customer submitted ID: {response_textract}')
         
         # Extract customer's information from the submitted ID.
-        extracted_info = get_customer_extracted_info(response_textract)
-        if extracted_info is None:
+        extraction = {'confidence': {}}
+        extracted_customer = extract_customer_details(response_textract, extraction)
+        if extracted_customer is None:
             raise ValueError('Could not extract customer\'s information from the ID')
-        print(f'Extracted info from customer submitted ID: {extracted_info}')
+        print(f'Extracted info from customer submitted ID: {extracted_customer}, confidence: {extraction["confidence"]}')
         
         # Compare extracted information with customer's submitted information
-        matches_info_found = is_matching_customer_info(extracted_info, details_dic)
+        matches_info_found = is_matching_customer_info(extracted_customer, details_dic)
         print(f'Is matching customer info?: {matches_info_found}')
         
-        # Update LICENSE_DETAILS_MATCH attribute according to matches_info_found result (i.e True/False). 
-        #  The DynamoDB update_item() will create the attribute if it does not exist.
-        response_db_update = ddb_table.update_item(
-            Key={"APP_UUID": appuuid},
-            UpdateExpression='SET LICENSE_DETAILS_MATCH=:f_matches',
-            ExpressionAttributeValues={':f_matches':matches_info_found})
+        # Update LICENSE_DETAILS_MATCH attribute according to matches_info_found result (i.e True/False),
+        #  and keep the extracted information (EXTRACTED_DETAILS) to re-verify the application later.
+        #  The DynamoDB update_item() will create the attributes if they do not exist.
+        response_db_update = set_ddb_attributes(ddb_table, appuuid, {
+            'LICENSE_DETAILS_MATCH': matches_info_found,
+            'EXTRACTED_DETAILS': extracted_customer.to_payload()})
         if response_db_update is None:
             raise ValueError('Could not update DynamoDB Table item with LICENSE_DETAILS_MATCH')
         print(f'Response to update LICENSE_DETAILS_MATCH attribute: {response_db_update}')
@@ -322,6 +968,8 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
 
     except Exception as error:
         print(f'Exception error: {error}')
+        if valerror is not None:
+            valerror['error'] = error
     else:
         # If no errors are detected, continue to execute the following:
         print(f'else block: do nothing for now')
@@ -334,19 +982,226 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
     return ret
 
 
+def park_application(checkpoint):
+    """
+    This function parks an application whose CompareDetails stage was throttled, or could not get an API permit.
+    The checkpoint is sent to the parking queue of this function with a delay, and this function drains
+    its parking queue at a controlled rate (see the ParkingEvent in YAML template).
+    Each time an application is parked again, the delay doubles.
+
+    Parameters:
+
+    checkpoint: A dictionary that contains the state machine event of the application (event)
+                and the number of times it was parked (attempt)
+
+    Returns:
+
+    True if the application is parked. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        queue_url = os.environ['PARKING_QUEUE_URL']
+        max_attempts = int(os.environ.get('PARKING_MAX_ATTEMPTS', DEFAULT_PARKING_MAX_ATTEMPTS))
+
+        attempt = checkpoint.get('attempt', 0) + 1
+        if attempt > max_attempts:
+            raise ValueError(f'Application was parked {max_attempts} times')
+        checkpoint['attempt'] = attempt
+
+        # Exponential backoff with jitter, so parked applications do not come back all at once.
+        delay = min(PARKING_MAX_DELAY_SECONDS,
+                    int(PARKING_BASE_DELAY_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)))
+
+        response = get_client('sqs').send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps(checkpoint),
+            DelaySeconds=delay)
+        print(f'Parked application {checkpoint["event"]["application"]["app_uuid"]} for {delay} seconds: {response}')
+
+    except Exception as error:
+        print(f'Exception error: park_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: park_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: park_application :')
+        return ret
+
+def complete_resumed_application(ddb_table, appuuid, notification):
+    """
+    This function completes an application that was resumed from the parking queue.
+    The state machine execution of a parked application ended in its Parked state, so the
+    SendSuccess state did not run. Once both LICENSE_SELFIE_MATCH and LICENSE_DETAILS_MATCH
+    are True, this function sends the notification to the license queue in place of SendSuccess.
+    If both checks were parked and resume at the same time, only the one that sets LICENSE_QUEUED
+    (a conditional update) sends the notification, so the license is submitted once.
+
+    Parameters:
+
+    ddb_table: DynamoDB table
+    appuuid: Customer's ID, which is also the partition key for DynamoDB table
+    notification: The response of WriteToDynamoLambdaFunction ($.notification in the state machine)
+
+    Returns:
+
+    True if operations are successful. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        response_db = ddb_table.get_item(
+            Key={"APP_UUID": appuuid},
+            ProjectionExpression='LICENSE_SELFIE_MATCH, LICENSE_DETAILS_MATCH, LICENSE_QUEUED',
+            ConsistentRead=True)
+        item = response_db.get('Item', {})
+
+        if item.get('LICENSE_QUEUED') is True:
+            print(f'Application {appuuid} was already sent to the license queue')
+        elif item.get('LICENSE_SELFIE_MATCH') is True and item.get('LICENSE_DETAILS_MATCH') is True:
+            try:
+                ddb_table.update_item(
+                    Key={"APP_UUID": appuuid},
+                    UpdateExpression='SET LICENSE_QUEUED = :queued',
+                    ConditionExpression='attribute_not_exists(LICENSE_QUEUED)',
+                    ExpressionAttributeValues={':queued': True})
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # The other check resumed at the same time, and sends the notification
+                print(f'Application {appuuid} was already sent to the license queue by the other check')
+            else:
+                try:
+                    response_sqs = get_client('sqs').send_message(
+                        QueueUrl=os.environ['QUEUE_URL'],
+                        MessageBody=json.dumps(notification))
+                    print(f'Message sent to SQS: {response_sqs}')
+                except Exception:
+                    # Release LICENSE_QUEUED, so the parked message is sent when SQS delivers it again
+                    ddb_table.update_item(
+                        Key={"APP_UUID": appuuid},
+                        UpdateExpression='REMOVE LICENSE_QUEUED')
+                    raise
+        else:
+            # The other check is still parked (or failed). It completes the application when it is done.
+            print(f'Application {appuuid} is waiting for the other check: {item}')
+
+    except Exception as error:
+        print(f'Exception error: complete_resumed_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: complete_resumed_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: complete_resumed_application :')
+        return ret
+
+def get_key_layout():
+    """
+    This function gets the S3 key layout of the unzipped objects from the environment variable KEY_LAYOUT.
+    If it is not set, or not a known layout, the flat layout (unzipped/<appuuid>_selfie.png) is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED
+    
+    """    
+    layout = os.environ.get('KEY_LAYOUT', KEY_LAYOUT_FLAT)
+    if layout not in (KEY_LAYOUT_FLAT, KEY_LAYOUT_SHARDED):
+        print(f'Unknown KEY_LAYOUT {layout}, using {KEY_LAYOUT_FLAT}')
+        layout = KEY_LAYOUT_FLAT
+
+    return layout
+
+def get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, layout = None):
+    """
+    This function gets the S3 key of an unzipped object of an application.
+    For example, for appuuid 8d247914 and file_name 8d247914_selfie.png:
+    flat layout: unzipped/8d247914_selfie.png
+    sharded layout: unzipped/<first hex digits of sha256(appuuid)>/8d247914_selfie.png
+
+    All the objects of one application are in the same shard.
+
+    Parameters:
+
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+    layout: KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED. If None, get_key_layout() is used
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    if layout is None:
+        layout = get_key_layout()
+
+    if layout == KEY_LAYOUT_SHARDED:
+        shard = hashlib.sha256(appuuid.encode('utf-8')).hexdigest()[:KEY_SHARD_HEX_DIGITS]
+        return bucket_unzipped_prefix + shard + '/' + file_name
+
+    return bucket_unzipped_prefix + file_name
+
+def resolve_artifact_key(bucket, bucket_unzipped_prefix, appuuid, file_name):
+    """
+    This function gets the S3 key of an existing unzipped object of an application.
+    With the sharded layout, an application that was stored before the layout changed
+    is still read from its flat key.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name)
+
+    if get_key_layout() == KEY_LAYOUT_FLAT:
+        return ret
+
+    try:
+        get_client('s3').head_object(Bucket=bucket, Key=ret)
+    except botocore.exceptions.ClientError as error:
+        # Without s3:ListBucket permission, S3 returns 403 instead of 404 for a missing key.
+        if error.response.get('Error', {}).get('Code') in ('404', '403', 'NoSuchKey', 'NotFound'):
+            print(f'{ret} not found, using the flat key')
+            ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, KEY_LAYOUT_FLAT)
+        else:
+            print(f'Exception Client Error: resolve_artifact_key : {error}')
+    except Exception as error:
+        print(f'Exception error: resolve_artifact_key : {error}')
+
+    return ret
+
 def lambda_handler(event, context):
     """
     This function is the AWS Lambda function call for CompareDetailsLambdaFunction.
 
     Parameters:
 
-    event: State event, which contains app_uuid and bucket name
+    event: State event, which contains app_uuid and bucket name,
+           or SQS event from the parking queue, which contains a parked application
     context: not used in this application
 
     Returns:
 
     A dictionary that contains a status as either failure or success,
     with a message describing the status.
+    If a resumed application cannot be completed, an error is raised, so SQS delivers it again.
     
     """    
     
@@ -361,9 +1216,19 @@ def lambda_handler(event, context):
         "message": "ID Information Comparison failed"
     }
 
+    resume_failed = False
+
     try:
         print(f'event: {event}')
-        
+
+        # A parked application arrives from the parking queue with its checkpoint.
+        checkpoint = {'event': event, 'attempt': 0}
+        resumed = 'Records' in event
+        if resumed:
+            checkpoint = json.loads(event['Records'][0]['body'])
+            event = checkpoint['event']
+            print(f'Resuming parked application: {checkpoint}')
+
         detail = event['detail']
         bucket = detail['bucket']['name']
         application = event['application']
@@ -379,21 +1244,24 @@ def lambda_handler(event, context):
         if not os.path.exists(subfolder_path):
             os.makedirs(subfolder_path)
 
-        license_key = BUCKET_UNZIPPED_PREFIX + appuuid + '_license.png'
+        # Unzip passes the S3 keys of the unzipped objects. An older execution only has the app_uuid.
+        license_key = application.get('license_key') or resolve_artifact_key(
+            bucket, BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_license.png')
 
         # Download the .csv file from S3 bucket to this Lambda's internal memory
         # Use: s3.download_file(bucket, from, to)
-        location_in_bucket = BUCKET_UNZIPPED_PREFIX + appuuid + '_details.csv'
+        location_in_bucket = application.get('details_key') or resolve_artifact_key(
+            bucket, BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_details.csv')
         details_file = LAMBDA_TMP_FOLDER + LAMBDA_UNZIPPED_FOLDER + appuuid + '_details.csv'
         print(f'location_in_bucket: {location_in_bucket}')
         print(f'details_file: {details_file}')
-        response_s3 = s3.download_file(bucket, location_in_bucket, details_file)
+        response_s3 = get_client('s3').download_file(bucket, location_in_bucket, details_file)
 
-        # Parse .csv file and get a dictionary
-        details_dic = parse_csv_ddb(details_file)
-        if details_dic is None:
+        # Parse and validate the .csv file
+        customer = parse_customer_details(details_file)
+        if customer is None:
             raise ValueError('Could not parse csv file')
-        print(f'details_dic: {details_dic}')
+        print(f'customer: {customer}')
 
         # Get DynamoDB table. The status of Textract comparison operation will be written in the table.
         ddb_table_name = get_dynamo_db_table_name()
@@ -403,7 +1271,7 @@ def lambda_handler(event, context):
         
         # From Boto3 documentation:
         # Instantiate a table resource object without actually creating a DynamoDB table.
-        ddb_table = dynamodb.Table(ddb_table_name)
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
         if ddb_table is None:
             raise ValueError('Table: test_table not found')
         # For unit testing, the following if-condition will not work unless I have IAM Policy "DerscribeTable".
@@ -423,9 +1291,24 @@ def lambda_handler(event, context):
         # Update DynamoDB table the outcome of this comparison.
         # Send an email if the comparison fails.
         #=====================================================================================================
-        outcome = validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic)
+        valerror = {'error':''}
+        outcome = validate_customer_details(bucket, license_key, appuuid, ddb_table, customer, valerror, application.get('document_keys'))
         if outcome == False:
-            raise ValueError('Error in validate_customer_details')
+            if not is_throttling_error(valerror['error']):
+                raise ValueError('Error in validate_customer_details')
+
+            # Throttled: park the application instead of failing it.
+            if park_application(checkpoint) == False:
+                raise ValueError('Error in validate_customer_details, and could not park the application')
+            ret = {
+                "status": "parked",
+                "message": "ID Information Comparison parked"
+            }
+            return ret
+
+        if resumed and complete_resumed_application(ddb_table, appuuid, event['notification']) == False:
+            resume_failed = True
+            raise ValueError('Error in complete_resumed_application')
                         
     except Exception as error:
         print(f'Exception error: {error}')
@@ -441,7 +1324,11 @@ def lambda_handler(event, context):
     
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
-        return ret
+    if resume_failed:
+        # Raise an error, so SQS delivers the parked application again (see ParkingEvent in YAML template)
+        raise RuntimeError(f'Could not complete the resumed application: {event}')
+
+    return ret
 
@@ -1,14 +1,89 @@
 import os
+import threading
+import json
+import time
+import random
+import botocore
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
+from api_limiter import PermitUnavailableError, acquire_api_permit, release_api_permit
 
 SIMILARITY_THRESHOLD = 80
 SNS_FACEMATCH_MESSAGE = 'No matches between selfie and license'
 SNS_FACEMATCH_SUBJECT = 'Face Match Fails'
-
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-rekognition = boto3.client('rekognition')
-sns = boto3.client('sns')
+COMPARE_FACES_API = 'CompareFaces'
+DEFAULT_COMPARE_FACES_PERMITS = 5
+
+# Parking queue for applications whose check was throttled (see park_application()).
+DEFAULT_PARKING_MAX_ATTEMPTS = 5
+PARKING_BASE_DELAY_SECONDS = 30
+PARKING_MAX_DELAY_SECONDS = 900 # SQS allows a delay of at most 15 minutes
+
+# Adaptive (AIMD) concurrency limits of the calls that an invocation makes concurrently, e.g. one per
+# ID document (see call_with_adaptive_limit()).
+AIMD_INITIAL_LIMIT = 4
+AIMD_MIN_LIMIT = 1
+AIMD_MAX_LIMIT = 64
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_LATENCY_TARGET_SECONDS = {
+    'rekognition.compare_faces': 3.0}
+THROTTLING_ERROR_CODES = (
+    'ThrottlingException',
+    'Throttling',
+    'ProvisionedThroughputExceededException',
+    'ProvisionedThroughputExceeded',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+    'SlowDown')
+
+# S3 key layout of the unzipped objects (see get_artifact_key()). With 'sharded', the keys of each
+# application are spread across hashed sub-prefixes, e.g. unzipped/3f/8d247914_selfie.png
+KEY_LAYOUT_FLAT = 'flat'
+KEY_LAYOUT_SHARDED = 'sharded'
+KEY_SHARD_HEX_DIGITS = 2
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb'),
+    'rekognition': ('client', 'rekognition'),
+    'sns': ('client', 'sns'),
+    'sqs': ('client', 'sqs')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Item shape of the DynamoDB table (see serialize_ddb_item()). The writes use the low-level DynamoDB
+# client, and the known attributes are converted to the DynamoDB format by precompiled serializers,
+# instead of the type inspection of the boto3 resource layer. Other attributes use TypeSerializer.
+DDB_STRING_ATTRIBUTES = (
+    'APP_UUID',
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS',
+    'ARCHIVE_SHA256',
+    'SELFIE_DHASH',
+    'DUPLICATE_OF')
+DDB_BOOLEAN_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH', 'LICENSE_VALIDATION')
+DDB_STRING_LIST_ATTRIBUTES = ('DUPLICATE_LICENSE_OF', 'SIMILAR_SELFIE_OF')
+DDB_ITEM_SERIALIZERS = {
+    **{name: (str, lambda value: {'S': value}) for name in DDB_STRING_ATTRIBUTES},
+    **{name: (bool, lambda value: {'BOOL': value}) for name in DDB_BOOLEAN_ATTRIBUTES},
+    **{name: (list, lambda value: {'L': [{'S': element} for element in value]}) for name in DDB_STRING_LIST_ATTRIBUTES}}
+
+ddb_type_serializer = TypeSerializer()
+
+aimd_condition = threading.Condition()
+aimd_limits = {}
 
 def get_dynamo_db_table_name():
     """
@@ -39,6 +114,187 @@ def get_dynamo_db_table_name():
         print(f'finally block: do nothing for now')
         return ret
     
+def serialize_ddb_attribute(name, value):
+    """
+    This function converts the value of an attribute of the DynamoDB table to the low-level DynamoDB format,
+    e.g. 'NICK' to {'S': 'NICK'}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    name: Name of the attribute, e.g. 'FIRST_NAME'
+    value: Value of the attribute
+
+    Returns:
+
+    The value in the low-level DynamoDB format
+    
+    """
+    serializer = DDB_ITEM_SERIALIZERS.get(name)
+    if serializer is not None and type(value) is serializer[0]:
+        return serializer[1](value)
+    return ddb_type_serializer.serialize(value)
+
+def serialize_ddb_item(item):
+    """
+    This function converts an item of the DynamoDB table to the low-level DynamoDB format,
+    e.g. {'APP_UUID': '8d247914'} to {'APP_UUID': {'S': '8d247914'}}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    item: A dictionary of attribute names and values
+
+    Returns:
+
+    The item in the low-level DynamoDB format
+    
+    """
+    return {name: serialize_ddb_attribute(name, value) for name, value in item.items()}
+
+def get_ddb_table_name(ddb_table):
+    """
+    This function returns the name of a DynamoDB table.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+
+    Returns:
+
+    The table name
+    
+    """
+    return ddb_table if isinstance(ddb_table, str) else ddb_table.name
+
+def put_ddb_item(ddb_table, item, serialized = False):
+    """
+    This function writes an item to the DynamoDB table with the low-level DynamoDB client.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    item: A dictionary of attribute names and values, with APP_UUID
+    serialized: True if the item is already in the low-level DynamoDB format, e.g. CustomerDetails.to_ddb_item()
+
+    Returns:
+
+    The put_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').put_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Item = item if serialized else serialize_ddb_item(item))
+
+def set_ddb_attribute(ddb_table, appuuid, attribute_name, value):
+    """
+    This function sets one attribute of an item of the DynamoDB table with the low-level DynamoDB client.
+    update_item() creates the attribute if it does not exist.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the attribute, e.g. 'LICENSE_SELFIE_MATCH'
+    value: Value of the attribute
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = f'SET {attribute_name}=:value',
+        ExpressionAttributeValues = {':value': serialize_ddb_attribute(attribute_name, value)})
+
+def is_throttling_error(error):
+    """
+    This function checks if an exception raised by a boto3 call is a throttling error.
+
+    Parameters:
+
+    error: The exception raised by the boto3 call
+
+    Returns:
+
+    True if the error is a throttling error. Otherwise, False
+    
+    """    
+    if isinstance(error, PermitUnavailableError):
+        return True
+
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+    # s3.upload_file() wraps the ClientError in S3UploadFailedError, so look at its message.
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+def call_with_adaptive_limit(operation, api_call, **kwargs):
+    """
+    This function calls a downstream AWS API while keeping the number of in-flight calls
+    for that operation within an adaptive limit (additive-increase/multiplicative-decrease).
+    Every call that succeeds within its latency target raises the limit by 1/limit
+    (i.e. by about one per round of calls). A throttling error or a slow call halves the limit.
+    Other errors keep the limit.
+    Callers that wait for a free slot block until another call completes.
+    It is only used for the concurrent calls of an invocation (see get_matching_faces_for_documents()):
+    the limit is per container, so the containers together are limited by the API permits (see acquire_api_permit()).
+
+    Parameters:
+
+    operation: Name of the operation, e.g. 'rekognition.compare_faces'. See AIMD_LATENCY_TARGET_SECONDS.
+    api_call: The boto3 method to call, e.g. rekognition.compare_faces
+    kwargs: Arguments passed to api_call
+
+    Returns:
+
+    The response of api_call. Exceptions raised by api_call are raised again to the caller.
+    
+    """    
+    with aimd_condition:
+        state = aimd_limits.setdefault(operation, {'limit': float(AIMD_INITIAL_LIMIT), 'in_flight': 0})
+        while state['in_flight'] >= int(state['limit']):
+            aimd_condition.wait()
+        state['in_flight'] += 1
+
+    succeeded = False
+    throttled = False
+    start = time.monotonic()
+    try:
+        response = api_call(**kwargs)
+        succeeded = True
+        return response
+    except Exception as error:
+        throttled = is_throttling_error(error)
+        raise
+    finally:
+        latency = time.monotonic() - start
+        with aimd_condition:
+            state['in_flight'] -= 1
+            # Other errors (e.g. ValidationException, AccessDenied) are not a congestion signal: the limit is kept
+            if throttled or (succeeded and latency > AIMD_LATENCY_TARGET_SECONDS.get(operation, float('inf'))):
+                state['limit'] = max(AIMD_MIN_LIMIT, state['limit'] * AIMD_DECREASE_FACTOR)
+                print(f'call_with_adaptive_limit : {operation} : throttled={throttled} latency={latency:.3f}s, limit decreased to {int(state["limit"])}')
+            elif succeeded:
+                state['limit'] = min(AIMD_MAX_LIMIT, state['limit'] + 1 / state['limit'])
+            aimd_condition.notify_all()
+
+def get_adaptive_limits():
+    """
+    This function returns the current adaptive concurrency limit of each downstream operation.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary of operation name to its current limit.
+    
+    """    
+    with aimd_condition:
+        return {operation: int(state['limit']) for operation, state in aimd_limits.items()}
+
 def get_matching_faces(
         bucket_name,
         source_image,
@@ -64,9 +320,17 @@ def get_matching_faces(
     """    
     
     ret = None
+    lease = {'permit_key': None}
     try:
+        # Wait for a CompareFaces permit, so all containers together stay within the account's TPS.
+        permits = int(os.environ.get('COMPARE_FACES_PERMITS', DEFAULT_COMPARE_FACES_PERMITS))
+        if acquire_api_permit(COMPARE_FACES_API, permits, lease) == False:
+            raise PermitUnavailableError('Could not acquire a CompareFaces permit')
+
         # Using the global rekognition client
-        response = rekognition.compare_faces(
+        response = call_with_adaptive_limit(
+            'rekognition.compare_faces',
+            get_client('rekognition').compare_faces,
             SourceImage={
                 'S3Object': {
                     'Bucket': bucket_name,
@@ -94,9 +358,66 @@ def get_matching_faces(
     finally:
         # Execute the following code whether or not an exception has been raised:
         print(f'finally block: get_matching_faces :')
+        release_api_permit(lease)
 
         return ret
 
+def get_matching_faces_for_documents(
+        bucket_name,
+        source_image,
+        target_images,
+        similarity_threshold,
+        valerror):
+    """
+    This function compares a source image with several target images (e.g. the ID documents of an
+    application) using get_matching_faces(). The comparisons run concurrently, so several documents
+    take about as long as one.
+
+    Parameters:
+
+    bucket_name: Name of s3 bucket where the images are stored.
+    source_image: Name of the source image filename in S3 bucket.
+    target_images: List of the target image filenames in S3 bucket.
+    similarity_threshold: The SimilarityThreshold used by compare_faces() function.
+    valerror: returned exception error. If several comparisons fail, an error that is not throttling is returned first.
+
+    Returns:
+    
+    A list of compare_faces() responses, in the order of target_images. Otherwise, None
+
+    """    
+    
+    ret = None
+    try:
+        errors = [{'error':''} for target_image in target_images]
+        if len(target_images) == 1:
+            responses = [get_matching_faces(bucket_name, source_image, target_images[0], similarity_threshold, errors[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(target_images)) as executor:
+                futures = [executor.submit(get_matching_faces, bucket_name, source_image, target_image, similarity_threshold, error)
+                           for target_image, error in zip(target_images, errors)]
+                responses = [future.result() for future in futures]
+
+        failures = [error['error'] for response, error in zip(responses, errors) if response is None]
+        if failures:
+            # A throttled comparison can be retried, but another failed comparison would fail again
+            raise next((failure for failure in failures if not is_throttling_error(failure)), failures[0])
+
+    except Exception as error:
+        print(f'Exception error: get_matching_faces_for_documents : {error}')
+        valerror['error'] = error
+
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: get_matching_faces_for_documents :')
+        ret = responses
+
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: get_matching_faces_for_documents :')
+
+    return ret
+
 def is_matching_faces(response):
     """
     This function checks if the response from the AWS Rekognition's compare_faces() function contains matched faces.
@@ -171,7 +492,7 @@ def send_sns_email(message, subject):
         if topic_name is None:
             raise ValueError('Could not get SNS Topic!')
                 
-        response_sns = sns.publish(
+        response_sns = get_client('sns').publish(
             TopicArn = topic_name,
             Message = message,
             Subject = subject)
@@ -192,11 +513,13 @@ def send_sns_email(message, subject):
         print(f'finally block: send_sns_email :')
         return ret
 
-def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror):
+def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror, document_keys = None):
     """
     This function compares two images (selfie_key and license_key) using AWS Rekognition,
     updates DynamoDB table (LICENSE_SELFIE_MATCH attribute) with the outcome of this comparison,
     and sends an email if the comparison fails.
+    With several ID documents (document_keys), the selfie is compared with each document concurrently,
+    and it matches if it matches any document (e.g. the back of a license has no face).
 
     Parameters:
 
@@ -206,6 +529,7 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
     appuuid: Customer's ID, which is also the partition key for DynamoDB table
     ddb_table: DynamoDB table name
     valerror: returned exception error
+    document_keys: The ID documents, with license_key first (optional)
 
     Returns:
 
@@ -217,27 +541,28 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
 
     try:
     
-        # Compare selfie_key with license_key using AWS Rekognition, and get an array of matching faces.
-        matching_faces = get_matching_faces(
+        # Compare selfie_key with each document using AWS Rekognition, and get an array of matching faces per document.
+        all_matching_faces = get_matching_faces_for_documents(
             bucket,
             selfie_key,
-            license_key,
+            document_keys or [license_key],
             SIMILARITY_THRESHOLD,
             valerror)
-        if matching_faces['ResponseMetadata']['HTTPStatusCode'] != 200:
-            raise ValueError('Could not compare images')
-        print(f'Possible Matching Faces: {matching_faces}')
+        if all_matching_faces is None:
+            # Keep the error from get_matching_faces() (e.g. a throttling error) for the caller.
+            raise valerror['error']
+        for matching_faces in all_matching_faces:
+            if matching_faces['ResponseMetadata']['HTTPStatusCode'] != 200:
+                raise ValueError('Could not compare images')
+            print(f'Possible Matching Faces: {matching_faces}')
         
         # Check if matches found
-        matches_found = is_matching_faces(matching_faces)
+        matches_found = any(is_matching_faces(matching_faces) for matching_faces in all_matching_faces)
         print(f'Is matches found?: {matches_found}')
 
         # Update LICENSE_SELFIE_MATCH attribute according to match-found result (i.e True/False). 
         #  The DynamoDB update_item() will create the attribute if it does not exist.
-        response_db_update = ddb_table.update_item(
-            Key={"APP_UUID": appuuid},
-            UpdateExpression='SET LICENSE_SELFIE_MATCH=:f_matches',
-            ExpressionAttributeValues={':f_matches':matches_found})
+        response_db_update = set_ddb_attribute(ddb_table, appuuid, 'LICENSE_SELFIE_MATCH', matches_found)
         if response_db_update['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Could not update DynamoDB Table item with LICENSE_SELFIE_MATCH')
         print(f'Response to update LICENSE_SELFIE_MATCH attribute: {response_db_update}')
@@ -267,19 +592,226 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
     return ret
 
 
+def park_application(checkpoint):
+    """
+    This function parks an application whose CompareFaces stage was throttled, or could not get an API permit.
+    The checkpoint is sent to the parking queue of this function with a delay, and this function drains
+    its parking queue at a controlled rate (see the ParkingEvent in YAML template).
+    Each time an application is parked again, the delay doubles.
+
+    Parameters:
+
+    checkpoint: A dictionary that contains the state machine event of the application (event)
+                and the number of times it was parked (attempt)
+
+    Returns:
+
+    True if the application is parked. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        queue_url = os.environ['PARKING_QUEUE_URL']
+        max_attempts = int(os.environ.get('PARKING_MAX_ATTEMPTS', DEFAULT_PARKING_MAX_ATTEMPTS))
+
+        attempt = checkpoint.get('attempt', 0) + 1
+        if attempt > max_attempts:
+            raise ValueError(f'Application was parked {max_attempts} times')
+        checkpoint['attempt'] = attempt
+
+        # Exponential backoff with jitter, so parked applications do not come back all at once.
+        delay = min(PARKING_MAX_DELAY_SECONDS,
+                    int(PARKING_BASE_DELAY_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)))
+
+        response = get_client('sqs').send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps(checkpoint),
+            DelaySeconds=delay)
+        print(f'Parked application {checkpoint["event"]["application"]["app_uuid"]} for {delay} seconds: {response}')
+
+    except Exception as error:
+        print(f'Exception error: park_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: park_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: park_application :')
+        return ret
+
+def complete_resumed_application(ddb_table, appuuid, notification):
+    """
+    This function completes an application that was resumed from the parking queue.
+    The state machine execution of a parked application ended in its Parked state, so the
+    SendSuccess state did not run. Once both LICENSE_SELFIE_MATCH and LICENSE_DETAILS_MATCH
+    are True, this function sends the notification to the license queue in place of SendSuccess.
+    If both checks were parked and resume at the same time, only the one that sets LICENSE_QUEUED
+    (a conditional update) sends the notification, so the license is submitted once.
+
+    Parameters:
+
+    ddb_table: DynamoDB table
+    appuuid: Customer's ID, which is also the partition key for DynamoDB table
+    notification: The response of WriteToDynamoLambdaFunction ($.notification in the state machine)
+
+    Returns:
+
+    True if operations are successful. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        response_db = ddb_table.get_item(
+            Key={"APP_UUID": appuuid},
+            ProjectionExpression='LICENSE_SELFIE_MATCH, LICENSE_DETAILS_MATCH, LICENSE_QUEUED',
+            ConsistentRead=True)
+        item = response_db.get('Item', {})
+
+        if item.get('LICENSE_QUEUED') is True:
+            print(f'Application {appuuid} was already sent to the license queue')
+        elif item.get('LICENSE_SELFIE_MATCH') is True and item.get('LICENSE_DETAILS_MATCH') is True:
+            try:
+                ddb_table.update_item(
+                    Key={"APP_UUID": appuuid},
+                    UpdateExpression='SET LICENSE_QUEUED = :queued',
+                    ConditionExpression='attribute_not_exists(LICENSE_QUEUED)',
+                    ExpressionAttributeValues={':queued': True})
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # The other check resumed at the same time, and sends the notification
+                print(f'Application {appuuid} was already sent to the license queue by the other check')
+            else:
+                try:
+                    response_sqs = get_client('sqs').send_message(
+                        QueueUrl=os.environ['QUEUE_URL'],
+                        MessageBody=json.dumps(notification))
+                    print(f'Message sent to SQS: {response_sqs}')
+                except Exception:
+                    # Release LICENSE_QUEUED, so the parked message is sent when SQS delivers it again
+                    ddb_table.update_item(
+                        Key={"APP_UUID": appuuid},
+                        UpdateExpression='REMOVE LICENSE_QUEUED')
+                    raise
+        else:
+            # The other check is still parked (or failed). It completes the application when it is done.
+            print(f'Application {appuuid} is waiting for the other check: {item}')
+
+    except Exception as error:
+        print(f'Exception error: complete_resumed_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: complete_resumed_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: complete_resumed_application :')
+        return ret
+
+def get_key_layout():
+    """
+    This function gets the S3 key layout of the unzipped objects from the environment variable KEY_LAYOUT.
+    If it is not set, or not a known layout, the flat layout (unzipped/<appuuid>_selfie.png) is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED
+    
+    """    
+    layout = os.environ.get('KEY_LAYOUT', KEY_LAYOUT_FLAT)
+    if layout not in (KEY_LAYOUT_FLAT, KEY_LAYOUT_SHARDED):
+        print(f'Unknown KEY_LAYOUT {layout}, using {KEY_LAYOUT_FLAT}')
+        layout = KEY_LAYOUT_FLAT
+
+    return layout
+
+def get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, layout = None):
+    """
+    This function gets the S3 key of an unzipped object of an application.
+    For example, for appuuid 8d247914 and file_name 8d247914_selfie.png:
+    flat layout: unzipped/8d247914_selfie.png
+    sharded layout: unzipped/<first hex digits of sha256(appuuid)>/8d247914_selfie.png
+
+    All the objects of one application are in the same shard.
+
+    Parameters:
+
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+    layout: KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED. If None, get_key_layout() is used
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    if layout is None:
+        layout = get_key_layout()
+
+    if layout == KEY_LAYOUT_SHARDED:
+        shard = hashlib.sha256(appuuid.encode('utf-8')).hexdigest()[:KEY_SHARD_HEX_DIGITS]
+        return bucket_unzipped_prefix + shard + '/' + file_name
+
+    return bucket_unzipped_prefix + file_name
+
+def resolve_artifact_key(bucket, bucket_unzipped_prefix, appuuid, file_name):
+    """
+    This function gets the S3 key of an existing unzipped object of an application.
+    With the sharded layout, an application that was stored before the layout changed
+    is still read from its flat key.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name)
+
+    if get_key_layout() == KEY_LAYOUT_FLAT:
+        return ret
+
+    try:
+        get_client('s3').head_object(Bucket=bucket, Key=ret)
+    except botocore.exceptions.ClientError as error:
+        # Without s3:ListBucket permission, S3 returns 403 instead of 404 for a missing key.
+        if error.response.get('Error', {}).get('Code') in ('404', '403', 'NoSuchKey', 'NotFound'):
+            print(f'{ret} not found, using the flat key')
+            ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, KEY_LAYOUT_FLAT)
+        else:
+            print(f'Exception Client Error: resolve_artifact_key : {error}')
+    except Exception as error:
+        print(f'Exception error: resolve_artifact_key : {error}')
+
+    return ret
+
 def lambda_handler(event, context):
     """
     This function is the AWS Lambda function call for CompareFacesLambdaFunction.
 
     Parameters:
 
-    event: State event, which contains app_uuid and bucket name
+    event: State event, which contains app_uuid and bucket name,
+           or SQS event from the parking queue, which contains a parked application
     context: not used in this application
 
     Returns:
     
     A dictionary that contains a status as either failure or success,
     with a message describing the status.
+    If a resumed application cannot be completed, an error is raised, so SQS delivers it again.
     
     """    
     
@@ -292,9 +824,19 @@ def lambda_handler(event, context):
         "message": "Selfie Comparison failed"
     }
 
+    resume_failed = False
+
     try:
         print(f'event: {event}')
-        
+
+        # A parked application arrives from the parking queue with its checkpoint.
+        checkpoint = {'event': event, 'attempt': 0}
+        resumed = 'Records' in event
+        if resumed:
+            checkpoint = json.loads(event['Records'][0]['body'])
+            event = checkpoint['event']
+            print(f'Resuming parked application: {checkpoint}')
+
         detail = event['detail']
         bucket = detail['bucket']['name']
         application = event['application']
@@ -305,8 +847,11 @@ def lambda_handler(event, context):
         print(f'application: {application}')
         print(f'appuuid: {appuuid}')
 
-        selfie_key = BUCKET_UNZIPPED_PREFIX + appuuid + '_selfie.png'
-        license_key = BUCKET_UNZIPPED_PREFIX + appuuid + '_license.png'
+        # Unzip passes the S3 keys of the unzipped objects. An older execution only has the app_uuid.
+        selfie_key = application.get('selfie_key') or resolve_artifact_key(
+            bucket, BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_selfie.png')
+        license_key = application.get('license_key') or resolve_artifact_key(
+            bucket, BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_license.png')
 
         #====================================================================
         # Get DynamoDB table. The status of Rekognition comparison operation
@@ -319,7 +864,7 @@ def lambda_handler(event, context):
         
         # From Boto3 documentation:
         # Instantiate a table resource object without actually creating a DynamoDB table.
-        ddb_table = dynamodb.Table(ddb_table_name)
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
         if ddb_table is None:
             raise ValueError('Table: test_table not found')
         # For unit testing, the following if-condition will not work unless I have IAM Policy "DerscribeTable".
@@ -340,9 +885,23 @@ def lambda_handler(event, context):
         # Send an email if the comparison fails.
         #=======================================================================================================
         valerror = {'error':''}
-        outcome = validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror)
+        outcome = validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror, application.get('document_keys'))
         if outcome == False:
-            raise ValueError('Error in validate_selfie')
+            if not is_throttling_error(valerror['error']):
+                raise ValueError('Error in validate_selfie')
+
+            # Throttled: park the application instead of failing it.
+            if park_application(checkpoint) == False:
+                raise ValueError('Error in validate_selfie, and could not park the application')
+            ret = {
+                "status": "parked",
+                "message": "Selfie Comparison parked"
+            }
+            return ret
+
+        if resumed and complete_resumed_application(ddb_table, appuuid, event['notification']) == False:
+            resume_failed = True
+            raise ValueError('Error in complete_resumed_application')
                         
     except Exception as error:
         print(f'Exception error: {error}')
@@ -358,7 +917,11 @@ def lambda_handler(event, context):
         
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
-        return ret
+    if resume_failed:
+        # Raise an error, so SQS delivers the parked application again (see ParkingEvent in YAML template)
+        raise RuntimeError(f'Could not complete the resumed application: {event}')
+
+    return ret
 
@@ -0,0 +1,175 @@
+import collections
+import itertools
+import json
+from aws_services import get_client, get_module_getattr
+
+# Outcomes of the applications of a manifest (see ProcessApplications in ManifestStateMachine).
+# The other outcomes need attention: unusable_image, duplicate_license, comparison_failed and error.
+SUCCESSFUL_STATUSES = ('verified', 'duplicate', 'parked', 'skipped')
+# The outcome of an application whose DocumentStateMachine execution ended in a Fail state, by error of the Fail state.
+# The other errors (e.g. UnzipFailed, or a timed out execution) are the error outcome.
+DOCUMENT_ERROR_STATUSES = {
+    'UnusableImage': 'unusable_image',
+    'DuplicateLicense': 'duplicate_license',
+    'ComparisonFailed': 'comparison_failed'}
+# The result files of the distributed Map (see ResultWriter in ManifestStateMachine), by status of the child execution
+RESULT_FILE_STATUSES = ('SUCCEEDED', 'FAILED', 'PENDING')
+# The output of a Step Functions task is at most 256 KiB, so the summary only lists the first failures.
+# All of them are in the result files (manifest-results/).
+MAX_SUMMARY_FAILURES = 100
+
+# The AWS clients of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() in aws_services.py).
+AWS_SERVICES = {
+    's3': ('client', 's3')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+def get_document_outcome(key, document):
+    """
+    This function gets the outcome of an application from the final state of its DocumentStateMachine execution
+    that succeeded, i.e. that ended in the Skipped, Duplicate or Parked state, or after ArchiveImages.
+
+    Parameters:
+
+    key: The S3 key of the application, e.g. "zipped/8d247914.zip"
+    document: The output of the DocumentStateMachine execution, with the result of Unzip in "application"
+              and the results of the checks in "checkResults"
+
+    Returns:
+
+    The outcome of the application, e.g. {"key": "zipped/8d247914.zip", "app_uuid": "8d247914", "status": "verified"}
+
+    """
+    application = document.get('application') or {}
+    status = application.get('status')
+    if status not in ('skipped', 'duplicate'):
+        check_statuses = [result.get(name, {}).get('status')
+                          for result, name in zip(document.get('checkResults') or [], ('CompareFacesResult', 'CompareDetailsResult'))]
+        status = 'parked' if 'parked' in check_statuses else 'verified'
+
+    outcome = {"key": key, "status": status}
+    if application.get('app_uuid'):
+        outcome['app_uuid'] = application['app_uuid']
+    return outcome
+
+def get_result_outcome(result):
+    """
+    This function gets the outcome of an application from its child execution in a result file of the distributed Map.
+    The child execution runs DocumentStateMachine (see VerifyApplication in ManifestStateMachine). When DocumentStateMachine
+    ends in a Fail state, the child execution fails, and its Cause holds the DocumentStateMachine execution with the error
+    of the Fail state (see DOCUMENT_ERROR_STATUSES). A child execution that failed otherwise (e.g. it timed out) is an error.
+
+    Parameters:
+
+    result: A child execution, with its "Status", "Input" and "Output" as JSON strings, and its "Error" and "Cause" if it failed
+
+    Returns:
+
+    The outcome of the application, e.g. {"key": "zipped/8d247914.zip", "app_uuid": "8d247914", "status": "verified"}.
+    Exceptions are raised to the caller.
+
+    """
+    if result.get('Status') == 'SUCCEEDED':
+        output = json.loads(result['Output'])
+        return get_document_outcome(output['key'], output.get('document') or {})
+
+    key = json.loads(result['Input'])['detail']['object']['key']
+    error = result.get('Error') or result.get('Status')
+    try:
+        # The Cause of a failed startExecution.sync task is the DocumentStateMachine execution
+        error = json.loads(result['Cause'])['Error']
+    except (KeyError, TypeError, ValueError):
+        # Another failure, e.g. the child execution timed out: its Cause is not an execution
+        pass
+
+    if error in DOCUMENT_ERROR_STATUSES:
+        return {"key": key, "status": DOCUMENT_ERROR_STATUSES[error]}
+    return {"key": key, "status": "error", "error": error}
+
+def read_results(result_writer_details):
+    """
+    This function reads the outcomes of the applications, which the distributed Map wrote to S3:
+    its manifest.json lists the result files, one per status of the child executions.
+
+    Parameters:
+
+    result_writer_details: The ResultWriterDetails of the Map, e.g. {"Bucket": ..., "Key": "manifest-results/.../manifest.json"}
+
+    Returns:
+
+    A list of the outcomes of the applications. Exceptions are raised to the caller.
+
+    """
+    bucket = result_writer_details['Bucket']
+    response = get_client('s3').get_object(Bucket=bucket, Key=result_writer_details['Key'])
+    manifest = json.loads(response['Body'].read())
+
+    results = []
+    for status in RESULT_FILE_STATUSES:
+        for result_file in manifest.get('ResultFiles', {}).get(status, []):
+            response = get_client('s3').get_object(Bucket=bucket, Key=result_file['Key'])
+            results.extend(get_result_outcome(result) for result in json.loads(response['Body'].read()))
+    return results
+
+def summarize_results(results):
+    """
+    This function aggregates the outcomes of the applications of a manifest.
+
+    Parameters:
+
+    results: A list of the outcomes of the applications, e.g. {"key": "zipped/8d247914.zip", "app_uuid": "8d247914", "status": "verified"}
+
+    Returns:
+
+    A dictionary: {"total": ..., "succeeded": ..., "failed": ..., "statuses": {status: count},
+    "failures": [the first MAX_SUMMARY_FAILURES outcomes that need attention]}
+
+    """
+    statuses = collections.Counter(result['status'] for result in results)
+    failed = sum(count for status, count in statuses.items() if status not in SUCCESSFUL_STATUSES)
+    failures = list(itertools.islice((result for result in results if result['status'] not in SUCCESSFUL_STATUSES),
+                                     MAX_SUMMARY_FAILURES))
+    return {"total": len(results),
+            "succeeded": len(results) - failed,
+            "failed": failed,
+            "statuses": dict(statuses),
+            "failures": failures}
+
+def lambda_handler(event, context):
+    """
+    This function is the AWS Lambda function call for ManifestSummaryLambdaFunction.
+
+    Parameters:
+
+    event: ManifestStateMachine input, with the outcomes of the applications in "results": a list,
+           or the ResultWriterDetails of the distributed Map (see read_results())
+    context: not used in this application
+
+    Returns:
+
+    A dictionary: {"bucket": ..., "total": ..., "succeeded": ..., "failed": ..., "statuses": {...}, "failures": [...]}. Otherwise, None
+
+    """
+    print(f'Entering lambda handler for ManifestSummaryLambdaFunction')
+
+    ret = None
+
+    try:
+        results = event['results']
+        if isinstance(results, dict):
+            results = read_results(results['ResultWriterDetails'])
+        summary = summarize_results(results)
+        print(f'Manifest of {event["bucket"]}: {summary["total"]} applications, {summary["statuses"]}')
+
+    except Exception as error:
+        print(f'Exception error: {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: do nothing for now')
+
+        ret = {"bucket": event['bucket'], **summary}
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: do nothing for now')
+
+        return ret
@@ -1,10 +1,129 @@
 import os
+import time
 import botocore
 import boto3
+import hashlib
+import io
 import zipfile
+import struct
+import zlib
+import shutil
+import json
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
 
-s3 = boto3.client('s3')
+# NumPy and Pillow are in requirements.txt. Without them, the selfie screening is skipped,
+# and the original images are used for inference.
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
 
+# Only .zip files uploaded to this S3 folder are applications. Other keys (e.g. the unzipped
+# objects that this function stores in S3) are rejected before any S3 operation.
+ACCEPTED_KEY_PREFIX = 'zipped/'
+ACCEPTED_KEY_SUFFIX = '.zip'
+KEY_FILTER_METRIC_NAMESPACE = 'KycApp/EventFilter'
+
+# S3 key layout of the unzipped objects (see get_artifact_key()). With 'sharded', the keys of each
+# application are spread across hashed sub-prefixes, e.g. unzipped/3f/8d247914_selfie.png
+KEY_LAYOUT_FLAT = 'flat'
+KEY_LAYOUT_SHARDED = 'sharded'
+KEY_SHARD_HEX_DIGITS = 2
+
+# Artifact storage (see upload_blob_to_s3()). With 'content', images are stored once by their
+# SHA-256 under BLOB_PREFIX, and a per-application manifest points at them.
+ARTIFACT_STORAGE_KEYED = 'keyed'
+ARTIFACT_STORAGE_CONTENT = 'content'
+BLOB_PREFIX = 'blobs/'
+BLOB_FILE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+BLOB_READ_CHUNK_BYTES = 1024 * 1024
+
+# Whole-application dedup (see reuse_completed_application()). ARCHIVE_SHA256 is the SHA-256 of the
+# uploaded .zip file, and ArchiveDigestIndex is its GSI in the DynamoDB table.
+ARCHIVE_DIGEST_ATTRIBUTE = 'ARCHIVE_SHA256'
+ARCHIVE_DIGEST_INDEX = 'ArchiveDigestIndex'
+VERDICT_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH')
+
+# Near-duplicate selfie screening (see screen_selfie()). The 64-bit dHash of each selfie is split into
+# DHASH_BANDS bands of 16 bits in SelfieHashTable (multi-index hashing): two hashes within
+# SELFIE_HAMMING_THRESHOLD bits (< DHASH_BANDS) always share at least one identical band.
+DHASH_SIZE = 8
+DHASH_BANDS = 4
+SELFIE_HAMMING_THRESHOLD = 3
+# Every band is queried and indexed, so the guarantee holds. A popular band (e.g. 0#0000, shared by every
+# flat image) is only read up to DHASH_MAX_BAND_ITEMS items, so one selfie does not read a whole partition.
+DHASH_MAX_BAND_ITEMS = 1000
+
+# Inference variants (see create_inference_variant()). The selfie and the license are downscaled to
+# INFERENCE_MAX_DIMENSION pixels and re-encoded as JPEG for Rekognition and Textract.
+INFERENCE_VARIANT_SUFFIX = '_inference.jpg'
+INFERENCE_JPEG_QUALITY = 85
+
+# Multi-document applications (see get_document_files()). Besides the driver license, an application may
+# have other ID documents, e.g. the back of the license or a passport. Textract analyzes at most
+# TEXTRACT_MAX_DOCUMENT_PAGES pages per analyze_id() call.
+ID_DOCUMENT_PREFIXES = ('license', 'passport')
+MAX_ID_DOCUMENTS = 4
+TEXTRACT_MAX_DOCUMENT_PAGES = 2
+
+# Image-quality gate (see assess_image_quality()). Sharpness is the variance of the Laplacian, and
+# brightness is the mean luminance (0 to 255) from the histogram, both of a QUALITY_SAMPLE_DIMENSION copy.
+QUALITY_SAMPLE_DIMENSION = 512
+
+# Header-only image inspection (see inspect_application_images()). The selfie and the license are checked
+# from the headers in the .zip file, so unusable images are rejected before anything is uploaded.
+APPLICATION_IMAGES = ('_selfie.png', '_license.png')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+IMAGE_HEADER_READ_BYTES = 4 * 1024
+IMAGE_HEADER_MAX_BYTES = 64 * 1024
+IMAGE_MIN_DIMENSION = 80 # Rekognition needs at least 80 pixels in height and width
+IMAGE_MAX_DIMENSION = 10000 # Textract accepts at most 10000 pixels in height and width
+IMAGE_MAX_BYTES = 10 * 1024 * 1024 # Textract synchronous operations accept at most 10 MB
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Number of rejected keys since this container started
+rejected_keys = {'count': 0}
+
+def get_dynamo_db_table_name():
+    """
+    This function gets table name of the DynamoDB.
+    In the YAML template, we define an Environment in Lambda Function that gets
+    the CustomerDDBTable as TABLE. We can get the value of TABLE by using os.environ['TABLE']
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    Table name. Otherwise, None
+    
+    """    
+    ret = None
+    try:
+        table_name = os.environ['TABLE']
+    except Exception as error:
+        print(f'Exception error: {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: do nothing for now')
+        ret = table_name
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: do nothing for now')
+        return ret
+    
 def unzip_file(zipfile_filename, path_of_unzipped_file = None):
     """
     This function unzip a given file.
@@ -79,6 +198,838 @@ def get_unzipped_files(path_of_unzipped_file = None):
 
         return ret
 
+def get_key_layout():
+    """
+    This function gets the S3 key layout of the unzipped objects from the environment variable KEY_LAYOUT.
+    If it is not set, or not a known layout, the flat layout (unzipped/<appuuid>_selfie.png) is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED
+    
+    """    
+    layout = os.environ.get('KEY_LAYOUT', KEY_LAYOUT_FLAT)
+    if layout not in (KEY_LAYOUT_FLAT, KEY_LAYOUT_SHARDED):
+        print(f'Unknown KEY_LAYOUT {layout}, using {KEY_LAYOUT_FLAT}')
+        layout = KEY_LAYOUT_FLAT
+
+    return layout
+
+def get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, layout = None):
+    """
+    This function gets the S3 key of an unzipped object of an application.
+    For example, for appuuid 8d247914 and file_name 8d247914_selfie.png:
+    flat layout: unzipped/8d247914_selfie.png
+    sharded layout: unzipped/<first hex digits of sha256(appuuid)>/8d247914_selfie.png
+
+    All the objects of one application are in the same shard.
+
+    Parameters:
+
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+    layout: KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED. If None, get_key_layout() is used
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    if layout is None:
+        layout = get_key_layout()
+
+    if layout == KEY_LAYOUT_SHARDED:
+        shard = hashlib.sha256(appuuid.encode('utf-8')).hexdigest()[:KEY_SHARD_HEX_DIGITS]
+        return bucket_unzipped_prefix + shard + '/' + file_name
+
+    return bucket_unzipped_prefix + file_name
+
+def get_artifact_storage():
+    """
+    This function gets how the unzipped images are stored from the environment variable ARTIFACT_STORAGE.
+    If it is not set, or not a known value, each image is stored under its own key (keyed).
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    ARTIFACT_STORAGE_KEYED or ARTIFACT_STORAGE_CONTENT
+    
+    """    
+    storage = os.environ.get('ARTIFACT_STORAGE', ARTIFACT_STORAGE_KEYED)
+    if storage not in (ARTIFACT_STORAGE_KEYED, ARTIFACT_STORAGE_CONTENT):
+        print(f'Unknown ARTIFACT_STORAGE {storage}, using {ARTIFACT_STORAGE_KEYED}')
+        storage = ARTIFACT_STORAGE_KEYED
+
+    return storage
+
+def upload_blob_to_s3(
+        s3,
+        file_to_upload,
+        path_of_file,
+        bucket_name,
+        blob_info):
+    """
+    This function stores a file in S3 by its content: the key is BLOB_PREFIX/<2 hex digits>/<sha256><extension>.
+    The file is read once: the SHA-256 is computed while the file is read into memory, and the same bytes are uploaded.
+    If an object with the same SHA-256 is already in the bucket (e.g. the same selfie was submitted before),
+    nothing is uploaded.
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    file_to_upload: The file that you want to upload.
+    path_of_file: The path where the file_to_upload is located.
+    bucket_name: S3 Bucket Name where the file will be uploaded to.
+    blob_info: returned dictionary that contains the S3 key, the sha256, and uploaded (False if the blob was already stored)
+
+    Returns:
+
+    True if the blob is stored. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        # Hash the file while reading it into memory
+        digest = hashlib.sha256()
+        body = io.BytesIO()
+        with open(path_of_file + file_to_upload, 'rb') as file:
+            for chunk in iter(lambda: file.read(BLOB_READ_CHUNK_BYTES), b''):
+                digest.update(chunk)
+                body.write(chunk)
+
+        sha256 = digest.hexdigest()
+        extension = os.path.splitext(file_to_upload)[1].lower()
+        key = BLOB_PREFIX + sha256[:KEY_SHARD_HEX_DIGITS] + '/' + sha256 + extension
+
+        blob_info['key'] = key
+        blob_info['sha256'] = sha256
+        blob_info['uploaded'] = False
+
+        # Upload the blob only if it is not already stored
+        try:
+            s3.head_object(Bucket=bucket_name, Key=key)
+            print(f'Blob {key} is already stored')
+        except botocore.exceptions.ClientError as error:
+            # Without s3:ListBucket permission, S3 returns 403 instead of 404 for a missing key.
+            if error.response.get('Error', {}).get('Code') not in ('404', '403', 'NoSuchKey', 'NotFound'):
+                raise
+            body.seek(0)
+            s3.put_object(
+                Body=body,
+                Bucket=bucket_name,
+                Key=key)
+            blob_info['uploaded'] = True
+            print(f'Blob {key} is uploaded')
+
+    except Exception as error:
+        print(f'Exception error: upload_blob_to_s3 : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: upload_blob_to_s3 :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: upload_blob_to_s3 :')
+
+    return ret
+
+def put_application_manifest(s3, bucket_name, manifest_key, manifest):
+    """
+    This function stores the manifest of an application in S3. The manifest maps each unzipped
+    file name of the application to its S3 key, e.g.
+    {"app_uuid": "8d247914", "artifacts": {"8d247914_selfie.png": "blobs/3f/3f...png"}}
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    bucket_name: S3 Bucket Name where the manifest will be stored.
+    manifest_key: The S3 key of the manifest
+    manifest: The manifest dictionary
+
+    Returns:
+
+    True if the manifest is stored. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        s3.put_object(
+            Body=json.dumps(manifest).encode('utf-8'),
+            Bucket=bucket_name,
+            Key=manifest_key,
+            ContentType='application/json')
+
+    except Exception as error:
+        print(f'Exception error: put_application_manifest : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: put_application_manifest :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: put_application_manifest :')
+
+    return ret
+
+def download_archive(s3, bucket, key, file_name_with_path, archive_info):
+    """
+    This function downloads a .zip file from S3, and computes its SHA-256 while the file is streamed to disk.
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    bucket: S3 bucket name
+    key: Zip filename prefixed with S3 folder name
+    file_name_with_path: Where the downloaded file is stored
+    archive_info: returned dictionary that contains the sha256 of the file
+
+    Returns:
+
+    True if the download is successful. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        digest = hashlib.sha256()
+        response = s3.get_object(Bucket=bucket, Key=key)
+        with open(file_name_with_path, 'wb') as file:
+            for chunk in response['Body'].iter_chunks(BLOB_READ_CHUNK_BYTES):
+                digest.update(chunk)
+                file.write(chunk)
+
+        archive_info['sha256'] = digest.hexdigest()
+        print(f'archive sha256: {archive_info["sha256"]}')
+
+    except Exception as error:
+        print(f'Exception error: download_archive : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: download_archive :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: download_archive :')
+
+    return ret
+
+def reuse_completed_application(archive_sha256, appuuid):
+    """
+    This function looks up a completed application (one with all VERDICT_ATTRIBUTES) that was
+    submitted with the same .zip file, using the ArchiveDigestIndex of the DynamoDB table.
+    If it is found under another app_uuid, its item (with the verdicts) is copied to appuuid.
+
+    A failed lookup is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    archive_sha256: SHA-256 of the .zip file
+    appuuid: The application uuid
+
+    Returns:
+
+    The app_uuid of the completed application. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        ddb_table_name = get_dynamo_db_table_name()
+        if not ddb_table_name:
+            raise ValueError('No DynamoDB table')
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
+
+        response = ddb_table.query(
+            IndexName=ARCHIVE_DIGEST_INDEX,
+            KeyConditionExpression=f'{ARCHIVE_DIGEST_ATTRIBUTE} = :sha256',
+            ExpressionAttributeValues={':sha256': archive_sha256})
+
+        for item in response.get('Items', []):
+            if all(attribute in item for attribute in VERDICT_ATTRIBUTES):
+                if item['APP_UUID'] != appuuid:
+                    ddb_table.put_item(Item={**item, 'APP_UUID': appuuid, 'DUPLICATE_OF': item['APP_UUID']})
+                ret = item['APP_UUID']
+                print(f'Application {appuuid} is a duplicate of the completed application {ret}')
+                break
+
+    except Exception as error:
+        print(f'Exception error: reuse_completed_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: reuse_completed_application :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: reuse_completed_application :')
+
+    return ret
+
+def get_selfie_hash_table_name():
+    """
+    This function gets the name of the DynamoDB table of selfie hashes from the environment variable
+    SELFIE_HASH_TABLE. If it is not set, the selfie screening is not used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    Table name. Otherwise, None
+    
+    """    
+    return os.environ.get('SELFIE_HASH_TABLE') or None
+
+def decode_image(image_file):
+    """
+    This function decodes an image once, so that the inference variant, the quality gate and the dHash
+    use the same pixels (see create_inference_variant(), assess_image_quality() and compute_dhash()).
+
+    Parameters:
+
+    image_file: The image file with its path
+
+    Returns:
+
+    The decoded image. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if Image is None:
+            raise ValueError('Pillow is not available')
+
+        with Image.open(image_file) as image:
+            image.load()
+        ret = image
+
+    except Exception as error:
+        print(f'Exception error: decode_image : {error}')
+
+    return ret
+
+def compute_dhash(image_file, image = None):
+    """
+    This function computes the difference hash (dHash) of an image: the image is converted to grayscale
+    and resized to 9x8 pixels, and each bit tells if a pixel is brighter than its left neighbour.
+    Re-encoded, resized or slightly edited copies of the same photo have hashes that differ by a few bits.
+
+    Parameters:
+
+    image_file: The image file with its path
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+
+    Returns:
+
+    The 64-bit hash as 16 hex digits. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if numpy is None or Image is None:
+            raise ValueError('NumPy and Pillow are not available')
+
+        if image is None:
+            image = decode_image(image_file)
+        image = image.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS)
+        pixels = numpy.asarray(image, dtype=numpy.int16)
+
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        ret = numpy.packbits(bits.flatten()).tobytes().hex()
+
+    except Exception as error:
+        print(f'Exception error: compute_dhash : {error}')
+
+    return ret
+
+def get_dhash_bands(dhash):
+    """
+    This function splits a dHash into DHASH_BANDS keys of SelfieHashTable, e.g. 0#3fa0, 1#9c11, 2#..., 3#...
+
+    Parameters:
+
+    dhash: The 64-bit hash as 16 hex digits
+
+    Returns:
+
+    A list of keys
+    
+    """    
+    width = len(dhash) // DHASH_BANDS
+    return [f'{band}#{dhash[band * width:(band + 1) * width]}' for band in range(DHASH_BANDS)]
+
+def screen_selfie(image_file, appuuid, selfie_screen, dhash = None):
+    """
+    This function finds the applications whose selfie is a near-duplicate of this selfie
+    (Hamming distance of their dHash at most SELFIE_HAMMING_THRESHOLD), then adds this selfie to the index.
+    It queries SelfieHashTable once per band (DHASH_BANDS Query calls, each followed through its pages),
+    so no Rekognition call is needed. At most DHASH_MAX_BAND_ITEMS items are read per band: a near-duplicate
+    that only shares a band beyond them (e.g. a flat selfie, after many other flat selfies) is not found.
+
+    A failed screening is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    image_file: The selfie image file with its path
+    appuuid: The application uuid
+    selfie_screen: returned dictionary that contains the dhash, similar_selfies (list of app_uuid),
+                   and truncated_bands (the bands that were not read to the end)
+    dhash: The dHash of the selfie (see compute_dhash()). If it is None, it is computed from image_file
+
+    Returns:
+
+    True if the selfie is screened. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        table_name = get_selfie_hash_table_name()
+        if table_name is None:
+            raise ValueError('No SELFIE_HASH_TABLE')
+        selfie_hash_table = get_resource('dynamodb').Table(table_name)
+
+        if dhash is None:
+            dhash = compute_dhash(image_file)
+        if dhash is None:
+            raise ValueError('Could not compute the dHash of the selfie')
+        selfie_screen['dhash'] = dhash
+
+        # Candidates share at least one band. Then compare the whole hash.
+        bands = get_dhash_bands(dhash)
+        selfie_screen['truncated_bands'] = []
+        similar_selfies = {}
+        for band in bands:
+            query = {'KeyConditionExpression': 'BAND = :band',
+                     'ExpressionAttributeValues': {':band': band},
+                     'ProjectionExpression': 'APP_UUID, DHASH'}
+            read_items = 0
+            while True:
+                query['Limit'] = DHASH_MAX_BAND_ITEMS - read_items
+                response = selfie_hash_table.query(**query)
+                read_items += len(response.get('Items', []))
+                for item in response.get('Items', []):
+                    if item['APP_UUID'] == appuuid:
+                        continue
+                    distance = (int(item['DHASH'], 16) ^ int(dhash, 16)).bit_count()
+                    if distance <= SELFIE_HAMMING_THRESHOLD:
+                        similar_selfies[item['APP_UUID']] = distance
+
+                if 'LastEvaluatedKey' not in response:
+                    break
+                if read_items >= DHASH_MAX_BAND_ITEMS:
+                    # A popular band: the other items are not compared
+                    selfie_screen['truncated_bands'].append(band)
+                    break
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        if selfie_screen['truncated_bands']:
+            print(f'bands with at least {DHASH_MAX_BAND_ITEMS} selfies are not read to the end: {selfie_screen["truncated_bands"]}')
+        selfie_screen['similar_selfies'] = sorted(similar_selfies, key=similar_selfies.get)
+        print(f'similar selfies: {similar_selfies}')
+
+        with selfie_hash_table.batch_writer() as batch:
+            for band in bands:
+                batch.put_item(Item={'BAND': band, 'APP_UUID': appuuid, 'DHASH': dhash})
+
+    except Exception as error:
+        print(f'Exception error: screen_selfie : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: screen_selfie :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: screen_selfie :')
+
+    return ret
+
+def get_inference_max_dimension():
+    """
+    This function gets the maximum width and height of the inference variants from the environment
+    variable INFERENCE_MAX_DIMENSION. If it is not set (or 0), no variant is created, and Rekognition
+    and Textract use the original images.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    The maximum dimension in pixels. Otherwise, 0
+    
+    """    
+    ret = 0
+    try:
+        ret = max(0, int(os.environ.get('INFERENCE_MAX_DIMENSION', '0')))
+    except Exception as error:
+        print(f'Exception error: get_inference_max_dimension : {error}')
+
+    return ret
+
+def create_inference_variant(image_file, variant_file, max_dimension, image = None, variant_info = None):
+    """
+    This function decodes an image once, downscales it so that its width and height are at most
+    max_dimension (the aspect ratio is kept, and a smaller image is not enlarged), then re-encodes it
+    as a compact JPEG. Rekognition and Textract are faster with the smaller payload.
+
+    Parameters:
+
+    image_file: The image file with its path
+    variant_file: The JPEG file to create, with its path
+    max_dimension: The maximum width and height in pixels
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+    variant_info: returned dictionary that contains the downscaled image ('image'), so that it is not decoded again
+
+    Returns:
+
+    True if the variant is created. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        if Image is None:
+            raise ValueError('Pillow is not available')
+
+        if image is None:
+            with Image.open(image_file) as image:
+                # draft() lets the JPEG decoder skip detail that the thumbnail does not need
+                image.draft('RGB', (max_dimension, max_dimension))
+                variant = image.convert('RGB')
+        else:
+            variant = image.convert('RGB')
+        variant.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        variant.save(variant_file, 'JPEG', quality=INFERENCE_JPEG_QUALITY, optimize=True)
+        if variant_info is not None:
+            variant_info['image'] = variant
+
+        print(f'Inference variant {variant_file}: {os.path.getsize(image_file)} bytes -> {os.path.getsize(variant_file)} bytes, {variant.size}')
+
+    except Exception as error:
+        print(f'Exception error: create_inference_variant : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: create_inference_variant :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: create_inference_variant :')
+
+    return ret
+
+def get_quality_thresholds():
+    """
+    This function gets the thresholds of the image-quality gate from the environment variables
+    QUALITY_MIN_SHARPNESS, QUALITY_MIN_BRIGHTNESS and QUALITY_MAX_BRIGHTNESS.
+    A threshold that is not set (or 0) is not checked.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary: {'min_sharpness':..., 'min_brightness':..., 'max_brightness':...}
+    
+    """    
+    ret = {'min_sharpness': 0.0, 'min_brightness': 0.0, 'max_brightness': 0.0}
+    for threshold, variable in (('min_sharpness', 'QUALITY_MIN_SHARPNESS'),
+                                ('min_brightness', 'QUALITY_MIN_BRIGHTNESS'),
+                                ('max_brightness', 'QUALITY_MAX_BRIGHTNESS')):
+        try:
+            ret[threshold] = max(0.0, float(os.environ.get(variable, '0')))
+        except Exception as error:
+            print(f'Exception error: get_quality_thresholds : {error}')
+
+    return ret
+
+def assess_image_quality(image_file, thresholds, quality, image = None):
+    """
+    This function decodes a downsampled grayscale copy of an image into a NumPy array, then measures
+    its sharpness (variance of the Laplacian) and its brightness (mean of the luminance histogram).
+    A blurry, dark or overexposed image is rejected before Rekognition and Textract are called.
+
+    Parameters:
+
+    image_file: The image file with its path
+    thresholds: The thresholds (see get_quality_thresholds())
+    quality: returned dictionary that contains 'sharpness' and 'brightness',
+             or 'reason' if the image is below a threshold
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+
+    Returns:
+
+    True if the image can be used, or if NumPy and Pillow are not available. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        if numpy is None or Image is None:
+            print(f'NumPy and Pillow are not available: the quality of {image_file} is not checked')
+            ret = True
+            return ret
+
+        if image is None:
+            with Image.open(image_file) as image:
+                # draft() lets the JPEG decoder downscale while it decodes
+                image.draft('L', (QUALITY_SAMPLE_DIMENSION, QUALITY_SAMPLE_DIMENSION))
+                sample = image.convert('L')
+        else:
+            sample = image.convert('L')
+        sample.thumbnail((QUALITY_SAMPLE_DIMENSION, QUALITY_SAMPLE_DIMENSION))
+        pixels = numpy.asarray(sample, dtype=numpy.uint8)
+
+        # 4-neighbour Laplacian: a blurry image has few edges, so a low variance
+        luminance = pixels.astype(numpy.float32)
+        laplacian = 4 * luminance[1:-1, 1:-1] - luminance[:-2, 1:-1] - luminance[2:, 1:-1] \
+                    - luminance[1:-1, :-2] - luminance[1:-1, 2:]
+        quality['sharpness'] = round(float(laplacian.var()), 1)
+
+        histogram = numpy.bincount(pixels.ravel(), minlength=256)
+        quality['brightness'] = round(float(numpy.dot(histogram, numpy.arange(256)) / histogram.sum()), 1)
+
+        # The exposure is checked first: a dark image also has a low Laplacian variance
+        if quality['brightness'] < thresholds['min_brightness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is too dark (brightness {quality["brightness"]}, the minimum is {thresholds["min_brightness"]})'
+        elif thresholds['max_brightness'] > 0 and quality['brightness'] > thresholds['max_brightness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is overexposed (brightness {quality["brightness"]}, the maximum is {thresholds["max_brightness"]})'
+        elif quality['sharpness'] < thresholds['min_sharpness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is too blurry (sharpness {quality["sharpness"]}, the minimum is {thresholds["min_sharpness"]})'
+
+    except Exception as error:
+        print(f'Exception error: assess_image_quality : {error}')
+        quality['reason'] = f'{os.path.basename(image_file)} cannot be decoded'
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: assess_image_quality : {quality}')
+        ret = 'reason' not in quality
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: assess_image_quality :')
+
+    return ret
+
+def get_document_files(file_names, appuuid):
+    """
+    This function finds the ID documents of an application among its files: the driver license
+    (<app_uuid>_license.png), and the other documents whose name starts with one of ID_DOCUMENT_PREFIXES,
+    e.g. <app_uuid>_license_back.png (the back of the license) or <app_uuid>_passport.png.
+
+    Parameters:
+
+    file_names: The names of the files of the application
+    appuuid: The application uuid
+
+    Returns:
+
+    A list of file names, with the driver license first. Inference variants are not included.
+    
+    """    
+    document_prefixes = tuple(appuuid + '_' + prefix for prefix in ID_DOCUMENT_PREFIXES)
+    document_files = [file_name for file_name in file_names
+                      if file_name.startswith(document_prefixes)
+                      and file_name.lower().endswith(BLOB_FILE_EXTENSIONS)
+                      and not file_name.endswith(INFERENCE_VARIANT_SUFFIX)]
+
+    return sorted(document_files, key=lambda file_name: (file_name != appuuid + '_license.png', file_name))
+
+def inspect_image_header(stream, image_info):
+    """
+    This function inspects the header of a PNG or JPEG image, without decoding the image.
+    For PNG, it checks the signature, the IHDR chunk (dimensions, bit depth and color type), and the CRC
+    of every chunk before the image data. For JPEG, it reads the dimensions from the start of frame (SOFn).
+    The stream is read IMAGE_HEADER_READ_BYTES at a time, and at most IMAGE_HEADER_MAX_BYTES are read.
+
+    Parameters:
+
+    stream: A binary file object, e.g. a member of a .zip file opened with ZipFile.open()
+    image_info: returned dictionary that contains 'format', 'width', 'height' and 'bit_depth',
+                or 'reason' if the image cannot be used
+
+    Returns:
+
+    True if the header is valid. Otherwise, False
+
+    """
+    ret = False
+
+    try:
+        data = stream.read(IMAGE_HEADER_READ_BYTES)
+
+        def is_available(end):
+            # Read more of the stream only when the next header goes past what was read
+            nonlocal data
+            while len(data) < end and len(data) < IMAGE_HEADER_MAX_BYTES:
+                more = stream.read(IMAGE_HEADER_READ_BYTES)
+                if not more:
+                    break
+                data += more
+            return len(data) >= end
+
+        if data[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+            image_info['format'] = 'PNG'
+
+            # Walk the chunks (length, type, data, CRC) until the image data (IDAT)
+            offset = len(PNG_SIGNATURE)
+            chunk_type = b''
+            while chunk_type != b'IDAT':
+                if not is_available(offset + 8):
+                    raise ValueError('PNG is truncated')
+                chunk_length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+                if offset == len(PNG_SIGNATURE) and (chunk_type != b'IHDR' or chunk_length != 13):
+                    raise ValueError('PNG does not start with an IHDR chunk')
+                if chunk_type == b'IEND':
+                    raise ValueError('PNG has no image data')
+                if chunk_type == b'IDAT':
+                    break
+                # A chunk that goes past IMAGE_HEADER_MAX_BYTES (e.g. a large text chunk) is not checked
+                chunk_end = offset + 8 + chunk_length + 4
+                if not is_available(chunk_end):
+                    if len(data) < IMAGE_HEADER_MAX_BYTES:
+                        raise ValueError('PNG is truncated')
+                    break
+                chunk_data = data[offset + 8:chunk_end - 4]
+                if zlib.crc32(chunk_type + chunk_data) != struct.unpack('>I', data[chunk_end - 4:chunk_end])[0]:
+                    raise ValueError(f'PNG {chunk_type.decode("latin-1")} chunk has a bad CRC')
+                if chunk_type == b'IHDR':
+                    width, height, bit_depth, color_type = struct.unpack('>IIBB', chunk_data[:10])
+                    if bit_depth not in PNG_BIT_DEPTHS.get(color_type, ()):
+                        raise ValueError(f'PNG has an invalid bit depth {bit_depth} for color type {color_type}')
+                offset = chunk_end
+
+        elif data[:2] == b'\xff\xd8':
+            image_info['format'] = 'JPEG'
+
+            # Walk the marker segments (APPn, DQT, DHT...) until the start of frame (SOFn)
+            offset = 2
+            while True:
+                if not is_available(offset + 4):
+                    raise ValueError('JPEG has no start of frame in its headers')
+                if data[offset] != 0xFF:
+                    raise ValueError('JPEG has an invalid marker')
+                marker = data[offset + 1]
+                if marker == 0xFF:
+                    # Fill byte
+                    offset += 1
+                    continue
+                if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                    # Markers without a segment
+                    offset += 2
+                    continue
+                if marker in (0xD9, 0xDA):
+                    raise ValueError('JPEG has no start of frame before its image data')
+                segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+                if segment_length < 2:
+                    raise ValueError('JPEG has an invalid segment length')
+                if marker in JPEG_SOF_MARKERS:
+                    if not is_available(offset + 9):
+                        raise ValueError('JPEG is truncated')
+                    bit_depth, height, width = struct.unpack('>BHH', data[offset + 4:offset + 9])
+                    if bit_depth != 8:
+                        raise ValueError(f'JPEG has an unsupported precision of {bit_depth} bits')
+                    break
+                offset += 2 + segment_length
+
+        else:
+            raise ValueError('The image is not a PNG or JPEG file')
+
+        if min(width, height) < IMAGE_MIN_DIMENSION:
+            raise ValueError(f'The image is too small ({width}x{height}), the minimum is {IMAGE_MIN_DIMENSION} pixels')
+
+        image_info['width'] = width
+        image_info['height'] = height
+        image_info['bit_depth'] = bit_depth
+
+    except Exception as error:
+        print(f'Exception error: inspect_image_header : {error}')
+        image_info['reason'] = str(error)
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: inspect_image_header : {image_info}')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: inspect_image_header :')
+
+    return ret
+
+def inspect_application_images(zipfile_filename, appuuid, inspection):
+    """
+    This function inspects the selfie and the ID documents of an application straight from the .zip file,
+    before anything is unzipped or uploaded (see inspect_image_header()). Only the headers are read.
+    Without inference variants (see get_inference_max_dimension()), the original images are sent
+    to Rekognition and Textract, so their size and dimensions are also checked against the limits of these services.
+
+    Parameters:
+
+    zipfile_filename: The filename of the Zipped File
+    appuuid: The application uuid
+    inspection: returned dictionary that contains 'images' (image_info of each image),
+                or 'reason' if the application cannot be used
+
+    Returns:
+
+    True if the images can be used. Otherwise, False
+
+    """
+    ret = False
+
+    try:
+        original_images_for_inference = get_inference_max_dimension() == 0
+
+        with zipfile.ZipFile(zipfile_filename, mode='r') as zipped_file_object:
+            # The selfie and the driver license are required. The other ID documents are optional.
+            member_names = [appuuid + image_suffix for image_suffix in APPLICATION_IMAGES]
+            member_names += [member_name for member_name in get_document_files(zipped_file_object.namelist(), appuuid)
+                             if member_name not in member_names]
+            if len(member_names) - 1 > MAX_ID_DOCUMENTS:
+                raise ValueError(f'The application has more than {MAX_ID_DOCUMENTS} ID documents')
+
+            for member_name in member_names:
+                try:
+                    member = zipped_file_object.getinfo(member_name)
+                except KeyError:
+                    raise ValueError(f'{member_name} is missing')
+
+                image_info = {'format': '', 'width': 0, 'height': 0, 'bit_depth': 0}
+                with zipped_file_object.open(member) as stream:
+                    if inspect_image_header(stream, image_info) == False:
+                        raise ValueError(f'{member_name}: {image_info["reason"]}')
+
+                if original_images_for_inference:
+                    if member.file_size > IMAGE_MAX_BYTES:
+                        raise ValueError(f'{member_name}: the image is larger than {IMAGE_MAX_BYTES} bytes')
+                    if max(image_info['width'], image_info['height']) > IMAGE_MAX_DIMENSION:
+                        raise ValueError(f'{member_name}: the image is larger than {IMAGE_MAX_DIMENSION} pixels')
+
+                inspection['images'][member_name] = image_info
+
+    except Exception as error:
+        print(f'Exception error: inspect_application_images : {error}')
+        inspection['reason'] = str(error)
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: inspect_application_images :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: inspect_application_images :')
+
+    return ret
+
 def upload_file_to_s3(
         s3,
         file_to_upload, 
@@ -111,9 +1062,9 @@ def upload_file_to_s3(
         # Per Lab3 instructions, the 'key' should include the 'prefix' (see Task 4). Thus, I am passing 'prefix + file_key_name'
         file_name_with_path = path_of_file + file_to_upload
         response = s3.upload_file(
-            file_name_with_path,
-            bucket_name,
-            prefix + file_key_name)
+            Filename=file_name_with_path,
+            Bucket=bucket_name,
+            Key=prefix + file_key_name)
 
         # response was None
         print(f'Response after uploading file to S3: {response}')
@@ -175,7 +1126,11 @@ def prepare_customer_info(bucket,
                           customer_info,
                           valerror):
     """
-    This function gets .zip file from S3 bucket, unzip the file, then stores the unzipped objects in S3
+    This function gets .zip file from S3 bucket, unzip the file, then stores the unzipped objects in S3.
+    If the same .zip file was already verified, nothing is unzipped, and customer_info['duplicate_of']
+    is the app_uuid of that application (see reuse_completed_application()).
+    If the selfie or the license cannot be used, nothing is uploaded, and customer_info['rejected_reason']
+    is the reason (see inspect_application_images() and assess_image_quality()).
 
     Parameters:
 
@@ -202,12 +1157,30 @@ def prepare_customer_info(bucket,
         zip_name_with_path = lambda_tmp_folder + zip_name
         print(f'Name of zip file with full path is {zip_name} and {zip_name_with_path}')
             
-        # Download the .zip file from zipped/ prefix in S3 Bucket.
+        # Download the .zip file from zipped/ prefix in S3 Bucket, and hash it while it is downloaded.
         # Store the downloaded file in the lambda folder 'tmp/'
-        s3.download_file(
-            bucket,
-            key,
-            zip_name_with_path)
+        archive_info = {'sha256': ''}
+        if download_archive(get_client('s3'), bucket, key, zip_name_with_path, archive_info) == False:
+            raise ValueError('Error in downloading the .zip file from S3')
+        customer_info['archive_sha256'] = archive_info['sha256']
+
+        # A byte-identical .zip file that was already verified (e.g. a retried upload)
+        # reuses the stored verdicts instead of running the whole verification again.
+        duplicate_of = reuse_completed_application(archive_info['sha256'], get_app_uuid(zip_name))
+        if duplicate_of is not None:
+            customer_info['appuuid'] = get_app_uuid(zip_name)
+            customer_info['duplicate_of'] = duplicate_of
+            ret = True
+            return ret
+
+        # Reject tiny, truncated or wrong-format images from their headers in the .zip file,
+        # before anything is unzipped, uploaded or stored in DynamoDB table.
+        inspection = {'images': {}}
+        if inspect_application_images(zip_name_with_path, get_app_uuid(zip_name), inspection) == False:
+            customer_info['appuuid'] = get_app_uuid(zip_name)
+            customer_info['rejected_reason'] = inspection['reason']
+            ret = True
+            return ret
 
         # Unzip the downloaded file to 'tmp/unzipped'
         print('Ready to unzip the file...')
@@ -221,28 +1194,104 @@ def prepare_customer_info(bucket,
             raise ValueError('No files to upload to S3')
         print(f'list_of_files: {list_of_files}')
 
-        # Upload each file to S3 Bucket in unzipped/ prefix
+        appuuid = get_app_uuid(zip_name)
+        print(f'app uuid: {appuuid}')
+
+        # The selfie, then the ID documents (the driver license first, see get_document_files())
+        image_files = [appuuid + '_selfie.png'] + get_document_files(list_of_files, appuuid)
+        print(f'image_files: {image_files}')
+
+        # Each image is decoded once, then (1) a compact JPEG variant is created for Rekognition and Textract,
+        # and uploaded with the other files, (2) a blurry, dark or overexposed image is rejected before
+        # anything is uploaded (the variant is checked if it was created, since it is the image sent to
+        # Rekognition and Textract), and (3) the dHash of the selfie is computed.
+        max_dimension = get_inference_max_dimension()
+        thresholds = get_quality_thresholds()
+        screening = get_selfie_hash_table_name() is not None
+        selfie_dhash = None
+        if max_dimension > 0 or any(thresholds.values()) or screening:
+            for image_file in image_files:
+                image = decode_image(lambda_tmp_folder + lambda_unzipped_folder + image_file)
+
+                variant = os.path.splitext(image_file)[0] + INFERENCE_VARIANT_SUFFIX
+                variant_info = {'image': None}
+                if max_dimension > 0 and create_inference_variant(lambda_tmp_folder + lambda_unzipped_folder + image_file,
+                                                                  lambda_tmp_folder + lambda_unzipped_folder + variant,
+                                                                  max_dimension,
+                                                                  image,
+                                                                  variant_info):
+                    list_of_files.append(variant)
+
+                if any(thresholds.values()):
+                    quality = {}
+                    if variant in list_of_files:
+                        ret_quality = assess_image_quality(lambda_tmp_folder + lambda_unzipped_folder + variant, thresholds, quality, variant_info['image'])
+                    else:
+                        ret_quality = assess_image_quality(lambda_tmp_folder + lambda_unzipped_folder + image_file, thresholds, quality, image)
+                    if ret_quality == False:
+                        customer_info['appuuid'] = appuuid
+                        customer_info['rejected_reason'] = quality['reason']
+                        ret = True
+                        return ret
+
+                if screening and image_file == appuuid + '_selfie.png' and image is not None:
+                    selfie_dhash = compute_dhash(lambda_tmp_folder + lambda_unzipped_folder + image_file, image)
+
+        # Find earlier applications with a near-duplicate selfie
+        selfie_screen = {'dhash': '', 'similar_selfies': []}
+        if screening:
+            screen_selfie(lambda_tmp_folder + lambda_unzipped_folder + appuuid + '_selfie.png', appuuid, selfie_screen, selfie_dhash)
+        customer_info['selfie_screen'] = selfie_screen
+
+        # Upload each file to S3 Bucket in unzipped/ prefix (see get_artifact_key() for the key layout).
+        # With content storage, images are stored by their SHA-256 instead (see upload_blob_to_s3()).
+        content_storage = get_artifact_storage() == ARTIFACT_STORAGE_CONTENT
+        manifest = {'app_uuid': appuuid, 'artifacts': {}}
         for file in list_of_files:
-            ret_upload = upload_file_to_s3(
-                s3,
-                file, 
-                lambda_tmp_folder + lambda_unzipped_folder, 
-                bucket, 
-                file, 
-                bucket_unzipped_prefix)
+            if content_storage and file.lower().endswith(BLOB_FILE_EXTENSIONS):
+                blob_info = {'key': '', 'sha256': '', 'uploaded': False}
+                ret_upload = upload_blob_to_s3(
+                    get_client('s3'),
+                    file,
+                    lambda_tmp_folder + lambda_unzipped_folder,
+                    bucket,
+                    blob_info)
+                manifest['artifacts'][file] = blob_info['key']
+            else:
+                ret_upload = upload_file_to_s3(
+                    get_client('s3'),
+                    file, 
+                    lambda_tmp_folder + lambda_unzipped_folder, 
+                    bucket, 
+                    get_artifact_key(bucket_unzipped_prefix, appuuid, file))
+                manifest['artifacts'][file] = get_artifact_key(bucket_unzipped_prefix, appuuid, file)
             if ret_upload == False:
                 raise ValueError('Error in uploading a file to S3')
-                
-        appuuid = get_app_uuid(zip_name)
-        print(f'app uuid: {appuuid}')
+
+        if content_storage:
+            manifest_key = get_artifact_key(bucket_unzipped_prefix, appuuid, appuuid + '_manifest.json')
+            if put_application_manifest(get_client('s3'), bucket, manifest_key, manifest) == False:
+                raise ValueError('Error in storing the application manifest in S3')
+            customer_info['manifest_key'] = manifest_key
+            print(f'manifest: {manifest}')
         
-        selfie_key = bucket_unzipped_prefix + appuuid + '_selfie.png'
-        license_key = bucket_unzipped_prefix + appuuid + '_license.png'
+        # The images for Rekognition and Textract: the inference variants if they were created
+        inference_keys = []
+        for image_file in image_files:
+            variant = os.path.splitext(image_file)[0] + INFERENCE_VARIANT_SUFFIX
+            inference_keys.append(manifest['artifacts'].get(variant) or
+                                  manifest['artifacts'].get(image_file, get_artifact_key(bucket_unzipped_prefix, appuuid, image_file)))
+        selfie_key = inference_keys[0]
+        document_keys = inference_keys[1:]
+        license_key = document_keys[0]
         details_file = lambda_tmp_folder + lambda_unzipped_folder + appuuid + '_details.csv'
 
         customer_info['selfie_key'] = selfie_key
         customer_info['license_key'] = license_key
+        customer_info['document_keys'] = document_keys
         customer_info['details_file'] = details_file
+        # The original images, which ArchiveImagesLambdaFunction archives after verification
+        customer_info['archive_keys'] = [manifest['artifacts'][file] for file in image_files if file in manifest['artifacts']]
         customer_info['appuuid'] = appuuid
 
         print(f'selfie_key: {selfie_key}')
@@ -262,6 +1311,57 @@ def prepare_customer_info(bucket,
 
     return ret
     
+def is_accepted_key(key):
+    """
+    This function checks if an S3 key is an application, i.e. a .zip file in the zipped/ folder
+    or one of its subfolders, without any S3 operation. It accepts the same keys as the
+    zipped/*.zip pattern of DocumentUploadRule (an EventBridge wildcard also matches '/'),
+    so every execution that the rule starts is processed.
+
+    Parameters:
+
+    key: S3 key from the event
+
+    Returns:
+
+    True if the key is an application. Otherwise, False
+    
+    """    
+    ret = False
+
+    if isinstance(key, str) and key.startswith(ACCEPTED_KEY_PREFIX) and key.endswith(ACCEPTED_KEY_SUFFIX):
+        ret = True
+
+    return ret
+
+def put_rejected_key_metric(key):
+    """
+    This function counts a rejected key, and publishes it as the RejectedKeys CloudWatch metric
+    using the embedded metric format (a JSON log line that CloudWatch Logs turns into a metric).
+
+    Parameters:
+
+    key: The rejected S3 key
+
+    Returns:
+
+    None
+    
+    """    
+    rejected_keys['count'] += 1
+
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': KEY_FILTER_METRIC_NAMESPACE,
+                'Dimensions': [['FunctionName']],
+                'Metrics': [{'Name': 'RejectedKeys', 'Unit': 'Count'}]}]},
+        'FunctionName': 'UnzipLambdaFunction',
+        'RejectedKeys': 1,
+        'RejectedKeysSinceColdStart': rejected_keys['count'],
+        'Key': key}))
+
 def lambda_handler(event, context):
     """
     This function is the AWS Lambda function call for UnzipLambdaFunction.
@@ -273,7 +1373,11 @@ def lambda_handler(event, context):
 
     Returns:
     
-    A dictionary: {"app_uuid":appuuid}. Otherwise, None.
+    A dictionary: {"app_uuid":appuuid, "status":"unzipped", "selfie_key":..., "license_key":..., "document_keys":[...], "details_key":..., "archive_sha256":...,
+    "selfie_dhash":..., "similar_selfies":[...], "archive_keys":[...]}.
+    If the key is not an application: {"app_uuid":None, "status":"skipped"}.
+    If the same .zip file was already verified: {"app_uuid":appuuid, "status":"duplicate", "duplicate_of":...}.
+    If the selfie or the license cannot be used: {"app_uuid":appuuid, "status":"rejected", "reason":...}. Otherwise, None.
 
     """    
     
@@ -293,7 +1397,19 @@ def lambda_handler(event, context):
         print(f'record: {record}')
         print(f'bucket: {bucket}') # e.g. bucket: documentbucket-115476135777
         print(f'key: {key}')  # e.g. key: zipped/8d247914.zip
+
+        #============================================================================
+        # Skip keys that are not applications, before downloading anything from S3
+        #============================================================================
+        if is_accepted_key(key) == False:
+            print(f'Skipping key that is not an application: {key}')
+            put_rejected_key_metric(key)
+            ret = {"app_uuid":None, "status":"skipped"}
+            return ret
         
+        # A warm container may still have the files of a previous application in its /tmp folder.
+        shutil.rmtree(LAMBDA_TMP_FOLDER + LAMBDA_UNZIPPED_FOLDER, ignore_errors=True)
+
         #====================================================================================
         # Get .zip file from S3 bucket, unzip the file, then store the unzipped objects in S3
         #====================================================================================
@@ -303,12 +1419,35 @@ def lambda_handler(event, context):
         if outcome == False:
             raise ValueError('Error in prepare_customer_info')
 
+        appuuid = customer_info['appuuid']
+
+        # The same .zip file was already verified, and its verdicts are in DynamoDB table.
+        if customer_info.get('duplicate_of') is not None:
+            ret = {"app_uuid":appuuid, "status":"duplicate", "duplicate_of":customer_info['duplicate_of']}
+            return ret
+
+        # The selfie or the license cannot be used, so nothing was uploaded or stored.
+        if customer_info.get('rejected_reason') is not None:
+            print(f'Application {appuuid} is rejected: {customer_info["rejected_reason"]}')
+            ret = {"app_uuid":appuuid, "status":"rejected", "reason":customer_info['rejected_reason']}
+            return ret
+
         selfie_key = customer_info['selfie_key']
         license_key = customer_info['license_key']
         details_file = customer_info['details_file']
-        appuuid = customer_info['appuuid']
 
-        response = {"app_uuid":appuuid}
+        details_key = get_artifact_key(BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_details.csv')
+
+        response = {"app_uuid":appuuid,
+                    "status":"unzipped",
+                    "selfie_key":selfie_key,
+                    "license_key":license_key,
+                    "document_keys":customer_info['document_keys'],
+                    "details_key":details_key,
+                    "archive_sha256":customer_info['archive_sha256'],
+                    "selfie_dhash":customer_info['selfie_screen']['dhash'],
+                    "similar_selfies":customer_info['selfie_screen']['similar_selfies'],
+                    "archive_keys":customer_info['archive_keys']}
     
     except Exception as error:
         print(f'Exception error: {error}')
@@ -319,7 +1458,7 @@ def lambda_handler(event, context):
         ret = response
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
         return ret
 
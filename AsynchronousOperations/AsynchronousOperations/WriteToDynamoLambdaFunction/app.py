@@ -1,9 +1,68 @@
 import os
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+import botocore
+import hashlib
 import csv
-
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
+
+CUSTOMER_INFORMATION = [
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS']
+CUSTOMER_INFORMATION_INDEX = {name: index for index, name in enumerate(CUSTOMER_INFORMATION)}
+
+# S3 key layout of the unzipped objects (see get_artifact_key()). With 'sharded', the keys of each
+# application are spread across hashed sub-prefixes, e.g. unzipped/3f/8d247914_selfie.png
+KEY_LAYOUT_FLAT = 'flat'
+KEY_LAYOUT_SHARDED = 'sharded'
+KEY_SHARD_HEX_DIGITS = 2
+
+# Duplicate-license detection (see find_applications_with_document_number()). DocumentNumberIndex is
+# the GSI of DOCUMENT_NUMBER in the DynamoDB table. With the 'reject' policy, an application with a
+# DOCUMENT_NUMBER that was already submitted is not verified. With 'flag', it is only marked.
+DOCUMENT_NUMBER_INDEX = 'DocumentNumberIndex'
+DUPLICATE_LICENSE_POLICY_FLAG = 'flag'
+DUPLICATE_LICENSE_POLICY_REJECT = 'reject'
+DUPLICATE_LICENSE_LOOKUP_LIMIT = 10
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Item shape of the DynamoDB table (see serialize_ddb_item()). The writes use the low-level DynamoDB
+# client, and the known attributes are converted to the DynamoDB format by precompiled serializers,
+# instead of the type inspection of the boto3 resource layer. Other attributes use TypeSerializer.
+DDB_STRING_ATTRIBUTES = (
+    'APP_UUID',
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS',
+    'ARCHIVE_SHA256',
+    'SELFIE_DHASH',
+    'DUPLICATE_OF')
+DDB_BOOLEAN_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH', 'LICENSE_VALIDATION')
+DDB_STRING_LIST_ATTRIBUTES = ('DUPLICATE_LICENSE_OF', 'SIMILAR_SELFIE_OF')
+DDB_ITEM_SERIALIZERS = {
+    **{name: (str, lambda value: {'S': value}) for name in DDB_STRING_ATTRIBUTES},
+    **{name: (bool, lambda value: {'BOOL': value}) for name in DDB_BOOLEAN_ATTRIBUTES},
+    **{name: (list, lambda value: {'L': [{'S': element} for element in value]}) for name in DDB_STRING_LIST_ATTRIBUTES}}
+
+ddb_type_serializer = TypeSerializer()
 
 def get_dynamo_db_table_name():
     """
@@ -34,6 +93,99 @@ def get_dynamo_db_table_name():
         print(f'finally block: do nothing for now')
         return ret
     
+def serialize_ddb_attribute(name, value):
+    """
+    This function converts the value of an attribute of the DynamoDB table to the low-level DynamoDB format,
+    e.g. 'NICK' to {'S': 'NICK'}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    name: Name of the attribute, e.g. 'FIRST_NAME'
+    value: Value of the attribute
+
+    Returns:
+
+    The value in the low-level DynamoDB format
+    
+    """
+    serializer = DDB_ITEM_SERIALIZERS.get(name)
+    if serializer is not None and type(value) is serializer[0]:
+        return serializer[1](value)
+    return ddb_type_serializer.serialize(value)
+
+def serialize_ddb_item(item):
+    """
+    This function converts an item of the DynamoDB table to the low-level DynamoDB format,
+    e.g. {'APP_UUID': '8d247914'} to {'APP_UUID': {'S': '8d247914'}}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    item: A dictionary of attribute names and values
+
+    Returns:
+
+    The item in the low-level DynamoDB format
+    
+    """
+    return {name: serialize_ddb_attribute(name, value) for name, value in item.items()}
+
+def get_ddb_table_name(ddb_table):
+    """
+    This function returns the name of a DynamoDB table.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+
+    Returns:
+
+    The table name
+    
+    """
+    return ddb_table if isinstance(ddb_table, str) else ddb_table.name
+
+def put_ddb_item(ddb_table, item, serialized = False):
+    """
+    This function writes an item to the DynamoDB table with the low-level DynamoDB client.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    item: A dictionary of attribute names and values, with APP_UUID
+    serialized: True if the item is already in the low-level DynamoDB format, e.g. CustomerDetails.to_ddb_item()
+
+    Returns:
+
+    The put_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').put_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Item = item if serialized else serialize_ddb_item(item))
+
+def set_ddb_attribute(ddb_table, appuuid, attribute_name, value):
+    """
+    This function sets one attribute of an item of the DynamoDB table with the low-level DynamoDB client.
+    update_item() creates the attribute if it does not exist.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the attribute, e.g. 'LICENSE_SELFIE_MATCH'
+    value: Value of the attribute
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = f'SET {attribute_name}=:value',
+        ExpressionAttributeValues = {':value': serialize_ddb_attribute(attribute_name, value)})
+
 def parse_csv_ddb(csv_filename):
     """
     This function parses .csv file and returns its contents as a dictionary.
@@ -64,7 +216,253 @@ def parse_csv_ddb(csv_filename):
 
         return details_reader
     
-def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror):
+def normalize_customer_value(value):
+    """
+    This function returns the normalized form of a customer's detail, which is used to compare it:
+    upper case, without leading, trailing or repeated spaces.
+
+    Parameters:
+
+    value: A customer's detail, e.g. ' 123  Main Street'. None is a missing detail.
+
+    Returns:
+
+    The normalized detail, e.g. '123 MAIN STREET'. An empty string for a missing detail.
+    
+    """
+    if value is None:
+        return ''
+    return ' '.join(value.split()).upper()
+
+class CustomerDetails:
+    """
+    This class holds the customer's details of an application (the .csv file). They are validated once,
+    when the .csv file is parsed (see parse_customer_details()). The CUSTOMER_INFORMATION fields are kept
+    in their fixed order, with their normalized form (see normalize_customer_value()), which is compared
+    with the information extracted from the ID documents when DETAILS_MATCHING is normalized
+    (see is_matching_customer_info()). The other columns of the .csv file are kept in extra: they are stored
+    with the details, but not compared.
+    Like the dictionary of the .csv file, a detail can be read with get(), e.g. customer.get('DOCUMENT_NUMBER', '0').
+    
+    """
+    __slots__ = ('values', 'normalized', 'extra')
+
+    def __init__(self, values, extra = None):
+        """
+        Parameters:
+
+        values: The CUSTOMER_INFORMATION values, in their order. A missing value is None.
+        extra: Optional dictionary of the other columns of the .csv file
+        
+        """
+        self.values = tuple(values)
+        self.normalized = tuple(normalize_customer_value(value) for value in self.values)
+        self.extra = dict(extra or {})
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        This function creates the customer's details from a dictionary, e.g. the details_dic of a checkpoint.
+        The CUSTOMER_INFORMATION fields that are not in the dictionary are missing, and the other keys are extra.
+
+        Parameters:
+
+        payload: A dictionary of the customer's details
+
+        Returns:
+
+        A CustomerDetails
+        
+        """
+        return cls((payload.get(name) for name in CUSTOMER_INFORMATION),
+                   {name: value for name, value in payload.items() if name not in CUSTOMER_INFORMATION_INDEX})
+
+    def get(self, name, default = None):
+        """
+        This function returns a customer's detail, like dict.get().
+
+        Parameters:
+
+        name: Name of the detail, e.g. 'DOCUMENT_NUMBER'
+        default: Returned value if the detail is missing
+
+        Returns:
+
+        The customer's detail. Otherwise, default
+        
+        """
+        index = CUSTOMER_INFORMATION_INDEX.get(name)
+        if index is None or self.values[index] is None:
+            return default
+        return self.values[index]
+
+    def matches(self, extracted_info, normalized = False):
+        """
+        This function compares the customer's CUSTOMER_INFORMATION details with the information extracted from
+        the ID documents. The extra details are not compared.
+
+        Parameters:
+
+        extracted_info: A dictionary of the extracted CUSTOMER_INFORMATION fields (see get_customer_extracted_info())
+        normalized: True to compare the normalized forms (see normalize_customer_value()). Otherwise, the details must be equal
+
+        Returns:
+
+        True if all the fields match. Otherwise, False
+        
+        """
+        if normalized:
+            return self.normalized == tuple(normalize_customer_value(extracted_info.get(name)) for name in CUSTOMER_INFORMATION)
+        return self.values == tuple(extracted_info.get(name) for name in CUSTOMER_INFORMATION)
+
+    def to_payload(self):
+        """
+        This function returns the customer's details as a dictionary, e.g. for a checkpoint or a state machine payload.
+
+        Parameters:
+
+        None
+
+        Returns:
+
+        A dictionary of the CUSTOMER_INFORMATION fields that are not missing, then the extra details
+        
+        """
+        payload = {name: value for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None}
+        payload.update((name, value) for name, value in self.extra.items() if name not in payload)
+        return payload
+
+    def to_ddb_item(self, appuuid, extra_attributes = None):
+        """
+        This function returns the DynamoDB item of the application, in the low-level DynamoDB format.
+        The customer's details, including the extra details, are strings, so they are converted without serialize_ddb_item().
+
+        Parameters:
+
+        appuuid: Customer's ID, which is the partition key of the item
+        extra_attributes: Optional dictionary of attributes that are stored with the customer's details
+
+        Returns:
+
+        The item in the low-level DynamoDB format (see put_ddb_item())
+        
+        """
+        item = {name: {'S': value} for name, value in self.extra.items()}
+        item.update((name, {'S': value}) for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None)
+        if extra_attributes:
+            item.update(serialize_ddb_item(extra_attributes))
+        item['APP_UUID'] = {'S': appuuid}
+        return item
+
+    def __repr__(self):
+        return f'CustomerDetails({self.to_payload()})'
+
+def parse_customer_details(csv_filename):
+    """
+    This function parses the .csv file of an application, and validates it:
+    it must have all the CUSTOMER_INFORMATION columns. The other columns are kept as extra details (see CustomerDetails).
+
+    Parameters:
+
+    csv_filename: The .csv filename to parse.
+
+    Returns:
+
+    A CustomerDetails. Otherwise, None.
+    
+    """
+    ret = None
+    try:
+        details_dic = parse_csv_ddb(csv_filename)
+        if not details_dic:
+            raise ValueError('Could not parse csv file')
+
+        missing = [name for name in CUSTOMER_INFORMATION if details_dic.get(name) is None]
+        if missing:
+            raise ValueError(f'Missing {", ".join(missing)} in the .csv file')
+
+        # A row with more values than columns has them in a list under None, which is not a detail
+        extra = {name: value for name, value in details_dic.items()
+                 if isinstance(name, str) and isinstance(value, str) and name not in CUSTOMER_INFORMATION_INDEX}
+        ret = CustomerDetails((details_dic[name] for name in CUSTOMER_INFORMATION), extra)
+
+    except Exception as error:
+        print(f'Exception error: parse_customer_details : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: parse_customer_details :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: parse_customer_details :')
+
+    return ret
+    
+def get_duplicate_license_policy():
+    """
+    This function gets the policy for a DOCUMENT_NUMBER that was already submitted from the
+    environment variable DUPLICATE_LICENSE_POLICY. If it is not set, or not a known policy, 'flag' is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    DUPLICATE_LICENSE_POLICY_FLAG or DUPLICATE_LICENSE_POLICY_REJECT
+    
+    """    
+    policy = os.environ.get('DUPLICATE_LICENSE_POLICY', DUPLICATE_LICENSE_POLICY_FLAG)
+    if policy not in (DUPLICATE_LICENSE_POLICY_FLAG, DUPLICATE_LICENSE_POLICY_REJECT):
+        print(f'Unknown DUPLICATE_LICENSE_POLICY {policy}, using {DUPLICATE_LICENSE_POLICY_FLAG}')
+        policy = DUPLICATE_LICENSE_POLICY_FLAG
+
+    return policy
+
+def find_applications_with_document_number(ddb_table, document_number, appuuid):
+    """
+    This function finds other applications that were submitted with the same driver license
+    (DOCUMENT_NUMBER), with a Query on the DocumentNumberIndex of the DynamoDB table (no Scan).
+
+    A failed lookup is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    ddb_table: DynamoDB table
+    document_number: Customer's driver license number
+    appuuid: The application uuid, which is not returned (e.g. when the same application is retried)
+
+    Returns:
+
+    A list of app_uuid (at most DUPLICATE_LICENSE_LOOKUP_LIMIT). Otherwise, an empty list
+    
+    """    
+    ret = []
+
+    try:
+        if not document_number:
+            raise ValueError('No DOCUMENT_NUMBER')
+
+        response = ddb_table.query(
+            IndexName=DOCUMENT_NUMBER_INDEX,
+            KeyConditionExpression='DOCUMENT_NUMBER = :document_number',
+            ExpressionAttributeValues={':document_number': document_number},
+            Limit=DUPLICATE_LICENSE_LOOKUP_LIMIT + 1)
+
+        ret = [item['APP_UUID'] for item in response.get('Items', []) if item['APP_UUID'] != appuuid]
+        ret = ret[:DUPLICATE_LICENSE_LOOKUP_LIMIT]
+
+    except Exception as error:
+        print(f'Exception error: find_applications_with_document_number : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: find_applications_with_document_number : {ret}')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: find_applications_with_document_number :')
+
+    return ret
+
+def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror, extra_attributes = None):
     """
     This function adds customer's personal details (in .csv file) to DynamoDB table
 
@@ -73,8 +471,12 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
     details_file: Customer's personal details (.csv file)
     appuuid: Customer's ID which is used as DynamoDB partition key
     customer_details: Returned dictionary that contains DynamoDB table name and Customer's detailed info.
+                      'customer' is the CustomerDetails, and 'details_dic' is the same details as a dictionary.
+                      'duplicate_license_of' is the list of other applications with the same DOCUMENT_NUMBER.
     ddb_response: Returned response from DynamoDB.
     valerror: returned exception error
+    extra_attributes: Optional dictionary of attributes that are stored with the customer's details,
+                      e.g. {'ARCHIVE_SHA256': ...}
 
     Returns:
 
@@ -93,7 +495,7 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         
         # From Boto3 documentation:
         # Instantiate a table resource object without actually creating a DynamoDB table.
-        ddb_table = dynamodb.Table(ddb_table_name)
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
         if ddb_table is None:
             raise ValueError('Table: test_table not found')
         # For unit testing, the following if-condition will not work unless I have IAM Policy "DerscribeTable".
@@ -108,20 +510,25 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         #    raise ValueError()
         print(f'ddb_table: {ddb_table}')
         
-        # Parse csv file and get a dictionary
-        details_dic = parse_csv_ddb(details_file)
-        if not details_dic:
+        # Parse and validate the csv file
+        customer = parse_customer_details(details_file)
+        if customer is None:
             raise ValueError('Could not parse csv file')
-        print(f'details_dic: {details_dic}')
+        print(f'customer: {customer}')
+
+        # Flag the application if its driver license was already submitted by other applications
+        duplicate_license_of = find_applications_with_document_number(ddb_table, customer.get('DOCUMENT_NUMBER'), appuuid)
+        if duplicate_license_of:
+            extra_attributes = {**(extra_attributes or {}), 'DUPLICATE_LICENSE_OF': duplicate_license_of}
         
         # Write the dictionary to DynamoDB table.
         # Item: attributes for the primary key (partition key).
         # For the partition key, see KeySchema in YAML. It is a Hash Key for appuuid.
-        # So, for one item (details_dic), there is one unique partition key.
+        # So, for one item (customer), there is one unique partition key.
         # For Valid DynamoDB Types, see:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/customizations/dynamodb.html#ref-valid-dynamodb-types
         #  It shows: S for string, M for dictionary, N for integer, L for list, etc.
-        ddb_response['ddb_response'] = ddb_table.put_item(Item={**details_dic, "APP_UUID": appuuid}) # see APP_UUID in AttributeName in YAML DynamoDB
+        ddb_response['ddb_response'] = put_ddb_item(ddb_table, customer.to_ddb_item(appuuid, extra_attributes), serialized = True) # see APP_UUID in AttributeName in YAML DynamoDB
         if ddb_response['ddb_response']['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Could not put DynamoDB Table item')
 
@@ -134,7 +541,9 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         print(f'else block: update_ddb_with_customer_info :')
         
         customer_details['ddb_table'] = ddb_table
-        customer_details['details_dic'] = details_dic
+        customer_details['customer'] = customer
+        customer_details['details_dic'] = customer.to_payload()
+        customer_details['duplicate_license_of'] = duplicate_license_of
 
         ret = True
 
@@ -144,6 +553,94 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
 
     return ret
 
+def get_key_layout():
+    """
+    This function gets the S3 key layout of the unzipped objects from the environment variable KEY_LAYOUT.
+    If it is not set, or not a known layout, the flat layout (unzipped/<appuuid>_selfie.png) is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED
+    
+    """    
+    layout = os.environ.get('KEY_LAYOUT', KEY_LAYOUT_FLAT)
+    if layout not in (KEY_LAYOUT_FLAT, KEY_LAYOUT_SHARDED):
+        print(f'Unknown KEY_LAYOUT {layout}, using {KEY_LAYOUT_FLAT}')
+        layout = KEY_LAYOUT_FLAT
+
+    return layout
+
+def get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, layout = None):
+    """
+    This function gets the S3 key of an unzipped object of an application.
+    For example, for appuuid 8d247914 and file_name 8d247914_selfie.png:
+    flat layout: unzipped/8d247914_selfie.png
+    sharded layout: unzipped/<first hex digits of sha256(appuuid)>/8d247914_selfie.png
+
+    All the objects of one application are in the same shard.
+
+    Parameters:
+
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+    layout: KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED. If None, get_key_layout() is used
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    if layout is None:
+        layout = get_key_layout()
+
+    if layout == KEY_LAYOUT_SHARDED:
+        shard = hashlib.sha256(appuuid.encode('utf-8')).hexdigest()[:KEY_SHARD_HEX_DIGITS]
+        return bucket_unzipped_prefix + shard + '/' + file_name
+
+    return bucket_unzipped_prefix + file_name
+
+def resolve_artifact_key(bucket, bucket_unzipped_prefix, appuuid, file_name):
+    """
+    This function gets the S3 key of an existing unzipped object of an application.
+    With the sharded layout, an application that was stored before the layout changed
+    is still read from its flat key.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name)
+
+    if get_key_layout() == KEY_LAYOUT_FLAT:
+        return ret
+
+    try:
+        get_client('s3').head_object(Bucket=bucket, Key=ret)
+    except botocore.exceptions.ClientError as error:
+        # Without s3:ListBucket permission, S3 returns 403 instead of 404 for a missing key.
+        if error.response.get('Error', {}).get('Code') in ('404', '403', 'NoSuchKey', 'NotFound'):
+            print(f'{ret} not found, using the flat key')
+            ret = get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, KEY_LAYOUT_FLAT)
+        else:
+            print(f'Exception Client Error: resolve_artifact_key : {error}')
+    except Exception as error:
+        print(f'Exception error: resolve_artifact_key : {error}')
+
+    return ret
+
 def lambda_handler(event, context):
     """
     This function is the AWS Lambda function call for WriteToDynamoLambdaFunction.
@@ -155,7 +652,8 @@ def lambda_handler(event, context):
 
     Returns:
 
-    A dictionary that contains driver_license_id, validation_override, and appuuid. Otherwise, None.
+    A dictionary that contains driver_license_id, validation_override, and appuuid
+    (and duplicate_license_of if the application is rejected as a duplicate license). Otherwise, None.
     
     """    
     
@@ -185,11 +683,12 @@ def lambda_handler(event, context):
 
         # Download the .csv file from S3 bucket to this Lambda's internal memory
         # Use: s3.download_file(bucket, from, to)
-        location_in_bucket = BUCKET_UNZIPPED_PREFIX + appuuid + '_details.csv'
+        location_in_bucket = application.get('details_key') or resolve_artifact_key(
+            bucket, BUCKET_UNZIPPED_PREFIX, appuuid, appuuid + '_details.csv')
         details_file = LAMBDA_TMP_FOLDER + LAMBDA_UNZIPPED_FOLDER + appuuid + '_details.csv'
         print(f'location_in_bucket: {location_in_bucket}')
         print(f'details_file: {details_file}')
-        response_s3 = s3.download_file(bucket, location_in_bucket, details_file)
+        response_s3 = get_client('s3').download_file(bucket, location_in_bucket, details_file)
 
         #==============================================================
         # Put customer's personal details (.csv file) in DynamoDB table
@@ -197,16 +696,31 @@ def lambda_handler(event, context):
         customer_details = {'ddb_table':'', 'details_dic':{}}
         ddb_response = {'ddb_response':''}
         valerror = {'error':''}
-        outcome = update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror)
+        # Unzip passes the SHA-256 of the .zip file, so that a resubmitted .zip file can reuse the verdicts.
+        extra_attributes = {}
+        if application.get('archive_sha256'):
+            extra_attributes['ARCHIVE_SHA256'] = application['archive_sha256']
+        # Unzip also passes the dHash of the selfie, and the applications with a near-duplicate selfie.
+        if application.get('selfie_dhash'):
+            extra_attributes['SELFIE_DHASH'] = application['selfie_dhash']
+        if application.get('similar_selfies'):
+            extra_attributes['SIMILAR_SELFIE_OF'] = application['similar_selfies']
+        outcome = update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror, extra_attributes)
         if outcome == False:
             raise ValueError('Error in update_ddb_with_customer_info')
         
         ddb_table = customer_details['ddb_table']
-        details_dic = customer_details['details_dic']
+        customer = customer_details['customer']
 
-        response = {'driver_license_id': details_dic.get('DOCUMENT_NUMBER', '0'), # if 'DOCUMENT_NUMBER' does not exist, it returns '0'
+        response = {'driver_license_id': customer.get('DOCUMENT_NUMBER', '0'), # if 'DOCUMENT_NUMBER' does not exist, it returns '0'
                     'validation_override': True,
                     'app_uuid': appuuid}
+
+        # With the 'reject' policy, the CheckDuplicateLicense state ends the execution before PerformChecks.
+        # (This response is also the message to the third-party API, so it is only added when rejected.)
+        duplicate_license_of = customer_details['duplicate_license_of']
+        if duplicate_license_of and get_duplicate_license_policy() == DUPLICATE_LICENSE_POLICY_REJECT:
+            response['duplicate_license_of'] = duplicate_license_of
         
     except Exception as error:
         print(f'Exception error: {error}')
@@ -217,7 +731,7 @@ def lambda_handler(event, context):
         ret = response
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
         return ret
 
@@ -0,0 +1,163 @@
+import unittest
+from unittest.mock import patch
+from moto import mock_aws
+import sys
+import os
+import time
+
+# Append the path to sys.path, in order to import from CompareFacesLambdaFunction/ and CompareDetailsLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services and api_limiter
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+import api_limiter
+import AsynchronousOperations.CompareDetailsLambdaFunction.app as compare_details
+from AsynchronousOperations.CompareFacesLambdaFunction.app import acquire_api_permit
+from AsynchronousOperations.CompareFacesLambdaFunction.app import release_api_permit
+from AsynchronousOperations.CompareFacesLambdaFunction.app import get_resource
+
+class TestApiPermit(unittest.TestCase):
+
+    LIMITER_TABLE = 'test_limiter_table'
+    API_NAME = 'CompareFaces'
+
+    def create_limiter_table(self):
+        # Create a mock table like the ApiLimiterTable of the template
+        return get_resource('dynamodb').create_table(
+            TableName=TestApiPermit.LIMITER_TABLE,
+            KeySchema=[{'AttributeName': 'LIMITER_KEY', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'LIMITER_KEY', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+    def limiter_environ(self, max_wait_seconds = '0.2'):
+        return patch.dict(os.environ, {
+            'LIMITER_TABLE': TestApiPermit.LIMITER_TABLE,
+            'PERMIT_LEASE_SECONDS': '30',
+            'PERMIT_MAX_WAIT_SECONDS': max_wait_seconds})
+
+    def test_limiter_is_shared_by_the_functions(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # Both Compare functions use the limiter of the AwsServicesLayer
+        self.assertIs(acquire_api_permit, api_limiter.acquire_api_permit)
+        self.assertIs(compare_details.acquire_api_permit, api_limiter.acquire_api_permit)
+        self.assertIs(compare_details.release_api_permit, api_limiter.release_api_permit)
+
+    @mock_aws
+    def test_permits_are_acquired_until_timeout(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        table = self.create_limiter_table()
+        permits = 3
+
+        with self.limiter_environ():
+            leases = []
+            for _ in range(permits):
+                lease = {}
+                self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, permits, lease), True)
+                leases.append(lease)
+
+            # Each lease holds its own permit
+            self.assertEqual(sorted(lease['permit_key'] for lease in leases),
+                             [f'{TestApiPermit.API_NAME}#{slot}' for slot in range(permits)])
+
+            # All the permits are taken, so the next one times out
+            lease = {}
+            start = time.monotonic()
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, permits, lease), False)
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertNotIn('permit_key', lease)
+
+            # A released permit can be acquired again
+            self.assertEqual(release_api_permit(leases[0]), True)
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, permits, lease), True)
+            self.assertEqual(lease['permit_key'], leases[0]['permit_key'])
+
+        self.assertEqual(table.scan()['Count'], permits)
+
+    @mock_aws
+    def test_expired_lease_is_taken_over(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        table = self.create_limiter_table()
+
+        # The only permit is held by a container that crashed: its lease has expired
+        permit_key = f'{TestApiPermit.API_NAME}#0'
+        table.put_item(Item={'LIMITER_KEY': permit_key, 'HOLDER': 'crashed', 'LEASE_EXPIRY': int(time.time()) - 1})
+
+        with self.limiter_environ():
+            lease = {}
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, 1, lease), True)
+
+        self.assertEqual(lease['permit_key'], permit_key)
+        item = table.get_item(Key={'LIMITER_KEY': permit_key})['Item']
+        self.assertEqual(item['HOLDER'], lease['holder'])
+        self.assertGreater(item['LEASE_EXPIRY'], time.time())
+
+    @mock_aws
+    def test_release_of_a_permit_held_by_another_container_is_a_no_op(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        table = self.create_limiter_table()
+
+        with self.limiter_environ():
+            lease = {}
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, 1, lease), True)
+
+            # The lease expired, and another container took the permit
+            table.put_item(Item={'LIMITER_KEY': lease['permit_key'], 'HOLDER': 'other', 'LEASE_EXPIRY': int(time.time()) + 30})
+
+            self.assertEqual(release_api_permit(lease), True)
+
+        # The permit of the other container is not deleted
+        item = table.get_item(Key={'LIMITER_KEY': lease['permit_key']})['Item']
+        self.assertEqual(item['HOLDER'], 'other')
+
+    @mock_aws
+    def test_limiter_is_disabled_without_table(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+
+        environ = {name: value for name, value in os.environ.items() if name != 'LIMITER_TABLE'}
+        with patch.dict(os.environ, environ, clear=True):
+            lease = {}
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, 1, lease), True)
+            self.assertIsNone(lease['permit_key'])
+
+            # Any number of calls go through, and there is nothing to release
+            self.assertEqual(acquire_api_permit(TestApiPermit.API_NAME, 1, {}), True)
+            self.assertEqual(release_api_permit(lease), True)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
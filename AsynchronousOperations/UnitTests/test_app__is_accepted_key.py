@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Append the path to sys.path, in order to import from UnzipLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+import aws_services
+import AsynchronousOperations.UnzipLambdaFunction.app as app
+from AsynchronousOperations.UnzipLambdaFunction.app import is_accepted_key
+from AsynchronousOperations.UnzipLambdaFunction.app import lambda_handler
+
+class TestAcceptedKey(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+    REJECTED_KEYS = ('unzipped/8d247914_selfie.png', 'unzipped/8d247914_details.csv', 'zipped/x.txt')
+    ACCEPTED_KEYS = ('zipped/8d247914.zip', 'zipped/sub/a.zip')
+
+    def event(self, key):
+        # The input that DocumentUploadRule gives to DocumentStateMachine
+        return {'detail': {'bucket': {'name': TestAcceptedKey.BUCKET_NAME}, 'object': {'key': key}}}
+
+    def test_keys_are_filtered(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        for key in TestAcceptedKey.REJECTED_KEYS + ('zipped/8d247914.zip.png', 'other/zipped/a.zip', None):
+            self.assertEqual(is_accepted_key(key), False, key)
+        for key in TestAcceptedKey.ACCEPTED_KEYS:
+            self.assertEqual(is_accepted_key(key), True, key)
+
+    def test_rejected_keys_are_skipped_before_any_s3_call(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        for key in TestAcceptedKey.REJECTED_KEYS:
+            with patch.object(aws_services, 'get_aws_service') as get_aws_service, \
+                 patch.object(app, 'get_client') as get_client, \
+                 patch.object(app, 'prepare_customer_info') as prepare_customer_info, \
+                 patch.object(app, 'put_rejected_key_metric') as put_rejected_key_metric:
+
+                # Call the function to test
+                ret = lambda_handler(self.event(key), None)
+
+                # Assert the key is skipped and counted, without creating or calling an AWS client
+                self.assertEqual(ret, {'app_uuid': None, 'status': 'skipped'}, key)
+                put_rejected_key_metric.assert_called_once_with(key)
+                prepare_customer_info.assert_not_called()
+                get_aws_service.assert_not_called()
+                get_client.assert_not_called()
+
+    def test_accepted_keys_are_processed(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        for key in TestAcceptedKey.ACCEPTED_KEYS:
+            with patch.object(app, 'prepare_customer_info', return_value = False) as prepare_customer_info, \
+                 patch.object(app, 'put_rejected_key_metric') as put_rejected_key_metric:
+
+                # Call the function to test
+                lambda_handler(self.event(key), None)
+
+                # Assert the application is downloaded and unzipped
+                self.assertEqual(prepare_customer_info.call_args.args[:2], (TestAcceptedKey.BUCKET_NAME, key))
+                put_rejected_key_metric.assert_not_called()
+
+    def test_rejected_keys_are_counted(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        count = app.rejected_keys['count']
+
+        # Call the function to test
+        app.put_rejected_key_metric('zipped/x.txt')
+
+        self.assertEqual(app.rejected_keys['count'], count + 1)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,148 @@
+import unittest
+from moto import mock_aws
+import sys
+import os
+import json
+
+# Append the path to sys.path, in order to import from ManifestSummaryLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from AsynchronousOperations.ManifestSummaryLambdaFunction.app import read_results
+from AsynchronousOperations.ManifestSummaryLambdaFunction.app import summarize_results
+from AsynchronousOperations.ManifestSummaryLambdaFunction.app import lambda_handler
+from AsynchronousOperations.ManifestSummaryLambdaFunction.app import MAX_SUMMARY_FAILURES
+from AsynchronousOperations.ManifestSummaryLambdaFunction.app import s3
+
+class TestManifestSummary(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+    RESULTS_PREFIX = 'manifest-results/0123/'
+
+    def child_input(self, key):
+        # The input of a child execution (see ItemSelector in ManifestStateMachine)
+        return json.dumps({'detail': {'bucket': {'name': TestManifestSummary.BUCKET_NAME}, 'object': {'key': key}}})
+
+    def succeeded(self, key, document):
+        # A child execution whose DocumentStateMachine execution succeeded (see VerifyApplication)
+        return {'Status': 'SUCCEEDED', 'Input': self.child_input(key), 'Output': json.dumps({'key': key, 'document': document})}
+
+    def failed(self, key, error, cause):
+        return {'Status': 'FAILED', 'Input': self.child_input(key), 'Error': error, 'Cause': cause}
+
+    def document_failed(self, key, document_error):
+        # DocumentStateMachine ended in a Fail state, so the startExecution.sync task failed
+        cause = json.dumps({'Status': 'FAILED', 'Error': document_error, 'Cause': 'The application failed.'})
+        return self.failed(key, 'States.TaskFailed', cause)
+
+    def put_results(self, result_files):
+        # Write the result files of the distributed Map and their manifest.json, as the ResultWriter does
+        s3.create_bucket(Bucket=TestManifestSummary.BUCKET_NAME)
+        manifest = {'ResultFiles': {}}
+        for status, results in result_files.items():
+            key = f'{TestManifestSummary.RESULTS_PREFIX}{status}_0.json'
+            s3.put_object(Bucket=TestManifestSummary.BUCKET_NAME, Key=key, Body=json.dumps(results))
+            manifest['ResultFiles'][status] = [{'Key': key, 'Size': 0}]
+        manifest_key = f'{TestManifestSummary.RESULTS_PREFIX}manifest.json'
+        s3.put_object(Bucket=TestManifestSummary.BUCKET_NAME, Key=manifest_key, Body=json.dumps(manifest))
+        return {'Bucket': TestManifestSummary.BUCKET_NAME, 'Key': manifest_key}
+
+    @mock_aws
+    def test_outcomes_are_read_from_result_files(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        verified = {'application': {'app_uuid': '8d247914', 'status': 'unzipped'},
+                    'checkResults': [{'CompareFacesResult': {'status': 'success'}}, {'CompareDetailsResult': {'status': 'success'}}]}
+        parked = {'application': {'app_uuid': '7a135804', 'status': 'unzipped'},
+                  'checkResults': [{'CompareFacesResult': {'status': 'parked'}}, {'CompareDetailsResult': {'status': 'success'}}]}
+        result_writer_details = self.put_results({
+            'SUCCEEDED': [
+                self.succeeded('zipped/8d247914.zip', verified),
+                self.succeeded('zipped/7a135804.zip', parked),
+                self.succeeded('zipped/9c358026.zip', {'application': {'app_uuid': '9c358026', 'status': 'duplicate'}}),
+                self.succeeded('zipped/sub/skipped.zip', {'application': {'status': 'skipped'}})],
+            'FAILED': [
+                self.document_failed('zipped/blurry.zip', 'UnusableImage'),
+                self.document_failed('zipped/license.zip', 'DuplicateLicense'),
+                self.document_failed('zipped/mismatch.zip', 'ComparisonFailed'),
+                self.document_failed('zipped/corrupt.zip', 'UnzipFailed'),
+                self.failed('zipped/slow.zip', 'States.Timeout', 'The execution timed out.')]})
+
+        # Call the function to test
+        results = read_results(result_writer_details)
+
+        # Assert each child execution is the outcome of its application
+        outcomes = {result['key']: result for result in results}
+        self.assertEqual(len(results), 9)
+        self.assertEqual(outcomes['zipped/8d247914.zip'], {'key': 'zipped/8d247914.zip', 'app_uuid': '8d247914', 'status': 'verified'})
+        self.assertEqual(outcomes['zipped/7a135804.zip']['status'], 'parked')
+        self.assertEqual(outcomes['zipped/9c358026.zip']['status'], 'duplicate')
+        self.assertEqual(outcomes['zipped/sub/skipped.zip'], {'key': 'zipped/sub/skipped.zip', 'status': 'skipped'})
+        self.assertEqual(outcomes['zipped/blurry.zip']['status'], 'unusable_image')
+        self.assertEqual(outcomes['zipped/license.zip']['status'], 'duplicate_license')
+        self.assertEqual(outcomes['zipped/mismatch.zip']['status'], 'comparison_failed')
+        self.assertEqual(outcomes['zipped/corrupt.zip'], {'key': 'zipped/corrupt.zip', 'status': 'error', 'error': 'UnzipFailed'})
+        self.assertEqual(outcomes['zipped/slow.zip'], {'key': 'zipped/slow.zip', 'status': 'error', 'error': 'States.Timeout'})
+
+        # The handler summarizes the same outcomes
+        summary = lambda_handler({'bucket': TestManifestSummary.BUCKET_NAME,
+                                  'results': {'ResultWriterDetails': result_writer_details}}, None)
+        self.assertEqual(summary['total'], 9)
+        self.assertEqual(summary['succeeded'], 4)
+        self.assertEqual(summary['failed'], 5)
+
+    def test_failures_are_capped(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        failed = MAX_SUMMARY_FAILURES + 50
+        results = ([{'key': f'zipped/{index}.zip', 'status': 'verified'} for index in range(20)] +
+                   [{'key': f'zipped/failed{index}.zip', 'status': 'error', 'error': 'UnzipFailed'} for index in range(failed)])
+
+        # Call the function to test
+        summary = summarize_results(results)
+
+        # Assert all the failures are counted, but only the first ones are listed
+        self.assertEqual(summary['total'], 20 + failed)
+        self.assertEqual(summary['succeeded'], 20)
+        self.assertEqual(summary['failed'], failed)
+        self.assertEqual(summary['statuses'], {'verified': 20, 'error': failed})
+        self.assertEqual(len(summary['failures']), MAX_SUMMARY_FAILURES)
+        self.assertEqual(summary['failures'][0]['key'], 'zipped/failed0.zip')
+        self.assertLess(len(json.dumps(summary)), 256 * 1024)
+
+    def test_summary_without_failures(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # Call the function to test
+        summary = summarize_results([{'key': 'zipped/8d247914.zip', 'status': 'verified'},
+                                     {'key': 'zipped/7a135804.zip', 'status': 'skipped'}])
+
+        self.assertEqual(summary, {'total': 2, 'succeeded': 2, 'failed': 0,
+                                   'statuses': {'verified': 1, 'skipped': 1}, 'failures': []})
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
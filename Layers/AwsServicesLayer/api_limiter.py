@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import random
+import botocore
+from aws_services import get_resource
+
+# Distributed concurrency limiter of the Lambda functions. It is deployed in the AwsServicesLayer Lambda layer
+# with aws_services, and each function imports it (from api_limiter import acquire_api_permit, release_api_permit).
+# The permits of an API are items of the ApiLimiterTable (LIMITER_TABLE), so they are shared by all the containers.
+LIMITER_METRIC_NAMESPACE = 'KycApp/ConcurrencyLimiter'
+DEFAULT_PERMIT_LEASE_SECONDS = 30
+DEFAULT_PERMIT_MAX_WAIT_SECONDS = 10
+PERMIT_INITIAL_BACKOFF_SECONDS = 0.05
+PERMIT_MAX_BACKOFF_SECONDS = 1.0
+
+class PermitUnavailableError(Exception):
+    """
+    This exception is raised when an API permit could not be acquired (see acquire_api_permit()).
+    It is handled like a throttling error.
+    """    
+
+def get_limiter_table_name():
+    """
+    This function gets table name of the DynamoDB table that holds the API permits.
+    In the YAML template, we define an Environment in Lambda Function that gets
+    the ApiLimiterTable as LIMITER_TABLE. If LIMITER_TABLE is not defined, then
+    the distributed concurrency limiter is disabled.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    Table name. Otherwise, None
+    
+    """    
+    ret = None
+    try:
+        table_name = os.environ['LIMITER_TABLE']
+    except Exception as error:
+        print(f'Exception error: get_limiter_table_name : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: get_limiter_table_name :')
+        ret = table_name
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: get_limiter_table_name :')
+        return ret
+
+def put_permit_wait_metric(api_name, wait_seconds, attempts):
+    """
+    This function prints the time spent waiting for an API permit using the
+    CloudWatch Embedded Metric Format, so CloudWatch Logs turns it into metrics.
+
+    Parameters:
+
+    api_name: Name of the API that the permit protects (e.g. CompareFaces)
+    wait_seconds: Time spent waiting for the permit
+    attempts: Number of conditional writes that were needed to get the permit
+
+    Returns:
+
+    None
+    
+    """    
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': LIMITER_METRIC_NAMESPACE,
+                'Dimensions': [['Api']],
+                'Metrics': [
+                    {'Name': 'PermitWaitTime', 'Unit': 'Milliseconds'},
+                    {'Name': 'PermitAttempts', 'Unit': 'Count'}]
+            }]
+        },
+        'Api': api_name,
+        'PermitWaitTime': round(wait_seconds * 1000, 3),
+        'PermitAttempts': attempts}))
+
+def acquire_api_permit(api_name, permits, lease):
+    """
+    This function acquires one of the permits of a distributed semaphore that is stored in DynamoDB.
+    All containers share the same permits, so the number of concurrent calls to api_name
+    across the account never exceeds permits.
+    Each permit is an item (e.g. CompareFaces#3) that is taken with a conditional put_item().
+    A permit whose lease has expired (i.e. its holder crashed) can be taken by another container.
+
+    Parameters:
+
+    api_name: Name of the API that the permit protects (e.g. CompareFaces)
+    permits: Number of permits for api_name
+    lease: returned dictionary that contains the permit key and holder. Pass it to release_api_permit()
+
+    Returns:
+
+    True if a permit is acquired, or the limiter is disabled. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        limiter_table_name = get_limiter_table_name()
+        if not limiter_table_name:
+            # The limiter is disabled. Call the API without a permit.
+            lease['permit_key'] = None
+            ret = True
+            return ret
+
+        limiter_table = get_resource('dynamodb').Table(limiter_table_name)
+        lease_seconds = int(os.environ.get('PERMIT_LEASE_SECONDS', DEFAULT_PERMIT_LEASE_SECONDS))
+        max_wait_seconds = float(os.environ.get('PERMIT_MAX_WAIT_SECONDS', DEFAULT_PERMIT_MAX_WAIT_SECONDS))
+        holder = uuid.uuid4().hex
+
+        start = time.monotonic()
+        attempts = 0
+        backoff = PERMIT_INITIAL_BACKOFF_SECONDS
+        while True:
+            # Start from a random permit to spread the containers over the permits
+            first_slot = random.randrange(permits)
+            for i in range(permits):
+                permit_key = f'{api_name}#{(first_slot + i) % permits}'
+                now = int(time.time())
+                attempts += 1
+                try:
+                    limiter_table.put_item(
+                        Item={'LIMITER_KEY': permit_key, 'HOLDER': holder, 'LEASE_EXPIRY': now + lease_seconds},
+                        ConditionExpression='attribute_not_exists(LIMITER_KEY) OR LEASE_EXPIRY < :now',
+                        ExpressionAttributeValues={':now': now})
+                except botocore.exceptions.ClientError as error:
+                    if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+                    # Another container holds this permit. Try the next one.
+                    continue
+
+                lease['permit_key'] = permit_key
+                lease['holder'] = holder
+                put_permit_wait_metric(api_name, time.monotonic() - start, attempts)
+                ret = True
+                return ret
+
+            # All permits are taken. Wait (with jitter) before trying again.
+            if time.monotonic() - start + backoff > max_wait_seconds:
+                raise ValueError(f'Could not acquire a {api_name} permit')
+            time.sleep(backoff * random.uniform(0.5, 1.5))
+            backoff = min(backoff * 2, PERMIT_MAX_BACKOFF_SECONDS)
+
+    except Exception as error:
+        print(f'Exception error: acquire_api_permit : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: acquire_api_permit :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: acquire_api_permit :')
+        return ret
+
+def release_api_permit(lease):
+    """
+    This function releases a permit that was acquired by acquire_api_permit().
+    The permit is only deleted if it is still held by this container. If the lease has expired
+    and another container took the permit, then nothing is deleted.
+
+    Parameters:
+
+    lease: The dictionary that was returned by acquire_api_permit()
+
+    Returns:
+
+    True if the permit is released, or there is nothing to release. Otherwise, False
+    
+    """    
+    ret = False
+    try:
+        if lease.get('permit_key') is None:
+            ret = True
+            return ret
+
+        limiter_table = get_resource('dynamodb').Table(get_limiter_table_name())
+        limiter_table.delete_item(
+            Key={'LIMITER_KEY': lease['permit_key']},
+            ConditionExpression='HOLDER = :holder',
+            ExpressionAttributeValues={':holder': lease['holder']})
+
+    except botocore.exceptions.ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # The lease expired and the permit now belongs to another container.
+            print(f'Permit {lease["permit_key"]} is no longer held by this container')
+            ret = True
+        else:
+            print(f'Exception Client Error: release_api_permit : {error}')
+    except Exception as error:
+        print(f'Exception error: release_api_permit : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: release_api_permit :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: release_api_permit :')
+        return ret
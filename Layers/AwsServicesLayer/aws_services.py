@@ -0,0 +1,294 @@
+import os
+import threading
+import time
+import botocore
+import botocore.config
+import boto3
+
+# Client registry of the Lambda functions. It is deployed as the AwsServicesLayer Lambda layer, and each function
+# imports it (import aws_services). The AWS clients and resources are created on first use instead of at import
+# time, so the cold start does not pay for them, and a request only pays for the services it calls. They are all
+# created from one boto3 session and cached for the lifetime of the container (see get_client() and get_resource()).
+
+# botocore settings of the AWS clients (see get_aws_service_config()). The connection pools are sized to
+# the thread pools that share a client, and a call with all of its attempts, i.e.
+# max_attempts * (connect_timeout + read_timeout), fits in the 20-second timeout of the functions.
+# The adaptive retry mode also slows down the client when the service throttles it.
+AWS_SERVICE_DEFAULT_PROFILE = {
+    'max_pool_connections': 10, # s3.upload_file() uses up to 10 threads
+    'connect_timeout': 1,
+    'read_timeout': 5,
+    'max_attempts': 3}
+AWS_SERVICE_PROFILES = {
+    'rekognition': {'max_pool_connections': 4}, # One comparison per ID document (MAX_ID_DOCUMENTS of the functions)
+    'textract': {'max_pool_connections': 2, 'read_timeout': 8, 'max_attempts': 2}} # One call per 2 pages
+
+aws_session = None
+aws_services = {}
+aws_service_timings = {}
+aws_service_lock = threading.Lock()
+aws_service_metrics = {}
+aws_service_metrics_lock = threading.Lock()
+
+def get_aws_service(kind, service_name):
+    """
+    This function returns the boto3 client or resource of an AWS service.
+    It is created on first use, from the shared boto3 session and the botocore settings of
+    its profile (see get_aws_service_config()), and then cached.
+    The time it took to create it is kept in aws_service_timings.
+
+    Parameters:
+
+    kind: 'client' or 'resource'
+    service_name: Name of the AWS service, e.g. 's3'
+
+    Returns:
+
+    The boto3 client or resource
+    
+    """
+    global aws_session
+
+    key = kind + ':' + service_name
+    service = aws_services.get(key)
+    if service is not None:
+        return service
+
+    # boto3 sessions are not thread-safe, and the clients may be first used from a thread pool
+    with aws_service_lock:
+        service = aws_services.get(key)
+        if service is None:
+            if aws_session is None:
+                start = time.perf_counter()
+                aws_session = boto3.session.Session()
+                aws_service_timings['session'] = round((time.perf_counter() - start) * 1000, 1)
+
+            start = time.perf_counter()
+            config = get_aws_service_config(service_name)
+            if kind == 'resource':
+                service = aws_session.resource(service_name, config = config)
+                register_aws_service_metrics(service.meta.client, service_name)
+            else:
+                service = aws_session.client(service_name, config = config)
+                register_aws_service_metrics(service, service_name)
+            aws_service_timings[key] = round((time.perf_counter() - start) * 1000, 1)
+            aws_services[key] = service
+            print(f'get_aws_service : {key} created in {aws_service_timings[key]} ms')
+
+    return service
+
+def get_aws_service_config(service_name):
+    """
+    This function builds the botocore configuration of an AWS client from its profile.
+    See AWS_SERVICE_PROFILES.
+
+    Parameters:
+
+    service_name: Name of the AWS service, e.g. 's3'
+
+    Returns:
+
+    A botocore.config.Config
+    
+    """
+    profile = dict(AWS_SERVICE_DEFAULT_PROFILE, **AWS_SERVICE_PROFILES.get(service_name, {}))
+    return botocore.config.Config(
+        max_pool_connections = profile['max_pool_connections'],
+        connect_timeout = profile['connect_timeout'],
+        read_timeout = profile['read_timeout'],
+        retries = {'mode': 'adaptive', 'total_max_attempts': profile['max_attempts']},
+        tcp_keepalive = True)
+
+def record_aws_call_start(context, **kwargs):
+    """
+    This function is a botocore 'before-call' event handler. It keeps the start time of an API call.
+
+    Parameters:
+
+    context: The request context of the API call
+    kwargs: The other arguments of the event, not used
+
+    Returns:
+
+    None
+    
+    """
+    context['metrics_start'] = time.perf_counter()
+
+def record_aws_call_end(service_name, context, http_response = None, parsed = None, exception = None):
+    """
+    This function adds a completed API call, including its retries, to the metrics of its service.
+    See get_aws_service_metrics().
+
+    Parameters:
+
+    service_name: Name of the AWS service, e.g. 's3'
+    context: The request context of the API call
+    http_response: The last HTTP response, if any
+    parsed: The parsed response, if any
+    exception: The exception that ended the call, if any (e.g. a timeout)
+
+    Returns:
+
+    None
+    
+    """
+    start = context.get('metrics_start')
+    if start is None:
+        return
+    latency_ms = (time.perf_counter() - start) * 1000
+    retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    failed = exception is not None or http_response is None or http_response.status_code >= 300
+
+    with aws_service_metrics_lock:
+        metrics = aws_service_metrics.setdefault(service_name,
+            {'calls': 0, 'errors': 0, 'retries': 0, 'latency_ms_total': 0.0, 'latency_ms_max': 0.0})
+        metrics['calls'] += 1
+        metrics['errors'] += 1 if failed else 0
+        metrics['retries'] += retries
+        metrics['latency_ms_total'] += latency_ms
+        metrics['latency_ms_max'] = max(metrics['latency_ms_max'], latency_ms)
+
+def register_aws_service_metrics(client, service_name):
+    """
+    This function registers the event handlers that keep the metrics of an AWS client.
+
+    Parameters:
+
+    client: The boto3 client
+    service_name: Name of the AWS service, e.g. 's3'
+
+    Returns:
+
+    None
+    
+    """
+    events = client.meta.events
+    events.register('before-call', record_aws_call_start)
+    events.register('after-call',
+        lambda context, http_response, parsed, **kwargs: record_aws_call_end(service_name, context, http_response, parsed))
+    events.register('after-call-error',
+        lambda context, exception, **kwargs: record_aws_call_end(service_name, context, exception = exception))
+
+def get_aws_service_metrics():
+    """
+    This function returns the number of calls, errors and retries, and the latency of the API calls
+    of each AWS service since the container started, e.g.
+    {'s3': {'calls': 3, 'errors': 0, 'retries': 1, 'latency_ms_average': 41.0, 'latency_ms_max': 80.2}}
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary of metrics per service
+    
+    """
+    with aws_service_metrics_lock:
+        return {service_name: {
+                    'calls': metrics['calls'],
+                    'errors': metrics['errors'],
+                    'retries': metrics['retries'],
+                    'latency_ms_average': round(metrics['latency_ms_total'] / metrics['calls'], 1),
+                    'latency_ms_max': round(metrics['latency_ms_max'], 1)}
+                for service_name, metrics in aws_service_metrics.items()}
+
+def get_client(service_name):
+    """
+    This function returns the cached boto3 client of an AWS service. See get_aws_service().
+
+    Parameters:
+
+    service_name: Name of the AWS service, e.g. 's3'
+
+    Returns:
+
+    The boto3 client
+    
+    """
+    return get_aws_service('client', service_name)
+
+def get_resource(service_name):
+    """
+    This function returns the cached boto3 resource of an AWS service. See get_aws_service().
+
+    Parameters:
+
+    service_name: Name of the AWS service, e.g. 'dynamodb'
+
+    Returns:
+
+    The boto3 resource
+    
+    """
+    return get_aws_service('resource', service_name)
+
+def get_aws_service_timings():
+    """
+    This function returns how long it took to create the boto3 session, clients and resources
+    of this container, in milliseconds, e.g. {'session': 40.2, 'client:s3': 55.1}
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary of creation times in milliseconds
+    
+    """
+    return dict(aws_service_timings)
+
+def reset_aws_services():
+    """
+    This function forgets the boto3 session, clients and resources, and their timings and metrics.
+    It runs in a child process after os.fork() (e.g. the process pool of Tools/backfill.py): boto3 clients
+    are not fork-safe, and the child would otherwise share the open connections of its parent.
+    The locks are created again, since another thread of the parent may have held them.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    None
+    
+    """
+    global aws_session, aws_service_lock, aws_service_metrics_lock
+
+    aws_session = None
+    aws_services.clear()
+    aws_service_timings.clear()
+    aws_service_lock = threading.Lock()
+    aws_service_metrics.clear()
+    aws_service_metrics_lock = threading.Lock()
+
+def get_module_getattr(module_name, module_services):
+    """
+    This function returns the __getattr__() of a Lambda function module, which is called for a module attribute
+    that does not exist, e.g. app.s3. It creates the AWS client or resource of that name on first use,
+    so that other modules can still import them by name, e.g. from app import s3.
+
+    Parameters:
+
+    module_name: Name of the module, i.e. its __name__
+    module_services: The AWS clients and resources of the module, e.g. {'s3': ('client', 's3')}
+
+    Returns:
+
+    The __getattr__() function of the module. It returns the boto3 client or resource,
+    or raises AttributeError
+    
+    """
+    def module_getattr(name):
+        if name in module_services:
+            return get_aws_service(*module_services[name])
+        raise AttributeError(f'module {module_name!r} has no attribute {name!r}')
+
+    return module_getattr
+
+# A forked process creates its own AWS clients (see reset_aws_services())
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child = reset_aws_services)
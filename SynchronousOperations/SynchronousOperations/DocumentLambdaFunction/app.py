@@ -1,9 +1,29 @@
 import os
+import threading
+import time
 import botocore
 import boto3
+from boto3.dynamodb.types import TypeSerializer
+import hashlib
+import io
 import zipfile
+import struct
+import zlib
+import shutil
 import csv
 import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+from aws_services import get_client, get_resource, get_aws_service_metrics, get_module_getattr
+
+# NumPy and Pillow are in requirements.txt. Without them, the selfie screening is skipped,
+# and the original images are used for inference.
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
 
 SIMILARITY_THRESHOLD = 80
 CUSTOMER_INFORMATION = [
@@ -15,17 +35,179 @@ CUSTOMER_INFORMATION = [
     'STATE_IN_ADDRESS',
     'CITY_IN_ADDRESS',
     'ZIP_CODE_IN_ADDRESS']
+CUSTOMER_INFORMATION_INDEX = {name: index for index, name in enumerate(CUSTOMER_INFORMATION)}
+# Comparison of the customer's details with the fields extracted by Textract (see get_details_matching()):
+# exact, or normalized (case and repeated spaces are ignored, see normalize_customer_value()).
+DETAILS_MATCHING_EXACT = 'exact'
+DETAILS_MATCHING_NORMALIZED = 'normalized'
+# Compiled extraction spec of the analyze_id() responses (see extract_customer_fields()): the slot of each
+# Textract field type in CUSTOMER_INFORMATION. The other field types (e.g. EXPIRATION_DATE) are ignored.
+TEXTRACT_FIELD_SLOTS = {field_type: CUSTOMER_INFORMATION_INDEX[field_type] for field_type in CUSTOMER_INFORMATION}
 SNS_FACEMATCH_MESSAGE = 'No matches between selfie and license'
 SNS_FACEMATCH_SUBJECT = 'Face Match Fails'
 SNS_IDMATCH_MESSAGE = 'No matches between Customer ID and Submitted Customer Info'
 SNS_IDMATCH_SUBJECT = 'Customer ID Info Match Fails'
-
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-rekognition = boto3.client('rekognition')
-sns = boto3.client('sns')
-textract = boto3.client('textract')
-sqs = boto3.client('sqs')
+SNS_DUPLICATE_LICENSE_MESSAGE = 'The driver license was already submitted by another application'
+SNS_DUPLICATE_LICENSE_SUBJECT = 'Duplicate Driver License'
+SNS_UNUSABLE_IMAGE_MESSAGE = 'The selfie or the driver license cannot be used'
+SNS_UNUSABLE_IMAGE_SUBJECT = 'Unusable Image'
+
+# Adaptive (AIMD) concurrency limits of the calls that an invocation makes concurrently, e.g. one per
+# ID document (see call_with_adaptive_limit()).
+AIMD_INITIAL_LIMIT = 4
+AIMD_MIN_LIMIT = 1
+AIMD_MAX_LIMIT = 64
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_LATENCY_TARGET_SECONDS = {
+    'rekognition.compare_faces': 3.0,
+    'textract.analyze_id': 5.0}
+THROTTLING_ERROR_CODES = (
+    'ThrottlingException',
+    'Throttling',
+    'ProvisionedThroughputExceededException',
+    'ProvisionedThroughputExceeded',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+    'SlowDown')
+
+# Parking queue for applications whose checks were throttled (see park_application()).
+VERIFICATION_STAGES = ['validate_selfie', 'validate_customer_details', 'queue_customer_id', 'archive_images']
+DEFAULT_PARKING_MAX_ATTEMPTS = 5
+PARKING_BASE_DELAY_SECONDS = 30
+PARKING_MAX_DELAY_SECONDS = 900 # SQS allows a delay of at most 15 minutes
+
+# S3 key layout of the unzipped objects (see get_artifact_key()). With 'sharded', the keys of each
+# application are spread across hashed sub-prefixes, e.g. unzipped/3f/8d247914_selfie.png
+KEY_LAYOUT_FLAT = 'flat'
+KEY_LAYOUT_SHARDED = 'sharded'
+KEY_SHARD_HEX_DIGITS = 2
+
+# Artifact storage (see upload_blob_to_s3()). With 'content', images are stored once by their
+# SHA-256 under BLOB_PREFIX, and a per-application manifest points at them.
+ARTIFACT_STORAGE_KEYED = 'keyed'
+ARTIFACT_STORAGE_CONTENT = 'content'
+BLOB_PREFIX = 'blobs/'
+BLOB_FILE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+BLOB_READ_CHUNK_BYTES = 1024 * 1024
+
+# Whole-application dedup (see reuse_completed_application()). ARCHIVE_SHA256 is the SHA-256 of the
+# uploaded .zip file, and ArchiveDigestIndex is its GSI in the DynamoDB table.
+ARCHIVE_DIGEST_ATTRIBUTE = 'ARCHIVE_SHA256'
+ARCHIVE_DIGEST_INDEX = 'ArchiveDigestIndex'
+VERDICT_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH')
+# The license submission of an application, which is not copied to a resubmitted application (see reuse_completed_application())
+SUBMISSION_ATTRIBUTES = ('LICENSE_QUEUED', 'LICENSE_VALIDATION', 'LICENSE_SUBMIT_ERROR')
+# Outcomes of an application that is not processed again (see get_completed_outcome())
+COMPLETED_QUEUED = 'queued'
+COMPLETED_FAILED = 'failed'
+COMPLETED_REJECTED = 'rejected'
+
+# Near-duplicate selfie screening (see screen_selfie()). The 64-bit dHash of each selfie is split into
+# DHASH_BANDS bands of 16 bits in SelfieHashTable (multi-index hashing): two hashes within
+# SELFIE_HAMMING_THRESHOLD bits (< DHASH_BANDS) always share at least one identical band.
+DHASH_SIZE = 8
+DHASH_BANDS = 4
+SELFIE_HAMMING_THRESHOLD = 3
+# Every band is queried and indexed, so the guarantee holds. A popular band (e.g. 0#0000, shared by every
+# flat image) is only read up to DHASH_MAX_BAND_ITEMS items, so one selfie does not read a whole partition.
+DHASH_MAX_BAND_ITEMS = 1000
+
+# Inference variants (see create_inference_variant()). The selfie and the license are downscaled to
+# INFERENCE_MAX_DIMENSION pixels and re-encoded as JPEG for Rekognition and Textract.
+INFERENCE_VARIANT_SUFFIX = '_inference.jpg'
+INFERENCE_JPEG_QUALITY = 85
+
+# Multi-document applications (see get_document_files()). Besides the driver license, an application may
+# have other ID documents, e.g. the back of the license or a passport. Textract analyzes at most
+# TEXTRACT_MAX_DOCUMENT_PAGES pages per analyze_id() call.
+ID_DOCUMENT_PREFIXES = ('license', 'passport')
+MAX_ID_DOCUMENTS = 4
+TEXTRACT_MAX_DOCUMENT_PAGES = 2
+
+# Image-quality gate (see assess_image_quality()). Sharpness is the variance of the Laplacian, and
+# brightness is the mean luminance (0 to 255) from the histogram, both of a QUALITY_SAMPLE_DIMENSION copy.
+QUALITY_SAMPLE_DIMENSION = 512
+
+# Archive transcoding (see archive_application_images()). After verification, the original PNG images are
+# replaced by lossless WebP images, which are verified pixel by pixel before the originals are deleted.
+ARCHIVE_IMAGE_FORMAT_ORIGINAL = 'original'
+ARCHIVE_IMAGE_FORMAT_WEBP = 'webp'
+ARCHIVE_SOURCE_EXTENSION = '.png'
+ARCHIVE_WEBP_EXTENSION = '.webp'
+ARCHIVE_WEBP_METHOD = 2 # 0 (fast) to 6 (small). Above 2, the images are barely smaller and much slower to encode
+ARCHIVE_LOSSLESS_MODES = ('RGB', 'RGBA', 'L', 'LA', 'P')
+# Pillow decodes a 16-bit PNG to 8-bit samples, so only PNG images with 8-bit samples are transcoded
+ARCHIVE_PNG_BIT_DEPTH = 8
+
+# Header-only image inspection (see inspect_application_images()). The selfie and the license are checked
+# from the headers in the .zip file, so unusable images are rejected before anything is uploaded.
+APPLICATION_IMAGES = ('_selfie.png', '_license.png')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_BIT_DEPTHS = {0: (1, 2, 4, 8, 16), 2: (8, 16), 3: (1, 2, 4, 8), 4: (8, 16), 6: (8, 16)}
+JPEG_SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+IMAGE_HEADER_READ_BYTES = 4 * 1024
+IMAGE_HEADER_MAX_BYTES = 64 * 1024
+IMAGE_MIN_DIMENSION = 80 # Rekognition needs at least 80 pixels in height and width
+IMAGE_MAX_DIMENSION = 10000 # Textract accepts at most 10000 pixels in height and width
+IMAGE_MAX_BYTES = 10 * 1024 * 1024 # Textract synchronous operations accept at most 10 MB
+
+# Duplicate-license detection (see find_applications_with_document_number()). DocumentNumberIndex is
+# the GSI of DOCUMENT_NUMBER in the DynamoDB table. With the 'reject' policy, an application with a
+# DOCUMENT_NUMBER that was already submitted is not verified. With 'flag', it is only marked.
+DOCUMENT_NUMBER_INDEX = 'DocumentNumberIndex'
+DUPLICATE_LICENSE_POLICY_FLAG = 'flag'
+DUPLICATE_LICENSE_POLICY_REJECT = 'reject'
+DUPLICATE_LICENSE_LOOKUP_LIMIT = 10
+
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import s3 (see get_module_getattr()).
+AWS_SERVICES = {
+    's3': ('client', 's3'),
+    'dynamodb': ('resource', 'dynamodb'),
+    'rekognition': ('client', 'rekognition'),
+    'sns': ('client', 'sns'),
+    'textract': ('client', 'textract'),
+    'sqs': ('client', 'sqs')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Item shape of the DynamoDB table (see serialize_ddb_item()). The writes use the low-level DynamoDB
+# client, and the known attributes are converted to the DynamoDB format by precompiled serializers,
+# instead of the type inspection of the boto3 resource layer. Other attributes use TypeSerializer.
+DDB_STRING_ATTRIBUTES = (
+    'APP_UUID',
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS',
+    'ARCHIVE_SHA256',
+    'SELFIE_DHASH',
+    'DUPLICATE_OF')
+DDB_BOOLEAN_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH', 'LICENSE_VALIDATION')
+DDB_STRING_LIST_ATTRIBUTES = ('DUPLICATE_LICENSE_OF', 'SIMILAR_SELFIE_OF')
+# EXTRACTED_DETAILS: the CUSTOMER_INFORMATION fields extracted by Textract, which are kept to re-verify
+# the applications when the comparison rules change (see Tools/reverify_details.py)
+DDB_STRING_MAP_ATTRIBUTES = ('EXTRACTED_DETAILS',)
+DDB_ITEM_SERIALIZERS = {
+    **{name: (str, lambda value: {'S': value}) for name in DDB_STRING_ATTRIBUTES},
+    **{name: (bool, lambda value: {'BOOL': value}) for name in DDB_BOOLEAN_ATTRIBUTES},
+    **{name: (list, lambda value: {'L': [{'S': element} for element in value]}) for name in DDB_STRING_LIST_ATTRIBUTES},
+    **{name: (dict, lambda value: {'M': {key: {'S': element} for key, element in value.items()}}) for name in DDB_STRING_MAP_ATTRIBUTES}}
+
+ddb_type_serializer = TypeSerializer()
+
+aimd_condition = threading.Condition()
+aimd_limits = {}
+
+# Rate limits of the downstream operations, in calls per second (see set_api_rate_limits()). The Lambda function
+# has no rate limits: the backfill tool (Tools/backfill.py) sets them in each of its processes.
+api_rate_lock = threading.Lock()
+api_rate_limits = {}
 
 def unzip_file(zipfile_filename, path_of_unzipped_file = None):
     """
@@ -101,6 +283,1226 @@ def get_unzipped_files(path_of_unzipped_file = None):
 
         return ret
 
+def is_throttling_error(error):
+    """
+    This function checks if an exception raised by a boto3 call is a throttling error.
+
+    Parameters:
+
+    error: The exception raised by the boto3 call
+
+    Returns:
+
+    True if the error is a throttling error. Otherwise, False
+    
+    """    
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+    # s3.upload_file() wraps the ClientError in S3UploadFailedError, so look at its message.
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+def call_with_adaptive_limit(operation, api_call, **kwargs):
+    """
+    This function calls a downstream AWS API while keeping the number of in-flight calls
+    for that operation within an adaptive limit (additive-increase/multiplicative-decrease).
+    Every call that succeeds within its latency target raises the limit by 1/limit
+    (i.e. by about one per round of calls). A throttling error or a slow call halves the limit.
+    Other errors keep the limit.
+    Callers that wait for a free slot block until another call completes.
+    It is only used for the concurrent calls of an invocation (see get_matching_faces_for_documents() and
+    analyze_document_ids()): the limit is per process, so the calls that are made one at a time are not limited.
+    If the operation has a rate limit (see set_api_rate_limits()), the call first waits for its turn.
+
+    Parameters:
+
+    operation: Name of the operation, e.g. 'rekognition.compare_faces'. See AIMD_LATENCY_TARGET_SECONDS.
+    api_call: The boto3 method to call, e.g. rekognition.compare_faces
+    kwargs: Arguments passed to api_call
+
+    Returns:
+
+    The response of api_call. Exceptions raised by api_call are raised again to the caller.
+    
+    """    
+    acquire_api_rate(operation)
+
+    with aimd_condition:
+        state = aimd_limits.setdefault(operation, {'limit': float(AIMD_INITIAL_LIMIT), 'in_flight': 0})
+        while state['in_flight'] >= int(state['limit']):
+            aimd_condition.wait()
+        state['in_flight'] += 1
+
+    succeeded = False
+    throttled = False
+    start = time.monotonic()
+    try:
+        response = api_call(**kwargs)
+        succeeded = True
+        return response
+    except Exception as error:
+        throttled = is_throttling_error(error)
+        raise
+    finally:
+        latency = time.monotonic() - start
+        with aimd_condition:
+            state['in_flight'] -= 1
+            # Other errors (e.g. ValidationException, AccessDenied) are not a congestion signal: the limit is kept
+            if throttled or (succeeded and latency > AIMD_LATENCY_TARGET_SECONDS.get(operation, float('inf'))):
+                state['limit'] = max(AIMD_MIN_LIMIT, state['limit'] * AIMD_DECREASE_FACTOR)
+                print(f'call_with_adaptive_limit : {operation} : throttled={throttled} latency={latency:.3f}s, limit decreased to {int(state["limit"])}')
+            elif succeeded:
+                state['limit'] = min(AIMD_MAX_LIMIT, state['limit'] + 1 / state['limit'])
+            aimd_condition.notify_all()
+
+def get_adaptive_limits():
+    """
+    This function returns the current adaptive concurrency limit of each downstream operation.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary of operation name to its current limit.
+    
+    """    
+    with aimd_condition:
+        return {operation: int(state['limit']) for operation, state in aimd_limits.items()}
+
+def set_api_rate_limits(rate_limits):
+    """
+    This function sets the rate limits of the downstream operations (see call_with_adaptive_limit()).
+
+    Parameters:
+
+    rate_limits: A dictionary of operation name to its rate limit in calls per second,
+                 e.g. {'textract.analyze_id': 1.0}. An empty dictionary removes the rate limits.
+
+    Returns:
+
+    None
+    
+    """
+    with api_rate_lock:
+        api_rate_limits.clear()
+        for operation, rate in rate_limits.items():
+            api_rate_limits[operation] = {'interval': 1 / rate, 'next': 0.0}
+
+def acquire_api_rate(operation):
+    """
+    This function waits until a call of the operation is within its rate limit. The calls are spaced
+    by 1/rate seconds: each caller reserves the next free time, then sleeps until it.
+
+    Parameters:
+
+    operation: Name of the operation, e.g. 'textract.analyze_id'
+
+    Returns:
+
+    The number of seconds waited
+    
+    """
+    with api_rate_lock:
+        state = api_rate_limits.get(operation)
+        if state is None:
+            return 0
+        now = time.monotonic()
+        start = max(now, state['next'])
+        state['next'] = start + state['interval']
+
+    if start > now:
+        time.sleep(start - now)
+    return start - now
+
+def get_key_layout():
+    """
+    This function gets the S3 key layout of the unzipped objects from the environment variable KEY_LAYOUT.
+    If it is not set, or not a known layout, the flat layout (unzipped/<appuuid>_selfie.png) is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED
+    
+    """    
+    layout = os.environ.get('KEY_LAYOUT', KEY_LAYOUT_FLAT)
+    if layout not in (KEY_LAYOUT_FLAT, KEY_LAYOUT_SHARDED):
+        print(f'Unknown KEY_LAYOUT {layout}, using {KEY_LAYOUT_FLAT}')
+        layout = KEY_LAYOUT_FLAT
+
+    return layout
+
+def get_artifact_key(bucket_unzipped_prefix, appuuid, file_name, layout = None):
+    """
+    This function gets the S3 key of an unzipped object of an application.
+    For example, for appuuid 8d247914 and file_name 8d247914_selfie.png:
+    flat layout: unzipped/8d247914_selfie.png
+    sharded layout: unzipped/<first hex digits of sha256(appuuid)>/8d247914_selfie.png
+
+    All the objects of one application are in the same shard.
+
+    Parameters:
+
+    bucket_unzipped_prefix: S3 folder where unzipped files are stored
+    appuuid: The application uuid
+    file_name: The name of the unzipped file
+    layout: KEY_LAYOUT_FLAT or KEY_LAYOUT_SHARDED. If None, get_key_layout() is used
+
+    Returns:
+
+    The S3 key
+    
+    """    
+    if layout is None:
+        layout = get_key_layout()
+
+    if layout == KEY_LAYOUT_SHARDED:
+        shard = hashlib.sha256(appuuid.encode('utf-8')).hexdigest()[:KEY_SHARD_HEX_DIGITS]
+        return bucket_unzipped_prefix + shard + '/' + file_name
+
+    return bucket_unzipped_prefix + file_name
+
+def get_artifact_storage():
+    """
+    This function gets how the unzipped images are stored from the environment variable ARTIFACT_STORAGE.
+    If it is not set, or not a known value, each image is stored under its own key (keyed).
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    ARTIFACT_STORAGE_KEYED or ARTIFACT_STORAGE_CONTENT
+    
+    """    
+    storage = os.environ.get('ARTIFACT_STORAGE', ARTIFACT_STORAGE_KEYED)
+    if storage not in (ARTIFACT_STORAGE_KEYED, ARTIFACT_STORAGE_CONTENT):
+        print(f'Unknown ARTIFACT_STORAGE {storage}, using {ARTIFACT_STORAGE_KEYED}')
+        storage = ARTIFACT_STORAGE_KEYED
+
+    return storage
+
+def upload_blob_to_s3(
+        s3,
+        file_to_upload,
+        path_of_file,
+        bucket_name,
+        blob_info):
+    """
+    This function stores a file in S3 by its content: the key is BLOB_PREFIX/<2 hex digits>/<sha256><extension>.
+    The file is read once: the SHA-256 is computed while the file is read into memory, and the same bytes are uploaded.
+    If an object with the same SHA-256 is already in the bucket (e.g. the same selfie was submitted before),
+    nothing is uploaded.
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    file_to_upload: The file that you want to upload.
+    path_of_file: The path where the file_to_upload is located.
+    bucket_name: S3 Bucket Name where the file will be uploaded to.
+    blob_info: returned dictionary that contains the S3 key, the sha256, and uploaded (False if the blob was already stored)
+
+    Returns:
+
+    True if the blob is stored. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        # Hash the file while reading it into memory
+        digest = hashlib.sha256()
+        body = io.BytesIO()
+        with open(path_of_file + file_to_upload, 'rb') as file:
+            for chunk in iter(lambda: file.read(BLOB_READ_CHUNK_BYTES), b''):
+                digest.update(chunk)
+                body.write(chunk)
+
+        sha256 = digest.hexdigest()
+        extension = os.path.splitext(file_to_upload)[1].lower()
+        key = BLOB_PREFIX + sha256[:KEY_SHARD_HEX_DIGITS] + '/' + sha256 + extension
+
+        blob_info['key'] = key
+        blob_info['sha256'] = sha256
+        blob_info['uploaded'] = False
+
+        # Upload the blob only if it is not already stored
+        try:
+            s3.head_object(Bucket=bucket_name, Key=key)
+            print(f'Blob {key} is already stored')
+        except botocore.exceptions.ClientError as error:
+            # Without s3:ListBucket permission, S3 returns 403 instead of 404 for a missing key.
+            if error.response.get('Error', {}).get('Code') not in ('404', '403', 'NoSuchKey', 'NotFound'):
+                raise
+            body.seek(0)
+            s3.put_object(
+                Body=body,
+                Bucket=bucket_name,
+                Key=key)
+            blob_info['uploaded'] = True
+            print(f'Blob {key} is uploaded')
+
+    except Exception as error:
+        print(f'Exception error: upload_blob_to_s3 : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: upload_blob_to_s3 :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: upload_blob_to_s3 :')
+
+    return ret
+
+def put_application_manifest(s3, bucket_name, manifest_key, manifest):
+    """
+    This function stores the manifest of an application in S3. The manifest maps each unzipped
+    file name of the application to its S3 key, e.g.
+    {"app_uuid": "8d247914", "artifacts": {"8d247914_selfie.png": "blobs/3f/3f...png"}}
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    bucket_name: S3 Bucket Name where the manifest will be stored.
+    manifest_key: The S3 key of the manifest
+    manifest: The manifest dictionary
+
+    Returns:
+
+    True if the manifest is stored. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        s3.put_object(
+            Body=json.dumps(manifest).encode('utf-8'),
+            Bucket=bucket_name,
+            Key=manifest_key,
+            ContentType='application/json')
+
+    except Exception as error:
+        print(f'Exception error: put_application_manifest : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: put_application_manifest :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: put_application_manifest :')
+
+    return ret
+
+def download_archive(s3, bucket, key, file_name_with_path, archive_info):
+    """
+    This function downloads a .zip file from S3, and computes its SHA-256 while the file is streamed to disk.
+
+    Parameters:
+
+    s3: Boto3 S3 client
+    bucket: S3 bucket name
+    key: Zip filename prefixed with S3 folder name
+    file_name_with_path: Where the downloaded file is stored
+    archive_info: returned dictionary that contains the sha256 of the file
+
+    Returns:
+
+    True if the download is successful. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        digest = hashlib.sha256()
+        response = s3.get_object(Bucket=bucket, Key=key)
+        with open(file_name_with_path, 'wb') as file:
+            for chunk in response['Body'].iter_chunks(BLOB_READ_CHUNK_BYTES):
+                digest.update(chunk)
+                file.write(chunk)
+
+        archive_info['sha256'] = digest.hexdigest()
+        print(f'archive sha256: {archive_info["sha256"]}')
+
+    except Exception as error:
+        print(f'Exception error: download_archive : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: download_archive :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: download_archive :')
+
+    return ret
+
+def reuse_completed_application(archive_sha256, appuuid, reused_details = None):
+    """
+    This function looks up a verified application (one whose VERDICT_ATTRIBUTES are all True) that was
+    submitted with the same .zip file, using the ArchiveDigestIndex of the DynamoDB table.
+    If it is found under another app_uuid, its item (the customer's details and the verdicts, without
+    its license submission, see SUBMISSION_ATTRIBUTES) is copied to appuuid. An application with a failed
+    check is not reused, so the resubmitted application is verified again (and its email is sent).
+
+    A failed lookup is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    archive_sha256: SHA-256 of the .zip file
+    appuuid: The application uuid
+    reused_details: returned dictionary that is updated with the customer's details of the copied item (optional)
+
+    Returns:
+
+    The app_uuid of the verified application. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        ddb_table_name = get_dynamo_db_table_name()
+        if not ddb_table_name:
+            raise ValueError('No DynamoDB table')
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
+
+        query = {'IndexName': ARCHIVE_DIGEST_INDEX,
+                 'KeyConditionExpression': f'{ARCHIVE_DIGEST_ATTRIBUTE} = :sha256',
+                 'ExpressionAttributeValues': {':sha256': archive_sha256}}
+        while ret is None:
+            response = ddb_table.query(**query)
+
+            for item in response.get('Items', []):
+                # The application's own item (e.g. the same upload processed again) is checked by get_completed_outcome()
+                if item['APP_UUID'] != appuuid and all(item.get(attribute) is True for attribute in VERDICT_ATTRIBUTES):
+                    copied_item = {name: value for name, value in item.items() if name not in SUBMISSION_ATTRIBUTES}
+                    ddb_table.put_item(Item={**copied_item, 'APP_UUID': appuuid, 'DUPLICATE_OF': item['APP_UUID']})
+                    if reused_details is not None:
+                        reused_details.update({name: item[name] for name in CUSTOMER_INFORMATION if name in item})
+                    ret = item['APP_UUID']
+                    print(f'Application {appuuid} is a duplicate of the verified application {ret}')
+                    break
+
+            if 'LastEvaluatedKey' not in response:
+                break
+            query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    except Exception as error:
+        print(f'Exception error: reuse_completed_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: reuse_completed_application :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: reuse_completed_application :')
+
+    return ret
+
+def get_completed_outcome(archive_sha256, appuuid):
+    """
+    This function checks if an application was already completed with the same .zip file, e.g. when
+    the S3 notification of the ingestion queue is delivered again after its batch timed out.
+    An application is completed once its license was sent to the license queue (LICENSE_QUEUED),
+    a check failed and its email was sent (a verdict is False), or it was rejected (REJECTED_REASON).
+
+    A failed lookup is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    archive_sha256: SHA-256 of the .zip file
+    appuuid: The application uuid
+
+    Returns:
+
+    The outcome: COMPLETED_QUEUED, COMPLETED_FAILED or COMPLETED_REJECTED. Otherwise, None
+    
+    """
+    ret = None
+
+    try:
+        ddb_table_name = get_dynamo_db_table_name()
+        if not ddb_table_name:
+            raise ValueError('No DynamoDB table')
+
+        response = get_resource('dynamodb').Table(ddb_table_name).get_item(
+            Key={'APP_UUID': appuuid},
+            ProjectionExpression=', '.join((ARCHIVE_DIGEST_ATTRIBUTE, 'LICENSE_QUEUED', 'REJECTED_REASON') + VERDICT_ATTRIBUTES),
+            ConsistentRead=True)
+        item = response.get('Item', {})
+
+        if item.get(ARCHIVE_DIGEST_ATTRIBUTE) == archive_sha256:
+            if item.get('LICENSE_QUEUED') is True:
+                ret = COMPLETED_QUEUED
+            elif 'REJECTED_REASON' in item:
+                ret = COMPLETED_REJECTED
+            elif any(item.get(attribute) is False for attribute in VERDICT_ATTRIBUTES):
+                ret = COMPLETED_FAILED
+
+    except Exception as error:
+        print(f'Exception error: get_completed_outcome : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: get_completed_outcome : {ret}')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: get_completed_outcome :')
+
+    return ret
+
+def get_submission_attributes(appuuid):
+    """
+    This function gets the license submission of an application (see SUBMISSION_ATTRIBUTES), so that an
+    application that is verified again (see process_application() with reverify) keeps it when its item
+    is stored again, and its license is not sent again.
+
+    A failed lookup is not an error: the application then has no license submission.
+
+    Parameters:
+
+    appuuid: The application uuid
+
+    Returns:
+
+    A dictionary of the SUBMISSION_ATTRIBUTES of the application. Otherwise, an empty dictionary
+
+    """
+    ret = {}
+
+    try:
+        ddb_table_name = get_dynamo_db_table_name()
+        if not ddb_table_name:
+            raise ValueError('No DynamoDB table')
+
+        response = get_resource('dynamodb').Table(ddb_table_name).get_item(
+            Key={'APP_UUID': appuuid},
+            ProjectionExpression=', '.join(SUBMISSION_ATTRIBUTES),
+            ConsistentRead=True)
+        ret = {name: value for name, value in response.get('Item', {}).items() if name in SUBMISSION_ATTRIBUTES}
+
+    except Exception as error:
+        print(f'Exception error: get_submission_attributes : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: get_submission_attributes : {ret}')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: get_submission_attributes :')
+
+    return ret
+
+def get_selfie_hash_table_name():
+    """
+    This function gets the name of the DynamoDB table of selfie hashes from the environment variable
+    SELFIE_HASH_TABLE. If it is not set, the selfie screening is not used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    Table name. Otherwise, None
+    
+    """    
+    return os.environ.get('SELFIE_HASH_TABLE') or None
+
+def decode_image(image_file):
+    """
+    This function decodes an image once, so that the inference variant, the quality gate and the dHash
+    use the same pixels (see create_inference_variant(), assess_image_quality() and compute_dhash()).
+
+    Parameters:
+
+    image_file: The image file with its path
+
+    Returns:
+
+    The decoded image. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if Image is None:
+            raise ValueError('Pillow is not available')
+
+        with Image.open(image_file) as image:
+            image.load()
+        ret = image
+
+    except Exception as error:
+        print(f'Exception error: decode_image : {error}')
+
+    return ret
+
+def compute_dhash(image_file, image = None):
+    """
+    This function computes the difference hash (dHash) of an image: the image is converted to grayscale
+    and resized to 9x8 pixels, and each bit tells if a pixel is brighter than its left neighbour.
+    Re-encoded, resized or slightly edited copies of the same photo have hashes that differ by a few bits.
+
+    Parameters:
+
+    image_file: The image file with its path
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+
+    Returns:
+
+    The 64-bit hash as 16 hex digits. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if numpy is None or Image is None:
+            raise ValueError('NumPy and Pillow are not available')
+
+        if image is None:
+            image = decode_image(image_file)
+        image = image.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS)
+        pixels = numpy.asarray(image, dtype=numpy.int16)
+
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        ret = numpy.packbits(bits.flatten()).tobytes().hex()
+
+    except Exception as error:
+        print(f'Exception error: compute_dhash : {error}')
+
+    return ret
+
+def get_dhash_bands(dhash):
+    """
+    This function splits a dHash into DHASH_BANDS keys of SelfieHashTable, e.g. 0#3fa0, 1#9c11, 2#..., 3#...
+
+    Parameters:
+
+    dhash: The 64-bit hash as 16 hex digits
+
+    Returns:
+
+    A list of keys
+    
+    """    
+    width = len(dhash) // DHASH_BANDS
+    return [f'{band}#{dhash[band * width:(band + 1) * width]}' for band in range(DHASH_BANDS)]
+
+def screen_selfie(image_file, appuuid, selfie_screen, dhash = None):
+    """
+    This function finds the applications whose selfie is a near-duplicate of this selfie
+    (Hamming distance of their dHash at most SELFIE_HAMMING_THRESHOLD), then adds this selfie to the index.
+    It queries SelfieHashTable once per band (DHASH_BANDS Query calls, each followed through its pages),
+    so no Rekognition call is needed. At most DHASH_MAX_BAND_ITEMS items are read per band: a near-duplicate
+    that only shares a band beyond them (e.g. a flat selfie, after many other flat selfies) is not found.
+
+    A failed screening is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    image_file: The selfie image file with its path
+    appuuid: The application uuid
+    selfie_screen: returned dictionary that contains the dhash, similar_selfies (list of app_uuid),
+                   and truncated_bands (the bands that were not read to the end)
+    dhash: The dHash of the selfie (see compute_dhash()). If it is None, it is computed from image_file
+
+    Returns:
+
+    True if the selfie is screened. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        table_name = get_selfie_hash_table_name()
+        if table_name is None:
+            raise ValueError('No SELFIE_HASH_TABLE')
+        selfie_hash_table = get_resource('dynamodb').Table(table_name)
+
+        if dhash is None:
+            dhash = compute_dhash(image_file)
+        if dhash is None:
+            raise ValueError('Could not compute the dHash of the selfie')
+        selfie_screen['dhash'] = dhash
+
+        # Candidates share at least one band. Then compare the whole hash.
+        bands = get_dhash_bands(dhash)
+        selfie_screen['truncated_bands'] = []
+        similar_selfies = {}
+        for band in bands:
+            query = {'KeyConditionExpression': 'BAND = :band',
+                     'ExpressionAttributeValues': {':band': band},
+                     'ProjectionExpression': 'APP_UUID, DHASH'}
+            read_items = 0
+            while True:
+                query['Limit'] = DHASH_MAX_BAND_ITEMS - read_items
+                response = selfie_hash_table.query(**query)
+                read_items += len(response.get('Items', []))
+                for item in response.get('Items', []):
+                    if item['APP_UUID'] == appuuid:
+                        continue
+                    distance = (int(item['DHASH'], 16) ^ int(dhash, 16)).bit_count()
+                    if distance <= SELFIE_HAMMING_THRESHOLD:
+                        similar_selfies[item['APP_UUID']] = distance
+
+                if 'LastEvaluatedKey' not in response:
+                    break
+                if read_items >= DHASH_MAX_BAND_ITEMS:
+                    # A popular band: the other items are not compared
+                    selfie_screen['truncated_bands'].append(band)
+                    break
+                query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        if selfie_screen['truncated_bands']:
+            print(f'bands with at least {DHASH_MAX_BAND_ITEMS} selfies are not read to the end: {selfie_screen["truncated_bands"]}')
+        selfie_screen['similar_selfies'] = sorted(similar_selfies, key=similar_selfies.get)
+        print(f'similar selfies: {similar_selfies}')
+
+        with selfie_hash_table.batch_writer() as batch:
+            for band in bands:
+                batch.put_item(Item={'BAND': band, 'APP_UUID': appuuid, 'DHASH': dhash})
+
+    except Exception as error:
+        print(f'Exception error: screen_selfie : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: screen_selfie :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: screen_selfie :')
+
+    return ret
+
+def get_inference_max_dimension():
+    """
+    This function gets the maximum width and height of the inference variants from the environment
+    variable INFERENCE_MAX_DIMENSION. If it is not set (or 0), no variant is created, and Rekognition
+    and Textract use the original images.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    The maximum dimension in pixels. Otherwise, 0
+    
+    """    
+    ret = 0
+    try:
+        ret = max(0, int(os.environ.get('INFERENCE_MAX_DIMENSION', '0')))
+    except Exception as error:
+        print(f'Exception error: get_inference_max_dimension : {error}')
+
+    return ret
+
+def create_inference_variant(image_file, variant_file, max_dimension, image = None, variant_info = None):
+    """
+    This function decodes an image once, downscales it so that its width and height are at most
+    max_dimension (the aspect ratio is kept, and a smaller image is not enlarged), then re-encodes it
+    as a compact JPEG. Rekognition and Textract are faster with the smaller payload.
+
+    Parameters:
+
+    image_file: The image file with its path
+    variant_file: The JPEG file to create, with its path
+    max_dimension: The maximum width and height in pixels
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+    variant_info: returned dictionary that contains the downscaled image ('image'), so that it is not decoded again
+
+    Returns:
+
+    True if the variant is created. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        if Image is None:
+            raise ValueError('Pillow is not available')
+
+        if image is None:
+            with Image.open(image_file) as image:
+                # draft() lets the JPEG decoder skip detail that the thumbnail does not need
+                image.draft('RGB', (max_dimension, max_dimension))
+                variant = image.convert('RGB')
+        else:
+            variant = image.convert('RGB')
+        variant.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        variant.save(variant_file, 'JPEG', quality=INFERENCE_JPEG_QUALITY, optimize=True)
+        if variant_info is not None:
+            variant_info['image'] = variant
+
+        print(f'Inference variant {variant_file}: {os.path.getsize(image_file)} bytes -> {os.path.getsize(variant_file)} bytes, {variant.size}')
+
+    except Exception as error:
+        print(f'Exception error: create_inference_variant : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: create_inference_variant :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: create_inference_variant :')
+
+    return ret
+
+def get_quality_thresholds():
+    """
+    This function gets the thresholds of the image-quality gate from the environment variables
+    QUALITY_MIN_SHARPNESS, QUALITY_MIN_BRIGHTNESS and QUALITY_MAX_BRIGHTNESS.
+    A threshold that is not set (or 0) is not checked.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    A dictionary: {'min_sharpness':..., 'min_brightness':..., 'max_brightness':...}
+    
+    """    
+    ret = {'min_sharpness': 0.0, 'min_brightness': 0.0, 'max_brightness': 0.0}
+    for threshold, variable in (('min_sharpness', 'QUALITY_MIN_SHARPNESS'),
+                                ('min_brightness', 'QUALITY_MIN_BRIGHTNESS'),
+                                ('max_brightness', 'QUALITY_MAX_BRIGHTNESS')):
+        try:
+            ret[threshold] = max(0.0, float(os.environ.get(variable, '0')))
+        except Exception as error:
+            print(f'Exception error: get_quality_thresholds : {error}')
+
+    return ret
+
+def assess_image_quality(image_file, thresholds, quality, image = None):
+    """
+    This function decodes a downsampled grayscale copy of an image into a NumPy array, then measures
+    its sharpness (variance of the Laplacian) and its brightness (mean of the luminance histogram).
+    A blurry, dark or overexposed image is rejected before Rekognition and Textract are called.
+
+    Parameters:
+
+    image_file: The image file with its path
+    thresholds: The thresholds (see get_quality_thresholds())
+    quality: returned dictionary that contains 'sharpness' and 'brightness',
+             or 'reason' if the image is below a threshold
+    image: The decoded image (see decode_image()). If it is None, image_file is decoded
+
+    Returns:
+
+    True if the image can be used, or if NumPy and Pillow are not available. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        if numpy is None or Image is None:
+            print(f'NumPy and Pillow are not available: the quality of {image_file} is not checked')
+            ret = True
+            return ret
+
+        if image is None:
+            with Image.open(image_file) as image:
+                # draft() lets the JPEG decoder downscale while it decodes
+                image.draft('L', (QUALITY_SAMPLE_DIMENSION, QUALITY_SAMPLE_DIMENSION))
+                sample = image.convert('L')
+        else:
+            sample = image.convert('L')
+        sample.thumbnail((QUALITY_SAMPLE_DIMENSION, QUALITY_SAMPLE_DIMENSION))
+        pixels = numpy.asarray(sample, dtype=numpy.uint8)
+
+        # 4-neighbour Laplacian: a blurry image has few edges, so a low variance
+        luminance = pixels.astype(numpy.float32)
+        laplacian = 4 * luminance[1:-1, 1:-1] - luminance[:-2, 1:-1] - luminance[2:, 1:-1] \
+                    - luminance[1:-1, :-2] - luminance[1:-1, 2:]
+        quality['sharpness'] = round(float(laplacian.var()), 1)
+
+        histogram = numpy.bincount(pixels.ravel(), minlength=256)
+        quality['brightness'] = round(float(numpy.dot(histogram, numpy.arange(256)) / histogram.sum()), 1)
+
+        # The exposure is checked first: a dark image also has a low Laplacian variance
+        if quality['brightness'] < thresholds['min_brightness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is too dark (brightness {quality["brightness"]}, the minimum is {thresholds["min_brightness"]})'
+        elif thresholds['max_brightness'] > 0 and quality['brightness'] > thresholds['max_brightness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is overexposed (brightness {quality["brightness"]}, the maximum is {thresholds["max_brightness"]})'
+        elif quality['sharpness'] < thresholds['min_sharpness']:
+            quality['reason'] = f'{os.path.basename(image_file)} is too blurry (sharpness {quality["sharpness"]}, the minimum is {thresholds["min_sharpness"]})'
+
+    except Exception as error:
+        print(f'Exception error: assess_image_quality : {error}')
+        quality['reason'] = f'{os.path.basename(image_file)} cannot be decoded'
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: assess_image_quality : {quality}')
+        ret = 'reason' not in quality
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: assess_image_quality :')
+
+    return ret
+
+def get_document_files(file_names, appuuid):
+    """
+    This function finds the ID documents of an application among its files: the driver license
+    (<app_uuid>_license.png), and the other documents whose name starts with one of ID_DOCUMENT_PREFIXES,
+    e.g. <app_uuid>_license_back.png (the back of the license) or <app_uuid>_passport.png.
+
+    Parameters:
+
+    file_names: The names of the files of the application
+    appuuid: The application uuid
+
+    Returns:
+
+    A list of file names, with the driver license first. Inference variants are not included.
+    
+    """    
+    document_prefixes = tuple(appuuid + '_' + prefix for prefix in ID_DOCUMENT_PREFIXES)
+    document_files = [file_name for file_name in file_names
+                      if file_name.startswith(document_prefixes)
+                      and file_name.lower().endswith(BLOB_FILE_EXTENSIONS)
+                      and not file_name.endswith(INFERENCE_VARIANT_SUFFIX)]
+
+    return sorted(document_files, key=lambda file_name: (file_name != appuuid + '_license.png', file_name))
+
+def inspect_image_header(stream, image_info):
+    """
+    This function inspects the header of a PNG or JPEG image, without decoding the image.
+    For PNG, it checks the signature, the IHDR chunk (dimensions, bit depth and color type), and the CRC
+    of every chunk before the image data. For JPEG, it reads the dimensions from the start of frame (SOFn).
+    The stream is read IMAGE_HEADER_READ_BYTES at a time, and at most IMAGE_HEADER_MAX_BYTES are read.
+
+    Parameters:
+
+    stream: A binary file object, e.g. a member of a .zip file opened with ZipFile.open()
+    image_info: returned dictionary that contains 'format', 'width', 'height' and 'bit_depth',
+                or 'reason' if the image cannot be used
+
+    Returns:
+
+    True if the header is valid. Otherwise, False
+
+    """
+    ret = False
+
+    try:
+        data = stream.read(IMAGE_HEADER_READ_BYTES)
+
+        def is_available(end):
+            # Read more of the stream only when the next header goes past what was read
+            nonlocal data
+            while len(data) < end and len(data) < IMAGE_HEADER_MAX_BYTES:
+                more = stream.read(IMAGE_HEADER_READ_BYTES)
+                if not more:
+                    break
+                data += more
+            return len(data) >= end
+
+        if data[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+            image_info['format'] = 'PNG'
+
+            # Walk the chunks (length, type, data, CRC) until the image data (IDAT)
+            offset = len(PNG_SIGNATURE)
+            chunk_type = b''
+            while chunk_type != b'IDAT':
+                if not is_available(offset + 8):
+                    raise ValueError('PNG is truncated')
+                chunk_length, chunk_type = struct.unpack('>I4s', data[offset:offset + 8])
+                if offset == len(PNG_SIGNATURE) and (chunk_type != b'IHDR' or chunk_length != 13):
+                    raise ValueError('PNG does not start with an IHDR chunk')
+                if chunk_type == b'IEND':
+                    raise ValueError('PNG has no image data')
+                if chunk_type == b'IDAT':
+                    break
+                # A chunk that goes past IMAGE_HEADER_MAX_BYTES (e.g. a large text chunk) is not checked
+                chunk_end = offset + 8 + chunk_length + 4
+                if not is_available(chunk_end):
+                    if len(data) < IMAGE_HEADER_MAX_BYTES:
+                        raise ValueError('PNG is truncated')
+                    break
+                chunk_data = data[offset + 8:chunk_end - 4]
+                if zlib.crc32(chunk_type + chunk_data) != struct.unpack('>I', data[chunk_end - 4:chunk_end])[0]:
+                    raise ValueError(f'PNG {chunk_type.decode("latin-1")} chunk has a bad CRC')
+                if chunk_type == b'IHDR':
+                    width, height, bit_depth, color_type = struct.unpack('>IIBB', chunk_data[:10])
+                    if bit_depth not in PNG_BIT_DEPTHS.get(color_type, ()):
+                        raise ValueError(f'PNG has an invalid bit depth {bit_depth} for color type {color_type}')
+                offset = chunk_end
+
+        elif data[:2] == b'\xff\xd8':
+            image_info['format'] = 'JPEG'
+
+            # Walk the marker segments (APPn, DQT, DHT...) until the start of frame (SOFn)
+            offset = 2
+            while True:
+                if not is_available(offset + 4):
+                    raise ValueError('JPEG has no start of frame in its headers')
+                if data[offset] != 0xFF:
+                    raise ValueError('JPEG has an invalid marker')
+                marker = data[offset + 1]
+                if marker == 0xFF:
+                    # Fill byte
+                    offset += 1
+                    continue
+                if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+                    # Markers without a segment
+                    offset += 2
+                    continue
+                if marker in (0xD9, 0xDA):
+                    raise ValueError('JPEG has no start of frame before its image data')
+                segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+                if segment_length < 2:
+                    raise ValueError('JPEG has an invalid segment length')
+                if marker in JPEG_SOF_MARKERS:
+                    if not is_available(offset + 9):
+                        raise ValueError('JPEG is truncated')
+                    bit_depth, height, width = struct.unpack('>BHH', data[offset + 4:offset + 9])
+                    if bit_depth != 8:
+                        raise ValueError(f'JPEG has an unsupported precision of {bit_depth} bits')
+                    break
+                offset += 2 + segment_length
+
+        else:
+            raise ValueError('The image is not a PNG or JPEG file')
+
+        if min(width, height) < IMAGE_MIN_DIMENSION:
+            raise ValueError(f'The image is too small ({width}x{height}), the minimum is {IMAGE_MIN_DIMENSION} pixels')
+
+        image_info['width'] = width
+        image_info['height'] = height
+        image_info['bit_depth'] = bit_depth
+
+    except Exception as error:
+        print(f'Exception error: inspect_image_header : {error}')
+        image_info['reason'] = str(error)
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: inspect_image_header : {image_info}')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: inspect_image_header :')
+
+    return ret
+
+def inspect_application_images(zipfile_filename, appuuid, inspection):
+    """
+    This function inspects the selfie and the ID documents of an application straight from the .zip file,
+    before anything is unzipped or uploaded (see inspect_image_header()). Only the headers are read.
+    Without inference variants (see get_inference_max_dimension()), the original images are sent
+    to Rekognition and Textract, so their size and dimensions are also checked against the limits of these services.
+
+    Parameters:
+
+    zipfile_filename: The filename of the Zipped File
+    appuuid: The application uuid
+    inspection: returned dictionary that contains 'images' (image_info of each image),
+                or 'reason' if the application cannot be used
+
+    Returns:
+
+    True if the images can be used. Otherwise, False
+
+    """
+    ret = False
+
+    try:
+        original_images_for_inference = get_inference_max_dimension() == 0
+
+        with zipfile.ZipFile(zipfile_filename, mode='r') as zipped_file_object:
+            # The selfie and the driver license are required. The other ID documents are optional.
+            member_names = [appuuid + image_suffix for image_suffix in APPLICATION_IMAGES]
+            member_names += [member_name for member_name in get_document_files(zipped_file_object.namelist(), appuuid)
+                             if member_name not in member_names]
+            if len(member_names) - 1 > MAX_ID_DOCUMENTS:
+                raise ValueError(f'The application has more than {MAX_ID_DOCUMENTS} ID documents')
+
+            for member_name in member_names:
+                try:
+                    member = zipped_file_object.getinfo(member_name)
+                except KeyError:
+                    raise ValueError(f'{member_name} is missing')
+
+                image_info = {'format': '', 'width': 0, 'height': 0, 'bit_depth': 0}
+                with zipped_file_object.open(member) as stream:
+                    if inspect_image_header(stream, image_info) == False:
+                        raise ValueError(f'{member_name}: {image_info["reason"]}')
+
+                if original_images_for_inference:
+                    if member.file_size > IMAGE_MAX_BYTES:
+                        raise ValueError(f'{member_name}: the image is larger than {IMAGE_MAX_BYTES} bytes')
+                    if max(image_info['width'], image_info['height']) > IMAGE_MAX_DIMENSION:
+                        raise ValueError(f'{member_name}: the image is larger than {IMAGE_MAX_DIMENSION} pixels')
+
+                inspection['images'][member_name] = image_info
+
+    except Exception as error:
+        print(f'Exception error: inspect_application_images : {error}')
+        inspection['reason'] = str(error)
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: inspect_application_images :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: inspect_application_images :')
+
+    return ret
+
+def get_archive_image_format():
+    """
+    This function gets the format of the archived images from the environment variable ARCHIVE_IMAGE_FORMAT.
+    If it is not set, or not a known format, 'original' is used (the images are not transcoded).
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    ARCHIVE_IMAGE_FORMAT_ORIGINAL or ARCHIVE_IMAGE_FORMAT_WEBP
+    
+    """    
+    image_format = os.environ.get('ARCHIVE_IMAGE_FORMAT', ARCHIVE_IMAGE_FORMAT_ORIGINAL)
+    if image_format not in (ARCHIVE_IMAGE_FORMAT_ORIGINAL, ARCHIVE_IMAGE_FORMAT_WEBP):
+        print(f'Unknown ARCHIVE_IMAGE_FORMAT {image_format}, using {ARCHIVE_IMAGE_FORMAT_ORIGINAL}')
+        image_format = ARCHIVE_IMAGE_FORMAT_ORIGINAL
+
+    return image_format
+
+def transcode_image_to_webp(image_bytes):
+    """
+    This function transcodes an image to lossless WebP, then decodes the WebP image again and
+    compares both images pixel by pixel (round-trip check). The color values of transparent pixels
+    are kept (exact), so the round trip is exact.
+    Pillow decodes a PNG image with 16-bit samples to 8-bit samples, so the round-trip check cannot see
+    what is lost. Only a PNG image whose IHDR chunk has ARCHIVE_PNG_BIT_DEPTH is transcoded (see inspect_image_header()).
+
+    Parameters:
+
+    image_bytes: The original image (e.g. PNG)
+
+    Returns:
+
+    The WebP image if the round trip is exact. Otherwise, None
+    
+    """    
+    ret = None
+
+    try:
+        if numpy is None or Image is None:
+            raise ValueError('NumPy and Pillow are not available')
+
+        if image_bytes[:len(PNG_SIGNATURE)] == PNG_SIGNATURE:
+            image_info = {}
+            if inspect_image_header(io.BytesIO(image_bytes), image_info) == False:
+                raise ValueError(f'The PNG header cannot be read: {image_info["reason"]}')
+            if image_info['bit_depth'] != ARCHIVE_PNG_BIT_DEPTH:
+                raise ValueError(f'PNG with {image_info["bit_depth"]}-bit samples cannot be stored losslessly as WebP')
+
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if image.mode not in ARCHIVE_LOSSLESS_MODES:
+                raise ValueError(f'Image mode {image.mode} cannot be stored losslessly as WebP')
+            image.load()
+            # WebP stores RGB or RGBA. Expanding a grayscale or palette image to RGB(A) is lossless.
+            original = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+            icc_profile = image.info.get('icc_profile')
+
+        webp_file = io.BytesIO()
+        original.save(webp_file, 'WEBP', lossless=True, quality=100, method=ARCHIVE_WEBP_METHOD, exact=True, icc_profile=icc_profile)
+        webp_bytes = webp_file.getvalue()
+
+        # An opaque RGBA image is decoded as RGB, so both images are compared in the same mode
+        with Image.open(io.BytesIO(webp_bytes)) as decoded:
+            decoded = decoded.convert(original.mode)
+        if not numpy.array_equal(numpy.asarray(decoded), numpy.asarray(original)):
+            raise ValueError('The WebP image is not identical to the original image')
+
+    except Exception as error:
+        print(f'Exception error: transcode_image_to_webp : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: transcode_image_to_webp : {len(image_bytes)} bytes -> {len(webp_bytes)} bytes')
+        ret = webp_bytes
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: transcode_image_to_webp :')
+
+    return ret
+
+def archive_application_images(s3, bucket_name, image_keys, archive_info):
+    """
+    This function replaces the original images of an application in S3 by lossless WebP images
+    (see transcode_image_to_webp()). The WebP image is stored next to the original image
+    (e.g. unzipped/8d247914_license.webp), then the original image is deleted.
+    Content-addressed images (under BLOB_PREFIX) may be shared by several applications, so they are not archived.
+    An image that would not be smaller, or that fails the round-trip check, is kept as it is.
+
+    Parameters:
+
+    s3: S3 client
+    bucket_name: S3 bucket name
+    image_keys: The keys of the original images
+    archive_info: returned dictionary that contains 'images' (original key: WebP key), and 'bytes_saved'
+
+    Returns:
+
+    True if operations are successful. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        for image_key in image_keys:
+            if image_key.startswith(BLOB_PREFIX) or not image_key.lower().endswith(ARCHIVE_SOURCE_EXTENSION):
+                print(f'Skipping {image_key}: it is not archived')
+                continue
+
+            try:
+                response = s3.get_object(Bucket=bucket_name, Key=image_key)
+            except botocore.exceptions.ClientError as error:
+                # A parked application that is resumed may already have archived this image
+                if error.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                    raise
+                print(f'Skipping {image_key}: it does not exist')
+                continue
+            image_bytes = response['Body'].read()
+
+            webp_bytes = transcode_image_to_webp(image_bytes)
+            if webp_bytes is None or len(webp_bytes) >= len(image_bytes):
+                print(f'Keeping {image_key}: the WebP image is not usable or not smaller')
+                continue
+
+            webp_key = image_key[:-len(ARCHIVE_SOURCE_EXTENSION)] + ARCHIVE_WEBP_EXTENSION
+            s3.put_object(
+                Body=webp_bytes,
+                Bucket=bucket_name,
+                Key=webp_key,
+                ContentType='image/webp',
+                Metadata={'original-key': image_key,
+                          'original-bytes': str(len(image_bytes)),
+                          'original-sha256': hashlib.sha256(image_bytes).hexdigest()})
+            s3.delete_object(Bucket=bucket_name, Key=image_key)
+
+            archive_info['images'][image_key] = webp_key
+            archive_info['bytes_saved'] += len(image_bytes) - len(webp_bytes)
+            print(f'Archived {image_key} as {webp_key}: {len(image_bytes)} bytes -> {len(webp_bytes)} bytes')
+
+    except Exception as error:
+        print(f'Exception error: archive_application_images : {error}')
+        archive_info['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: archive_application_images : {archive_info}')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: archive_application_images :')
+
+    return ret
+
 def upload_file_to_s3(
         s3,
         file_to_upload, 
@@ -133,9 +1535,9 @@ def upload_file_to_s3(
         # Per Lab3 instructions, the 'key' should include the 'prefix' (see Task 4). Thus, I am passing 'prefix + file_key_name'
         file_name_with_path = path_of_file + file_to_upload
         response = s3.upload_file(
-            file_name_with_path,
-            bucket_name,
-            prefix + file_key_name)
+            Filename=file_name_with_path,
+            Bucket=bucket_name,
+            Key=prefix + file_key_name)
 
         # response was None
         print(f'Response after uploading file to S3: {response}')
@@ -218,6 +1620,170 @@ def get_dynamo_db_table_name():
         print(f'finally block: do nothing for now')
         return ret
     
+def serialize_ddb_attribute(name, value):
+    """
+    This function converts the value of an attribute of the DynamoDB table to the low-level DynamoDB format,
+    e.g. 'NICK' to {'S': 'NICK'}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    name: Name of the attribute, e.g. 'FIRST_NAME'
+    value: Value of the attribute
+
+    Returns:
+
+    The value in the low-level DynamoDB format
+    
+    """
+    serializer = DDB_ITEM_SERIALIZERS.get(name)
+    if serializer is not None and type(value) is serializer[0]:
+        return serializer[1](value)
+    return ddb_type_serializer.serialize(value)
+
+def serialize_ddb_item(item):
+    """
+    This function converts an item of the DynamoDB table to the low-level DynamoDB format,
+    e.g. {'APP_UUID': '8d247914'} to {'APP_UUID': {'S': '8d247914'}}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    item: A dictionary of attribute names and values
+
+    Returns:
+
+    The item in the low-level DynamoDB format
+    
+    """
+    return {name: serialize_ddb_attribute(name, value) for name, value in item.items()}
+
+def get_ddb_table_name(ddb_table):
+    """
+    This function returns the name of a DynamoDB table.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+
+    Returns:
+
+    The table name
+    
+    """
+    return ddb_table if isinstance(ddb_table, str) else ddb_table.name
+
+def put_ddb_item(ddb_table, item, serialized = False):
+    """
+    This function writes an item to the DynamoDB table with the low-level DynamoDB client.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    item: A dictionary of attribute names and values, with APP_UUID
+    serialized: True if the item is already in the low-level DynamoDB format, e.g. CustomerDetails.to_ddb_item()
+
+    Returns:
+
+    The put_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').put_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Item = item if serialized else serialize_ddb_item(item))
+
+def set_ddb_attribute(ddb_table, appuuid, attribute_name, value):
+    """
+    This function sets one attribute of an item of the DynamoDB table with the low-level DynamoDB client.
+    update_item() creates the attribute if it does not exist.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the attribute, e.g. 'LICENSE_SELFIE_MATCH'
+    value: Value of the attribute
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return set_ddb_attributes(ddb_table, appuuid, {attribute_name: value})
+
+def set_ddb_attributes(ddb_table, appuuid, attributes):
+    """
+    This function sets several attributes of an item of the DynamoDB table with one update_item() call.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attributes: A dictionary of attribute names and values
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    names = list(attributes)
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = 'SET ' + ', '.join(f'{name}=:value{index}' for index, name in enumerate(names)),
+        ExpressionAttributeValues = {f':value{index}': serialize_ddb_attribute(name, attributes[name])
+                                     for index, name in enumerate(names)})
+
+def claim_ddb_attribute(ddb_table, appuuid, attribute_name):
+    """
+    This function sets a flag attribute (True) of an item of the DynamoDB table with a conditional update_item(),
+    only if the attribute is not set yet. An operation that must run once per application (e.g. sending the
+    license to the license queue) claims its flag first, so it is not repeated when the application is processed again.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the flag attribute, e.g. 'LICENSE_QUEUED'
+
+    Returns:
+
+    True if the flag is set by this call. False if it was already set. Other exceptions are raised to the caller.
+    
+    """
+    try:
+        get_client('dynamodb').update_item(
+            TableName = get_ddb_table_name(ddb_table),
+            Key = {'APP_UUID': {'S': appuuid}},
+            UpdateExpression = f'SET {attribute_name}=:flag',
+            ConditionExpression = f'attribute_not_exists({attribute_name})',
+            ExpressionAttributeValues = {':flag': {'BOOL': True}})
+    except botocore.exceptions.ClientError as error:
+        if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+    return True
+
+def release_ddb_attribute(ddb_table, appuuid, attribute_name):
+    """
+    This function removes a flag attribute that was set by claim_ddb_attribute(), e.g. when the operation failed,
+    so that it runs again when the application is processed again.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the flag attribute, e.g. 'LICENSE_QUEUED'
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = f'REMOVE {attribute_name}')
+
 def parse_csv_ddb(csv_filename):
     """
     This function parses .csv file and returns its contents as a dictionary.
@@ -248,6 +1814,212 @@ def parse_csv_ddb(csv_filename):
 
         return details_reader
     
+def get_details_matching():
+    """
+    This function gets how the customer's details are compared with the fields extracted from the ID documents,
+    from the environment variable DETAILS_MATCHING. If it is not set, the details must be equal.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    DETAILS_MATCHING_EXACT or DETAILS_MATCHING_NORMALIZED
+    
+    """
+    matching = os.environ.get('DETAILS_MATCHING', DETAILS_MATCHING_EXACT)
+    if matching not in (DETAILS_MATCHING_EXACT, DETAILS_MATCHING_NORMALIZED):
+        print(f'Unknown DETAILS_MATCHING {matching}, using {DETAILS_MATCHING_EXACT}')
+        matching = DETAILS_MATCHING_EXACT
+    return matching
+
+def normalize_customer_value(value):
+    """
+    This function returns the normalized form of a customer's detail, which is used to compare it:
+    upper case, without leading, trailing or repeated spaces.
+
+    Parameters:
+
+    value: A customer's detail, e.g. ' 123  Main Street'. None is a missing detail.
+
+    Returns:
+
+    The normalized detail, e.g. '123 MAIN STREET'. An empty string for a missing detail.
+    
+    """
+    if value is None:
+        return ''
+    return ' '.join(value.split()).upper()
+
+class CustomerDetails:
+    """
+    This class holds the customer's details of an application (the .csv file). They are validated once,
+    when the .csv file is parsed (see parse_customer_details()). The CUSTOMER_INFORMATION fields are kept
+    in their fixed order, with their normalized form (see normalize_customer_value()), which is compared
+    with the information extracted from the ID documents when DETAILS_MATCHING is normalized
+    (see is_matching_customer_info()). The other columns of the .csv file are kept in extra: they are stored
+    with the details, but not compared.
+    Like the dictionary of the .csv file, a detail can be read with get(), e.g. customer.get('DOCUMENT_NUMBER', '0').
+    
+    """
+    __slots__ = ('values', 'normalized', 'extra')
+
+    def __init__(self, values, extra = None):
+        """
+        Parameters:
+
+        values: The CUSTOMER_INFORMATION values, in their order. A missing value is None.
+        extra: Optional dictionary of the other columns of the .csv file
+        
+        """
+        self.values = tuple(values)
+        self.normalized = tuple(normalize_customer_value(value) for value in self.values)
+        self.extra = dict(extra or {})
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        This function creates the customer's details from a dictionary, e.g. the details_dic of a checkpoint.
+        The CUSTOMER_INFORMATION fields that are not in the dictionary are missing, and the other keys are extra.
+
+        Parameters:
+
+        payload: A dictionary of the customer's details
+
+        Returns:
+
+        A CustomerDetails
+        
+        """
+        return cls((payload.get(name) for name in CUSTOMER_INFORMATION),
+                   {name: value for name, value in payload.items() if name not in CUSTOMER_INFORMATION_INDEX})
+
+    def get(self, name, default = None):
+        """
+        This function returns a customer's detail, like dict.get().
+
+        Parameters:
+
+        name: Name of the detail, e.g. 'DOCUMENT_NUMBER'
+        default: Returned value if the detail is missing
+
+        Returns:
+
+        The customer's detail. Otherwise, default
+        
+        """
+        index = CUSTOMER_INFORMATION_INDEX.get(name)
+        if index is None or self.values[index] is None:
+            return default
+        return self.values[index]
+
+    def matches(self, extracted_info, normalized = False):
+        """
+        This function compares the customer's CUSTOMER_INFORMATION details with the information extracted from
+        the ID documents. The extra details are not compared.
+
+        Parameters:
+
+        extracted_info: A CustomerDetails (see extract_customer_details()), or a dictionary of the extracted
+                        CUSTOMER_INFORMATION fields (see get_customer_extracted_info())
+        normalized: True to compare the normalized forms (see normalize_customer_value()). Otherwise, the details must be equal
+
+        Returns:
+
+        True if all the fields match. Otherwise, False
+        
+        """
+        if isinstance(extracted_info, CustomerDetails):
+            if normalized:
+                return self.normalized == extracted_info.normalized
+            return self.values == extracted_info.values
+        if normalized:
+            return self.normalized == tuple(normalize_customer_value(extracted_info.get(name)) for name in CUSTOMER_INFORMATION)
+        return self.values == tuple(extracted_info.get(name) for name in CUSTOMER_INFORMATION)
+
+    def to_payload(self):
+        """
+        This function returns the customer's details as a dictionary, e.g. for a checkpoint or a state machine payload.
+
+        Parameters:
+
+        None
+
+        Returns:
+
+        A dictionary of the CUSTOMER_INFORMATION fields that are not missing, then the extra details
+        
+        """
+        payload = {name: value for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None}
+        payload.update((name, value) for name, value in self.extra.items() if name not in payload)
+        return payload
+
+    def to_ddb_item(self, appuuid, extra_attributes = None):
+        """
+        This function returns the DynamoDB item of the application, in the low-level DynamoDB format.
+        The customer's details, including the extra details, are strings, so they are converted without serialize_ddb_item().
+
+        Parameters:
+
+        appuuid: Customer's ID, which is the partition key of the item
+        extra_attributes: Optional dictionary of attributes that are stored with the customer's details
+
+        Returns:
+
+        The item in the low-level DynamoDB format (see put_ddb_item())
+        
+        """
+        item = {name: {'S': value} for name, value in self.extra.items()}
+        item.update((name, {'S': value}) for name, value in zip(CUSTOMER_INFORMATION, self.values) if value is not None)
+        if extra_attributes:
+            item.update(serialize_ddb_item(extra_attributes))
+        item['APP_UUID'] = {'S': appuuid}
+        return item
+
+    def __repr__(self):
+        return f'CustomerDetails({self.to_payload()})'
+
+def parse_customer_details(csv_filename):
+    """
+    This function parses the .csv file of an application, and validates it:
+    it must have all the CUSTOMER_INFORMATION columns. The other columns are kept as extra details (see CustomerDetails).
+
+    Parameters:
+
+    csv_filename: The .csv filename to parse.
+
+    Returns:
+
+    A CustomerDetails. Otherwise, None.
+    
+    """
+    ret = None
+    try:
+        details_dic = parse_csv_ddb(csv_filename)
+        if not details_dic:
+            raise ValueError('Could not parse csv file')
+
+        missing = [name for name in CUSTOMER_INFORMATION if details_dic.get(name) is None]
+        if missing:
+            raise ValueError(f'Missing {", ".join(missing)} in the .csv file')
+
+        # A row with more values than columns has them in a list under None, which is not a detail
+        extra = {name: value for name, value in details_dic.items()
+                 if isinstance(name, str) and isinstance(value, str) and name not in CUSTOMER_INFORMATION_INDEX}
+        ret = CustomerDetails((details_dic[name] for name in CUSTOMER_INFORMATION), extra)
+
+    except Exception as error:
+        print(f'Exception error: parse_customer_details : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: parse_customer_details :')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: parse_customer_details :')
+
+    return ret
+    
 def get_matching_faces(
         bucket_name,
         source_image,
@@ -275,7 +2047,9 @@ def get_matching_faces(
     ret = None
     try:
         # Using the global rekognition client
-        response = rekognition.compare_faces(
+        response = call_with_adaptive_limit(
+            'rekognition.compare_faces',
+            get_client('rekognition').compare_faces,
             SourceImage={
                 'S3Object': {
                     'Bucket': bucket_name,
@@ -306,6 +2080,62 @@ def get_matching_faces(
 
         return ret
 
+def get_matching_faces_for_documents(
+        bucket_name,
+        source_image,
+        target_images,
+        similarity_threshold,
+        valerror):
+    """
+    This function compares a source image with several target images (e.g. the ID documents of an
+    application) using get_matching_faces(). The comparisons run concurrently, so several documents
+    take about as long as one.
+
+    Parameters:
+
+    bucket_name: Name of s3 bucket where the images are stored.
+    source_image: Name of the source image filename in S3 bucket.
+    target_images: List of the target image filenames in S3 bucket.
+    similarity_threshold: The SimilarityThreshold used by compare_faces() function.
+    valerror: returned exception error. If several comparisons fail, an error that is not throttling is returned first.
+
+    Returns:
+    
+    A list of compare_faces() responses, in the order of target_images. Otherwise, None
+
+    """    
+    
+    ret = None
+    try:
+        errors = [{'error':''} for target_image in target_images]
+        if len(target_images) == 1:
+            responses = [get_matching_faces(bucket_name, source_image, target_images[0], similarity_threshold, errors[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(target_images)) as executor:
+                futures = [executor.submit(get_matching_faces, bucket_name, source_image, target_image, similarity_threshold, error)
+                           for target_image, error in zip(target_images, errors)]
+                responses = [future.result() for future in futures]
+
+        failures = [error['error'] for response, error in zip(responses, errors) if response is None]
+        if failures:
+            # A throttled comparison can be retried, but another failed comparison would fail again
+            raise next((failure for failure in failures if not is_throttling_error(failure)), failures[0])
+
+    except Exception as error:
+        print(f'Exception error: get_matching_faces_for_documents : {error}')
+        valerror['error'] = error
+
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: get_matching_faces_for_documents :')
+        ret = responses
+
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: get_matching_faces_for_documents :')
+
+    return ret
+
 def is_matching_faces(response):
     """
     This function checks if the response from the AWS Rekognition's compare_faces() function contains matched faces.
@@ -333,14 +2163,17 @@ def is_matching_faces(response):
 
 def analyze_document_id(
         bucket_name,
-        document_id):
+        document_id,
+        valerror = None):
     """
     This function analyzes a document using AWS Textract service and returns extracted fields from the document.
 
     Parameters:
 
     bucket_name: Name of s3 bucket where the document filename is stored.
-    document_id: Name of the document image filename in S3 bucket.
+    document_id: Name of the document image filename in S3 bucket, or a list of at most
+                 TEXTRACT_MAX_DOCUMENT_PAGES filenames (e.g. the front and the back of a license).
+    valerror: returned exception error (optional)
 
     Returns:
     
@@ -349,31 +2182,166 @@ def analyze_document_id(
     """    
     ret = None
     try:
-        response = textract.analyze_id(
-            DocumentPages=[
-                {
-                    'S3Object': {
-                        'Bucket': bucket_name,
-                        'Name': document_id
-                    }
-                }
-            ]
-        )
+        document_ids = document_id if isinstance(document_id, list) else [document_id]
+        response = call_with_adaptive_limit(
+            'textract.analyze_id',
+            get_client('textract').analyze_id,
+            DocumentPages=[
+                {
+                    'S3Object': {
+                        'Bucket': bucket_name,
+                        'Name': name
+                    }
+                }
+                for name in document_ids
+            ]
+        )
+    except Exception as error:
+        print(f'Exception error: {error}')
+        if valerror is not None:
+            valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: do nothing for now')
+        ret = response
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: do nothing for now')
+        return ret
+
+def analyze_document_ids(
+        bucket_name,
+        document_ids,
+        valerror = None):
+    """
+    This function analyzes several ID documents using AWS Textract service (see analyze_document_id()).
+    Textract analyzes at most TEXTRACT_MAX_DOCUMENT_PAGES pages per call, so the documents are analyzed
+    in groups, and the groups are analyzed concurrently.
+
+    Parameters:
+
+    bucket_name: Name of s3 bucket where the documents are stored.
+    document_ids: List of the document image filenames in S3 bucket.
+    valerror: returned exception error (optional)
+
+    Returns:
+    
+    response: A dictionary like the analyze_id() response, with the IdentityDocuments of all the documents
+              (in the order of document_ids). Otherwise, None
+
+    """    
+    ret = None
+    try:
+        groups = [document_ids[index:index + TEXTRACT_MAX_DOCUMENT_PAGES]
+                  for index in range(0, len(document_ids), TEXTRACT_MAX_DOCUMENT_PAGES)]
+        errors = [{'error':''} for group in groups]
+        if len(groups) == 1:
+            responses = [analyze_document_id(bucket_name, groups[0], errors[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                futures = [executor.submit(analyze_document_id, bucket_name, group, error)
+                           for group, error in zip(groups, errors)]
+                responses = [future.result() for future in futures]
+
+        failures = [error['error'] or ValueError('Could not analyze customer\'s ID')
+                    for response, error in zip(responses, errors) if response is None]
+        if failures:
+            raise next((failure for failure in failures if not is_throttling_error(failure)), failures[0])
+
+        response = responses[0]
+        if len(responses) > 1:
+            # Merge the groups, and number the documents again
+            response = {'DocumentMetadata': {'Pages': 0},
+                        'IdentityDocuments': [],
+                        'ResponseMetadata': responses[0]['ResponseMetadata']}
+            for group_response in responses:
+                response['DocumentMetadata']['Pages'] += group_response.get('DocumentMetadata', {}).get('Pages', 0)
+                for document_dict in group_response['IdentityDocuments']:
+                    response['IdentityDocuments'].append({**document_dict, 'DocumentIndex': len(response['IdentityDocuments']) + 1})
+
+    except Exception as error:
+        print(f'Exception error: analyze_document_ids : {error}')
+        if valerror is not None:
+            valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: analyze_document_ids :')
+        ret = response
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: analyze_document_ids :')
+
+    return ret
+
+def extract_customer_fields(response):
+    """
+    This function extracts the CUSTOMER_INFORMATION fields of the documents analyzed by analyze_id(),
+    with the compiled extraction spec (see TEXTRACT_FIELD_SLOTS): each field type is looked up once in
+    a dictionary, instead of being searched in CUSTOMER_INFORMATION. With several documents (e.g. a license
+    and a passport), a field that is empty in a document is taken from the next document.
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+
+    Returns:
+
+    A tuple of two lists in the CUSTOMER_INFORMATION order: the values and their confidence (0 to 100).
+    A field that was not found is None. Exceptions are raised to the caller.
+    
+    """
+    values = [None] * len(CUSTOMER_INFORMATION)
+    confidences = [None] * len(CUSTOMER_INFORMATION)
+    for document_dict in response['IdentityDocuments']:
+        for field in document_dict['IdentityDocumentFields']:
+            slot = TEXTRACT_FIELD_SLOTS.get(field['Type']['Text'])
+            if slot is not None and not values[slot]:
+                value_detection = field['ValueDetection']
+                values[slot] = value_detection['Text']
+                confidences[slot] = value_detection.get('Confidence')
+    return values, confidences
+
+def extract_customer_details(response, extraction):
+    """
+    This function returns the customer's details extracted by analyze_id() as a CustomerDetails,
+    which can be compared with the customer's submitted details (see is_matching_customer_info()).
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+    extraction: Returned dictionary. 'confidence' is the confidence of each extracted field, e.g. {'FIRST_NAME': 99.2}
+
+    Returns:
+
+    A CustomerDetails. Otherwise, None
+    
+    """
+    ret = None
+    try:
+        # IdentityDocuments: An array (in the dictionary) of documents that were analyzed by analyze_id()
+        if len(response['IdentityDocuments']) == 0:
+            raise ValueError('No document was processed by analyze_id()')
+
+        values, confidences = extract_customer_fields(response)
+        extraction['confidence'] = {name: confidence for name, confidence in zip(CUSTOMER_INFORMATION, confidences)
+                                    if confidence is not None}
+        ret = CustomerDetails(values)
+
     except Exception as error:
-        print(f'Exception error: {error}')
+        print(f'Exception error: extract_customer_details : {error}')
     else:
         # If no errors are detected, continue to execute the following:
-        print(f'else block: do nothing for now')
-        ret = response
+        print(f'else block: extract_customer_details :')
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
-        return ret
+        print(f'finally block: extract_customer_details :')
+
+    return ret
 
 def get_customer_extracted_info(response):
     """
     This function returns the extracted information from the analyze_id() AWS Texract function
-    as a dictionary.
+    as a dictionary. See extract_customer_fields().
 
     Parameters:
 
@@ -392,13 +2360,8 @@ def get_customer_extracted_info(response):
             # The array is empty. Hence, no document was processed by analyze_id()
             return None 
         
-        # There is at least one document being analyzed.
-        document_dict = response['IdentityDocuments'][0]
-        document_fields = document_dict['IdentityDocumentFields'] # This is a list of dictionaries
-
-        for field in document_fields:
-            if field['Type']['Text'] in CUSTOMER_INFORMATION:
-                extracted_info[field['Type']['Text']] = field['ValueDetection']['Text']
+        values, confidences = extract_customer_fields(response)
+        extracted_info = {name: value for name, value in zip(CUSTOMER_INFORMATION, values) if value is not None}
 
     except Exception as error:
         print(f'Exception error: {error}')
@@ -413,15 +2376,18 @@ def get_customer_extracted_info(response):
 
 def is_matching_customer_info(
         extracted_info,
-        customer_info):
+        customer_info,
+        matching = None):
     """
     This function compares the extracted customer information from the document that was analyzed by
     the analyze_id() with the corresponding customer information submitted by the customer.
+    By default, each field must be equal. With DETAILS_MATCHING_NORMALIZED, case and repeated spaces are ignored.
 
     Parameters:
 
     extracted_info: Extracted customer information from the document that was analyzed.
-    customer_info: Customer information submitted by the customer
+    customer_info: Customer information submitted by the customer (a CustomerDetails or a dictionary)
+    matching: DETAILS_MATCHING_EXACT or DETAILS_MATCHING_NORMALIZED. If it is None, see get_details_matching()
 
     Returns:
     
@@ -432,8 +2398,11 @@ def is_matching_customer_info(
     ret = False
     
     try:
-        if extracted_info == customer_info:
-            ret = True
+        if isinstance(customer_info, dict):
+            customer_info = CustomerDetails.from_payload(customer_info)
+        if matching is None:
+            matching = get_details_matching()
+        ret = customer_info.matches(extracted_info, matching == DETAILS_MATCHING_NORMALIZED)
     except Exception as error:
         print(f'Exception error: {error}')
     else:
@@ -493,7 +2462,7 @@ def send_sns_email(message, subject):
         if topic_name is None:
             raise ValueError('Could not get SNS Topic!')
                 
-        response_sns = sns.publish(
+        response_sns = get_client('sns').publish(
             TopicArn = topic_name,
             Message = message,
             Subject = subject)
@@ -531,7 +2500,7 @@ def send_sqs_message(message):
     try:
         sqs_name = os.environ['QUEUE_URL']
 
-        response = sqs.send_message(
+        response = get_client('sqs').send_message(
             QueueUrl=sqs_name,
             MessageBody=json.dumps(message)
         )
@@ -552,9 +2521,17 @@ def prepare_customer_info(bucket,
                           lambda_unzipped_folder,
                           bucket_unzipped_prefix,
                           customer_info,
-                          valerror):
+                          valerror,
+                          reverify = False):
     """
-    This function gets .zip file from S3 bucket, unzip the file, then stores the unzipped objects in S3
+    This function gets .zip file from S3 bucket, unzip the file, then stores the unzipped objects in S3.
+    If the application was already completed with the same .zip file, nothing is unzipped, and
+    customer_info['completed'] is its outcome (see get_completed_outcome()).
+    If the same .zip file was already verified, nothing is unzipped, customer_info['duplicate_of']
+    is the app_uuid of that application, and customer_info['details_dic'] its customer's details
+    (see reuse_completed_application()). With reverify, both checks are skipped, so the application is verified again.
+    If the selfie or the license cannot be used, nothing is uploaded, and customer_info['rejected_reason']
+    is the reason (see inspect_application_images() and assess_image_quality()).
 
     Parameters:
 
@@ -565,6 +2542,7 @@ def prepare_customer_info(bucket,
     bucket_unzipped_prefix: S3 folder where unzipped files will be stored
     customer_info: returned dictionary that contains customer info
     valerror: returned exception error
+    reverify: True to verify the application again, even if it was completed (e.g. in a backfill)
 
     Returns:
     
@@ -581,12 +2559,41 @@ def prepare_customer_info(bucket,
         zip_name_with_path = lambda_tmp_folder + zip_name
         print(f'Name of zip file with full path is {zip_name} and {zip_name_with_path}')
             
-        # Download the .zip file from zipped/ prefix in S3 Bucket.
+        # Download the .zip file from zipped/ prefix in S3 Bucket, and hash it while it is downloaded.
         # Store the downloaded file in the lambda folder 'tmp/'
-        s3.download_file(
-            bucket,
-            key,
-            zip_name_with_path)
+        archive_info = {'sha256': ''}
+        if download_archive(get_client('s3'), bucket, key, zip_name_with_path, archive_info) == False:
+            raise ValueError('Error in downloading the .zip file from S3')
+        customer_info['archive_sha256'] = archive_info['sha256']
+
+        # The same upload was already completed (e.g. its SQS message was delivered again),
+        # so its emails and its license are not sent again.
+        completed = None if reverify else get_completed_outcome(archive_info['sha256'], get_app_uuid(zip_name))
+        if completed is not None:
+            customer_info['appuuid'] = get_app_uuid(zip_name)
+            customer_info['completed'] = completed
+            ret = True
+            return ret
+
+        # A byte-identical .zip file that was already verified (e.g. a retried upload)
+        # reuses the stored verdicts instead of running the whole verification again.
+        reused_details = {}
+        duplicate_of = None if reverify else reuse_completed_application(archive_info['sha256'], get_app_uuid(zip_name), reused_details)
+        if duplicate_of is not None:
+            customer_info['appuuid'] = get_app_uuid(zip_name)
+            customer_info['duplicate_of'] = duplicate_of
+            customer_info['details_dic'] = reused_details
+            ret = True
+            return ret
+
+        # Reject tiny, truncated or wrong-format images from their headers in the .zip file,
+        # before anything is unzipped, uploaded or stored in DynamoDB table.
+        inspection = {'images': {}}
+        if inspect_application_images(zip_name_with_path, get_app_uuid(zip_name), inspection) == False:
+            customer_info['appuuid'] = get_app_uuid(zip_name)
+            customer_info['rejected_reason'] = inspection['reason']
+            ret = True
+            return ret
 
         # Unzip the downloaded file to 'tmp/unzipped'
         print('Ready to unzip the file...')
@@ -600,28 +2607,104 @@ def prepare_customer_info(bucket,
             raise ValueError('No files to upload to S3')
         print(f'list_of_files: {list_of_files}')
 
-        # Upload each file to S3 Bucket in unzipped/ prefix
+        appuuid = get_app_uuid(zip_name)
+        print(f'app uuid: {appuuid}')
+
+        # The selfie, then the ID documents (the driver license first, see get_document_files())
+        image_files = [appuuid + '_selfie.png'] + get_document_files(list_of_files, appuuid)
+        print(f'image_files: {image_files}')
+
+        # Each image is decoded once, then (1) a compact JPEG variant is created for Rekognition and Textract,
+        # and uploaded with the other files, (2) a blurry, dark or overexposed image is rejected before
+        # anything is uploaded (the variant is checked if it was created, since it is the image sent to
+        # Rekognition and Textract), and (3) the dHash of the selfie is computed.
+        max_dimension = get_inference_max_dimension()
+        thresholds = get_quality_thresholds()
+        screening = get_selfie_hash_table_name() is not None
+        selfie_dhash = None
+        if max_dimension > 0 or any(thresholds.values()) or screening:
+            for image_file in image_files:
+                image = decode_image(lambda_tmp_folder + lambda_unzipped_folder + image_file)
+
+                variant = os.path.splitext(image_file)[0] + INFERENCE_VARIANT_SUFFIX
+                variant_info = {'image': None}
+                if max_dimension > 0 and create_inference_variant(lambda_tmp_folder + lambda_unzipped_folder + image_file,
+                                                                  lambda_tmp_folder + lambda_unzipped_folder + variant,
+                                                                  max_dimension,
+                                                                  image,
+                                                                  variant_info):
+                    list_of_files.append(variant)
+
+                if any(thresholds.values()):
+                    quality = {}
+                    if variant in list_of_files:
+                        ret_quality = assess_image_quality(lambda_tmp_folder + lambda_unzipped_folder + variant, thresholds, quality, variant_info['image'])
+                    else:
+                        ret_quality = assess_image_quality(lambda_tmp_folder + lambda_unzipped_folder + image_file, thresholds, quality, image)
+                    if ret_quality == False:
+                        customer_info['appuuid'] = appuuid
+                        customer_info['rejected_reason'] = quality['reason']
+                        ret = True
+                        return ret
+
+                if screening and image_file == appuuid + '_selfie.png' and image is not None:
+                    selfie_dhash = compute_dhash(lambda_tmp_folder + lambda_unzipped_folder + image_file, image)
+
+        # Find earlier applications with a near-duplicate selfie
+        selfie_screen = {'dhash': '', 'similar_selfies': []}
+        if screening:
+            screen_selfie(lambda_tmp_folder + lambda_unzipped_folder + appuuid + '_selfie.png', appuuid, selfie_screen, selfie_dhash)
+        customer_info['selfie_screen'] = selfie_screen
+
+        # Upload each file to S3 Bucket in unzipped/ prefix (see get_artifact_key() for the key layout).
+        # With content storage, images are stored by their SHA-256 instead (see upload_blob_to_s3()).
+        content_storage = get_artifact_storage() == ARTIFACT_STORAGE_CONTENT
+        manifest = {'app_uuid': appuuid, 'artifacts': {}}
         for file in list_of_files:
-            ret_upload = upload_file_to_s3(
-                s3,
-                file, 
-                lambda_tmp_folder + lambda_unzipped_folder, 
-                bucket, 
-                file, 
-                bucket_unzipped_prefix)
+            if content_storage and file.lower().endswith(BLOB_FILE_EXTENSIONS):
+                blob_info = {'key': '', 'sha256': '', 'uploaded': False}
+                ret_upload = upload_blob_to_s3(
+                    get_client('s3'),
+                    file,
+                    lambda_tmp_folder + lambda_unzipped_folder,
+                    bucket,
+                    blob_info)
+                manifest['artifacts'][file] = blob_info['key']
+            else:
+                ret_upload = upload_file_to_s3(
+                    get_client('s3'),
+                    file, 
+                    lambda_tmp_folder + lambda_unzipped_folder, 
+                    bucket, 
+                    get_artifact_key(bucket_unzipped_prefix, appuuid, file))
+                manifest['artifacts'][file] = get_artifact_key(bucket_unzipped_prefix, appuuid, file)
             if ret_upload == False:
                 raise ValueError('Error in uploading a file to S3')
-                
-        appuuid = get_app_uuid(zip_name)
-        print(f'app uuid: {appuuid}')
+
+        if content_storage:
+            manifest_key = get_artifact_key(bucket_unzipped_prefix, appuuid, appuuid + '_manifest.json')
+            if put_application_manifest(get_client('s3'), bucket, manifest_key, manifest) == False:
+                raise ValueError('Error in storing the application manifest in S3')
+            customer_info['manifest_key'] = manifest_key
+            print(f'manifest: {manifest}')
         
-        selfie_key = bucket_unzipped_prefix + appuuid + '_selfie.png'
-        license_key = bucket_unzipped_prefix + appuuid + '_license.png'
+        # The images for Rekognition and Textract: the inference variants if they were created
+        inference_keys = []
+        for image_file in image_files:
+            variant = os.path.splitext(image_file)[0] + INFERENCE_VARIANT_SUFFIX
+            inference_keys.append(manifest['artifacts'].get(variant) or
+                                  manifest['artifacts'].get(image_file, get_artifact_key(bucket_unzipped_prefix, appuuid, image_file)))
+        selfie_key = inference_keys[0]
+        document_keys = inference_keys[1:]
+        license_key = document_keys[0]
         details_file = lambda_tmp_folder + lambda_unzipped_folder + appuuid + '_details.csv'
 
         customer_info['selfie_key'] = selfie_key
         customer_info['license_key'] = license_key
+        customer_info['document_keys'] = document_keys
         customer_info['details_file'] = details_file
+        # The original images, which are archived after verification (see archive_images())
+        customer_info['archive_keys'] = [manifest['artifacts'][file] for file in image_files if file in manifest['artifacts']]
         customer_info['appuuid'] = appuuid
 
         print(f'selfie_key: {selfie_key}')
@@ -641,7 +2724,72 @@ def prepare_customer_info(bucket,
 
     return ret
     
-def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror):
+def get_duplicate_license_policy():
+    """
+    This function gets the policy for a DOCUMENT_NUMBER that was already submitted from the
+    environment variable DUPLICATE_LICENSE_POLICY. If it is not set, or not a known policy, 'flag' is used.
+
+    Parameters:
+
+    None
+
+    Returns:
+
+    DUPLICATE_LICENSE_POLICY_FLAG or DUPLICATE_LICENSE_POLICY_REJECT
+    
+    """    
+    policy = os.environ.get('DUPLICATE_LICENSE_POLICY', DUPLICATE_LICENSE_POLICY_FLAG)
+    if policy not in (DUPLICATE_LICENSE_POLICY_FLAG, DUPLICATE_LICENSE_POLICY_REJECT):
+        print(f'Unknown DUPLICATE_LICENSE_POLICY {policy}, using {DUPLICATE_LICENSE_POLICY_FLAG}')
+        policy = DUPLICATE_LICENSE_POLICY_FLAG
+
+    return policy
+
+def find_applications_with_document_number(ddb_table, document_number, appuuid):
+    """
+    This function finds other applications that were submitted with the same driver license
+    (DOCUMENT_NUMBER), with a Query on the DocumentNumberIndex of the DynamoDB table (no Scan).
+
+    A failed lookup is not an error: the application is then processed as usual.
+
+    Parameters:
+
+    ddb_table: DynamoDB table
+    document_number: Customer's driver license number
+    appuuid: The application uuid, which is not returned (e.g. when the same application is retried)
+
+    Returns:
+
+    A list of app_uuid (at most DUPLICATE_LICENSE_LOOKUP_LIMIT). Otherwise, an empty list
+    
+    """    
+    ret = []
+
+    try:
+        if not document_number:
+            raise ValueError('No DOCUMENT_NUMBER')
+
+        response = ddb_table.query(
+            IndexName=DOCUMENT_NUMBER_INDEX,
+            KeyConditionExpression='DOCUMENT_NUMBER = :document_number',
+            ExpressionAttributeValues={':document_number': document_number},
+            Limit=DUPLICATE_LICENSE_LOOKUP_LIMIT + 1)
+
+        ret = [item['APP_UUID'] for item in response.get('Items', []) if item['APP_UUID'] != appuuid]
+        ret = ret[:DUPLICATE_LICENSE_LOOKUP_LIMIT]
+
+    except Exception as error:
+        print(f'Exception error: find_applications_with_document_number : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: find_applications_with_document_number : {ret}')
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: find_applications_with_document_number :')
+
+    return ret
+
+def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror, extra_attributes = None):
     """
     This function adds customer's personal details (in .csv file) to DynamoDB table
 
@@ -650,8 +2798,12 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
     details_file: Customer's personal details (.csv file)
     appuuid: Customer's ID which is used as DynamoDB partition key
     customer_details: Returned dictionary that contains DynamoDB table name and Customer's detailed info.
+                      'customer' is the CustomerDetails, and 'details_dic' is the same details as a dictionary.
+                      'duplicate_license_of' is the list of other applications with the same DOCUMENT_NUMBER.
     ddb_response: Returned response from DynamoDB.
     valerror: returned exception error
+    extra_attributes: Optional dictionary of attributes that are stored with the customer's details,
+                      e.g. {'ARCHIVE_SHA256': ...}
 
     Returns:
 
@@ -670,7 +2822,7 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         
         # From Boto3 documentation:
         # Instantiate a table resource object without actually creating a DynamoDB table.
-        ddb_table = dynamodb.Table(ddb_table_name)
+        ddb_table = get_resource('dynamodb').Table(ddb_table_name)
         if ddb_table is None:
             raise ValueError('Table: test_table not found')
         # For unit testing, the following if-condition will not work unless I have IAM Policy "DerscribeTable".
@@ -685,20 +2837,25 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         #    raise ValueError()
         print(f'ddb_table: {ddb_table}')
         
-        # Parse csv file and get a dictionary
-        details_dic = parse_csv_ddb(details_file)
-        if not details_dic:
+        # Parse and validate the csv file
+        customer = parse_customer_details(details_file)
+        if customer is None:
             raise ValueError('Could not parse csv file')
-        print(f'details_dic: {details_dic}')
+        print(f'customer: {customer}')
+
+        # Flag the application if its driver license was already submitted by other applications
+        duplicate_license_of = find_applications_with_document_number(ddb_table, customer.get('DOCUMENT_NUMBER'), appuuid)
+        if duplicate_license_of:
+            extra_attributes = {**(extra_attributes or {}), 'DUPLICATE_LICENSE_OF': duplicate_license_of}
         
         # Write the dictionary to DynamoDB table.
         # Item: attributes for the primary key (partition key).
         # For the partition key, see KeySchema in YAML. It is a Hash Key for appuuid.
-        # So, for one item (details_dic), there is one unique partition key.
+        # So, for one item (customer), there is one unique partition key.
         # For Valid DynamoDB Types, see:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/customizations/dynamodb.html#ref-valid-dynamodb-types
         #  It shows: S for string, M for dictionary, N for integer, L for list, etc.
-        ddb_response['ddb_response'] = ddb_table.put_item(Item={**details_dic, "APP_UUID": appuuid}) # see APP_UUID in AttributeName in YAML DynamoDB
+        ddb_response['ddb_response'] = put_ddb_item(ddb_table, customer.to_ddb_item(appuuid, extra_attributes), serialized = True) # see APP_UUID in AttributeName in YAML DynamoDB
         if ddb_response['ddb_response']['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Could not put DynamoDB Table item')
 
@@ -711,7 +2868,9 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
         print(f'else block: update_ddb_with_customer_info :')
         
         customer_details['ddb_table'] = ddb_table
-        customer_details['details_dic'] = details_dic
+        customer_details['customer'] = customer
+        customer_details['details_dic'] = customer.to_payload()
+        customer_details['duplicate_license_of'] = duplicate_license_of
 
         ret = True
 
@@ -721,11 +2880,14 @@ def update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_r
 
     return ret
 
-def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror):
+def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror, document_keys = None, notify = True):
     """
     This function compares two images (selfie_key and license_key) using AWS Rekognition,
     updates DynamoDB table (LICENSE_SELFIE_MATCH attribute) with the outcome of this comparison,
     and sends an email if the comparison fails.
+    With several ID documents (document_keys), the selfie is compared with each document concurrently,
+    and it matches if it matches any document (e.g. the back of a license has no face).
+    If the selfie does not match, valerror['check_failed'] is True: the outcome is final, and is not retried.
 
     Parameters:
 
@@ -735,6 +2897,8 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
     appuuid: Customer's ID, which is also the partition key for DynamoDB table
     ddb_table: DynamoDB table name
     valerror: returned exception error
+    document_keys: The ID documents, with license_key first (optional)
+    notify: False to not send the email (e.g. when the application is verified again in a backfill)
 
     Returns:
 
@@ -746,35 +2910,38 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
 
     try:
     
-        # Compare selfie_key with license_key using AWS Rekognition, and get an array of matching faces.
-        matching_faces = get_matching_faces(
+        # Compare selfie_key with each document using AWS Rekognition, and get an array of matching faces per document.
+        all_matching_faces = get_matching_faces_for_documents(
             bucket,
             selfie_key,
-            license_key,
+            document_keys or [license_key],
             SIMILARITY_THRESHOLD,
             valerror)
-        if matching_faces['ResponseMetadata']['HTTPStatusCode'] != 200:
-            raise ValueError('Could not compare images')
-        print(f'Possible Matching Faces: {matching_faces}')
+        if all_matching_faces is None:
+            # Keep the error from get_matching_faces() (e.g. a throttling error) for the caller.
+            raise valerror['error']
+        for matching_faces in all_matching_faces:
+            if matching_faces['ResponseMetadata']['HTTPStatusCode'] != 200:
+                raise ValueError('Could not compare images')
+            print(f'Possible Matching Faces: {matching_faces}')
         
         # Check if matches found
-        matches_found = is_matching_faces(matching_faces)
+        matches_found = any(is_matching_faces(matching_faces) for matching_faces in all_matching_faces)
         print(f'Is matches found?: {matches_found}')
 
         # Update LICENSE_SELFIE_MATCH attribute according to match-found result (i.e True/False). 
         #  The DynamoDB update_item() will create the attribute if it does not exist.
-        response_db_update = ddb_table.update_item(
-            Key={"APP_UUID": appuuid},
-            UpdateExpression='SET LICENSE_SELFIE_MATCH=:f_matches',
-            ExpressionAttributeValues={':f_matches':matches_found})
+        response_db_update = set_ddb_attribute(ddb_table, appuuid, 'LICENSE_SELFIE_MATCH', matches_found)
         if response_db_update['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError('Could not update DynamoDB Table item with LICENSE_SELFIE_MATCH')
         print(f'Response to update LICENSE_SELFIE_MATCH attribute: {response_db_update}')
         
         # Send SNS email if a match is not found, and then raise an exception
         if matches_found is False:
+            valerror['check_failed'] = True
             # Send SNS
-            send_sns_email(SNS_FACEMATCH_MESSAGE, SNS_FACEMATCH_SUBJECT)
+            if notify:
+                send_sns_email(SNS_FACEMATCH_MESSAGE, SNS_FACEMATCH_SUBJECT)
             raise ValueError('Could not match selfie with license')
         
         print(f'No SNS is being sent')
@@ -795,12 +2962,13 @@ def validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerro
 
     return ret
 
-def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic):
+def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic, valerror = None, document_keys = None, notify = True):
     """
     This function compares customer's submitted info (in details_dic) with
     customer's driver license (in license_key) using AWS Textract,
     updates DynamoDB table (LICENSE_DETAILS_MATCH attribute) with the outcome of this comparison,
     and sends an email if the comparison fails.
+    If the details do not match, valerror['check_failed'] is True: the outcome is final, and is not retried.
 
     Parameters:
 
@@ -808,7 +2976,10 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
     license_key: Customer's driver license image
     appuuid: Customer's ID, which is also the partition key for DynamoDB table
     ddb_table: DynamoDB table name
-    details_dic: Customer's submitted info (from .csv file)
+    details_dic: Customer's submitted info (from .csv file), a CustomerDetails or a dictionary
+    valerror: returned exception error (optional)
+    document_keys: The ID documents, with license_key first (optional). Their fields are merged.
+    notify: False to not send the email (e.g. when the application is verified again in a backfill)
 
     Returns:
 
@@ -820,41 +2991,49 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
 
     try:
         # Analyze customer's submitted document ID.
-        response_textract = analyze_document_id(bucket, license_key)
+        textract_error = {'error':''}
+        response_textract = analyze_document_ids(bucket, document_keys or [license_key], textract_error)
         if response_textract is None:
-            raise ValueError('Could not analyze customer\'s ID')
+            # Keep the error from analyze_document_id() (e.g. a throttling error) for the caller.
+            raise textract_error['error'] or ValueError('Could not analyze customer\'s ID')
         print(f'Analysis of customer submitted ID: {response_textract}')
         
         # Extract customer's information from the submitted ID.
-        extracted_info = get_customer_extracted_info(response_textract)
-        if extracted_info is None:
+        extraction = {'confidence': {}}
+        extracted_customer = extract_customer_details(response_textract, extraction)
+        if extracted_customer is None:
             raise ValueError('Could not extract customer\'s information from the ID')
-        print(f'Extracted info from customer submitted ID: {extracted_info}')
+        print(f'Extracted info from customer submitted ID: {extracted_customer}, confidence: {extraction["confidence"]}')
         
         # Compare extracted information with customer's submitted information
-        matches_info_found = is_matching_customer_info(extracted_info, details_dic)
+        matches_info_found = is_matching_customer_info(extracted_customer, details_dic)
         print(f'Is matching customer info?: {matches_info_found}')
         
-        # Update LICENSE_DETAILS_MATCH attribute according to matches_info_found result (i.e True/False). 
-        #  The DynamoDB update_item() will create the attribute if it does not exist.
-        response_db_update = ddb_table.update_item(
-            Key={"APP_UUID": appuuid},
-            UpdateExpression='SET LICENSE_DETAILS_MATCH=:f_matches',
-            ExpressionAttributeValues={':f_matches':matches_info_found})
+        # Update LICENSE_DETAILS_MATCH attribute according to matches_info_found result (i.e True/False),
+        #  and keep the extracted information (EXTRACTED_DETAILS) to re-verify the application later.
+        #  The DynamoDB update_item() will create the attributes if they do not exist.
+        response_db_update = set_ddb_attributes(ddb_table, appuuid, {
+            'LICENSE_DETAILS_MATCH': matches_info_found,
+            'EXTRACTED_DETAILS': extracted_customer.to_payload()})
         if response_db_update is None:
             raise ValueError('Could not update DynamoDB Table item with LICENSE_DETAILS_MATCH')
         print(f'Response to update LICENSE_DETAILS_MATCH attribute: {response_db_update}')
         
         # Send SNS email if a match is not found, and then raise an exception
         if matches_info_found is False:
+            if valerror is not None:
+                valerror['check_failed'] = True
             # Send SNS
-            send_sns_email(SNS_IDMATCH_MESSAGE, SNS_IDMATCH_SUBJECT)
+            if notify:
+                send_sns_email(SNS_IDMATCH_MESSAGE, SNS_IDMATCH_SUBJECT)
             raise ValueError('Could not match Customer ID with submitted Customer info')
         
         print(f'No SNS is being sent')
 
     except Exception as error:
         print(f'Exception error: {error}')
+        if valerror is not None:
+            valerror['error'] = error
     else:
         # If no errors are detected, continue to execute the following:
         print(f'else block: do nothing for now')
@@ -866,14 +3045,17 @@ def validate_customer_details(bucket, license_key, appuuid, ddb_table, details_d
 
     return ret
 
-def queue_customer_id(appuuid, details_dic):
+def queue_customer_id(appuuid, details_dic, ddb_table = None):
     """
     This function writes customer's driver license ID to Amazon SQS queue.
+    With ddb_table, the LICENSE_QUEUED attribute is claimed first (see claim_ddb_attribute()),
+    so the license of an application is sent once, even if the application is processed again.
 
     Parameters:
 
     appuuid: Customer's unique ID
-    details_dic: Customer's detailed info (which includes driver license ID)
+    details_dic: Customer's detailed info (which includes driver license ID), a CustomerDetails or a dictionary
+    ddb_table: DynamoDB table (optional)
 
     Returns:
 
@@ -885,12 +3067,19 @@ def queue_customer_id(appuuid, details_dic):
 
     try:
 
+        if ddb_table is not None and claim_ddb_attribute(ddb_table, appuuid, 'LICENSE_QUEUED') == False:
+            print(f'The license of {appuuid} was already sent to SQS')
+            ret = True
+            return ret
+
         message = {'driver_license_id': details_dic.get('DOCUMENT_NUMBER', '0'), # if 'DOCUMENT_NUMBER' does not exist, it returns '0'
                    'validation_override': True,
                    'uuid': appuuid
                    }
         response_sqs = send_sqs_message(message)
         if response_sqs is None:
+            if ddb_table is not None:
+                release_ddb_attribute(ddb_table, appuuid, 'LICENSE_QUEUED')
             raise ValueError('Could not send message to SQS')
         print(f'Message sent to SQS: {response_sqs}')
     
@@ -907,42 +3096,227 @@ def queue_customer_id(appuuid, details_dic):
 
     return ret
     
-def lambda_handler(event, context):
+def archive_images(bucket, archive_keys, appuuid, ddb_table, valerror):
     """
-    This function is the AWS Lambda function call for DocumentLambdaFunction.
+    This function archives the original images of a verified application (see archive_application_images()),
+    and adds the WebP keys (ARCHIVED_IMAGES attribute) and the bytes saved (ARCHIVE_BYTES_SAVED attribute)
+    to DynamoDB table. Only a throttling error fails this stage (so the application is parked).
+    After any other error, the original images that were not archived are kept.
 
     Parameters:
 
-    event: S3 event, which contains bucket name and filename with the prefix
-    context: not used in this application
+    bucket: S3 bucket name where the images are stored
+    archive_keys: The keys of the original images
+    appuuid: Customer's ID, which is also the partition key for DynamoDB table
+    ddb_table: DynamoDB table
+    valerror: returned exception error
 
     Returns:
+
+    True if operations are successful. Otherwise, False
     
     """    
+    ret = False
+
+    try:
+        if get_archive_image_format() != ARCHIVE_IMAGE_FORMAT_WEBP or not archive_keys:
+            print(f'The images of {appuuid} are not archived')
+            ret = True
+            return ret
+
+        archive_info = {'images': {}, 'bytes_saved': 0}
+        archived = archive_application_images(get_client('s3'), bucket, archive_keys, archive_info)
+
+        if archive_info['images']:
+            ddb_table.update_item(
+                Key={"APP_UUID": appuuid},
+                UpdateExpression='ADD ARCHIVED_IMAGES :images, ARCHIVE_BYTES_SAVED :saved',
+                ExpressionAttributeValues={':images': set(archive_info['images'].values()),
+                                           ':saved': archive_info['bytes_saved']})
+            print(f'Archive of {appuuid} saved {archive_info["bytes_saved"]} bytes')
+
+        if archived == False and is_throttling_error(archive_info['error']):
+            raise archive_info['error']
+
+    except Exception as error:
+        print(f'Exception error: archive_images : {error}')
+        valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: archive_images :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: archive_images :')
+
+    return ret
+
+def park_application(checkpoint):
+    """
+    This function parks an application whose stage was throttled by Rekognition or Textract.
+    The checkpoint is sent to the parking queue with a delay, and DocumentLambdaFunction
+    drains the parking queue at a controlled rate (see ParkingQueue in YAML template).
+    Each time an application is parked again, the delay doubles.
+
+    Parameters:
+
+    checkpoint: A dictionary that contains the throttled stage and everything that is needed
+                to run that stage again (see run_verification_stages())
+
+    Returns:
+
+    True if the application is parked. Otherwise, False
     
-    print(f'Entering lambda handler for DocumentLambdaFunction')
+    """    
+    ret = False
+    try:
+        queue_url = os.environ['PARKING_QUEUE_URL']
+        max_attempts = int(os.environ.get('PARKING_MAX_ATTEMPTS', DEFAULT_PARKING_MAX_ATTEMPTS))
+
+        attempt = checkpoint.get('attempt', 0) + 1
+        if attempt > max_attempts:
+            raise ValueError(f'Application was parked {max_attempts} times')
+        checkpoint['attempt'] = attempt
+
+        # Exponential backoff with jitter, so parked applications do not come back all at once.
+        delay = min(PARKING_MAX_DELAY_SECONDS,
+                    int(PARKING_BASE_DELAY_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)))
+
+        response = get_client('sqs').send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps(checkpoint),
+            DelaySeconds=delay)
+        print(f'Parked application {checkpoint["appuuid"]} at stage {checkpoint["stage"]} for {delay} seconds: {response}')
+
+    except Exception as error:
+        print(f'Exception error: park_application : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: park_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: park_application :')
+        return ret
+
+def run_verification_stages(checkpoint, ddb_table, valerror):
+    """
+    This function runs the verification stages of an application, starting at checkpoint['stage']:
+    validate_selfie(), validate_customer_details(), queue_customer_id(), then archive_images().
+    If a stage is throttled, then the application is parked (see park_application()) with that stage
+    as its checkpoint, so only the throttled stage and the stages after it are run again.
+    If checkpoint['notify'] is False, no email is sent and the license is not sent to SQS (queue_customer_id() is skipped).
+    If a check failed (the selfie or the details do not match), valerror['check_failed'] is True: the outcome
+    of the application is final. Other errors (e.g. DynamoDB, SQS or S3 errors) can be retried.
+
+    Parameters:
+
+    checkpoint: A dictionary with the keys stage, bucket, appuuid, selfie_key, license_key, document_keys
+                (the ID documents), details_dic, archive_keys (the original images), attempt (number of times the application was parked)
+                and notify (optional, True by default)
+    ddb_table: DynamoDB table
+    valerror: returned exception error
+
+    Returns:
+
+    True if all stages are successful or the application is parked. Otherwise, False
     
-    BUCKET_UNZIPPED_PREFIX = 'unzipped/'
-    LAMBDA_TMP_FOLDER = '/tmp/'
-    LAMBDA_UNZIPPED_FOLDER = 'unzipped/'
+    """    
+    ret = False
+    try:
+        bucket = checkpoint['bucket']
+        appuuid = checkpoint['appuuid']
+        selfie_key = checkpoint['selfie_key']
+        license_key = checkpoint['license_key']
+        customer = CustomerDetails.from_payload(checkpoint['details_dic'])
+        document_keys = checkpoint.get('document_keys') or [license_key]
+        notify = checkpoint.get('notify', True)
+
+        first_stage = VERIFICATION_STAGES.index(checkpoint['stage'])
+        for stage in VERIFICATION_STAGES[first_stage:]:
+            checkpoint['stage'] = stage
+            stage_error = {'error':''}
+
+            if stage == 'validate_selfie':
+                outcome = validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, stage_error, document_keys, notify)
+            elif stage == 'validate_customer_details':
+                outcome = validate_customer_details(bucket, license_key, appuuid, ddb_table, customer, stage_error, document_keys, notify)
+            elif stage == 'queue_customer_id':
+                if not notify:
+                    print(f'The license of {appuuid} is not sent to SQS')
+                    continue
+                outcome = queue_customer_id(appuuid, customer, ddb_table)
+            else:
+                outcome = archive_images(bucket, checkpoint.get('archive_keys', []), appuuid, ddb_table, stage_error)
+
+            if outcome == False:
+                if stage_error.get('check_failed'):
+                    valerror['check_failed'] = True
+                if not is_throttling_error(stage_error['error']):
+                    raise ValueError(f'Error in {stage}')
+
+                # Throttled: park the application instead of failing it.
+                if park_application(checkpoint) == False:
+                    raise ValueError(f'Error in {stage}, and could not park the application')
+                break
+
+    except Exception as error:
+        print(f'Exception error: run_verification_stages : {error}')
+        valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: run_verification_stages :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: run_verification_stages :')
+
+    return ret
+    
+def process_application(bucket,
+                        key,
+                        lambda_tmp_folder,
+                        lambda_unzipped_folder,
+                        bucket_unzipped_prefix,
+                        application,
+                        valerror,
+                        reverify = False,
+                        notify = True):
+    """
+    This function runs all operations for one application (.zip file): it unzips the file, stores the
+    unzipped objects in S3, puts customer's details in DynamoDB table, then runs the verification stages.
+    With reverify, an application that was completed is verified again, and keeps its license submission
+    (see get_submission_attributes()). With notify False, no email is sent and no license is sent to SQS.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    key: Zip filename prefixed with S3 folder name
+    lambda_tmp_folder: This is the temporary folder of AWS Lambda. It is usually /tmp
+    lambda_unzipped_folder: This is a subfolder in AWS Lambda's /tmp folder
+    bucket_unzipped_prefix: S3 folder where unzipped files will be stored
+    application: returned dictionary that contains the appuuid, and 'stored' which is True
+                 once customer's details are in DynamoDB table
+    valerror: returned exception error
+    reverify: True to verify the application again, even if it was completed (e.g. in a backfill)
+    notify: False to not send the emails and the license (e.g. in a backfill)
+
+    Returns:
+
+    True if operations are successful. Otherwise, False
     
+    """    
     ret = False
 
     try:
-        record = event['Records'][0]
-        bucket = record['s3']['bucket']['name']
-        key = record['s3']['object']['key']
+        # A warm container may still have the files of a previous application in its /tmp folder.
+        shutil.rmtree(lambda_tmp_folder + lambda_unzipped_folder, ignore_errors=True)
 
-        print(f'record: {record}')
-        print(f'bucket: {bucket}') # e.g. bucket: documentbucket-115476135777
-        print(f'key: {key}')  # e.g. key: zipped/8d247914.zip
-        
         #====================================================================================
         # Get .zip file from S3 bucket, unzip the file, then store the unzipped objects in S3
         #====================================================================================
         customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
-        valerror = {'error':''}
-        outcome = prepare_customer_info(bucket, key, LAMBDA_TMP_FOLDER, LAMBDA_UNZIPPED_FOLDER, BUCKET_UNZIPPED_PREFIX, customer_info, valerror)
+        outcome = prepare_customer_info(bucket, key, lambda_tmp_folder, lambda_unzipped_folder, bucket_unzipped_prefix, customer_info, valerror, reverify)
         if outcome == False:
             raise ValueError('Error in prepare_customer_info')
 
@@ -950,47 +3324,237 @@ def lambda_handler(event, context):
         license_key = customer_info['license_key']
         details_file = customer_info['details_file']
         appuuid = customer_info['appuuid']
+        application['appuuid'] = appuuid
+
+        # The application was already completed: nothing is verified, stored or sent again.
+        if customer_info.get('completed') is not None:
+            print(f'Application {appuuid} was already completed: {customer_info["completed"]}')
+            application['stored'] = True
+            ret = True
+            return ret
+
+        # The same .zip file was already verified, and its verdicts are copied to DynamoDB table.
+        # Both checks passed, so the license of this application is sent for validation, as after the checks.
+        if customer_info.get('duplicate_of') is not None:
+            print(f'Application {appuuid} reuses the verdicts of {customer_info["duplicate_of"]}')
+            application['stored'] = True
+            ddb_table = get_resource('dynamodb').Table(get_dynamo_db_table_name())
+            if queue_customer_id(appuuid, customer_info['details_dic'], ddb_table) == False:
+                raise ValueError('Error in queue_customer_id')
+            ret = True
+            return ret
+
+        # The selfie or the license cannot be used. The rejection is final, so the application is not processed again.
+        # It is stored before the email is sent (see get_completed_outcome()).
+        if customer_info.get('rejected_reason') is not None:
+            print(f'Application {appuuid} is rejected: {customer_info["rejected_reason"]}')
+            set_ddb_attributes(get_dynamo_db_table_name(), appuuid, {
+                'REJECTED_REASON': customer_info['rejected_reason'],
+                ARCHIVE_DIGEST_ATTRIBUTE: customer_info['archive_sha256']})
+            if notify:
+                send_sns_email(SNS_UNUSABLE_IMAGE_MESSAGE + ': ' + customer_info['rejected_reason'], SNS_UNUSABLE_IMAGE_SUBJECT)
+            application['stored'] = True
+            ret = True
+            return ret
 
         #==============================================================
         # Put customer's personal details (.csv file) in DynamoDB table
         #==============================================================
         customer_details = {'ddb_table':'', 'details_dic':{}}
         ddb_response = {'ddb_response':''}
-        valerror = {'error':''}
-        outcome = update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror)
+        extra_attributes = {ARCHIVE_DIGEST_ATTRIBUTE: customer_info['archive_sha256']}
+        selfie_screen = customer_info['selfie_screen']
+        if selfie_screen['dhash']:
+            extra_attributes['SELFIE_DHASH'] = selfie_screen['dhash']
+        if selfie_screen['similar_selfies']:
+            extra_attributes['SIMILAR_SELFIE_OF'] = selfie_screen['similar_selfies']
+        # The item is stored again, so an application that is verified again keeps its license submission
+        if reverify:
+            extra_attributes.update(get_submission_attributes(appuuid))
+        outcome = update_ddb_with_customer_info(details_file, appuuid, customer_details, ddb_response, valerror, extra_attributes)
         if outcome == False:
             raise ValueError('Error in update_ddb_with_customer_info')
+        application['stored'] = True
         
         ddb_table = customer_details['ddb_table']
         details_dic = customer_details['details_dic']
 
+        # With the 'reject' policy, a driver license that was already submitted is not verified again
+        duplicate_license_of = customer_details['duplicate_license_of']
+        if duplicate_license_of and get_duplicate_license_policy() == DUPLICATE_LICENSE_POLICY_REJECT:
+            print(f'Application {appuuid} is rejected: its driver license was submitted by {duplicate_license_of}')
+            set_ddb_attribute(ddb_table, appuuid, 'REJECTED_REASON', 'duplicate_license')
+            if notify:
+                send_sns_email(SNS_DUPLICATE_LICENSE_MESSAGE, SNS_DUPLICATE_LICENSE_SUBJECT)
+            ret = True
+            return ret
+
         #=======================================================================================================
-        # Compare customer's selfie image with the image in the customer's driver license using AWS Rekognition.
-        # Update DynamoDB table with the outcome of this comparison.
-        # Send an email if the comparison fails.
-        #=======================================================================================================
-        valerror = {'error':''}
-        outcome = validate_selfie(bucket, selfie_key, license_key, appuuid, ddb_table, valerror)
-        if outcome == False:
-            raise ValueError('Error in validate_selfie')
-        
-        #=====================================================================================================
-        # Compare customer's submitted info (in details_dic) with customer's driver license using AWS Textract.
-        # Update DynamoDB table the outcome of this comparison.
-        # Send an email if the comparison fails.
-        #=====================================================================================================
-        outcome = validate_customer_details(bucket, license_key, appuuid, ddb_table, details_dic)
-        if outcome == False:
-            raise ValueError('Error in validate_customer_details')
-        
-        #==============================================================================================
-        # Write customer's license number (available in details_dic) to Amazon SQS queue.
+        # Compare customer's selfie image with the image in the customer's driver license using AWS Rekognition,
+        # then compare customer's submitted info (in details_dic) with customer's driver license using AWS Textract.
+        # Update DynamoDB table with the outcome of these comparisons, and send an email if a comparison fails.
+        # Then write customer's license number (available in details_dic) to Amazon SQS queue.
         # When a new message is in the queue, another Lambda function named SubmitLicenseLambdaFunction
         # will be invoked, which in turn will submit the license ID to the third-party API for validation.
-        #==============================================================================================
-        outcome = queue_customer_id(appuuid, details_dic)
+        # Finally, the original images are archived as lossless WebP images (ARCHIVE_IMAGE_FORMAT: webp).
+        # If Rekognition or Textract is throttled, the application is parked and resumed later.
+        #=======================================================================================================
+        checkpoint = {'stage': VERIFICATION_STAGES[0],
+                      'bucket': bucket,
+                      'appuuid': appuuid,
+                      'selfie_key': selfie_key,
+                      'license_key': license_key,
+                      'document_keys': customer_info['document_keys'],
+                      'details_dic': details_dic,
+                      'archive_keys': customer_info['archive_keys'],
+                      'attempt': 0,
+                      'notify': notify}
+        outcome = run_verification_stages(checkpoint, ddb_table, valerror)
+        if outcome == False:
+            raise ValueError('Error in run_verification_stages')
+
+    except Exception as error:
+        print(f'Exception error: process_application : {error}')
+        valerror['error'] = error
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: process_application :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: process_application :')
+
+    return ret
+
+def process_sqs_record(record,
+                       lambda_tmp_folder,
+                       lambda_unzipped_folder,
+                       bucket_unzipped_prefix):
+    """
+    This function processes one SQS message. The message is either an S3 notification from the
+    ingestion queue (buffered ingestion), or a parked application from the parking queue.
+
+    A message from the ingestion queue fails only if one of its applications could not be stored in
+    DynamoDB table. A message from the parking queue fails if its application could not be resumed,
+    unless a check failed (a final outcome, see run_verification_stages()). A message that fails too many
+    times goes to the parking dead-letter queue (see ParkingQueue in YAML template). A message can still be delivered again, e.g. when its batch times out: the applications
+    that were completed are then skipped (see get_completed_outcome()), and the license of an application
+    is sent once (see queue_customer_id()).
+
+    Parameters:
+
+    record: The SQS record
+    lambda_tmp_folder: This is the temporary folder of AWS Lambda. It is usually /tmp
+    lambda_unzipped_folder: This is a subfolder in AWS Lambda's /tmp folder
+    bucket_unzipped_prefix: S3 folder where unzipped files will be stored
+
+    Returns:
+
+    True if the message is processed and can be deleted. Otherwise, False
+    
+    """    
+    ret = False
+
+    try:
+        body = json.loads(record['body'])
+
+        if 'stage' in body:
+            #=========================================================================
+            # A parked application from the parking queue. Resume from its checkpoint.
+            #=========================================================================
+            print(f'Resuming parked application: {body}')
+            ddb_table = get_resource('dynamodb').Table(get_dynamo_db_table_name())
+            valerror = {'error':''}
+            outcome = run_verification_stages(body, ddb_table, valerror)
+            if outcome == False and not valerror.get('check_failed'):
+                raise ValueError(f'Could not resume application {body["appuuid"]}: {valerror["error"]}')
+
+        else:
+            #=====================================================================
+            # An S3 notification from the ingestion queue. It has one S3 record
+            # per uploaded .zip file. S3 also sends an s3:TestEvent without records.
+            #=====================================================================
+            for s3_record in body.get('Records', []):
+                bucket = s3_record['s3']['bucket']['name']
+                key = s3_record['s3']['object']['key']
+                print(f'bucket: {bucket}')
+                print(f'key: {key}')
+
+                application = {'appuuid': '', 'stored': False}
+                valerror = {'error':''}
+                process_application(bucket, key, lambda_tmp_folder, lambda_unzipped_folder, bucket_unzipped_prefix, application, valerror)
+                if application['stored'] == False:
+                    raise ValueError(f'Could not store application {key}')
+
+    except Exception as error:
+        print(f'Exception error: process_sqs_record : {error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: process_sqs_record :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: process_sqs_record :')
+
+    return ret
+
+def lambda_handler(event, context):
+    """
+    This function is the AWS Lambda function call for DocumentLambdaFunction.
+
+    Parameters:
+
+    event: S3 event, which contains bucket name and filename with the prefix,
+           or SQS event from the ingestion queue (S3 notifications) or the parking queue (parked applications)
+    context: not used in this application
+
+    Returns:
+
+    For an SQS event, a dictionary with the batchItemFailures (the SQS messages to process again).
+    For an S3 event, True if operations are successful. Otherwise, False.
+    
+    """    
+    
+    print(f'Entering lambda handler for DocumentLambdaFunction')
+    
+    BUCKET_UNZIPPED_PREFIX = 'unzipped/'
+    LAMBDA_TMP_FOLDER = '/tmp/'
+    LAMBDA_UNZIPPED_FOLDER = 'unzipped/'
+    
+    ret = False
+
+    try:
+        record = event['Records'][0]
+
+        if record.get('eventSource') == 'aws:sqs':
+            #==========================================================================
+            # A batch of SQS messages. Report the messages that failed, so that only
+            # these messages are processed again (see ReportBatchItemFailures in YAML).
+            #==========================================================================
+            batch_item_failures = []
+            for sqs_record in event['Records']:
+                outcome = process_sqs_record(sqs_record, LAMBDA_TMP_FOLDER, LAMBDA_UNZIPPED_FOLDER, BUCKET_UNZIPPED_PREFIX)
+                if outcome == False:
+                    batch_item_failures.append({'itemIdentifier': sqs_record['messageId']})
+            print(f'batchItemFailures: {batch_item_failures}')
+            ret = {'batchItemFailures': batch_item_failures}
+            return ret
+
+        bucket = record['s3']['bucket']['name']
+        key = record['s3']['object']['key']
+
+        print(f'record: {record}')
+        print(f'bucket: {bucket}') # e.g. bucket: documentbucket-115476135777
+        print(f'key: {key}')  # e.g. key: zipped/8d247914.zip
+
+        #==============================================================================
+        # Unzip the application, store it in S3 and DynamoDB table, then verify it
+        #==============================================================================
+        application = {'appuuid': '', 'stored': False}
+        valerror = {'error':''}
+        outcome = process_application(bucket, key, LAMBDA_TMP_FOLDER, LAMBDA_UNZIPPED_FOLDER, BUCKET_UNZIPPED_PREFIX, application, valerror)
         if outcome == False:
-            raise ValueError('Error in queue_customer_id')
+            raise ValueError('Error in process_application')
         
     except Exception as error:
         print(f'Exception error: {error}')
@@ -1001,7 +3565,7 @@ def lambda_handler(event, context):
         ret = True
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
         return ret
 
@@ -1,13 +1,46 @@
 import os
 import boto3
+from boto3.dynamodb.types import TypeSerializer
 import json
 import requests
+from aws_services import get_client, get_aws_service_metrics, get_module_getattr
 
 SNS_LICENSEVALIDATION_MESSAGE = 'Invalid Customer\'s license'
 SNS_LICENSEVALIDATION_SUBJECT = 'Customer\'s License Validation Fails'
 
-dynamoDb = boto3.resource('dynamodb')
-sns = boto3.client('sns')
+# The AWS clients and resources of this function. They are created on first use, and cached by the
+# client registry of the AwsServicesLayer Lambda layer (see get_client() and get_resource() in aws_services.py).
+# Other modules can still import them by name, e.g. from app import sns (see get_module_getattr()).
+AWS_SERVICES = {
+    'dynamodb': ('client', 'dynamodb'),
+    'sns': ('client', 'sns')}
+__getattr__ = get_module_getattr(__name__, AWS_SERVICES)
+
+# Item shape of the DynamoDB table (see serialize_ddb_item()). The writes use the low-level DynamoDB
+# client, and the known attributes are converted to the DynamoDB format by precompiled serializers,
+# instead of the type inspection of the boto3 resource layer. Other attributes use TypeSerializer.
+DDB_STRING_ATTRIBUTES = (
+    'APP_UUID',
+    'DOCUMENT_NUMBER',
+    'FIRST_NAME',
+    'LAST_NAME',
+    'DATE_OF_BIRTH',
+    'ADDRESS',
+    'STATE_IN_ADDRESS',
+    'CITY_IN_ADDRESS',
+    'ZIP_CODE_IN_ADDRESS',
+    'ARCHIVE_SHA256',
+    'SELFIE_DHASH',
+    'DUPLICATE_OF',
+    'LICENSE_SUBMIT_ERROR')
+DDB_BOOLEAN_ATTRIBUTES = ('LICENSE_SELFIE_MATCH', 'LICENSE_DETAILS_MATCH', 'LICENSE_VALIDATION')
+DDB_STRING_LIST_ATTRIBUTES = ('DUPLICATE_LICENSE_OF', 'SIMILAR_SELFIE_OF')
+DDB_ITEM_SERIALIZERS = {
+    **{name: (str, lambda value: {'S': value}) for name in DDB_STRING_ATTRIBUTES},
+    **{name: (bool, lambda value: {'BOOL': value}) for name in DDB_BOOLEAN_ATTRIBUTES},
+    **{name: (list, lambda value: {'L': [{'S': element} for element in value]}) for name in DDB_STRING_LIST_ATTRIBUTES}}
+
+ddb_type_serializer = TypeSerializer()
 
 def get_dynamo_db_table_name():
     """
@@ -38,6 +71,99 @@ def get_dynamo_db_table_name():
         print(f'finally block: do nothing for now')
         return ret
 
+def serialize_ddb_attribute(name, value):
+    """
+    This function converts the value of an attribute of the DynamoDB table to the low-level DynamoDB format,
+    e.g. 'NICK' to {'S': 'NICK'}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    name: Name of the attribute, e.g. 'FIRST_NAME'
+    value: Value of the attribute
+
+    Returns:
+
+    The value in the low-level DynamoDB format
+    
+    """
+    serializer = DDB_ITEM_SERIALIZERS.get(name)
+    if serializer is not None and type(value) is serializer[0]:
+        return serializer[1](value)
+    return ddb_type_serializer.serialize(value)
+
+def serialize_ddb_item(item):
+    """
+    This function converts an item of the DynamoDB table to the low-level DynamoDB format,
+    e.g. {'APP_UUID': '8d247914'} to {'APP_UUID': {'S': '8d247914'}}. See DDB_ITEM_SERIALIZERS.
+
+    Parameters:
+
+    item: A dictionary of attribute names and values
+
+    Returns:
+
+    The item in the low-level DynamoDB format
+    
+    """
+    return {name: serialize_ddb_attribute(name, value) for name, value in item.items()}
+
+def get_ddb_table_name(ddb_table):
+    """
+    This function returns the name of a DynamoDB table.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+
+    Returns:
+
+    The table name
+    
+    """
+    return ddb_table if isinstance(ddb_table, str) else ddb_table.name
+
+def put_ddb_item(ddb_table, item, serialized = False):
+    """
+    This function writes an item to the DynamoDB table with the low-level DynamoDB client.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    item: A dictionary of attribute names and values, with APP_UUID
+    serialized: True if the item is already in the low-level DynamoDB format, e.g. CustomerDetails.to_ddb_item()
+
+    Returns:
+
+    The put_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').put_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Item = item if serialized else serialize_ddb_item(item))
+
+def set_ddb_attribute(ddb_table, appuuid, attribute_name, value):
+    """
+    This function sets one attribute of an item of the DynamoDB table with the low-level DynamoDB client.
+    update_item() creates the attribute if it does not exist.
+
+    Parameters:
+
+    ddb_table: DynamoDB table (a boto3 Table) or its name
+    appuuid: Customer's ID, which is the partition key of the item
+    attribute_name: Name of the attribute, e.g. 'LICENSE_SELFIE_MATCH'
+    value: Value of the attribute
+
+    Returns:
+
+    The update_item() response. Exceptions are raised to the caller.
+    
+    """
+    return get_client('dynamodb').update_item(
+        TableName = get_ddb_table_name(ddb_table),
+        Key = {'APP_UUID': {'S': appuuid}},
+        UpdateExpression = f'SET {attribute_name}=:value',
+        ExpressionAttributeValues = {':value': serialize_ddb_attribute(attribute_name, value)})
+
 def get_sns_topic_name():
     """
     This function gets SNS Topic name.
@@ -87,7 +213,7 @@ def send_sns_email(message, subject):
         if topic_name is None:
             raise ValueError('Could not get SNS Topic!')
                 
-        response_sns = sns.publish(
+        response_sns = get_client('sns').publish(
             TopicArn = topic_name,
             Message = message,
             Subject = subject)
@@ -108,6 +234,40 @@ def send_sns_email(message, subject):
         print(f'finally block: send_sns_email :')
         return ret
     
+def record_submit_error(appuuid, error):
+    """
+    This function stores the class of the error that stopped the submission of a driver license
+    (LICENSE_SUBMIT_ERROR attribute), e.g. 'ConnectionError'. It is used to select the messages
+    of LicenseDeadLetterQueue to replay (see Tools/dlq_replay.py).
+
+    Parameters:
+
+    appuuid: Customer's ID, which is the partition key of the item
+    error: The exception
+
+    Returns:
+
+    True if the error is stored. Otherwise, False.
+    
+    """
+    ret = False
+    try:
+        ddb_table_name = get_dynamo_db_table_name()
+        if ddb_table_name is None:
+            raise ValueError('No DynamoDB table')
+        set_ddb_attribute(ddb_table_name, appuuid, 'LICENSE_SUBMIT_ERROR', type(error).__name__)
+    except Exception as record_error:
+        print(f'Exception error: record_submit_error : {record_error}')
+    else:
+        # If no errors are detected, continue to execute the following:
+        print(f'else block: record_submit_error :')
+        ret = True
+    finally:
+        # Execute the following code whether or not an exception has been raised:
+        print(f'finally block: record_submit_error :')
+
+    return ret
+
 def lambda_handler(event, context):
     """
     This function is the AWS Lambda function call for SubmitLicenseLambdaFunction.
@@ -122,6 +282,8 @@ def lambda_handler(event, context):
     
     """    
     ret = False
+    appuuid = None
+    validated = False
 
     try:
         url = os.environ['INVOKE_URL']
@@ -173,18 +335,11 @@ def lambda_handler(event, context):
             raise ValueError('No DynamoDB table')
         print(f'ddb_table_name: {ddb_table_name}')
             
-        ddb_table = dynamoDb.Table(ddb_table_name)
-        if ddb_table is None:
-            raise ValueError('No DynamoDB table')
-        print(f'ddb_table: {ddb_table}')
-        
-        response_db_update = ddb_table.update_item(
-            Key={"APP_UUID": appuuid},
-            UpdateExpression='SET LICENSE_VALIDATION=:v_matches',
-            ExpressionAttributeValues={':v_matches':response_in_json})
+        response_db_update = set_ddb_attribute(ddb_table_name, appuuid, 'LICENSE_VALIDATION', response_in_json)
         if response_db_update is None:
             raise ValueError('Could not update DynamoDB Table item with LICENSE_VALIDATION')
         print(f'Response to update LICENSE_VALIDATION attribute: {response_db_update}')
+        validated = True
             
         # Send SNS email if a match is not found, and then raise an exception
         if not response_in_json:
@@ -196,13 +351,16 @@ def lambda_handler(event, context):
     
     except Exception as error:
         print(f'Exception error: {error}')
+        # The license was not validated, e.g. the third-party API is down
+        if appuuid is not None and not validated:
+            record_submit_error(appuuid, error)
     else:
         # If no errors are detected, continue to execute the following:
         print(f'else block: do nothing for now')
         ret = True
     finally:
         # Execute the following code whether or not an exception has been raised:
-        print(f'finally block: do nothing for now')
+        print(f'finally block: AWS service metrics: {get_aws_service_metrics()}')
 
         return ret
 
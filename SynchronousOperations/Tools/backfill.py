@@ -0,0 +1,270 @@
+import argparse
+import collections
+import contextlib
+import json
+import shutil
+import sys
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import process_application
+from SynchronousOperations.DocumentLambdaFunction.app import set_api_rate_limits
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+
+BUCKET_UNZIPPED_PREFIX = 'unzipped/'
+LAMBDA_UNZIPPED_FOLDER = 'unzipped/'
+DEFAULT_PREFIX = 'zipped/'
+DEFAULT_PROCESSES = 4
+DEFAULT_SHARD_SIZE = 10
+
+# Rate limits of the downstream operations for the whole backfill, in calls per second. They are
+# below the default quotas of Rekognition and Textract, so the backfill leaves room for the Lambda function.
+# Only the operations that go through call_with_adaptive_limit() can be limited.
+DEFAULT_API_RATE_LIMITS = {
+    'rekognition.compare_faces': 20.0,
+    'textract.analyze_id': 1.0}
+
+worker_tmp_folder = None
+
+def list_zip_keys(bucket, prefix):
+    """
+    This function lists the .zip files under an S3 prefix, one page of at most 1000 keys at a time.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    prefix: S3 prefix, e.g. 'zipped/'
+
+    Returns:
+
+    A generator of the keys. Exceptions are raised to the caller.
+
+    """
+    paginator = get_client('s3').get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket = bucket, Prefix = prefix):
+        for content in page.get('Contents', []):
+            if content['Key'].endswith('.zip'):
+                yield content['Key']
+
+def read_checkpoint(checkpoint_filename):
+    """
+    This function reads the results of a previous run of the backfill (one JSON line per application).
+
+    Parameters:
+
+    checkpoint_filename: The checkpoint filename
+
+    Returns:
+
+    A dictionary of key to its result. An empty dictionary if there is no checkpoint.
+
+    """
+    results = {}
+    if os.path.exists(checkpoint_filename):
+        with open(checkpoint_filename) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result['key']] = result
+    return results
+
+def get_shards(keys, shard_size):
+    """
+    This function splits the keys in shards of at most shard_size keys. The shards are small,
+    so a process that gets slow applications does not hold back the others.
+
+    Parameters:
+
+    keys: An iterable of keys
+    shard_size: Number of keys per shard
+
+    Returns:
+
+    A generator of the lists of keys
+
+    """
+    shard = []
+    for key in keys:
+        shard.append(key)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+def init_worker(api_rate_limits, processes):
+    """
+    This function initializes a process of the pool: its share of the rate limits, and its own temporary folder.
+    A forked process does not share the AWS clients of the parent, which is still listing the keys
+    (see reset_aws_services() in aws_services.py).
+
+    Parameters:
+
+    api_rate_limits: The rate limits of the whole backfill (see DEFAULT_API_RATE_LIMITS)
+    processes: Number of processes of the pool
+
+    Returns:
+
+    None
+
+    """
+    global worker_tmp_folder
+    set_api_rate_limits({operation: rate / processes for operation, rate in api_rate_limits.items()})
+    worker_tmp_folder = tempfile.mkdtemp(prefix='backfill_') + '/'
+
+def backfill_shard(bucket, keys, verbose = False, notify = False):
+    """
+    This function runs the verification pipeline (see process_application()) for the applications of a shard,
+    in a process of the pool. The output of the pipeline is discarded, unless verbose is True.
+    The applications are verified again even if they were completed (reverify), and they keep their license
+    submission. No email is sent and no license is sent to SQS, unless notify is True.
+
+    Parameters:
+
+    bucket: S3 bucket name
+    keys: The keys of the .zip files
+    verbose: True to keep the output of the pipeline
+    notify: True to send the emails and the licenses of the applications
+
+    Returns:
+
+    A list of the results: a dictionary per application with 'key', 'appuuid', 'ok', 'stored', 'error' and 'seconds'
+
+    """
+    results = []
+    os.makedirs(worker_tmp_folder, exist_ok=True)
+    for key in keys:
+        application = {'appuuid': '', 'stored': False}
+        valerror = {'error': ''}
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            ok = process_application(bucket, key, worker_tmp_folder, LAMBDA_UNZIPPED_FOLDER, BUCKET_UNZIPPED_PREFIX,
+                                     application, valerror, reverify = True, notify = notify)
+        results.append({'key': key,
+                        'appuuid': application['appuuid'],
+                        'ok': ok,
+                        'stored': application['stored'],
+                        'error': str(valerror['error']) if not ok else '',
+                        'seconds': round(time.perf_counter() - start, 3)})
+    # The downloaded .zip files and the unzipped files of the shard
+    shutil.rmtree(worker_tmp_folder, ignore_errors=True)
+    return results
+
+def run_backfill(bucket, prefix, checkpoint_filename, processes = DEFAULT_PROCESSES, shard_size = DEFAULT_SHARD_SIZE,
+                 api_rate_limits = None, retry_failed = False, verbose = False, notify = False):
+    """
+    This function re-verifies the applications (.zip files) under an S3 prefix with a pool of processes.
+    The result of each application is appended to the checkpoint file as soon as its shard is done, so a
+    backfill that is stopped continues where it stopped. At most 2 shards per process are in flight, so the
+    first results are checkpointed while the prefix is still listed. The applications that failed are skipped too,
+    unless retry_failed is True. No email is sent and no license is sent to SQS, unless notify is True
+    (see backfill_shard()).
+
+    Parameters:
+
+    bucket: S3 bucket name
+    prefix: S3 prefix of the .zip files, e.g. 'zipped/'
+    checkpoint_filename: The checkpoint filename (JSON lines)
+    processes: Number of processes of the pool
+    shard_size: Number of applications per shard
+    api_rate_limits: The rate limits of the whole backfill. Default: DEFAULT_API_RATE_LIMITS
+    retry_failed: True to process the applications that failed in a previous run
+    verbose: True to keep the output of the pipeline
+    notify: True to send the emails and the licenses of the applications
+
+    Returns:
+
+    The summary report: a dictionary with 'listed', 'skipped', 'processed', 'succeeded', 'failed', 'not_stored',
+    'errors' (most common errors), 'seconds' and 'applications_per_hour'. Exceptions are raised to the caller.
+
+    """
+    previous_results = read_checkpoint(checkpoint_filename)
+    done_keys = {key for key, result in previous_results.items() if result['ok'] or not retry_failed}
+
+    summary = {'listed': 0, 'skipped': 0, 'processed': 0, 'succeeded': 0, 'failed': 0, 'not_stored': 0}
+    errors = collections.Counter()
+
+    def pending_keys():
+        for key in list_zip_keys(bucket, prefix):
+            summary['listed'] += 1
+            if key in done_keys:
+                summary['skipped'] += 1
+                continue
+            yield key
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers = processes,
+                             initializer = init_worker,
+                             initargs = (api_rate_limits or DEFAULT_API_RATE_LIMITS, processes)) as executor, \
+         open(checkpoint_filename, 'a') as checkpoint:
+        def record_results(future):
+            for result in future.result():
+                checkpoint.write(json.dumps(result) + '\n')
+                summary['processed'] += 1
+                if result['ok']:
+                    summary['succeeded'] += 1
+                else:
+                    summary['failed'] += 1
+                    errors[result['error']] += 1
+                if not result['stored']:
+                    summary['not_stored'] += 1
+            checkpoint.flush()
+
+        # In-flight shards
+        in_flight = set()
+        for shard in get_shards(pending_keys(), shard_size):
+            if len(in_flight) >= 2 * processes:
+                done, in_flight = wait(in_flight, return_when = FIRST_COMPLETED)
+                for future in done:
+                    record_results(future)
+            in_flight.add(executor.submit(backfill_shard, bucket, shard, verbose, notify))
+        done, _ = wait(in_flight)
+        for future in done:
+            record_results(future)
+
+    summary['seconds'] = round(time.perf_counter() - start, 1)
+    summary['applications_per_hour'] = round(summary['processed'] * 3600 / summary['seconds']) if summary['seconds'] > 0 else 0
+    summary['errors'] = errors.most_common(10)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-verify the applications (.zip files) under an S3 prefix.')
+    parser.add_argument('bucket', help='S3 bucket name')
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX, help='S3 prefix of the .zip files')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.jsonl', help='The checkpoint file (JSON lines)')
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help='Number of processes')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help='Number of applications per shard')
+    parser.add_argument('--rate', action='append', default=[], metavar='OPERATION=RATE',
+                        help='Rate limit of an operation for the whole backfill, in calls per second, '
+                             'e.g. textract.analyze_id=2. Can be repeated.')
+    parser.add_argument('--retry-failed', action='store_true', help='Process the applications that failed in a previous run')
+    parser.add_argument('--verbose', action='store_true', help='Keep the output of the pipeline')
+    parser.add_argument('--notify', action='store_true',
+                        help='Send the emails, and the licenses to SQS, like the Lambda function. By default, nothing is sent')
+    args = parser.parse_args()
+    if not os.environ.get('TABLE'):
+        parser.error('TABLE must be set, like in the Lambda function')
+
+    api_rate_limits = dict(DEFAULT_API_RATE_LIMITS)
+    for rate in args.rate:
+        operation, _, value = rate.partition('=')
+        api_rate_limits[operation] = float(value)
+
+    summary = run_backfill(args.bucket, args.prefix, args.checkpoint, args.processes, args.shard_size,
+                           api_rate_limits, args.retry_failed, args.verbose, args.notify)
+    print(json.dumps(summary, indent=1))
+    sys.exit(1 if summary['failed'] else 0)
+
+if __name__ == '__main__':
+
+    main()
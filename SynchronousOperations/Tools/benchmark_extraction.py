@@ -0,0 +1,112 @@
+import argparse
+import random
+import sys
+import os
+import timeit
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+from SynchronousOperations.DocumentLambdaFunction.app import extract_customer_fields
+from SynchronousOperations.DocumentLambdaFunction.app import CustomerDetails
+
+# Field types returned by analyze_id() that are not in CUSTOMER_INFORMATION
+OTHER_FIELD_TYPES = ['SUFFIX', 'CITY_IN_ADDRESS', 'ZIP_CODE_IN_ADDRESS', 'STATE_IN_ADDRESS', 'COUNTY', 'EXPIRATION_DATE',
+                     'DATE_OF_ISSUE', 'ID_TYPE', 'ENDORSEMENTS', 'VETERAN', 'RESTRICTIONS', 'CLASS', 'PLACE_OF_BIRTH',
+                     'STATE_NAME', 'MRZ_CODE']
+
+def create_response(documents, rng):
+    """
+    This function creates a synthetic analyze_id() response, with all the field types of each document in random order.
+
+    Parameters:
+
+    documents: The number of IdentityDocuments in the response
+    rng: A random.Random
+
+    Returns:
+
+    A dictionary like the response of analyze_id()
+
+    """
+    identity_documents = []
+    for index in range(documents):
+        field_types = CUSTOMER_INFORMATION + OTHER_FIELD_TYPES
+        rng.shuffle(field_types)
+        fields = [{'Type': {'Text': field_type},
+                   'ValueDetection': {'Text': '' if rng.random() < 0.2 else f'{field_type} {index}',
+                                      'Confidence': rng.uniform(50, 100)}}
+                  for field_type in field_types]
+        identity_documents.append({'DocumentIndex': index + 1, 'IdentityDocumentFields': fields})
+    return {'DocumentMetadata': {'Pages': documents}, 'IdentityDocuments': identity_documents}
+
+def baseline_extraction(response):
+    """
+    This function is the extraction before the compiled spec: each field type is searched in the CUSTOMER_INFORMATION list.
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+
+    Returns:
+
+    A CustomerDetails
+
+    """
+    extracted_info = {}
+    for document_dict in response['IdentityDocuments']:
+        for field in document_dict['IdentityDocumentFields']:
+            if field['Type']['Text'] in CUSTOMER_INFORMATION and not extracted_info.get(field['Type']['Text']):
+                extracted_info[field['Type']['Text']] = field['ValueDetection']['Text']
+    return CustomerDetails.from_payload(extracted_info)
+
+def compiled_extraction(response):
+    """
+    This function is the compiled extraction (see extract_customer_fields()).
+
+    Parameters:
+
+    response: A dictionary response from the analyze_id() function.
+
+    Returns:
+
+    A CustomerDetails
+
+    """
+    values, confidences = extract_customer_fields(response)
+    return CustomerDetails(values)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the parse cost of batches of analyze_id() responses.')
+    parser.add_argument('--responses', type=int, default=10000, help='Number of responses in the batch')
+    parser.add_argument('--documents', type=int, default=2, help='Number of documents in each response')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs; the best is reported')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    responses = [create_response(args.documents, rng) for _ in range(args.responses)]
+
+    # Both extractions must return the same details
+    for response in responses[:100]:
+        assert baseline_extraction(response).normalized == compiled_extraction(response).normalized
+
+    print(f'{args.responses} responses, {args.documents} documents per response:')
+    for name, extraction in (('baseline', baseline_extraction), ('compiled', compiled_extraction)):
+        best = min(timeit.repeat(lambda: [extraction(response) for response in responses], number=1, repeat=args.repeat))
+        print(f'{name}: {best * 1000:.1f} ms, {best * 1e6 / args.responses:.2f} us per response')
+
+if __name__ == '__main__':
+
+    main()
+
+    # Remove the same path from sys.path when finished
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import sys
+import os
+import time
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+
+DEFAULT_DLQ_NAME = 'LicenseDeadLetterQueue'
+DEFAULT_QUEUE_NAME = 'LicenseQueue'
+SQS_MAX_BATCH = 10 # The SQS batch calls, and receive_message(), take at most 10 messages
+DDB_MAX_BATCH_GET = 100
+DEFAULT_RATE = 1.0
+DEFAULT_MAX_QUEUE_DEPTH = 20
+DEFAULT_VISIBILITY_TIMEOUT = 900
+QUEUE_DEPTH_WAIT_SECONDS = 10
+EMPTY_RECEIVES_TO_STOP = 3
+UNKNOWN_ERROR_CLASS = 'unknown'
+
+def get_message_appuuid(message):
+    """
+    This function returns the customer's ID of a LicenseQueue message: 'app_uuid' (AsynchronousOperations)
+    or 'uuid' (SynchronousOperations) in its JSON body.
+
+    Parameters:
+
+    message: A message of receive_message()
+
+    Returns:
+
+    The customer's ID. Otherwise, None
+
+    """
+    try:
+        payload = json.loads(message['Body'])
+        return payload.get('app_uuid') or payload.get('uuid')
+    except (ValueError, AttributeError):
+        return None
+
+def get_submit_errors(table_name, appuuids):
+    """
+    This function returns the class of the error that stopped the submission of each driver license
+    (LICENSE_SUBMIT_ERROR, see record_submit_error() in SubmitLicenseLambdaFunction).
+
+    Parameters:
+
+    table_name: DynamoDB table name
+    appuuids: The customer's IDs
+
+    Returns:
+
+    A dictionary of customer's ID to its error class. UNKNOWN_ERROR_CLASS if no error was stored,
+    e.g. the function timed out. Exceptions are raised to the caller.
+
+    """
+    errors = {appuuid: UNKNOWN_ERROR_CLASS for appuuid in appuuids}
+    appuuids = list(errors)
+    for start in range(0, len(appuuids), DDB_MAX_BATCH_GET):
+        keys = [{'APP_UUID': {'S': appuuid}} for appuuid in appuuids[start:start + DDB_MAX_BATCH_GET]]
+        request_items = {table_name: {'Keys': keys, 'ProjectionExpression': 'APP_UUID, LICENSE_SUBMIT_ERROR'}}
+        while request_items:
+            response = get_client('dynamodb').batch_get_item(RequestItems = request_items)
+            for item in response['Responses'].get(table_name, []):
+                if 'LICENSE_SUBMIT_ERROR' in item:
+                    errors[item['APP_UUID']['S']] = item['LICENSE_SUBMIT_ERROR']['S']
+            request_items = response.get('UnprocessedKeys') or {}
+    return errors
+
+def read_progress(progress_filename):
+    """
+    This function reads the IDs of the DLQ messages that were already sent to the queue by a previous replay.
+
+    Parameters:
+
+    progress_filename: The progress filename (one message ID per line)
+
+    Returns:
+
+    A set of message IDs. An empty set if there is no progress file.
+
+    """
+    if not os.path.exists(progress_filename):
+        return set()
+    with open(progress_filename) as f:
+        return {line.strip() for line in f if line.strip()}
+
+def wait_for_queue_depth(queue_url, max_queue_depth, stats):
+    """
+    This function waits until the queue has at most max_queue_depth messages, so the replay does not
+    send messages faster than SubmitLicenseLambdaFunction and the third-party API can take them.
+
+    Parameters:
+
+    queue_url: URL of the queue
+    max_queue_depth: Maximum number of visible and in-flight messages. 0 does not wait.
+    stats: Returned dictionary: 'depth_waits' is updated
+
+    Returns:
+
+    None. Exceptions are raised to the caller.
+
+    """
+    while max_queue_depth > 0:
+        attributes = get_client('sqs').get_queue_attributes(
+            QueueUrl = queue_url,
+            AttributeNames = ['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])['Attributes']
+        depth = int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+        if depth <= max_queue_depth:
+            return
+        stats['depth_waits'] += 1
+        print(f'{depth} messages in the queue, waiting {QUEUE_DEPTH_WAIT_SECONDS} s')
+        time.sleep(QUEUE_DEPTH_WAIT_SECONDS)
+
+def replay_messages(dlq_url, queue_url, progress_filename, appuuids = None, error_classes = None, table_name = None,
+                    rate = DEFAULT_RATE, max_queue_depth = DEFAULT_MAX_QUEUE_DEPTH, max_messages = None,
+                    visibility_timeout = DEFAULT_VISIBILITY_TIMEOUT, dry_run = False):
+    """
+    This function moves the selected messages of the dead-letter queue back to the queue, at most rate messages per second.
+    The messages read from the dead-letter queue stay hidden during the replay, so each message is read once per replay.
+    The messages that were not replayed are made visible again at the end.
+
+    A message is deleted from the dead-letter queue after it is sent to the queue, and its ID is appended to the progress
+    file in between. If the replay is interrupted after a message was sent, the next replay deletes it without sending it again.
+
+    Parameters:
+
+    dlq_url: URL of the dead-letter queue
+    queue_url: URL of the queue
+    progress_filename: The progress filename
+    appuuids: Only replay the messages of these customer's IDs (optional)
+    error_classes: Only replay the messages whose LICENSE_SUBMIT_ERROR is one of these classes, e.g. ['ConnectionError'],
+                   or UNKNOWN_ERROR_CLASS (optional). table_name is required.
+    table_name: DynamoDB table name
+    rate: Maximum number of messages sent per second
+    max_queue_depth: Maximum number of messages in the queue before a batch is sent (see wait_for_queue_depth())
+    max_messages: Maximum number of messages to replay (optional)
+    visibility_timeout: Seconds the messages read from the dead-letter queue stay hidden if the replay is interrupted
+    dry_run: True to only count the selected messages
+
+    Returns:
+
+    A dictionary of the statistics: 'received', 'selected', 'sent', 'resumed' (deleted without being sent again),
+    'failed', 'depth_waits' and 'seconds'. Exceptions are raised to the caller.
+
+    """
+    sqs = get_client('sqs')
+    sent_ids = read_progress(progress_filename)
+    stats = {'received': 0, 'selected': 0, 'sent': 0, 'resumed': 0, 'failed': 0, 'depth_waits': 0}
+    appuuids = set(appuuids) if appuuids else None
+    start = time.perf_counter()
+    next_send = time.monotonic()
+    empty_receives = 0
+    # The receipt handles of the messages that stay in the dead-letter queue
+    kept = []
+
+    with open(progress_filename, 'a') as progress:
+        while max_messages is None or stats['selected'] < max_messages:
+            batch_size = SQS_MAX_BATCH if max_messages is None else min(SQS_MAX_BATCH, max_messages - stats['selected'])
+            messages = sqs.receive_message(QueueUrl = dlq_url,
+                                           MaxNumberOfMessages = batch_size,
+                                           MessageAttributeNames = ['All'],
+                                           VisibilityTimeout = visibility_timeout,
+                                           WaitTimeSeconds = 1).get('Messages', [])
+            if not messages:
+                empty_receives += 1
+                if empty_receives >= EMPTY_RECEIVES_TO_STOP:
+                    break
+                continue
+            empty_receives = 0
+            stats['received'] += len(messages)
+            received = messages
+
+            # Select the messages
+            if appuuids is not None:
+                messages = [message for message in messages if get_message_appuuid(message) in appuuids]
+            if error_classes:
+                submit_errors = get_submit_errors(table_name, {get_message_appuuid(message) for message in messages} - {None})
+                messages = [message for message in messages
+                            if submit_errors.get(get_message_appuuid(message), UNKNOWN_ERROR_CLASS) in error_classes]
+            stats['selected'] += len(messages)
+            if dry_run or not messages:
+                kept.extend(message['ReceiptHandle'] for message in received)
+                continue
+
+            # The messages that were sent by an interrupted replay are only deleted
+            resumed = [message for message in messages if message['MessageId'] in sent_ids]
+            to_send = [message for message in messages if message['MessageId'] not in sent_ids]
+            stats['resumed'] += len(resumed)
+
+            sent = []
+            if to_send:
+                wait_for_queue_depth(queue_url, max_queue_depth, stats)
+                # Space the batches, so that at most rate messages are sent per second
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.monotonic()) + len(to_send) / rate
+
+                entries = [{'Id': str(index), 'MessageBody': message['Body']} for index, message in enumerate(to_send)]
+                for entry, message in zip(entries, to_send):
+                    if message.get('MessageAttributes'):
+                        entry['MessageAttributes'] = message['MessageAttributes']
+                response = sqs.send_message_batch(QueueUrl = queue_url, Entries = entries)
+                sent = [to_send[int(entry['Id'])] for entry in response.get('Successful', [])]
+                stats['failed'] += len(response.get('Failed', []))
+                for message in sent:
+                    progress.write(message['MessageId'] + '\n')
+                progress.flush()
+                stats['sent'] += len(sent)
+
+            to_delete = resumed + sent
+            if to_delete:
+                sqs.delete_message_batch(QueueUrl = dlq_url,
+                                         Entries = [{'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                                                    for index, message in enumerate(to_delete)])
+            deleted = {message['ReceiptHandle'] for message in to_delete}
+            kept.extend(message['ReceiptHandle'] for message in received if message['ReceiptHandle'] not in deleted)
+
+    # The messages that were not replayed can be read again right away
+    for index in range(0, len(kept), SQS_MAX_BATCH):
+        sqs.change_message_visibility_batch(QueueUrl = dlq_url,
+                                            Entries = [{'Id': str(position), 'ReceiptHandle': receipt_handle, 'VisibilityTimeout': 0}
+                                                       for position, receipt_handle in enumerate(kept[index:index + SQS_MAX_BATCH])])
+
+    stats['seconds'] = round(time.perf_counter() - start, 1)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the messages of the license dead-letter queue at a controlled rate.')
+    parser.add_argument('--dlq', default=DEFAULT_DLQ_NAME, help='Name of the dead-letter queue')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE_NAME, help='Name of the queue')
+    parser.add_argument('--progress', default='dlq_replay_progress.txt', help='The progress file (one message ID per line)')
+    parser.add_argument('--app-uuid', action='append', default=[], help='Only replay the messages of this customer\'s ID. Can be repeated.')
+    parser.add_argument('--error-class', action='append', default=[],
+                        help=f'Only replay the messages whose LICENSE_SUBMIT_ERROR is this class, e.g. ConnectionError, '
+                             f'or {UNKNOWN_ERROR_CLASS}. Can be repeated.')
+    parser.add_argument('--table', default=os.environ.get('TABLE'), help='DynamoDB table name, for --error-class (default: $TABLE)')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Maximum number of messages sent per second')
+    parser.add_argument('--max-queue-depth', type=int, default=DEFAULT_MAX_QUEUE_DEPTH,
+                        help='Wait while the queue has more messages than this. 0 does not wait.')
+    parser.add_argument('--max-messages', type=int, help='Maximum number of messages to replay')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the selected messages')
+    args = parser.parse_args()
+    if args.error_class and not args.table:
+        parser.error('--table is required with --error-class when TABLE is not set')
+
+    sqs = get_client('sqs')
+    stats = replay_messages(sqs.get_queue_url(QueueName = args.dlq)['QueueUrl'],
+                            sqs.get_queue_url(QueueName = args.queue)['QueueUrl'],
+                            args.progress,
+                            appuuids = args.app_uuid,
+                            error_classes = args.error_class,
+                            table_name = args.table,
+                            rate = args.rate,
+                            max_queue_depth = args.max_queue_depth,
+                            max_messages = args.max_messages,
+                            dry_run = args.dry_run)
+    print(json.dumps(stats, indent=1))
+    sys.exit(1 if stats['failed'] else 0)
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import random
+import sys
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+from SynchronousOperations.DocumentLambdaFunction.app import CustomerDetails
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+
+# BatchWriteItem writes at most 25 items per call. The items that DynamoDB could not write (UnprocessedItems)
+# are written again after an exponential backoff with full jitter, at most BATCH_WRITE_MAX_ATTEMPTS times.
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ATTEMPTS = 8
+BATCH_WRITE_BASE_DELAY_SECONDS = 0.05
+BATCH_WRITE_MAX_DELAY_SECONDS = 5
+DEFAULT_WORKERS = 4
+
+def read_manifest(manifest_filename, stats):
+    """
+    This function reads the manifest .csv file one row at a time: the same columns as the <app_uuid>_details.csv
+    files, with APP_UUID. The rows without APP_UUID or a CUSTOMER_INFORMATION column are rejected.
+
+    Parameters:
+
+    manifest_filename: The manifest .csv filename
+    stats: Returned dictionary. 'rejected' is the list of the rejected line numbers.
+
+    Returns:
+
+    A generator of the DynamoDB items, in the low-level DynamoDB format (see CustomerDetails.to_ddb_item())
+
+    """
+    with open(manifest_filename, newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            appuuid = row.get('APP_UUID')
+            if not appuuid or any(row.get(name) is None for name in CUSTOMER_INFORMATION):
+                stats['rejected'].append(reader.line_num)
+                continue
+            yield CustomerDetails(row[name] for name in CUSTOMER_INFORMATION).to_ddb_item(appuuid)
+
+def get_batches(items):
+    """
+    This function groups the items in batches of at most BATCH_WRITE_MAX_ITEMS. A batch cannot have
+    the same APP_UUID twice, so a repeated APP_UUID starts a new batch (the last row is kept).
+
+    Parameters:
+
+    items: An iterable of DynamoDB items, in the low-level DynamoDB format
+
+    Returns:
+
+    A generator of the lists of items
+
+    """
+    batch = {}
+    for item in items:
+        appuuid = item['APP_UUID']['S']
+        if appuuid in batch or len(batch) == BATCH_WRITE_MAX_ITEMS:
+            yield list(batch.values())
+            batch = {}
+        batch[appuuid] = item
+    if batch:
+        yield list(batch.values())
+
+def write_batch(table_name, items, stats, stats_lock):
+    """
+    This function writes a batch of items with BatchWriteItem, and writes the UnprocessedItems again
+    after an exponential backoff with full jitter.
+
+    Parameters:
+
+    table_name: DynamoDB table name
+    items: A list of at most BATCH_WRITE_MAX_ITEMS items, in the low-level DynamoDB format
+    stats: Returned dictionary: 'written', 'retries', 'failed' and 'consumed_capacity' are updated
+    stats_lock: The lock of stats
+
+    Returns:
+
+    The number of items that were not written. Exceptions are raised to the caller.
+
+    """
+    request_items = {table_name: [{'PutRequest': {'Item': item}} for item in items]}
+    retries = 0
+    consumed_capacity = 0
+    for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        if attempt > 0:
+            retries += 1
+            time.sleep(random.uniform(0, min(BATCH_WRITE_MAX_DELAY_SECONDS, BATCH_WRITE_BASE_DELAY_SECONDS * 2 ** attempt)))
+        response = get_client('dynamodb').batch_write_item(RequestItems = request_items, ReturnConsumedCapacity = 'TOTAL')
+        consumed_capacity += sum(capacity.get('CapacityUnits', 0) for capacity in response.get('ConsumedCapacity', []))
+        request_items = response.get('UnprocessedItems') or {}
+        if not request_items:
+            break
+
+    unprocessed = len(request_items.get(table_name, []))
+    with stats_lock:
+        stats['written'] += len(items) - unprocessed
+        stats['failed'] += unprocessed
+        stats['retries'] += retries
+        stats['consumed_capacity'] += consumed_capacity
+    return unprocessed
+
+def ingest_manifest(manifest_filename, table_name, workers = DEFAULT_WORKERS):
+    """
+    This function writes the applications of a manifest .csv file to the DynamoDB table, like
+    update_ddb_with_customer_info() does for one application. The manifest is read one row at a time,
+    and at most 2 batches per worker are in flight, so the memory does not grow with the manifest.
+    A repeated APP_UUID keeps its last row. The duplicate driver licenses are not flagged
+    (see find_applications_with_document_number()).
+
+    Parameters:
+
+    manifest_filename: The manifest .csv filename
+    table_name: DynamoDB table name
+    workers: Number of concurrent BatchWriteItem calls
+
+    Returns:
+
+    A dictionary of the statistics: 'written', 'failed' (after BATCH_WRITE_MAX_ATTEMPTS), 'rejected'
+    (line numbers), 'batches', 'retries', 'consumed_capacity' (write capacity units), 'seconds' and
+    'items_per_second'. Exceptions are raised to the caller.
+
+    """
+    stats = {'written': 0, 'failed': 0, 'rejected': [], 'batches': 0, 'retries': 0, 'consumed_capacity': 0}
+    stats_lock = threading.Lock()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        # In-flight batches and their APP_UUIDs
+        in_flight = {}
+        for batch in get_batches(read_manifest(manifest_filename, stats)):
+            appuuids = {item['APP_UUID']['S'] for item in batch}
+            # A repeated APP_UUID is written after the batch of the previous row, so the last row is kept
+            conflicts = [future for future, keys in in_flight.items() if keys & appuuids]
+            if conflicts or len(in_flight) >= 2 * workers:
+                done, _ = wait(conflicts or in_flight, return_when = ALL_COMPLETED if conflicts else FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    del in_flight[future]
+            in_flight[executor.submit(write_batch, table_name, batch, stats, stats_lock)] = appuuids
+            stats['batches'] += 1
+        for future in in_flight:
+            future.result()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['items_per_second'] = stats['written'] / stats['seconds'] if stats['seconds'] > 0 else 0
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the applications of a manifest .csv file to the DynamoDB table.')
+    parser.add_argument('manifest', help='The manifest .csv file: APP_UUID and the columns of <app_uuid>_details.csv')
+    parser.add_argument('--table', default=os.environ.get('TABLE'), help='DynamoDB table name (default: $TABLE)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of concurrent BatchWriteItem calls')
+    args = parser.parse_args()
+    if not args.table:
+        parser.error('--table is required when TABLE is not set')
+
+    stats = ingest_manifest(args.manifest, args.table, args.workers)
+    print(f'{stats["written"]} applications written in {stats["seconds"]:.1f} s ({stats["items_per_second"]:.0f} per second), '
+          f'{stats["batches"]} batches, {stats["retries"]} retries, {stats["consumed_capacity"]:.0f} write capacity units')
+    if stats['failed']:
+        print(f'{stats["failed"]} applications were not written after {BATCH_WRITE_MAX_ATTEMPTS} attempts')
+    if stats['rejected']:
+        print(f'Rejected lines (no APP_UUID or missing columns): {stats["rejected"]}')
+    sys.exit(1 if stats['failed'] else 0)
+
+if __name__ == '__main__':
+
+    main()
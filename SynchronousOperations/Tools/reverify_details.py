@@ -0,0 +1,234 @@
+import argparse
+import csv
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+# numpy.strings (NumPy 2) has the fast string ufuncs. numpy.char has the same functions.
+numpy_strings = getattr(numpy, 'strings', numpy.char)
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+from SynchronousOperations.DocumentLambdaFunction.app import DETAILS_MATCHING_EXACT
+from SynchronousOperations.DocumentLambdaFunction.app import DETAILS_MATCHING_NORMALIZED
+from SynchronousOperations.DocumentLambdaFunction.app import get_details_matching
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import normalize_customer_value
+
+# The ASCII whitespace characters (tab to carriage return) are replaced by a space (see normalize_columns())
+ASCII_WHITESPACE = (0x09, 0x0d)
+ASCII_MAX = 0x7f
+DEFAULT_SCAN_SEGMENTS = 8
+
+def scan_segment(table_name, segment, total_segments):
+    """
+    This function reads one segment of a parallel scan of the DynamoDB table with the low-level DynamoDB client.
+    Only the customer's details, the extracted details (EXTRACTED_DETAILS) and LICENSE_DETAILS_MATCH are read.
+
+    Parameters:
+
+    table_name: DynamoDB table name
+    segment: The segment to read, from 0 to total_segments - 1
+    total_segments: Number of segments of the scan
+
+    Returns:
+
+    A list of the items, in the low-level DynamoDB format. Exceptions are raised to the caller.
+
+    """
+    paginator = get_client('dynamodb').get_paginator('scan')
+    items = []
+    for page in paginator.paginate(TableName = table_name,
+                                   Segment = segment,
+                                   TotalSegments = total_segments,
+                                   ProjectionExpression = ', '.join(['APP_UUID', 'EXTRACTED_DETAILS', 'LICENSE_DETAILS_MATCH'] +
+                                                                   CUSTOMER_INFORMATION)):
+        items.extend(page['Items'])
+    return items
+
+def load_columns(items):
+    """
+    This function loads the items of the DynamoDB table into column arrays: one row per application,
+    and one column per CUSTOMER_INFORMATION field. The applications without EXTRACTED_DETAILS
+    (e.g. not verified yet) are skipped.
+
+    Parameters:
+
+    items: The items in the low-level DynamoDB format (see scan_segment())
+
+    Returns:
+
+    A dictionary of NumPy arrays: 'appuuid', 'submitted' and 'extracted' (strings, a missing field is ''),
+    and 'stored_match' (LICENSE_DETAILS_MATCH). 'skipped' is the number of skipped applications.
+
+    """
+    appuuids = []
+    submitted = []
+    extracted = []
+    stored_match = []
+    for item in items:
+        extracted_details = item.get('EXTRACTED_DETAILS')
+        if extracted_details is None:
+            continue
+        extracted_details = extracted_details['M']
+        appuuids.append(item['APP_UUID']['S'])
+        submitted.append([item[name]['S'] if name in item else '' for name in CUSTOMER_INFORMATION])
+        extracted.append([extracted_details[name]['S'] if name in extracted_details else '' for name in CUSTOMER_INFORMATION])
+        stored_match.append(item.get('LICENSE_DETAILS_MATCH', {}).get('BOOL', False))
+
+    shape = (len(appuuids), len(CUSTOMER_INFORMATION))
+    return {'appuuid': numpy.array(appuuids, dtype=str),
+            'submitted': numpy.array(submitted, dtype=str).reshape(shape),
+            'extracted': numpy.array(extracted, dtype=str).reshape(shape),
+            'stored_match': numpy.array(stored_match, dtype=bool),
+            'skipped': len(items) - len(appuuids)}
+
+def normalize_columns(columns):
+    """
+    This function normalizes column arrays of customer's details, like normalize_customer_value() does
+    for one detail: upper case, without leading, trailing or repeated spaces. The ASCII letters and
+    whitespace are converted on the code points of the whole array at once; the details with other
+    characters (e.g. accented letters) are normalized by normalize_customer_value().
+
+    Parameters:
+
+    columns: A NumPy array of strings
+
+    Returns:
+
+    The NumPy array of the normalized strings
+
+    """
+    normalized = numpy.array(columns, dtype=str)
+    if normalized.size == 0:
+        return normalized
+    codes = normalized.view(numpy.uint32).reshape(normalized.shape + (-1,))
+    codes[(codes >= ASCII_WHITESPACE[0]) & (codes <= ASCII_WHITESPACE[1])] = ord(' ')
+    codes[(codes >= ord('a')) & (codes <= ord('z'))] -= ord('a') - ord('A')
+
+    # Collapse the repeated spaces: each pass halves the longest run of spaces
+    repeated = numpy_strings.find(normalized, '  ') >= 0
+    while repeated.any():
+        normalized[repeated] = numpy_strings.replace(normalized[repeated], '  ', ' ')
+        repeated = numpy_strings.find(normalized, '  ') >= 0
+    normalized = numpy_strings.strip(normalized)
+
+    non_ascii = (codes > ASCII_MAX).any(axis=-1)
+    if non_ascii.any():
+        values = numpy.array([normalize_customer_value(value) for value in numpy.asarray(columns, dtype=str)[non_ascii].tolist()],
+                             dtype=str)
+        # e.g. 'ß' is 'SS' in upper case
+        if values.itemsize > normalized.itemsize:
+            normalized = normalized.astype(values.dtype)
+        normalized[non_ascii] = values
+    return normalized
+
+def compare_columns(columns, normalized = False):
+    """
+    This function compares the submitted and the extracted details of each application, field by field,
+    like is_matching_customer_info() does. With normalized, only the details that differ before normalization
+    are normalized.
+
+    Parameters:
+
+    columns: The column arrays (see load_columns())
+    normalized: True to compare the normalized details (DETAILS_MATCHING_NORMALIZED). Otherwise, the details must be equal
+
+    Returns:
+
+    The mismatch matrix: a boolean NumPy array with one row per application and one column per
+    CUSTOMER_INFORMATION field, which is True if the field does not match
+
+    """
+    mismatch = columns['submitted'] != columns['extracted']
+    if normalized:
+        mismatch[mismatch] = normalize_columns(columns['submitted'][mismatch]) != normalize_columns(columns['extracted'][mismatch])
+    return mismatch
+
+def write_mismatch_matrix(output_filename, columns, mismatch):
+    """
+    This function writes the mismatch matrix to a .csv file: one row per application, with a 0/1 column per
+    CUSTOMER_INFORMATION field, the new verdict (LICENSE_DETAILS_MATCH) and the stored verdict.
+
+    Parameters:
+
+    output_filename: The .csv filename
+    columns: The column arrays (see load_columns())
+    mismatch: The mismatch matrix (see compare_columns())
+
+    Returns:
+
+    None. Exceptions are raised to the caller.
+
+    """
+    verdict = ~mismatch.any(axis=1)
+    with open(output_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['APP_UUID'] + CUSTOMER_INFORMATION + ['LICENSE_DETAILS_MATCH', 'STORED_LICENSE_DETAILS_MATCH'])
+        for appuuid, row, match, stored in zip(columns['appuuid'].tolist(), mismatch.astype(int).tolist(),
+                                               verdict.tolist(), columns['stored_match'].tolist()):
+            writer.writerow([appuuid] + row + [match, stored])
+
+def reverify_table(table_name, segments = DEFAULT_SCAN_SEGMENTS, normalized = False):
+    """
+    This function re-verifies the customer's details of all the applications of the DynamoDB table.
+    The segments of the table are scanned concurrently.
+
+    Parameters:
+
+    table_name: DynamoDB table name
+    segments: Number of segments of the parallel scan
+    normalized: True to compare the normalized details (see compare_columns())
+
+    Returns:
+
+    A tuple of the column arrays (see load_columns()) and the mismatch matrix (see compare_columns()).
+    Exceptions are raised to the caller.
+
+    """
+    with ThreadPoolExecutor(max_workers = segments) as executor:
+        pages = executor.map(lambda segment: scan_segment(table_name, segment, segments), range(segments))
+        items = [item for page in pages for item in page]
+    columns = load_columns(items)
+    return columns, compare_columns(columns, normalized)
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-verify the customer\'s details of all the applications in the DynamoDB table.')
+    parser.add_argument('--table', default=os.environ.get('TABLE'), help='DynamoDB table name (default: $TABLE)')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SCAN_SEGMENTS, help='Number of segments of the parallel scan')
+    parser.add_argument('--output', default='mismatch_matrix.csv', help='The .csv file of the mismatch matrix')
+    parser.add_argument('--matching', choices=[DETAILS_MATCHING_EXACT, DETAILS_MATCHING_NORMALIZED], default=get_details_matching(),
+                        help='How the details are compared (default: $DETAILS_MATCHING, or exact)')
+    args = parser.parse_args()
+    if not args.table:
+        parser.error('--table is required when TABLE is not set')
+
+    start = time.perf_counter()
+    columns, mismatch = reverify_table(args.table, args.segments, args.matching == DETAILS_MATCHING_NORMALIZED)
+    write_mismatch_matrix(args.output, columns, mismatch)
+
+    verdict = ~mismatch.any(axis=1)
+    print(f'{len(verdict)} applications re-verified in {time.perf_counter() - start:.1f} s, {columns["skipped"]} skipped (not verified)')
+    for name, count in zip(CUSTOMER_INFORMATION, mismatch.sum(axis=0).tolist()):
+        print(f'{name}: {count} mismatches')
+    print(f'Changed verdicts: {int((verdict != columns["stored_match"]).sum())}')
+
+if __name__ == '__main__':
+
+    main()
+
+    # Remove the same path from sys.path when finished
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,120 @@
+import unittest
+from unittest.mock import patch
+import threading
+import time
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import analyze_document_ids
+from SynchronousOperations.DocumentLambdaFunction.app import get_customer_extracted_info
+from SynchronousOperations.DocumentLambdaFunction.app import get_matching_faces_for_documents
+from SynchronousOperations.DocumentLambdaFunction.app import get_document_files
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import SIMILARITY_THRESHOLD
+
+class TestMultipleDocuments(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+    APPUUID = '8d247914'
+    DOCUMENTS = ['8d247914_license.png', '8d247914_license_back.png', '8d247914_passport.png']
+
+    def create_identity_document(self, fields):
+        return {'IdentityDocumentFields': [{'Type': {'Text': name}, 'ValueDetection': {'Text': value}}
+                                           for name, value in fields.items()]}
+
+    def test_document_files(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        file_names = ['8d247914_passport.png', '8d247914_details.csv', '8d247914_selfie.png',
+                      '8d247914_license_back.png', '8d247914_license.png', '8d247914_license_inference.jpg']
+
+        # The driver license is first, and the selfie, the details and the inference variants are not documents
+        self.assertEqual(get_document_files(file_names, TestMultipleDocuments.APPUUID), TestMultipleDocuments.DOCUMENTS)
+
+    def test_analyze_document_ids(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        fields_by_document = {
+            '8d247914_license.png': {'DOCUMENT_NUMBER': 'S123456579010', 'FIRST_NAME': 'JOHN', 'ADDRESS': ''},
+            '8d247914_license_back.png': {'DOCUMENT_NUMBER': '', 'FIRST_NAME': '', 'ADDRESS': ''},
+            '8d247914_passport.png': {'DOCUMENT_NUMBER': 'P987654', 'FIRST_NAME': 'JOHN', 'ADDRESS': '1 MAIN ST'}}
+        calls = []
+
+        # Mock analyze_id, which returns one IdentityDocument per page
+        def mock_analyze_id(DocumentPages):
+            names = [page['S3Object']['Name'] for page in DocumentPages]
+            calls.append(names)
+            return {'DocumentMetadata': {'Pages': len(names)},
+                    'IdentityDocuments': [dict(self.create_identity_document(fields_by_document[name]), DocumentIndex=index + 1)
+                                          for index, name in enumerate(names)],
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        # Call the function to test
+        with patch.object(get_client('textract'), 'analyze_id', mock_analyze_id):
+            response = analyze_document_ids(TestMultipleDocuments.BUCKET_NAME, TestMultipleDocuments.DOCUMENTS)
+
+        # Assert Textract got at most 2 pages per call, and the documents are merged in order
+        self.assertEqual(sorted(calls), [TestMultipleDocuments.DOCUMENTS[:2], TestMultipleDocuments.DOCUMENTS[2:]])
+        self.assertEqual(response['DocumentMetadata']['Pages'], 3)
+        self.assertEqual([document['DocumentIndex'] for document in response['IdentityDocuments']], [1, 2, 3])
+
+        # Assert an empty field is taken from the next document, and the license number comes first
+        extracted_info = get_customer_extracted_info(response)
+        self.assertEqual(extracted_info, {'DOCUMENT_NUMBER': 'S123456579010', 'FIRST_NAME': 'JOHN', 'ADDRESS': '1 MAIN ST'})
+
+    def test_faces_are_compared_concurrently(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        in_flight = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        # Mock compare_faces: only the front of the license has a face
+        def mock_compare_faces(**kwargs):
+            with lock:
+                in_flight['now'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            time.sleep(0.2)
+            with lock:
+                in_flight['now'] -= 1
+            face_matches = []
+            if kwargs['TargetImage']['S3Object']['Name'] == '8d247914_license.png':
+                face_matches = [{'Similarity': SIMILARITY_THRESHOLD + 1}]
+            return {'FaceMatches': face_matches, 'UnmatchedFaces': [], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        valerror = {'error':''}
+
+        # Call the function to test
+        with patch.object(get_client('rekognition'), 'compare_faces', mock_compare_faces):
+            responses = get_matching_faces_for_documents(TestMultipleDocuments.BUCKET_NAME,
+                                                         '8d247914_selfie.png',
+                                                         TestMultipleDocuments.DOCUMENTS,
+                                                         SIMILARITY_THRESHOLD,
+                                                         valerror)
+
+        # Assert the responses are in the order of the documents, and the comparisons overlapped
+        self.assertEqual([len(response['FaceMatches']) for response in responses], [1, 0, 0])
+        self.assertGreater(in_flight['max'], 1)
+
+if __name__ == '__main__':
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,171 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import io
+import zipfile
+import struct
+import zlib
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import archive_images
+from SynchronousOperations.DocumentLambdaFunction.app import transcode_image_to_webp
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+from SynchronousOperations.DocumentLambdaFunction.app import numpy
+from SynchronousOperations.DocumentLambdaFunction.app import Image
+
+@unittest.skipIf(Image is None, 'NumPy and Pillow are not installed')
+class TestArchiveImages(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    BUCKET_NAME = 'documentbucket-123456789102'
+    APPUUID = '8d247914'
+    SELFIE_KEY = 'unzipped/8d247914_selfie.png'
+    BLOB_KEY = 'blobs/3f/3f0c.png'
+
+    def create_table(self):
+        # Create a mock table
+        return dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'KeyType': 'HASH'  # Partition key
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+    @patch.dict(os.environ, {'ARCHIVE_IMAGE_FORMAT': 'webp'})
+    @mock_aws
+    def test_selfie_is_archived_as_webp(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': TestArchiveImages.APPUUID})
+
+        # Upload the selfie located in UnitTests/ as an unzipped object, and as a content-addressed blob
+        zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestArchiveImages.ZIPFILE)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            selfie_bytes = zip_file.read('8d247914_selfie.png')
+        s3.create_bucket(Bucket=TestArchiveImages.BUCKET_NAME)
+        s3.put_object(Bucket=TestArchiveImages.BUCKET_NAME, Key=TestArchiveImages.SELFIE_KEY, Body=selfie_bytes)
+        s3.put_object(Bucket=TestArchiveImages.BUCKET_NAME, Key=TestArchiveImages.BLOB_KEY, Body=selfie_bytes)
+
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = archive_images(TestArchiveImages.BUCKET_NAME,
+                             [TestArchiveImages.SELFIE_KEY, TestArchiveImages.BLOB_KEY],
+                             TestArchiveImages.APPUUID,
+                             table,
+                             valerror)
+        self.assertEqual(ret, True)
+
+        # Assert the original selfie is replaced by an identical, smaller WebP image, and the blob is kept
+        response = s3.list_objects_v2(Bucket=TestArchiveImages.BUCKET_NAME)
+        keys = [item['Key'] for item in response['Contents']]
+        self.assertEqual(sorted(keys), [TestArchiveImages.BLOB_KEY, 'unzipped/8d247914_selfie.webp'])
+
+        webp_bytes = s3.get_object(Bucket=TestArchiveImages.BUCKET_NAME, Key='unzipped/8d247914_selfie.webp')['Body'].read()
+        self.assertLess(len(webp_bytes), len(selfie_bytes))
+        with Image.open(io.BytesIO(selfie_bytes)) as original, Image.open(io.BytesIO(webp_bytes)) as archived:
+            self.assertTrue(numpy.array_equal(numpy.asarray(archived.convert(original.mode)), numpy.asarray(original)))
+
+        # Assert the archive is recorded in the DynamoDB table
+        item = table.get_item(Key={'APP_UUID': TestArchiveImages.APPUUID})['Item']
+        self.assertEqual(item['ARCHIVED_IMAGES'], {'unzipped/8d247914_selfie.webp'})
+        self.assertEqual(item['ARCHIVE_BYTES_SAVED'], len(selfie_bytes) - len(webp_bytes))
+
+        # Archiving again (e.g. a resumed application) skips the image that was already archived
+        self.assertEqual(archive_images(TestArchiveImages.BUCKET_NAME, [TestArchiveImages.SELFIE_KEY],
+                                        TestArchiveImages.APPUUID, table, valerror), True)
+
+    def create_png_16bit(self, width, height):
+        # A 16-bit RGB PNG (color type 2), whose low bytes are lost when it is decoded to 8 bits
+        def chunk(chunk_type, data):
+            return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+        rows = b''.join(b'\x00' + b''.join(struct.pack('>HHH', x * 600 + y, y * 600 + x, (x * y) & 0xFFFF)
+                                             for x in range(width))
+                        for y in range(height))
+        return (b'\x89PNG\r\n\x1a\n' +
+                chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 16, 2, 0, 0, 0)) +
+                chunk(b'IDAT', zlib.compress(rows)) +
+                chunk(b'IEND', b''))
+
+    @patch.dict(os.environ, {'ARCHIVE_IMAGE_FORMAT': 'webp'})
+    @mock_aws
+    def test_16bit_png_is_not_archived(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': TestArchiveImages.APPUUID})
+
+        # Pillow decodes the 16-bit PNG to 8 bits, so the pixel check alone would accept a lossy WebP image
+        png_bytes = self.create_png_16bit(100, 100)
+        with Image.open(io.BytesIO(png_bytes)) as image:
+            self.assertEqual(image.mode, 'RGB')
+        self.assertIsNone(transcode_image_to_webp(png_bytes))
+
+        s3.create_bucket(Bucket=TestArchiveImages.BUCKET_NAME)
+        s3.put_object(Bucket=TestArchiveImages.BUCKET_NAME, Key=TestArchiveImages.SELFIE_KEY, Body=png_bytes)
+
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = archive_images(TestArchiveImages.BUCKET_NAME, [TestArchiveImages.SELFIE_KEY],
+                             TestArchiveImages.APPUUID, table, valerror)
+        self.assertEqual(ret, True)
+
+        # Assert the original PNG is kept as it is, and nothing is archived
+        response = s3.list_objects_v2(Bucket=TestArchiveImages.BUCKET_NAME)
+        self.assertEqual([item['Key'] for item in response['Contents']], [TestArchiveImages.SELFIE_KEY])
+        original_bytes = s3.get_object(Bucket=TestArchiveImages.BUCKET_NAME, Key=TestArchiveImages.SELFIE_KEY)['Body'].read()
+        self.assertEqual(original_bytes, png_bytes)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
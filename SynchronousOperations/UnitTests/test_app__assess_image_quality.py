@@ -0,0 +1,125 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import zipfile
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import assess_image_quality
+from SynchronousOperations.DocumentLambdaFunction.app import get_quality_thresholds
+from SynchronousOperations.DocumentLambdaFunction.app import prepare_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+from SynchronousOperations.DocumentLambdaFunction.app import Image
+
+@unittest.skipIf(Image is None, 'NumPy and Pillow are not installed')
+class TestImageQuality(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    BUCKET_NAME = 'documentbucket-123456789102'
+    THRESHOLDS = {'QUALITY_MIN_SHARPNESS': '50', 'QUALITY_MIN_BRIGHTNESS': '45', 'QUALITY_MAX_BRIGHTNESS': '235'}
+
+    def setUp(self):
+        self.lambda_tmp_folder = tempfile.mkdtemp() + '/'
+
+        # Unzip the selfie located in UnitTests/
+        zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestImageQuality.ZIPFILE)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            zip_file.extract('8d247914_selfie.png', self.lambda_tmp_folder)
+        self.image_file = self.lambda_tmp_folder + '8d247914_selfie.png'
+
+    def tearDown(self):
+        shutil.rmtree(self.lambda_tmp_folder)
+
+    @patch.dict(os.environ, THRESHOLDS)
+    def test_sharp_selfie_is_usable(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        quality = {}
+        ret = assess_image_quality(self.image_file, get_quality_thresholds(), quality)
+
+        self.assertEqual(ret, True)
+        self.assertGreater(quality['sharpness'], 50)
+        self.assertNotIn('reason', quality)
+
+    @patch.dict(os.environ, THRESHOLDS)
+    def test_blurry_and_dark_selfies_are_rejected(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from PIL import ImageEnhance, ImageFilter
+
+        with Image.open(self.image_file) as image:
+            image.filter(ImageFilter.GaussianBlur(4)).save(self.lambda_tmp_folder + 'blurry.png')
+            ImageEnhance.Brightness(image).enhance(0.2).save(self.lambda_tmp_folder + 'dark.png')
+
+        quality = {}
+        self.assertEqual(assess_image_quality(self.lambda_tmp_folder + 'blurry.png', get_quality_thresholds(), quality), False)
+        self.assertIn('too blurry', quality['reason'])
+
+        quality = {}
+        self.assertEqual(assess_image_quality(self.lambda_tmp_folder + 'dark.png', get_quality_thresholds(), quality), False)
+        self.assertIn('too dark', quality['reason'])
+
+    @patch.dict(os.environ, {'QUALITY_MIN_SHARPNESS': '100000', 'KEY_LAYOUT': 'flat', 'ARTIFACT_STORAGE': 'keyed'})
+    @mock_aws
+    def test_prepare_customer_info_rejects_before_upload(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestImageQuality.ZIPFILE)
+        s3.create_bucket(Bucket=TestImageQuality.BUCKET_NAME)
+        object_key = 'zipped/' + TestImageQuality.ZIPFILE
+        s3.upload_file(file_path, TestImageQuality.BUCKET_NAME, object_key)
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = prepare_customer_info(TestImageQuality.BUCKET_NAME,
+                                    object_key,
+                                    self.lambda_tmp_folder,
+                                    'unzipped/',
+                                    'unzipped/',
+                                    customer_info,
+                                    valerror)
+
+        # Assert the application is rejected with a reason, and nothing was uploaded
+        self.assertEqual(ret, True)
+        self.assertIn('8d247914_selfie.png is too blurry', customer_info['rejected_reason'])
+        response = s3.list_objects_v2(Bucket=TestImageQuality.BUCKET_NAME, Prefix='unzipped/')
+        self.assertNotIn('Contents', response)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,109 @@
+import unittest
+import botocore
+import time
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import call_with_adaptive_limit
+from SynchronousOperations.DocumentLambdaFunction.app import get_adaptive_limits
+from SynchronousOperations.DocumentLambdaFunction.app import aimd_limits
+from SynchronousOperations.DocumentLambdaFunction.app import AIMD_INITIAL_LIMIT
+from SynchronousOperations.DocumentLambdaFunction.app import AIMD_MIN_LIMIT
+from SynchronousOperations.DocumentLambdaFunction.app import set_api_rate_limits
+
+class TestAdaptiveLimit(unittest.TestCase):
+
+    OPERATION = 'rekognition.compare_faces'
+
+    def setUp(self):
+        # Every test starts from the initial limit
+        aimd_limits.clear()
+
+    def test_successful_calls_increase_limit(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # Fast successful calls add about one to the limit per round of calls
+        for i in range(20):
+            response = call_with_adaptive_limit(TestAdaptiveLimit.OPERATION, lambda **kwargs: kwargs, Value=i)
+            self.assertEqual(response, {'Value': i})
+
+        limits = get_adaptive_limits()
+        self.assertGreater(limits[TestAdaptiveLimit.OPERATION], AIMD_INITIAL_LIMIT)
+        self.assertEqual(aimd_limits[TestAdaptiveLimit.OPERATION]['in_flight'], 0)
+
+    def test_throttling_decreases_limit(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        def throttled_call(**kwargs):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                'CompareFaces')
+
+        # The throttling error is raised again to the caller, and the limit is halved each time
+        for i in range(3):
+            with self.assertRaises(botocore.exceptions.ClientError):
+                call_with_adaptive_limit(TestAdaptiveLimit.OPERATION, throttled_call)
+
+        limits = get_adaptive_limits()
+        self.assertEqual(limits[TestAdaptiveLimit.OPERATION], AIMD_MIN_LIMIT)
+        self.assertEqual(aimd_limits[TestAdaptiveLimit.OPERATION]['in_flight'], 0)
+
+    def test_other_errors_keep_limit(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        def failed_call(**kwargs):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidParameterException', 'Message': 'Bad image'}},
+                'CompareFaces')
+
+        for i in range(10):
+            with self.assertRaises(botocore.exceptions.ClientError):
+                call_with_adaptive_limit(TestAdaptiveLimit.OPERATION, failed_call)
+
+        # A non-throttling error is not a congestion signal, nor a success
+        self.assertEqual(aimd_limits[TestAdaptiveLimit.OPERATION]['limit'], AIMD_INITIAL_LIMIT)
+        self.assertEqual(aimd_limits[TestAdaptiveLimit.OPERATION]['in_flight'], 0)
+
+    def test_rate_limit_spaces_calls(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # 5 calls at 50 calls per second take at least 4 intervals of 20 ms. Other operations are not limited.
+        set_api_rate_limits({TestAdaptiveLimit.OPERATION: 50.0})
+        try:
+            start = time.monotonic()
+            for i in range(5):
+                call_with_adaptive_limit(TestAdaptiveLimit.OPERATION, lambda **kwargs: kwargs, Value=i)
+            self.assertGreaterEqual(time.monotonic() - start, 0.08)
+
+            start = time.monotonic()
+            for i in range(5):
+                call_with_adaptive_limit('sns.publish', lambda **kwargs: kwargs, Value=i)
+            self.assertLess(time.monotonic() - start, 0.08)
+        finally:
+            set_api_rate_limits({})
+
+if __name__ == '__main__':
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
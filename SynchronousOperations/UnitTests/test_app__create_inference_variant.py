@@ -0,0 +1,163 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import zipfile
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import create_inference_variant
+from SynchronousOperations.DocumentLambdaFunction.app import prepare_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import compute_dhash
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import Image
+
+@unittest.skipIf(Image is None, 'NumPy and Pillow are not installed')
+class TestInferenceVariant(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    BUCKET_NAME = 'documentbucket-123456789102'
+    APPUUID = '8d247914'
+
+    def setUp(self):
+        self.lambda_tmp_folder = tempfile.mkdtemp() + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.lambda_tmp_folder)
+
+    def test_license_variant_is_smaller(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # Unzip the license located in UnitTests/
+        zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestInferenceVariant.ZIPFILE)
+        with zipfile.ZipFile(zip_path) as zip_file:
+            zip_file.extract('8d247914_license.png', self.lambda_tmp_folder)
+        image_file = self.lambda_tmp_folder + '8d247914_license.png'
+        variant_file = self.lambda_tmp_folder + '8d247914_license_inference.jpg'
+
+        # Call the function to test
+        ret = create_inference_variant(image_file, variant_file, 800)
+
+        # Assert the variant is a downscaled JPEG, at least 5 times smaller
+        self.assertEqual(ret, True)
+        with Image.open(variant_file) as variant:
+            self.assertEqual(variant.format, 'JPEG')
+            self.assertEqual(max(variant.size), 800)
+        self.assertLess(os.path.getsize(variant_file) * 5, os.path.getsize(image_file))
+
+    @patch.dict(os.environ, {'INFERENCE_MAX_DIMENSION': '1600', 'KEY_LAYOUT': 'flat', 'ARTIFACT_STORAGE': 'keyed'})
+    @mock_aws
+    def test_prepare_customer_info_uses_variants(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestInferenceVariant.ZIPFILE)
+        s3.create_bucket(Bucket=TestInferenceVariant.BUCKET_NAME)
+        object_key = 'zipped/' + TestInferenceVariant.ZIPFILE
+        s3.upload_file(file_path, TestInferenceVariant.BUCKET_NAME, object_key)
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = prepare_customer_info(TestInferenceVariant.BUCKET_NAME,
+                                    object_key,
+                                    self.lambda_tmp_folder,
+                                    'unzipped/',
+                                    'unzipped/',
+                                    customer_info,
+                                    valerror)
+
+        # Assert Rekognition and Textract get the variants, and the originals are still stored
+        self.assertEqual(ret, True)
+        self.assertEqual(customer_info['selfie_key'], 'unzipped/8d247914_selfie_inference.jpg')
+        self.assertEqual(customer_info['license_key'], 'unzipped/8d247914_license_inference.jpg')
+
+        response = s3.list_objects_v2(Bucket=TestInferenceVariant.BUCKET_NAME, Prefix='unzipped/')
+        keys = [item['Key'] for item in response['Contents']]
+        self.assertIn('unzipped/8d247914_license.png', keys)
+        self.assertIn('unzipped/8d247914_license_inference.jpg', keys)
+
+    @patch.dict(os.environ, {'INFERENCE_MAX_DIMENSION': '1600', 'QUALITY_MIN_SHARPNESS': '1',
+                             'SELFIE_HASH_TABLE': 'selfie_hash_table', 'KEY_LAYOUT': 'flat', 'ARTIFACT_STORAGE': 'keyed'})
+    @mock_aws
+    def test_each_image_is_decoded_once(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket, and create a mock table of selfie hashes
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestInferenceVariant.ZIPFILE)
+        s3.create_bucket(Bucket=TestInferenceVariant.BUCKET_NAME)
+        object_key = 'zipped/' + TestInferenceVariant.ZIPFILE
+        s3.upload_file(file_path, TestInferenceVariant.BUCKET_NAME, object_key)
+        dynamodb.create_table(
+            TableName='selfie_hash_table',
+            KeySchema=[
+                {'AttributeName': 'BAND', 'KeyType': 'HASH'},
+                {'AttributeName': 'APP_UUID', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'BAND', 'AttributeType': 'S'},
+                {'AttributeName': 'APP_UUID', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test, and count how many times each image is opened
+        with patch.object(Image, 'open', wraps=Image.open) as image_open:
+            ret = prepare_customer_info(TestInferenceVariant.BUCKET_NAME,
+                                        object_key,
+                                        self.lambda_tmp_folder,
+                                        'unzipped/',
+                                        'unzipped/',
+                                        customer_info,
+                                        valerror)
+        opened_files = [os.path.basename(call.args[0]) for call in image_open.call_args_list]
+
+        # Assert the variants, the quality gate and the dHash did not decode the images again
+        self.assertEqual(ret, True)
+        self.assertEqual(sorted(opened_files), ['8d247914_license.png', '8d247914_selfie.png'])
+        self.assertEqual(customer_info['selfie_screen']['dhash'],
+                         compute_dhash(self.lambda_tmp_folder + 'unzipped/8d247914_selfie.png'))
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,131 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import shutil
+import tempfile
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import CustomerDetails
+from SynchronousOperations.DocumentLambdaFunction.app import parse_customer_details
+from SynchronousOperations.DocumentLambdaFunction.app import is_matching_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import serialize_ddb_item
+from SynchronousOperations.DocumentLambdaFunction.app import DETAILS_MATCHING_NORMALIZED
+
+class TestCustomerDetails(unittest.TestCase):
+
+    APPUUID = '8d247914'
+    CUSTOMER_DETAILS_FILE = '8d247914_details.csv'
+
+    def setUp(self):
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestCustomerDetails.CUSTOMER_DETAILS_FILE)
+        self.customer = parse_customer_details(file_path)
+
+    def test_parse_customer_details(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # The details of the .csv file located in UnitTests/ are kept in the CUSTOMER_INFORMATION order
+        self.assertEqual(self.customer.get('DOCUMENT_NUMBER'), 'S123456579010')
+        self.assertEqual(self.customer.get('UNKNOWN', '0'), '0')
+        self.assertEqual(list(self.customer.to_payload())[:3], ['DOCUMENT_NUMBER', 'FIRST_NAME', 'LAST_NAME'])
+        self.assertFalse(hasattr(self.customer, '__dict__'))
+
+        # A .csv file without all the CUSTOMER_INFORMATION columns is not valid
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        try:
+            with open(lambda_tmp_folder + 'details.csv', 'w') as f:
+                f.write('FIRST_NAME,LAST_NAME\nNICK,SAMPLE\n')
+            self.assertIsNone(parse_customer_details(lambda_tmp_folder + 'details.csv'))
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+    def test_extra_columns_are_kept(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # A .csv file with more columns than CUSTOMER_INFORMATION
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        try:
+            with open(lambda_tmp_folder + 'details.csv', 'w') as f:
+                f.write(','.join(self.customer.to_payload()) + ',EMAIL\n' + ','.join(self.customer.to_payload().values()) + ',nick@example.com\n')
+            customer = parse_customer_details(lambda_tmp_folder + 'details.csv')
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+        # The extra column is stored with the details, and kept in the payload of a checkpoint
+        self.assertEqual(customer.extra, {'EMAIL': 'nick@example.com'})
+        self.assertEqual(customer.to_ddb_item(TestCustomerDetails.APPUUID)['EMAIL'], {'S': 'nick@example.com'})
+        self.assertEqual(CustomerDetails.from_payload(customer.to_payload()).extra, {'EMAIL': 'nick@example.com'})
+
+        # It is not compared with the ID documents
+        self.assertTrue(is_matching_customer_info(self.customer.to_payload(), customer))
+
+    def test_matching_customer_info(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        extracted_info = self.customer.to_payload()
+
+        # By default, the details must be equal, in a CustomerDetails or in a dictionary
+        self.assertTrue(is_matching_customer_info(extracted_info, self.customer))
+        self.assertTrue(is_matching_customer_info(CustomerDetails.from_payload(extracted_info), self.customer.to_payload()))
+        self.assertFalse(is_matching_customer_info({**extracted_info, 'ADDRESS': '123  Main Street '}, self.customer))
+        self.assertFalse(is_matching_customer_info(CustomerDetails.from_payload({**extracted_info, 'ADDRESS': '123 main street'}), self.customer))
+
+        # A different or missing detail does not match
+        self.assertFalse(is_matching_customer_info({**extracted_info, 'ZIP_CODE_IN_ADDRESS': '000001235'}, self.customer))
+        del extracted_info['DATE_OF_BIRTH']
+        self.assertFalse(is_matching_customer_info(extracted_info, self.customer))
+
+    @patch.dict(os.environ, {'DETAILS_MATCHING': 'normalized'})
+    def test_normalized_matching_customer_info(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        extracted_info = self.customer.to_payload()
+
+        # With DETAILS_MATCHING set to normalized, case and extra spaces do not matter
+        self.assertTrue(is_matching_customer_info({**extracted_info, 'ADDRESS': '123  Main Street '}, self.customer))
+        self.assertTrue(is_matching_customer_info(CustomerDetails.from_payload({**extracted_info, 'ADDRESS': '123 main street'}), self.customer))
+        self.assertTrue(is_matching_customer_info({**extracted_info, 'FIRST_NAME': 'nick'}, self.customer.to_payload(), DETAILS_MATCHING_NORMALIZED))
+
+        # A different or missing detail still does not match
+        self.assertFalse(is_matching_customer_info({**extracted_info, 'ZIP_CODE_IN_ADDRESS': '000001235'}, self.customer))
+        del extracted_info['DATE_OF_BIRTH']
+        self.assertFalse(is_matching_customer_info(extracted_info, self.customer))
+
+    def test_to_ddb_item(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        extra_attributes = {'ARCHIVE_SHA256': 'ab' * 32, 'SIMILAR_SELFIE_OF': ['7a135804']}
+
+        # The item is the same as the serialized dictionary of the details
+        self.assertEqual(self.customer.to_ddb_item(TestCustomerDetails.APPUUID, extra_attributes),
+                         serialize_ddb_item({**self.customer.to_payload(), **extra_attributes, 'APP_UUID': TestCustomerDetails.APPUUID}))
+
+        # A checkpoint payload gives the same details
+        self.assertEqual(CustomerDetails.from_payload(self.customer.to_payload()).normalized, self.customer.normalized)
+
+if __name__ == '__main__':
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,76 @@
+import unittest
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import extract_customer_details
+from SynchronousOperations.DocumentLambdaFunction.app import extract_customer_fields
+from SynchronousOperations.DocumentLambdaFunction.app import is_matching_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import DETAILS_MATCHING_NORMALIZED
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+
+class TestExtractCustomerDetails(unittest.TestCase):
+
+    DETAILS_DIC = {'FIRST_NAME': 'John', 'LAST_NAME': 'Doe', 'DATE_OF_BIRTH': '01/01/1990',
+                   'ADDRESS': '1 Main St', 'DOCUMENT_NUMBER': 'S123456579010'}
+
+    def create_identity_document(self, fields):
+        return {'IdentityDocumentFields': [{'Type': {'Text': name}, 'ValueDetection': {'Text': value, 'Confidence': confidence}}
+                                           for name, (value, confidence) in fields.items()]}
+
+    def test_extract_customer_details(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        license = self.create_identity_document({'FIRST_NAME': ('JOHN', 99.1), 'LAST_NAME': ('DOE', 98.0),
+                                                 'EXPIRATION_DATE': ('01/01/2030', 97.0), 'ADDRESS': ('', 40.0),
+                                                 'DATE_OF_BIRTH': ('01/01/1990', 96.5),
+                                                 'DOCUMENT_NUMBER': ('S123456579010', 95.0)})
+        passport = self.create_identity_document({'FIRST_NAME': ('JON', 90.0), 'ADDRESS': ('1 MAIN  ST', 88.5)})
+        response = {'IdentityDocuments': [license, passport]}
+
+        # Assert the values are in the CUSTOMER_INFORMATION order, and an empty field is taken from the next document
+        values, confidences = extract_customer_fields(response)
+        self.assertEqual(values[CUSTOMER_INFORMATION.index('FIRST_NAME')], 'JOHN')
+        self.assertEqual(values[CUSTOMER_INFORMATION.index('ADDRESS')], '1 MAIN  ST')
+        self.assertEqual(confidences[CUSTOMER_INFORMATION.index('ADDRESS')], 88.5)
+        self.assertNotIn('01/01/2030', values)
+
+        # Call the function to test
+        extraction = {'confidence': {}}
+        customer = extract_customer_details(response, extraction)
+        self.assertEqual(customer.get('LAST_NAME'), 'DOE')
+        self.assertEqual(extraction['confidence']['FIRST_NAME'], 99.1)
+        self.assertEqual(extraction['confidence']['ADDRESS'], 88.5)
+        self.assertNotIn('EXPIRATION_DATE', extraction['confidence'])
+
+        # Assert the typed details match the submitted details after normalization, but are not equal
+        self.assertEqual(is_matching_customer_info(customer, TestExtractCustomerDetails.DETAILS_DIC, DETAILS_MATCHING_NORMALIZED), True)
+        self.assertEqual(is_matching_customer_info(customer, dict(TestExtractCustomerDetails.DETAILS_DIC, LAST_NAME='Roe'), DETAILS_MATCHING_NORMALIZED), False)
+        self.assertEqual(is_matching_customer_info(customer, TestExtractCustomerDetails.DETAILS_DIC), False)
+
+    def test_no_document(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # Call the function to test
+        self.assertIsNone(extract_customer_details({'IdentityDocuments': []}, {'confidence': {}}))
+
+if __name__ == '__main__':
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import hashlib
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import get_artifact_key
+from SynchronousOperations.DocumentLambdaFunction.app import prepare_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+
+class TestKeyLayout(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    BUCKET_NAME = 'documentbucket-123456789102'
+    BUCKET_UNZIPPED_PREFIX = 'unzipped/'
+    APPUUID = '8d247914'
+    SHARD = hashlib.sha256(APPUUID.encode('utf-8')).hexdigest()[:2]
+
+    def test_flat_layout_is_the_default(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        with patch.dict(os.environ):
+            os.environ.pop('KEY_LAYOUT', None)
+            key = get_artifact_key(TestKeyLayout.BUCKET_UNZIPPED_PREFIX, TestKeyLayout.APPUUID, '8d247914_selfie.png')
+
+        self.assertEqual(key, 'unzipped/8d247914_selfie.png')
+
+    @mock_aws
+    def test_sharded_layout(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestKeyLayout.ZIPFILE)
+        s3.create_bucket(Bucket=TestKeyLayout.BUCKET_NAME)
+        object_key = 'zipped/' + TestKeyLayout.ZIPFILE
+        s3.upload_file(file_path, TestKeyLayout.BUCKET_NAME, object_key)
+
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        try:
+            with patch.dict(os.environ, {'KEY_LAYOUT': 'sharded'}):
+                ret = prepare_customer_info(TestKeyLayout.BUCKET_NAME,
+                                            object_key,
+                                            lambda_tmp_folder,
+                                            'unzipped/',
+                                            TestKeyLayout.BUCKET_UNZIPPED_PREFIX,
+                                            customer_info,
+                                            valerror)
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+        # Assert all objects of the application are in the same hashed sub-prefix
+        prefix = 'unzipped/' + TestKeyLayout.SHARD + '/'
+        self.assertEqual(ret, True)
+        self.assertEqual(customer_info['selfie_key'], prefix + '8d247914_selfie.png')
+        self.assertEqual(customer_info['license_key'], prefix + '8d247914_license.png')
+
+        response = s3.list_objects_v2(Bucket=TestKeyLayout.BUCKET_NAME, Prefix='unzipped/')
+        keys = sorted(item['Key'] for item in response['Contents'])
+        self.assertEqual(keys, [prefix + '8d247914_details.csv',
+                                prefix + '8d247914_license.png',
+                                prefix + '8d247914_selfie.png'])
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
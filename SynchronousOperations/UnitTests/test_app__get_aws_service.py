@@ -0,0 +1,113 @@
+import unittest
+from moto import mock_aws
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+import aws_services
+import SynchronousOperations.DocumentLambdaFunction.app as app
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import get_resource
+from aws_services import get_aws_service_timings
+from aws_services import get_aws_service_metrics
+
+class TestAwsServices(unittest.TestCase):
+
+    def test_services_are_created_once(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # The module-level names are the cached clients and resources of the layer
+        self.assertIs(app.s3, get_client('s3'))
+        self.assertIs(app.get_client, aws_services.get_client)
+        self.assertIs(app.dynamodb, get_resource('dynamodb'))
+        self.assertIs(get_client('s3'), get_client('s3'))
+
+        # The creation times are kept
+        timings = get_aws_service_timings()
+        self.assertIn('session', timings)
+        self.assertIn('client:s3', timings)
+        self.assertIn('resource:dynamodb', timings)
+
+        with self.assertRaises(AttributeError):
+            app.not_an_aws_service
+
+    def test_first_use_from_threads(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # A client first used from several threads is created only once
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: get_client('sts'), range(8)))
+
+        self.assertEqual(len({id(client) for client in clients}), 1)
+
+    @unittest.skipIf(not hasattr(os, 'register_at_fork'), 'os.fork() is not available')
+    def test_forked_process_creates_its_own_services(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        get_client('s3')
+        self.assertIn('client:s3', get_aws_service_timings())
+
+        # A forked process (e.g. a process of the backfill pool) does not inherit the clients of its parent
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+            self.assertEqual(executor.submit(get_aws_service_timings).result(), {})
+
+        # The parent keeps its clients
+        self.assertIn('client:s3', get_aws_service_timings())
+
+    @mock_aws
+    def test_config_and_metrics(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        s3 = get_client('s3')
+        patch_client(s3)
+
+        # The clients use the botocore settings of their profile
+        self.assertEqual(s3.meta.config.retries, {'mode': 'adaptive', 'total_max_attempts': 3})
+        self.assertEqual(s3.meta.config.tcp_keepalive, True)
+        self.assertEqual(get_client('rekognition').meta.config.max_pool_connections, 4)
+        self.assertEqual(get_client('textract').meta.config.read_timeout, 8)
+
+        # The calls and the errors of each service are counted
+        before = get_aws_service_metrics().get('s3', {'calls': 0, 'errors': 0})
+        s3.create_bucket(Bucket='documentbucket-123456789102')
+        with self.assertRaises(Exception):
+            s3.head_object(Bucket='documentbucket-123456789102', Key='unzipped/8d247914_selfie.png')
+
+        after = get_aws_service_metrics()['s3']
+        self.assertEqual(after['calls'] - before['calls'], 2)
+        self.assertEqual(after['errors'] - before['errors'], 1)
+        self.assertGreaterEqual(after['latency_ms_max'], after['latency_ms_average'])
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,109 @@
+import unittest
+import io
+import struct
+import sys
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import inspect_image_header
+from SynchronousOperations.DocumentLambdaFunction.app import inspect_application_images
+from SynchronousOperations.DocumentLambdaFunction.app import PNG_SIGNATURE
+
+class TestImageHeader(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    APPUUID = '8d247914'
+
+    def png_chunk(self, chunk_type, chunk_data):
+        return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + \
+               struct.pack('>I', zlib.crc32(chunk_type + chunk_data))
+
+    def create_png(self, width, height, bit_depth = 8, color_type = 2):
+        # Only the headers are inspected, so the image data does not need to be valid
+        ihdr = struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)
+        return PNG_SIGNATURE + self.png_chunk(b'IHDR', ihdr) + self.png_chunk(b'IDAT', b'\x00' * 16) + \
+               self.png_chunk(b'IEND', b'')
+
+    def create_jpeg(self, width, height):
+        app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+        sof0 = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+        return b'\xff\xd8' + app0 + sof0 + b'\xff\xda'
+
+    def test_valid_png_and_jpeg(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        image_info = {}
+        self.assertEqual(inspect_image_header(io.BytesIO(self.create_png(640, 480)), image_info), True)
+        self.assertEqual(image_info, {'format': 'PNG', 'width': 640, 'height': 480, 'bit_depth': 8})
+
+        image_info = {}
+        self.assertEqual(inspect_image_header(io.BytesIO(self.create_jpeg(800, 600)), image_info), True)
+        self.assertEqual(image_info, {'format': 'JPEG', 'width': 800, 'height': 600, 'bit_depth': 8})
+
+    def test_unusable_images(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        png = self.create_png(640, 480)
+        bad_crc = bytearray(png)
+        bad_crc[len(PNG_SIGNATURE) + 8] ^= 0xFF # First byte of the width in IHDR
+
+        unusable_images = {
+            'too small': self.create_png(64, 480),
+            'truncated': png[:len(PNG_SIGNATURE) + 20],
+            'bad CRC': bytes(bad_crc),
+            'bad bit depth': self.create_png(640, 480, bit_depth = 4, color_type = 2),
+            'not an image': b'GIF89a' + b'\x00' * 32}
+
+        for name, data in unusable_images.items():
+            image_info = {}
+            self.assertEqual(inspect_image_header(io.BytesIO(data), image_info), False, name)
+            self.assertIn('reason', image_info)
+
+    def test_application_images(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # The images of the .zip file located in UnitTests/ can be used
+        zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestImageHeader.ZIPFILE)
+        inspection = {'images': {}}
+        self.assertEqual(inspect_application_images(zip_path, TestImageHeader.APPUUID, inspection), True)
+        self.assertEqual(inspection['images']['8d247914_license.png']['width'], 1920)
+
+        # A .zip file with a tiny selfie is rejected, without unzipping it
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        try:
+            tiny_zip_path = lambda_tmp_folder + TestImageHeader.ZIPFILE
+            with zipfile.ZipFile(tiny_zip_path, mode='w') as zip_file:
+                zip_file.writestr('8d247914_selfie.png', self.create_png(32, 32))
+                zip_file.writestr('8d247914_license.png', self.create_png(1920, 1080))
+            inspection = {'images': {}}
+            self.assertEqual(inspect_application_images(tiny_zip_path, TestImageHeader.APPUUID, inspection), False)
+            self.assertIn('8d247914_selfie.png', inspection['reason'])
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+if __name__ == '__main__':
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,168 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import json
+import hashlib
+import botocore
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import lambda_handler
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+from SynchronousOperations.DocumentLambdaFunction.app import sqs
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import rekognition
+
+class TestIngestionBuffer(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+
+    def create_sqs_record(self, message_id, body):
+        return {'messageId': message_id,
+                'eventSource': 'aws:sqs',
+                'body': json.dumps(body)}
+
+    @mock_aws
+    def test_batch_reports_only_failed_uploads(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+
+        # Create a bucket without the uploaded .zip file, so the application cannot be stored
+        s3.create_bucket(Bucket=TestIngestionBuffer.BUCKET_NAME)
+
+        # S3 sends an s3:TestEvent to the queue when the notification is configured
+        test_event = {'Service': 'Amazon S3', 'Event': 's3:TestEvent', 'Bucket': TestIngestionBuffer.BUCKET_NAME}
+        upload_event = {'Records': [{'s3': {'bucket': {'name': TestIngestionBuffer.BUCKET_NAME},
+                                            'object': {'key': 'zipped/8d247914.zip'}}}]}
+        event = {'Records': [self.create_sqs_record('message-1', test_event),
+                             self.create_sqs_record('message-2', upload_event)]}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'TABLE': 'test_table'}):
+            response = lambda_handler(event, None)
+
+        # Assert only the upload that could not be stored is processed again
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': 'message-2'}]})
+
+    @mock_aws
+    def test_redelivered_completed_application_is_skipped(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_client(sqs)
+        patch_resource(dynamodb)
+
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '8d247914.zip')
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestIngestionBuffer.BUCKET_NAME)
+        s3.upload_file(file_path, TestIngestionBuffer.BUCKET_NAME, 'zipped/8d247914.zip')
+        queue_url = sqs.create_queue(QueueName='LicenseQueue')['QueueUrl']
+
+        # The application was completed, then its batch timed out, so its message is delivered again
+        table = dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+        table.put_item(Item={'APP_UUID': '8d247914',
+                             'ARCHIVE_SHA256': sha256,
+                             'LICENSE_SELFIE_MATCH': True,
+                             'LICENSE_DETAILS_MATCH': True,
+                             'LICENSE_QUEUED': True})
+
+        upload_event = {'Records': [{'s3': {'bucket': {'name': TestIngestionBuffer.BUCKET_NAME},
+                                            'object': {'key': 'zipped/8d247914.zip'}}}]}
+        event = {'Records': [self.create_sqs_record('message-1', upload_event)]}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'TABLE': 'test_table', 'QUEUE_URL': queue_url}), \
+             patch('SynchronousOperations.DocumentLambdaFunction.app.send_sns_email') as send_sns_email:
+            response = lambda_handler(event, None)
+
+        # Assert the message is deleted, and nothing is unzipped, notified or queued again
+        self.assertEqual(response, {'batchItemFailures': []})
+        send_sns_email.assert_not_called()
+        response = s3.list_objects_v2(Bucket=TestIngestionBuffer.BUCKET_NAME, Prefix='unzipped/')
+        self.assertEqual(response['KeyCount'], 0)
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessages'], '0')
+
+    @mock_aws
+    def test_parked_application_that_cannot_be_resumed_is_retried(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(sqs)
+        patch_resource(dynamodb)
+
+        queue_url = sqs.create_queue(QueueName='ParkingQueue')['QueueUrl']
+        dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+
+        # Mock compare_faces: the selfie of 7a135804 does not match, and 9c358026 is throttled again
+        def mock_compare_faces(**kwargs):
+            if kwargs['SourceImage']['S3Object']['Name'].startswith('9c358026'):
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                    'CompareFaces')
+            return {'FaceMatches': [], 'UnmatchedFaces': [], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        def create_checkpoint(appuuid, attempt):
+            return {'stage': 'validate_selfie',
+                    'bucket': TestIngestionBuffer.BUCKET_NAME,
+                    'appuuid': appuuid,
+                    'selfie_key': appuuid + '_selfie.png',
+                    'license_key': appuuid + '_license.png',
+                    'details_dic': {'DOCUMENT_NUMBER': 'S123456579010'},
+                    'attempt': attempt}
+        event = {'Records': [self.create_sqs_record('message-1', create_checkpoint('7a135804', 0)),
+                             self.create_sqs_record('message-2', create_checkpoint('9c358026', 5))]}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'TABLE': 'test_table', 'PARKING_QUEUE_URL': queue_url, 'PARKING_MAX_ATTEMPTS': '5'}), \
+             patch.object(rekognition, 'compare_faces', mock_compare_faces), \
+             patch('SynchronousOperations.DocumentLambdaFunction.app.send_sns_email') as send_sns_email:
+            response = lambda_handler(event, None)
+
+        # Assert the failed check is final (its message is deleted), and the application that
+        # could not be parked again is delivered again (then moved to the parking dead-letter queue)
+        self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': 'message-2'}]})
+        send_sns_email.assert_called_once()
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,242 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import hashlib
+import json
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import prepare_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import process_application
+from SynchronousOperations.DocumentLambdaFunction.app import sqs
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+
+class TestResubmittedApplication(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    BUCKET_NAME = 'documentbucket-123456789102'
+    APPUUID = '8d247914'
+
+    def create_table(self):
+        # Create a mock table with the ArchiveDigestIndex
+        return dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'APP_UUID', 'AttributeType': 'S'},
+                {'AttributeName': 'ARCHIVE_SHA256', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexes=[{
+                'IndexName': 'ArchiveDigestIndex',
+                'KeySchema': [{'AttributeName': 'ARCHIVE_SHA256', 'KeyType': 'HASH'}],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+            }],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+        )
+
+    def prepare(self, object_key, customer_info, valerror):
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        try:
+            with patch.dict(os.environ, {'TABLE': 'test_table'}):
+                return prepare_customer_info(TestResubmittedApplication.BUCKET_NAME,
+                                             object_key,
+                                             lambda_tmp_folder,
+                                             'unzipped/',
+                                             'unzipped/',
+                                             customer_info,
+                                             valerror)
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+    @mock_aws
+    def test_completed_application_is_reused(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestResubmittedApplication.ZIPFILE)
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestResubmittedApplication.BUCKET_NAME)
+        object_key = 'zipped/' + TestResubmittedApplication.ZIPFILE
+        s3.upload_file(file_path, TestResubmittedApplication.BUCKET_NAME, object_key)
+
+        # The same .zip file was verified before under another app_uuid, and its license was validated
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': '7a135804',
+                             'ARCHIVE_SHA256': sha256,
+                             'DOCUMENT_NUMBER': 'S123456579010',
+                             'LICENSE_SELFIE_MATCH': True,
+                             'LICENSE_DETAILS_MATCH': True,
+                             'LICENSE_QUEUED': True,
+                             'LICENSE_VALIDATION': True})
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = self.prepare(object_key, customer_info, valerror)
+
+        # Assert the verdicts are copied without the license submission, and nothing was unzipped to S3
+        self.assertEqual(ret, True)
+        self.assertEqual(customer_info['archive_sha256'], sha256)
+        self.assertEqual(customer_info['duplicate_of'], '7a135804')
+        self.assertEqual(customer_info['details_dic'], {'DOCUMENT_NUMBER': 'S123456579010'})
+
+        item = table.get_item(Key={'APP_UUID': TestResubmittedApplication.APPUUID})['Item']
+        self.assertEqual(item['LICENSE_SELFIE_MATCH'], True)
+        self.assertEqual(item['LICENSE_DETAILS_MATCH'], True)
+        self.assertEqual(item['DUPLICATE_OF'], '7a135804')
+        self.assertNotIn('LICENSE_QUEUED', item)
+        self.assertNotIn('LICENSE_VALIDATION', item)
+
+        response = s3.list_objects_v2(Bucket=TestResubmittedApplication.BUCKET_NAME, Prefix='unzipped/')
+        self.assertEqual(response['KeyCount'], 0)
+
+    @mock_aws
+    def test_failed_application_is_not_reused(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestResubmittedApplication.ZIPFILE)
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestResubmittedApplication.BUCKET_NAME)
+        object_key = 'zipped/' + TestResubmittedApplication.ZIPFILE
+        s3.upload_file(file_path, TestResubmittedApplication.BUCKET_NAME, object_key)
+
+        # The same .zip file failed a check under another app_uuid
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': '7a135804',
+                             'ARCHIVE_SHA256': sha256,
+                             'LICENSE_SELFIE_MATCH': True,
+                             'LICENSE_DETAILS_MATCH': False})
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = self.prepare(object_key, customer_info, valerror)
+
+        # Assert the application is unzipped and verified again, so the applicant gets the outcome of its own checks
+        self.assertEqual(ret, True)
+        self.assertNotIn('duplicate_of', customer_info)
+        self.assertEqual(customer_info['selfie_key'], 'unzipped/8d247914_selfie.png')
+        self.assertNotIn('Item', table.get_item(Key={'APP_UUID': TestResubmittedApplication.APPUUID}))
+
+    @mock_aws
+    def test_reused_application_queues_its_license(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_client(sqs)
+        patch_resource(dynamodb)
+
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestResubmittedApplication.ZIPFILE)
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestResubmittedApplication.BUCKET_NAME)
+        object_key = 'zipped/' + TestResubmittedApplication.ZIPFILE
+        s3.upload_file(file_path, TestResubmittedApplication.BUCKET_NAME, object_key)
+        queue_url = sqs.create_queue(QueueName='LicenseQueue')['QueueUrl']
+
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': '7a135804',
+                             'ARCHIVE_SHA256': sha256,
+                             'DOCUMENT_NUMBER': 'S123456579010',
+                             'LICENSE_SELFIE_MATCH': True,
+                             'LICENSE_DETAILS_MATCH': True})
+
+        application = {'appuuid': '', 'stored': False}
+        valerror = {'error':''}
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+
+        # Call the function to test
+        try:
+            with patch.dict(os.environ, {'TABLE': 'test_table', 'QUEUE_URL': queue_url}):
+                ret = process_application(TestResubmittedApplication.BUCKET_NAME, object_key, lambda_tmp_folder,
+                                          'unzipped/', 'unzipped/', application, valerror)
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+        # Assert the license of the new application is sent for validation
+        self.assertEqual(ret, True)
+        self.assertEqual(application, {'appuuid': TestResubmittedApplication.APPUUID, 'stored': True})
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)['Messages']
+        self.assertEqual([json.loads(message['Body']) for message in messages],
+                         [{'driver_license_id': 'S123456579010', 'validation_override': True, 'uuid': TestResubmittedApplication.APPUUID}])
+        self.assertEqual(table.get_item(Key={'APP_UUID': TestResubmittedApplication.APPUUID})['Item']['LICENSE_QUEUED'], True)
+
+    @mock_aws
+    def test_incomplete_application_is_not_reused(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(s3)
+        patch_resource(dynamodb)
+
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestResubmittedApplication.ZIPFILE)
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestResubmittedApplication.BUCKET_NAME)
+        object_key = 'zipped/' + TestResubmittedApplication.ZIPFILE
+        s3.upload_file(file_path, TestResubmittedApplication.BUCKET_NAME, object_key)
+
+        # The first upload is still being verified: it has no verdicts yet
+        table = self.create_table()
+        table.put_item(Item={'APP_UUID': TestResubmittedApplication.APPUUID, 'ARCHIVE_SHA256': sha256})
+
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        ret = self.prepare(object_key, customer_info, valerror)
+
+        # Assert the application is unzipped as usual
+        self.assertEqual(ret, True)
+        self.assertNotIn('duplicate_of', customer_info)
+        self.assertEqual(customer_info['selfie_key'], 'unzipped/8d247914_selfie.png')
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
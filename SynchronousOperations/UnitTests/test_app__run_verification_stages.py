@@ -0,0 +1,209 @@
+import unittest
+from unittest.mock import patch
+import boto3
+import botocore
+from moto import mock_aws
+import sys
+import os
+import json
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import run_verification_stages
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import rekognition
+from SynchronousOperations.DocumentLambdaFunction.app import sqs
+
+class TestParking(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+    APPUUID = '8d247914'
+
+    def create_table(self):
+        # Create a mock table
+        return dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'KeyType': 'HASH'  # Partition key
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+    def create_checkpoint(self):
+        return {'stage': 'validate_selfie',
+                'bucket': TestParking.BUCKET_NAME,
+                'appuuid': TestParking.APPUUID,
+                'selfie_key': 'fakesource.png',
+                'license_key': 'faketarget.png',
+                'details_dic': {'DOCUMENT_NUMBER': 'S123456579010'},
+                'attempt': 0}
+
+    @mock_aws
+    def test_throttled_selfie_is_parked(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        patch_client(rekognition)
+        patch_client(sqs)
+
+        table = self.create_table()
+        queue_url = sqs.create_queue(QueueName='ParkingQueue')['QueueUrl']
+
+        # Mock compare_faces to be throttled by AWS Rekognition
+        def throttled_compare_faces(**kwargs):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                'CompareFaces')
+        rekognition.compare_faces = throttled_compare_faces
+
+        checkpoint = self.create_checkpoint()
+        valerror = {'error':''}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'PARKING_QUEUE_URL': queue_url}):
+            response = run_verification_stages(checkpoint, table, valerror)
+
+        # Assert the application was parked (not failed) at the throttled stage
+        self.assertEqual(response, True)
+        self.assertEqual(checkpoint['stage'], 'validate_selfie')
+        self.assertEqual(checkpoint['attempt'], 1)
+
+        # The parked message is delayed, so it is not visible yet
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessagesDelayed'], '1')
+
+        # The selfie check did not write an outcome to the table
+        response = table.get_item(Key={'APP_UUID': TestParking.APPUUID})
+        self.assertNotIn('Item', response)
+
+    @mock_aws
+    def test_parked_too_many_times(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        patch_client(rekognition)
+        patch_client(sqs)
+
+        table = self.create_table()
+        queue_url = sqs.create_queue(QueueName='ParkingQueue')['QueueUrl']
+
+        def throttled_compare_faces(**kwargs):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                'CompareFaces')
+        rekognition.compare_faces = throttled_compare_faces
+
+        checkpoint = self.create_checkpoint()
+        checkpoint['attempt'] = 5
+        valerror = {'error':''}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'PARKING_QUEUE_URL': queue_url, 'PARKING_MAX_ATTEMPTS': '5'}):
+            response = run_verification_stages(checkpoint, table, valerror)
+
+        # Assert the application failed, because it could not be parked again
+        self.assertEqual(response, False)
+        self.assertEqual(valerror['error'].args[0], 'Error in validate_selfie, and could not park the application')
+
+    @mock_aws
+    def test_failed_selfie_is_not_parked(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        patch_client(rekognition)
+        patch_client(sqs)
+
+        table = self.create_table()
+        queue_url = sqs.create_queue(QueueName='ParkingQueue')['QueueUrl']
+
+        # Mock compare_faces to fail with an error that is not throttling
+        def failed_compare_faces(**kwargs):
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidS3ObjectException', 'Message': 'Unable to get object'}},
+                'CompareFaces')
+        rekognition.compare_faces = failed_compare_faces
+
+        checkpoint = self.create_checkpoint()
+        valerror = {'error':''}
+
+        # Call the function to test
+        with patch.dict(os.environ, {'PARKING_QUEUE_URL': queue_url}):
+            response = run_verification_stages(checkpoint, table, valerror)
+
+        # Assert the application failed, and nothing was parked
+        self.assertEqual(response, False)
+        self.assertEqual(valerror['error'].args[0], 'Error in validate_selfie')
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessagesDelayed'], '0')
+
+    @mock_aws
+    def test_license_is_queued_once(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        patch_client(sqs)
+
+        table = self.create_table()
+        queue_url = sqs.create_queue(QueueName='LicenseQueue')['QueueUrl']
+
+        # The same application reaches the queue_customer_id stage twice (e.g. its SQS message is delivered again)
+        with patch.dict(os.environ, {'QUEUE_URL': queue_url}):
+            for i in range(2):
+                checkpoint = self.create_checkpoint()
+                checkpoint['stage'] = 'queue_customer_id'
+                valerror = {'error':''}
+
+                # Call the function to test
+                response = run_verification_stages(checkpoint, table, valerror)
+                self.assertEqual(response, True)
+
+        # Assert the license was sent once
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)['Messages']
+        self.assertEqual([json.loads(message['Body'])['uuid'] for message in messages], [TestParking.APPUUID])
+        self.assertEqual(table.get_item(Key={'APP_UUID': TestParking.APPUUID})['Item']['LICENSE_QUEUED'], True)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
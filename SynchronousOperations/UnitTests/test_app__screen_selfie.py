@@ -0,0 +1,163 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import zipfile
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+import SynchronousOperations.DocumentLambdaFunction.app as app
+from SynchronousOperations.DocumentLambdaFunction.app import screen_selfie
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+from SynchronousOperations.DocumentLambdaFunction.app import Image
+
+@unittest.skipIf(Image is None, 'NumPy and Pillow are not installed')
+class TestSelfieScreening(unittest.TestCase):
+
+    # 7a135804 and 8d247914 have the same selfie. 9c358026 has another selfie.
+    APPLICATIONS = ['7a135804', '8d247914', '9c358026']
+
+    def setUp(self):
+        # Unzip the selfies of the applications located in UnitTests/
+        self.unzipped_folder = tempfile.mkdtemp() + '/'
+        for appuuid in TestSelfieScreening.APPLICATIONS:
+            zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), appuuid + '.zip')
+            with zipfile.ZipFile(zip_path) as zip_file:
+                zip_file.extract(appuuid + '_selfie.png', self.unzipped_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.unzipped_folder)
+
+    def create_table(self):
+        # Create a mock table of selfie hashes
+        return dynamodb.create_table(
+            TableName='selfie_hash_table',
+            KeySchema=[
+                {'AttributeName': 'BAND', 'KeyType': 'HASH'},
+                {'AttributeName': 'APP_UUID', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'BAND', 'AttributeType': 'S'},
+                {'AttributeName': 'APP_UUID', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+    @patch.dict(os.environ, {'SELFIE_HASH_TABLE': 'selfie_hash_table'})
+    @mock_aws
+    def test_near_duplicate_selfies(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        self.create_table()
+
+        # Call the function to test for each application, in order
+        screens = {}
+        for appuuid in TestSelfieScreening.APPLICATIONS:
+            screens[appuuid] = {'dhash': '', 'similar_selfies': []}
+            ret = screen_selfie(self.unzipped_folder + appuuid + '_selfie.png', appuuid, screens[appuuid])
+            self.assertEqual(ret, True)
+
+        # Assert only the reused selfie is found
+        self.assertEqual(len(screens['7a135804']['dhash']), 16)
+        self.assertEqual(screens['7a135804']['similar_selfies'], [])
+        self.assertEqual(screens['8d247914']['similar_selfies'], ['7a135804'])
+        self.assertEqual(screens['9c358026']['similar_selfies'], [])
+
+    @patch.dict(os.environ, {'SELFIE_HASH_TABLE': 'selfie_hash_table'})
+    @mock_aws
+    def test_screening_same_application_again(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        self.create_table()
+
+        # A retried application is not a near-duplicate of itself
+        for i in range(2):
+            selfie_screen = {'dhash': '', 'similar_selfies': []}
+            ret = screen_selfie(self.unzipped_folder + '8d247914_selfie.png', '8d247914', selfie_screen)
+            self.assertEqual(ret, True)
+            self.assertEqual(selfie_screen['similar_selfies'], [])
+
+    @patch.dict(os.environ, {'SELFIE_HASH_TABLE': 'selfie_hash_table'})
+    @mock_aws
+    def test_low_entropy_bands_are_screened(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        table = self.create_table()
+
+        # A flat image has the dHash 0000000000000000: its four bands are shared by every flat image
+        Image.new('RGB', (640, 480), (128, 128, 128)).save(self.unzipped_folder + 'flat_selfie.png')
+        screens = {}
+        for appuuid in ('1f2e3d4c', '5a6b7c8d'):
+            screens[appuuid] = {'dhash': '', 'similar_selfies': []}
+            ret = screen_selfie(self.unzipped_folder + 'flat_selfie.png', appuuid, screens[appuuid])
+            self.assertEqual(ret, True)
+
+        # Assert the bands are queried and indexed, so the near-duplicate is found
+        self.assertEqual(screens['5a6b7c8d']['dhash'], '0000000000000000')
+        self.assertEqual(screens['5a6b7c8d']['similar_selfies'], ['1f2e3d4c'])
+        self.assertEqual(screens['5a6b7c8d']['truncated_bands'], [])
+        self.assertEqual(table.scan()['Count'], 8)
+
+    @patch.dict(os.environ, {'SELFIE_HASH_TABLE': 'selfie_hash_table'})
+    @mock_aws
+    def test_popular_bands_are_truncated(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+        self.create_table()
+
+        Image.new('RGB', (640, 480), (128, 128, 128)).save(self.unzipped_folder + 'flat_selfie.png')
+        with patch.object(app, 'DHASH_MAX_BAND_ITEMS', 2):
+            for appuuid in ('1f2e3d4c', '2e3d4c5b', '3d4c5b6a'):
+                selfie_screen = {'dhash': '', 'similar_selfies': []}
+                self.assertEqual(screen_selfie(self.unzipped_folder + 'flat_selfie.png', appuuid, selfie_screen), True)
+
+            # Call the function to test
+            selfie_screen = {'dhash': '', 'similar_selfies': []}
+            ret = screen_selfie(self.unzipped_folder + 'flat_selfie.png', '4c5b6a79', selfie_screen)
+
+        # Assert only the first DHASH_MAX_BAND_ITEMS selfies of each band are compared: the reduced recall is reported
+        self.assertEqual(ret, True)
+        self.assertEqual(sorted(selfie_screen['similar_selfies']), ['1f2e3d4c', '2e3d4c5b'])
+        self.assertEqual(selfie_screen['truncated_bands'], ['0#0000', '1#0000', '2#0000', '3#0000'])
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
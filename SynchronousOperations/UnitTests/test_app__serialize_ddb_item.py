@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from moto import mock_aws
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import serialize_ddb_item
+from SynchronousOperations.DocumentLambdaFunction.app import put_ddb_item
+from SynchronousOperations.DocumentLambdaFunction.app import set_ddb_attribute
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
+
+class TestDynamoDBItem(unittest.TestCase):
+
+    APPUUID = '8d247914'
+    ITEM = {
+        'APP_UUID': '8d247914',
+        'FIRST_NAME': 'NICK',
+        'DOCUMENT_NUMBER': 'S123456579010',
+        'ZIP_CODE_IN_ADDRESS': '000001234',
+        'SELFIE_DHASH': '00ff00ff00ff00ff',
+        'SIMILAR_SELFIE_OF': ['7a135804', '9c358026'],
+        'LICENSE_SELFIE_MATCH': True}
+
+    def test_serialize_ddb_item(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        # The precompiled serializers give the same result as the boto3 resource layer
+        type_serializer = TypeSerializer()
+        self.assertEqual(serialize_ddb_item(TestDynamoDBItem.ITEM),
+                         {name: type_serializer.serialize(value) for name, value in TestDynamoDBItem.ITEM.items()})
+
+        # Unknown attributes, and values of an unexpected type, are serialized by TypeSerializer
+        self.assertEqual(serialize_ddb_item({'ARCHIVE_BYTES_SAVED': 42, 'LICENSE_VALIDATION': 'true'}),
+                         {'ARCHIVE_BYTES_SAVED': {'N': '42'}, 'LICENSE_VALIDATION': {'S': 'true'}})
+
+    @mock_aws
+    def test_put_and_set_with_table_or_name(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_client(get_client('dynamodb'))
+        patch_resource(dynamodb)
+
+        # Create a mock table
+        table = dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+
+        # Call the functions to test, with a boto3 Table and with a table name
+        response = put_ddb_item(table, TestDynamoDBItem.ITEM)
+        self.assertEqual(response['ResponseMetadata']['HTTPStatusCode'], 200)
+        response = set_ddb_attribute('test_table', TestDynamoDBItem.APPUUID, 'LICENSE_DETAILS_MATCH', False)
+        self.assertEqual(response['ResponseMetadata']['HTTPStatusCode'], 200)
+
+        # The item reads back through the resource layer as it was written
+        item = table.get_item(Key={'APP_UUID': TestDynamoDBItem.APPUUID})['Item']
+        self.assertEqual(item, {**TestDynamoDBItem.ITEM, 'LICENSE_DETAILS_MATCH': False})
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
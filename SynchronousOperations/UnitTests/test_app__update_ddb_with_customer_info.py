@@ -9,6 +9,10 @@ import os
 path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(path_to_add)
 
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
 from SynchronousOperations.DocumentLambdaFunction.app import update_ddb_with_customer_info
 from SynchronousOperations.DocumentLambdaFunction.app import dynamodb
 
@@ -275,6 +279,69 @@ class TestDynamoDB(unittest.TestCase):
         self.assertTrue(not any(ddb_response.values()))
         self.assertIn('Missing the key UnknownID in the item', str(valerror['error']))
 
+    @patch.dict(os.environ, {'TABLE': 'test_table'})
+    @mock_aws
+    def test_duplicate_license_is_flagged(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        patch_resource(dynamodb)
+
+        # Create a mock table with the DocumentNumberIndex
+        table = dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'KeyType': 'HASH'  # Partition key
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'APP_UUID',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'DOCUMENT_NUMBER',
+                    'AttributeType': 'S'
+                }
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    'IndexName': 'DocumentNumberIndex',
+                    'KeySchema': [{'AttributeName': 'DOCUMENT_NUMBER', 'KeyType': 'HASH'}],
+                    'Projection': {'ProjectionType': 'KEYS_ONLY'},
+                    'ProvisionedThroughput': {'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1}
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+
+        # Another application was submitted with the same driver license
+        table.put_item(Item={'APP_UUID': '7a135804', 'DOCUMENT_NUMBER': 'S123456579010'})
+
+        customer_details = {'ddb_table':'', 'details_dic':''}
+        ddb_response = {'ddb_response':''}
+        valerror = {'error':''}
+
+        # Construct the absolute path to the file located in UnitTests/
+        project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        file_path = os.path.join(project_dir, 'UnitTests', TestDynamoDB.CUSTOMER_DETAILS_FILE)
+
+        # Call the function to test
+        response = update_ddb_with_customer_info(file_path, TestDynamoDB.APPUUID, customer_details, ddb_response, valerror)
+
+        # Assert the item was added, and flagged with the other application
+        self.assertEqual(response, True)
+        self.assertEqual(customer_details['duplicate_license_of'], ['7a135804'])
+        response = table.get_item(Key={'APP_UUID': TestDynamoDB.APPUUID})
+        self.assertEqual(response['Item']['DUPLICATE_LICENSE_OF'], ['7a135804'])
+
 
 if __name__ == '__main__':
 
@@ -289,4 +356,6 @@ if __name__ == '__main__':
     # Remove the same path from sys.path when finished testing
     if path_to_add in sys.path:
         sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
 
@@ -0,0 +1,118 @@
+import unittest
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+import sys
+import os
+import shutil
+import tempfile
+import hashlib
+import json
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import upload_blob_to_s3
+from SynchronousOperations.DocumentLambdaFunction.app import prepare_customer_info
+from SynchronousOperations.DocumentLambdaFunction.app import s3
+
+class TestContentStorage(unittest.TestCase):
+
+    ZIPFILE = '8d247914.zip'
+    DETAILS_FILE = '8d247914_details.csv'
+    BUCKET_NAME = 'documentbucket-123456789102'
+
+    @mock_aws
+    def test_same_content_is_uploaded_once(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+        s3.create_bucket(Bucket=TestContentStorage.BUCKET_NAME)
+
+        path_of_file = os.path.dirname(os.path.abspath(__file__)) + '/'
+        with open(path_of_file + TestContentStorage.DETAILS_FILE, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+
+        # Call the function to test twice with the same file
+        first = {'key': '', 'sha256': '', 'uploaded': False}
+        second = {'key': '', 'sha256': '', 'uploaded': False}
+        ret_first = upload_blob_to_s3(s3, TestContentStorage.DETAILS_FILE, path_of_file, TestContentStorage.BUCKET_NAME, first)
+        ret_second = upload_blob_to_s3(s3, TestContentStorage.DETAILS_FILE, path_of_file, TestContentStorage.BUCKET_NAME, second)
+
+        # Assert the blob is keyed by its SHA-256, and only the first call uploaded it
+        self.assertEqual(ret_first, True)
+        self.assertEqual(ret_second, True)
+        self.assertEqual(first['sha256'], sha256)
+        self.assertEqual(first['key'], 'blobs/' + sha256[:2] + '/' + sha256 + '.csv')
+        self.assertEqual(second['key'], first['key'])
+        self.assertEqual(first['uploaded'], True)
+        self.assertEqual(second['uploaded'], False)
+
+    @mock_aws
+    def test_prepare_customer_info_with_manifest(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        patch_client(s3)
+
+        # Upload the zip file to the "zipped" prefix of a mock S3 bucket
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestContentStorage.ZIPFILE)
+        s3.create_bucket(Bucket=TestContentStorage.BUCKET_NAME)
+        object_key = 'zipped/' + TestContentStorage.ZIPFILE
+        s3.upload_file(file_path, TestContentStorage.BUCKET_NAME, object_key)
+
+        lambda_tmp_folder = tempfile.mkdtemp() + '/'
+        customer_info = {'selfie_key' : '', 'license_key' : '', 'details_file' : '', 'appuuid' : ''}
+        valerror = {'error':''}
+
+        # Call the function to test
+        try:
+            with patch.dict(os.environ, {'ARTIFACT_STORAGE': 'content', 'KEY_LAYOUT': 'flat'}):
+                ret = prepare_customer_info(TestContentStorage.BUCKET_NAME,
+                                            object_key,
+                                            lambda_tmp_folder,
+                                            'unzipped/',
+                                            'unzipped/',
+                                            customer_info,
+                                            valerror)
+        finally:
+            shutil.rmtree(lambda_tmp_folder)
+
+        # Assert the images are blobs, and the manifest points at them
+        self.assertEqual(ret, True)
+        self.assertTrue(customer_info['selfie_key'].startswith('blobs/'))
+        self.assertTrue(customer_info['license_key'].startswith('blobs/'))
+        self.assertEqual(customer_info['manifest_key'], 'unzipped/8d247914_manifest.json')
+
+        response = s3.get_object(Bucket=TestContentStorage.BUCKET_NAME, Key=customer_info['manifest_key'])
+        manifest = json.loads(response['Body'].read())
+        self.assertEqual(manifest['app_uuid'], '8d247914')
+        self.assertEqual(manifest['artifacts']['8d247914_selfie.png'], customer_info['selfie_key'])
+        self.assertEqual(manifest['artifacts']['8d247914_license.png'], customer_info['license_key'])
+        self.assertEqual(manifest['artifacts']['8d247914_details.csv'], 'unzipped/8d247914_details.csv')
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -11,6 +11,10 @@ import zipfile
 path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(path_to_add)
 
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
 from SynchronousOperations.DocumentLambdaFunction.app import validate_selfie
 from SynchronousOperations.DocumentLambdaFunction.app import SIMILARITY_THRESHOLD
 from SynchronousOperations.DocumentLambdaFunction.app import s3
@@ -324,6 +328,8 @@ if __name__ == '__main__':
     # Remove the same path from sys.path when finished testing
     if path_to_add in sys.path:
         sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
 
 
 
@@ -0,0 +1,280 @@
+import unittest
+from unittest.mock import patch
+from moto import mock_aws
+from concurrent.futures import ThreadPoolExecutor
+import json
+import hashlib
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/ and Tools/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import set_api_rate_limits
+from SynchronousOperations.DocumentLambdaFunction.app import api_rate_limits
+from SynchronousOperations.DocumentLambdaFunction.app import get_resource
+from SynchronousOperations.DocumentLambdaFunction.app import SIMILARITY_THRESHOLD
+from Tools.backfill import run_backfill
+from Tools.backfill import get_shards
+
+class TestBackfill(unittest.TestCase):
+
+    BUCKET_NAME = 'documentbucket-123456789102'
+    CHECKPOINT = 'backfill_checkpoint.jsonl'
+
+    def test_get_shards(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        self.assertEqual(list(get_shards(iter('abcdefg'), 3)), [['a', 'b', 'c'], ['d', 'e', 'f'], ['g']])
+
+    @mock_aws
+    def test_results_are_checkpointed_while_listing(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        checkpoint_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestBackfill.CHECKPOINT)
+        keys = [f'zipped/{index:08x}.zip' for index in range(20)]
+        checkpointed = []
+
+        # Mock list_zip_keys: keep the number of checkpointed applications each time a key is listed
+        def mock_list_zip_keys(bucket, prefix):
+            for key in keys:
+                with open(checkpoint_filename) as f:
+                    checkpointed.append(len(f.readlines()))
+                yield key
+
+        def mock_process_application(bucket, key, lambda_tmp_folder, lambda_unzipped_folder, bucket_unzipped_prefix,
+                                     application, valerror, reverify = False, notify = True):
+            application['appuuid'] = key[len('zipped/'):-len('.zip')]
+            application['stored'] = True
+            return True
+
+        try:
+            with patch('Tools.backfill.ProcessPoolExecutor', ThreadPoolExecutor), \
+                 patch('Tools.backfill.list_zip_keys', mock_list_zip_keys), \
+                 patch('Tools.backfill.process_application', mock_process_application):
+                # Call the function to test
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=1, shard_size=2)
+        finally:
+            set_api_rate_limits({})
+            if os.path.exists(checkpoint_filename):
+                os.remove(checkpoint_filename)
+
+        # Assert at most 2 shards are in flight, so results are checkpointed before the last key is listed:
+        # of the 19 keys listed before it, only the shard being filled (1 key) and 2 shards (4 keys) are not done
+        self.assertEqual(summary['succeeded'], 20)
+        self.assertEqual(checkpointed[0], 0)
+        self.assertGreaterEqual(checkpointed[-1], 19 - 1 - 4)
+
+    @mock_aws
+    def test_run_backfill(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        s3 = get_client('s3')
+        patch_client(s3)
+
+        # 12 applications and another object under the prefix
+        s3.create_bucket(Bucket=TestBackfill.BUCKET_NAME)
+        keys = [f'zipped/{index:08x}.zip' for index in range(12)]
+        for key in keys + ['zipped/readme.txt']:
+            s3.put_object(Bucket=TestBackfill.BUCKET_NAME, Key=key, Body=b'')
+
+        # Mock process_application: the first run fails on the 4th application
+        calls = []
+        def mock_process_application(bucket, key, lambda_tmp_folder, lambda_unzipped_folder, bucket_unzipped_prefix,
+                                     application, valerror, reverify = False, notify = True):
+            calls.append(key)
+            # The applications are verified again, and nothing is sent by default
+            self.assertEqual((reverify, notify), (True, False))
+            application['appuuid'] = key[len('zipped/'):-len('.zip')]
+            if key == keys[3] and calls.count(key) == 1:
+                valerror['error'] = ValueError('Throttled')
+                return False
+            application['stored'] = True
+            return True
+
+        checkpoint_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestBackfill.CHECKPOINT)
+        try:
+            # The processes are replaced by threads, so that the mocks apply
+            with patch('Tools.backfill.ProcessPoolExecutor', ThreadPoolExecutor), \
+                 patch('Tools.backfill.process_application', mock_process_application):
+                # Call the function to test
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=2, shard_size=5,
+                                       api_rate_limits={'textract.analyze_id': 2.0})
+                self.assertEqual(api_rate_limits['textract.analyze_id']['interval'], 1.0)
+
+                self.assertEqual(sorted(calls), keys)
+                self.assertEqual(summary['listed'], 12)
+                self.assertEqual(summary['succeeded'], 11)
+                self.assertEqual(summary['failed'], 1)
+                self.assertEqual(summary['not_stored'], 1)
+                self.assertEqual(summary['errors'], [('Throttled', 1)])
+
+                # A second run skips the applications in the checkpoint, and retries the failed one on request
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=2, shard_size=5)
+                self.assertEqual((summary['skipped'], summary['processed']), (12, 0))
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=2, shard_size=5,
+                                       retry_failed=True)
+                self.assertEqual((summary['skipped'], summary['succeeded']), (11, 1))
+
+            with open(checkpoint_filename) as f:
+                results = [json.loads(line) for line in f]
+        finally:
+            set_api_rate_limits({})
+            if os.path.exists(checkpoint_filename):
+                os.remove(checkpoint_filename)
+
+        self.assertEqual(len(results), 13)
+        self.assertEqual(results[-1]['key'], keys[3])
+        self.assertEqual(results[-1]['ok'], True)
+
+    def create_completed_application(self, s3, dynamodb, sqs):
+        # The application was completed: both checks passed, and its license was sent to the license queue
+        file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '8d247914.zip')
+        with open(file_path, 'rb') as file:
+            sha256 = hashlib.sha256(file.read()).hexdigest()
+        s3.create_bucket(Bucket=TestBackfill.BUCKET_NAME)
+        s3.upload_file(file_path, TestBackfill.BUCKET_NAME, 'zipped/8d247914.zip')
+        queue_url = sqs.create_queue(QueueName='LicenseQueue')['QueueUrl']
+
+        table = dynamodb.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+        table.put_item(Item={'APP_UUID': '8d247914',
+                             'ARCHIVE_SHA256': sha256,
+                             'LICENSE_SELFIE_MATCH': True,
+                             'LICENSE_DETAILS_MATCH': True,
+                             'LICENSE_QUEUED': True,
+                             'LICENSE_VALIDATION': 'valid'})
+        return table, queue_url
+
+    def create_identity_document(self, fields):
+        return {'IdentityDocumentFields': [{'Type': {'Text': name}, 'ValueDetection': {'Text': value}}
+                                           for name, value in fields.items()]}
+
+    @mock_aws
+    def test_backfill_verifies_completed_application_again(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        s3 = get_client('s3')
+        sqs = get_client('sqs')
+        dynamodb = get_resource('dynamodb')
+        patch_client(s3)
+        patch_client(sqs)
+        patch_resource(dynamodb)
+        table, queue_url = self.create_completed_application(s3, dynamodb, sqs)
+
+        # Mock Rekognition and Textract: the selfie and the customer's details match the license
+        compare_faces_calls = []
+        def mock_compare_faces(**kwargs):
+            compare_faces_calls.append(kwargs)
+            return {'FaceMatches': [{'Similarity': SIMILARITY_THRESHOLD + 1}], 'UnmatchedFaces': [],
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+        fields = {'FIRST_NAME': 'NICK', 'LAST_NAME': 'SAMPLE', 'CITY_IN_ADDRESS': 'TALLAHASSEE', 'ZIP_CODE_IN_ADDRESS': '000001234',
+                  'STATE_IN_ADDRESS': 'FL', 'DOCUMENT_NUMBER': 'S123456579010', 'DATE_OF_BIRTH': '01/12/1957', 'ADDRESS': '123 MAIN STREET'}
+        def mock_analyze_id(DocumentPages):
+            return {'DocumentMetadata': {'Pages': len(DocumentPages)},
+                    'IdentityDocuments': [dict(self.create_identity_document(fields), DocumentIndex=1)],
+                    'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        checkpoint_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestBackfill.CHECKPOINT)
+        try:
+            # The processes are replaced by threads, so that the mocks apply.
+            # The real process_application() is called.
+            with patch('Tools.backfill.ProcessPoolExecutor', ThreadPoolExecutor), \
+                 patch.dict(os.environ, {'TABLE': 'test_table', 'QUEUE_URL': queue_url}), \
+                 patch.object(get_client('rekognition'), 'compare_faces', mock_compare_faces), \
+                 patch.object(get_client('textract'), 'analyze_id', mock_analyze_id), \
+                 patch('SynchronousOperations.DocumentLambdaFunction.app.send_sns_email') as send_sns_email:
+                # Call the function to test
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=1, shard_size=1)
+        finally:
+            set_api_rate_limits({})
+            if os.path.exists(checkpoint_filename):
+                os.remove(checkpoint_filename)
+
+        # Assert the completed application was verified again (it was not skipped as already completed)
+        self.assertEqual((summary['processed'], summary['succeeded']), (1, 1))
+        self.assertEqual(len(compare_faces_calls), 1)
+        item = table.get_item(Key={'APP_UUID': '8d247914'})['Item']
+        self.assertEqual(item['LICENSE_SELFIE_MATCH'], True)
+        self.assertEqual(item['LICENSE_DETAILS_MATCH'], True)
+        self.assertEqual(item['EXTRACTED_DETAILS']['DOCUMENT_NUMBER'], 'S123456579010')
+
+        # Assert nothing was notified or queued, and the license submission was kept
+        send_sns_email.assert_not_called()
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessages'], '0')
+        self.assertEqual(item['LICENSE_QUEUED'], True)
+        self.assertEqual(item['LICENSE_VALIDATION'], 'valid')
+
+    @mock_aws
+    def test_backfill_does_not_notify_failed_check(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client, patch_resource
+        s3 = get_client('s3')
+        sqs = get_client('sqs')
+        dynamodb = get_resource('dynamodb')
+        patch_client(s3)
+        patch_client(sqs)
+        patch_resource(dynamodb)
+        table, queue_url = self.create_completed_application(s3, dynamodb, sqs)
+
+        # Mock Rekognition: the selfie does not match the license anymore
+        def mock_compare_faces(**kwargs):
+            return {'FaceMatches': [], 'UnmatchedFaces': [], 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+        checkpoint_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestBackfill.CHECKPOINT)
+        try:
+            with patch('Tools.backfill.ProcessPoolExecutor', ThreadPoolExecutor), \
+                 patch.dict(os.environ, {'TABLE': 'test_table', 'QUEUE_URL': queue_url}), \
+                 patch.object(get_client('rekognition'), 'compare_faces', mock_compare_faces), \
+                 patch('SynchronousOperations.DocumentLambdaFunction.app.send_sns_email') as send_sns_email:
+                # Call the function to test
+                summary = run_backfill(TestBackfill.BUCKET_NAME, 'zipped/', checkpoint_filename, processes=1, shard_size=1)
+        finally:
+            set_api_rate_limits({})
+            if os.path.exists(checkpoint_filename):
+                os.remove(checkpoint_filename)
+
+        # Assert the new verdict is stored, and its email is not sent
+        self.assertEqual(summary['failed'], 1)
+        item = table.get_item(Key={'APP_UUID': '8d247914'})['Item']
+        self.assertEqual(item['LICENSE_SELFIE_MATCH'], False)
+        send_sns_email.assert_not_called()
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
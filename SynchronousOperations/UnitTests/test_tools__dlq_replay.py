@@ -0,0 +1,90 @@
+import unittest
+from moto import mock_aws
+import json
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/ and Tools/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import put_ddb_item
+from Tools.dlq_replay import replay_messages
+
+class TestDlqReplay(unittest.TestCase):
+
+    PROGRESS = 'dlq_replay_progress.txt'
+
+    @mock_aws
+    def test_replay_messages(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        sqs = get_client('sqs')
+        dynamodb_client = get_client('dynamodb')
+        patch_client(sqs)
+        patch_client(dynamodb_client)
+
+        # Create mock queues and a mock table
+        dlq_url = sqs.create_queue(QueueName='LicenseDeadLetterQueue')['QueueUrl']
+        queue_url = sqs.create_queue(QueueName='LicenseQueue')['QueueUrl']
+        dynamodb_client.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+
+        # The third-party API was down for 4 applications. The license of 7a135804 was not submitted for another reason.
+        message_ids = {}
+        for appuuid, submit_error in (('8d247914', 'ConnectionError'), ('9c358026', 'ConnectionError'),
+                                      ('1f2e3d4c', 'ConnectionError'), ('5a6b7c8d', 'ConnectionError'),
+                                      ('7a135804', 'KeyError')):
+            put_ddb_item('test_table', {'APP_UUID': appuuid, 'LICENSE_SUBMIT_ERROR': submit_error})
+            body = json.dumps({'driver_license_id': 'S123456579010', 'validation_override': True, 'app_uuid': appuuid})
+            message_ids[appuuid] = sqs.send_message(QueueUrl=dlq_url, MessageBody=body)['MessageId']
+
+        # An interrupted replay sent the message of 5a6b7c8d, but did not delete it
+        progress_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestDlqReplay.PROGRESS)
+        with open(progress_filename, 'w') as f:
+            f.write(message_ids['5a6b7c8d'] + '\n')
+
+        try:
+            # Call the function to test
+            stats = replay_messages(dlq_url, queue_url, progress_filename,
+                                    error_classes=['ConnectionError'], table_name='test_table', rate=100.0, max_queue_depth=10)
+            with open(progress_filename) as f:
+                progress = f.read().split()
+        finally:
+            os.remove(progress_filename)
+
+        # Assert the messages of the ConnectionError are moved once, and the other message stays in the dead-letter queue
+        self.assertEqual((stats['received'], stats['selected'], stats['sent'], stats['resumed'], stats['failed']), (5, 4, 3, 1, 0))
+        self.assertEqual(sorted(progress), sorted(message_ids[appuuid] for appuuid in ('8d247914', '9c358026', '1f2e3d4c', '5a6b7c8d')))
+
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)['Messages']
+        self.assertEqual(sorted(json.loads(message['Body'])['app_uuid'] for message in messages), ['1f2e3d4c', '8d247914', '9c358026'])
+        messages = sqs.receive_message(QueueUrl=dlq_url, MaxNumberOfMessages=10)['Messages']
+        self.assertEqual([json.loads(message['Body'])['app_uuid'] for message in messages], ['7a135804'])
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
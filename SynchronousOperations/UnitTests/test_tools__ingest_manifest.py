@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import patch
+from moto import mock_aws
+import csv
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/ and Tools/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+from Tools.ingest_manifest import ingest_manifest
+
+class TestIngestManifest(unittest.TestCase):
+
+    MANIFEST = 'manifest.csv'
+
+    def write_manifest(self, manifest_filename, rows):
+        with open(manifest_filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['APP_UUID'] + CUSTOMER_INFORMATION + ['EMAIL'])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    @mock_aws
+    def test_ingest_manifest(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        dynamodb_client = get_client('dynamodb')
+        patch_client(dynamodb_client)
+
+        # Create a mock table
+        dynamodb_client.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+
+        # 60 applications, an application without APP_UUID, and an application that is repeated
+        rows = [dict({name: f'{name} {index}' for name in CUSTOMER_INFORMATION}, APP_UUID=f'{index:08x}', EMAIL='a@b.c')
+                for index in range(60)]
+        rows.insert(10, dict(rows[0], APP_UUID=''))
+        rows.insert(20, dict(rows[5], FIRST_NAME='NICK'))
+
+        # DynamoDB cannot write the last item of the first call of each batch
+        batch_write_item = dynamodb_client.batch_write_item
+        unprocessed_calls = []
+        def mock_batch_write_item(RequestItems, **kwargs):
+            requests = RequestItems['test_table']
+            if len(requests) > 1:
+                unprocessed_calls.append(requests[-1])
+                response = batch_write_item(RequestItems={'test_table': requests[:-1]}, **kwargs)
+                response['UnprocessedItems'] = {'test_table': requests[-1:]}
+                return response
+            return batch_write_item(RequestItems=RequestItems, **kwargs)
+
+        manifest_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), TestIngestManifest.MANIFEST)
+        try:
+            self.write_manifest(manifest_filename, rows)
+
+            # Call the function to test
+            with patch.object(dynamodb_client, 'batch_write_item', mock_batch_write_item):
+                stats = ingest_manifest(manifest_filename, 'test_table', workers=2)
+        finally:
+            os.remove(manifest_filename)
+
+        # Assert the repeated application starts a new batch, and the unprocessed items were written again
+        self.assertEqual(stats['rejected'], [12])
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['retries'], len(unprocessed_calls))
+        self.assertEqual(stats['written'], 61)
+        self.assertEqual(stats['failed'], 0)
+        self.assertGreater(stats['consumed_capacity'], 0)
+
+        response = dynamodb_client.scan(TableName='test_table', Select='COUNT')
+        self.assertEqual(response['Count'], 60)
+        item = dynamodb_client.get_item(TableName='test_table', Key={'APP_UUID': {'S': '00000005'}})['Item']
+        self.assertEqual(item['FIRST_NAME'], {'S': 'NICK'})
+        self.assertNotIn('EMAIL', item)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)
@@ -0,0 +1,107 @@
+import unittest
+from moto import mock_aws
+import numpy
+import sys
+import os
+
+# Append the path to sys.path, in order to import from DocumentLambdaFunction/ and Tools/
+path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(path_to_add)
+
+# Append the path of the AwsServicesLayer Lambda layer, in order to import aws_services
+layer_path_to_add = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'Layers', 'AwsServicesLayer'))
+sys.path.append(layer_path_to_add)
+
+from SynchronousOperations.DocumentLambdaFunction.app import normalize_customer_value
+from SynchronousOperations.DocumentLambdaFunction.app import put_ddb_item
+from SynchronousOperations.DocumentLambdaFunction.app import set_ddb_attributes
+from SynchronousOperations.DocumentLambdaFunction.app import get_client
+from SynchronousOperations.DocumentLambdaFunction.app import CUSTOMER_INFORMATION
+from Tools.reverify_details import normalize_columns
+from Tools.reverify_details import reverify_table
+from Tools.reverify_details import write_mismatch_matrix
+
+class TestReverifyDetails(unittest.TestCase):
+
+    DETAILS = {'DOCUMENT_NUMBER': 'S123456579010', 'FIRST_NAME': 'John', 'LAST_NAME': 'Doe', 'DATE_OF_BIRTH': '01/01/1990',
+               'ADDRESS': '1 Main St', 'STATE_IN_ADDRESS': 'CA', 'CITY_IN_ADDRESS': 'Los Angeles', 'ZIP_CODE_IN_ADDRESS': '90001'}
+
+    def test_normalize_columns(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        values = ['1 Main St', ' 1  main\tst ', '', 'Los    Angeles\n', '   ', 'o\'neil', 'Straße  Zoë', 'São\u00a0Paulo']
+
+        # The vectorized normalization gives the same result as normalize_customer_value()
+        self.assertEqual(normalize_columns(numpy.array(values, dtype=str)).tolist(),
+                         [normalize_customer_value(value) for value in values])
+
+    @mock_aws
+    def test_reverify_table(self):
+        print(f'***************************************************')
+        print(f'Unit Test: {self.__class__.__name__} : {self._testMethodName} :')
+        print(f'***************************************************')
+
+        from moto.core import patch_client
+        dynamodb_client = get_client('dynamodb')
+        patch_client(dynamodb_client)
+
+        # Create a mock table
+        dynamodb_client.create_table(
+            TableName='test_table',
+            KeySchema=[{'AttributeName': 'APP_UUID', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'APP_UUID', 'AttributeType': 'S'}],
+            ProvisionedThroughput={'ReadCapacityUnits': 1, 'WriteCapacityUnits': 1})
+
+        # 8d247914 matches after normalization, 7a135804 has another last name, and 9c358026 was not verified
+        details = TestReverifyDetails.DETAILS
+        extracted = {name: value.upper() for name, value in details.items()}
+        for appuuid, extracted_details in (('8d247914', dict(extracted, ADDRESS='1  MAIN ST')),
+                                           ('7a135804', dict(extracted, LAST_NAME='ROE')),
+                                           ('9c358026', None)):
+            put_ddb_item('test_table', {'APP_UUID': appuuid, **details})
+            if extracted_details is not None:
+                set_ddb_attributes('test_table', appuuid, {'LICENSE_DETAILS_MATCH': True, 'EXTRACTED_DETAILS': extracted_details})
+
+        # Call the function to test
+        columns, mismatch = reverify_table('test_table', segments=2, normalized=True)
+
+        self.assertEqual(columns['skipped'], 1)
+        rows = dict(zip(columns['appuuid'].tolist(), mismatch.tolist()))
+        self.assertEqual(rows['8d247914'], [False] * len(CUSTOMER_INFORMATION))
+        self.assertEqual(rows['7a135804'], [name == 'LAST_NAME' for name in CUSTOMER_INFORMATION])
+
+        # Without normalization, the details that differ in case or spaces do not match
+        exact_columns, exact_mismatch = reverify_table('test_table', segments=2)
+        exact_rows = dict(zip(exact_columns['appuuid'].tolist(), exact_mismatch.tolist()))
+        self.assertEqual(exact_rows['8d247914'],
+                         [details[name] != dict(extracted, ADDRESS='1  MAIN ST')[name] for name in CUSTOMER_INFORMATION])
+        self.assertTrue(exact_rows['8d247914'][CUSTOMER_INFORMATION.index('ADDRESS')])
+
+        # The mismatch matrix has one row per application
+        output_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mismatch_matrix.csv')
+        try:
+            write_mismatch_matrix(output_filename, columns, mismatch)
+            with open(output_filename) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(output_filename)
+        self.assertEqual(len(lines), 3)
+        self.assertIn('7a135804,0,0,1,0,0,0,0,0,False,True', lines)
+
+if __name__ == '__main__':
+
+    os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+    os.environ['AWS_SECURITY_TOKEN'] = 'testing'
+    os.environ['AWS_SESSION_TOKEN'] = 'testing'
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+
+    unittest.main()
+
+    # Remove the same path from sys.path when finished testing
+    if path_to_add in sys.path:
+        sys.path.remove(path_to_add)
+    if layer_path_to_add in sys.path:
+        sys.path.remove(layer_path_to_add)